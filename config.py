@@ -1,10 +1,20 @@
 # config.py
+from typing import Optional
+
 from pydantic import SecretStr
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 
 class BotSettings(BaseSettings):
     bot_token: SecretStr
+    # Telegram ID администраторов (JSON-список в .env: ADMIN_IDS=[123, 456])
+    admin_ids: list[int] = []
+    # Служебный чат для прогрева file_id изображений (бот должен иметь
+    # право писать в него); не задан - прогрев отключён
+    asset_storage_chat_id: Optional[int] = None
+    # Другой сервер Bot API (локальный telegram-bot-api или тестовый фейк),
+    # например http://localhost:8081; не задан - api.telegram.org
+    telegram_api_base: Optional[str] = None
 
     model_config = SettingsConfigDict(
         env_file=".env", env_file_encoding="utf-8"
@@ -15,3 +25,6 @@ settings = BotSettings()
 
 # Для прямого доступа, если не хотите везде использовать settings.bot_token
 BOT_TOKEN = settings.bot_token.get_secret_value()
+ADMIN_IDS = frozenset(settings.admin_ids)
+ASSET_STORAGE_CHAT_ID = settings.asset_storage_chat_id
+TELEGRAM_API_BASE = settings.telegram_api_base
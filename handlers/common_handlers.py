@@ -2,12 +2,17 @@
 import asyncio
 import logging
 import os
-from typing import Union, Optional  # Added Optional
+from typing import Union, Optional, Dict, Any, Tuple  # Added Optional
 
 from aiogram import Bot, F, Router
 from aiogram.enums import ParseMode
 from aiogram.exceptions import TelegramBadRequest
-from aiogram.filters import Command, CommandStart, StateFilter
+from aiogram.filters import (
+    Command,
+    CommandObject,
+    CommandStart,
+    StateFilter,
+)
 from aiogram.fsm.context import FSMContext
 from aiogram.types import (
     Message,
@@ -30,10 +35,19 @@ from keyboards import (
     ACTION_SELECTION_KEYBOARD_RETURNING,
     IKB,
 )
-from settings import EXCEL_FILENAME, BASE_HEADERS
+from config import ADMIN_IDS
+from settings import (
+    EXCEL_FILENAME,
+    BASE_HEADERS,
+    REGISTERED_AT_HEADER,
+    TEST_IDLE_TTL_S,
+    TEST_IDLE_TTL_DEFAULT_S,
+)
 from utils.bot_helpers import (
     get_active_profile_from_fsm,
+    make_service_message,
     send_main_action_menu,
+    split_message_text,
     _safe_delete_message,
     _clear_fsm_and_set_profile,
 )
@@ -44,10 +58,18 @@ from utils.excel_handler import (
     check_if_verbal_fluency_results_exist,
     check_if_mental_rotation_results_exist,
     check_if_raven_matrices_results_exist,
-    create_user_profile_in_excel,
-    find_user_profile_in_excel,
+    register_user_profile,
+    find_user_profile,
     get_all_user_data_from_excel,
+    get_user_data_version,
+    get_cached_user_data_text,
+    cache_user_data_text,
+    get_user_percentiles,
+    get_result_stats,
+    build_export_file,
 )
+from utils.export import parse_export_args
+from utils.session_tasks import session_tasks
 from .tests import (
     corsi_handlers,
     stroop_handlers,
@@ -87,12 +109,34 @@ UID_FAIL_KEYBOARD = InlineKeyboardMarkup(
     ]
 )
 
+def _registry_save(save_func, *, trigger_message: bool, bot_arg: bool):
+    """
+    Adapts a test's save function to the registry signature
+    (state, bot, *, is_interrupted). trigger_message: it takes a leading
+    message (only used to reply), given a service message to the state's
+    chat; bot_arg: it takes the bot after the state.
+    """
+
+    async def save(state: FSMContext, bot: Bot, *, is_interrupted: bool):
+        args: list = [state]
+        if trigger_message:
+            args.insert(0, make_service_message(bot, state.key.chat_id))
+        if bot_arg:
+            args.append(bot)
+        await save_func(*args, is_interrupted=is_interrupted)
+
+    return save
+
+
+# "save_function" has the uniform signature (state, bot, *, is_interrupted)
 TEST_REGISTRY = {
     "initiate_corsi_test": {
         "name": "Тест Корси",
         "fsm_group_class": CorsiTestStates,
         "start_function": corsi_handlers.start_corsi_test,
-        "save_function": corsi_handlers.save_corsi_results,
+        "save_function": _registry_save(
+            corsi_handlers.save_corsi_results, trigger_message=True, bot_arg=True
+        ),
         "cleanup_function": corsi_handlers.cleanup_corsi_messages,
         "results_exist_check": check_if_corsi_results_exist,
         "requires_active_profile": True,
@@ -101,7 +145,9 @@ TEST_REGISTRY = {
         "name": "Тест Струпа",
         "fsm_group_class": StroopTestStates,
         "start_function": stroop_handlers.start_stroop_test,
-        "save_function": stroop_handlers.save_stroop_results,
+        "save_function": _registry_save(
+            stroop_handlers.save_stroop_results, trigger_message=True, bot_arg=True
+        ),
         "cleanup_function": stroop_handlers.cleanup_stroop_ui,
         "results_exist_check": check_if_stroop_results_exist,
         "requires_active_profile": True,
@@ -110,7 +156,11 @@ TEST_REGISTRY = {
         "name": "Тест на Скорость Реакции",
         "fsm_group_class": ReactionTimeTestStates,
         "start_function": reaction_time_handlers.start_reaction_time_test,
-        "save_function": reaction_time_handlers.save_reaction_time_results,
+        "save_function": _registry_save(
+            reaction_time_handlers.save_reaction_time_results,
+            trigger_message=False,
+            bot_arg=False,
+        ),
         "cleanup_function": reaction_time_handlers.cleanup_reaction_time_ui,
         "results_exist_check": check_if_reaction_time_results_exist,
         "requires_active_profile": True,
@@ -120,7 +170,11 @@ TEST_REGISTRY = {
         "name": "Тест на вербальную беглость",
         "fsm_group_class": VerbalFluencyStates,
         "start_function": verbal_fluency_handlers.start_verbal_fluency_test,
-        "save_function": verbal_fluency_handlers.save_verbal_fluency_results,
+        "save_function": _registry_save(
+            verbal_fluency_handlers.save_verbal_fluency_results,
+            trigger_message=False,
+            bot_arg=False,
+        ),
         "cleanup_function": verbal_fluency_handlers.cleanup_verbal_fluency_ui,
         "results_exist_check": check_if_verbal_fluency_results_exist,
         "requires_active_profile": True,
@@ -130,7 +184,11 @@ TEST_REGISTRY = {
         "name": "Тест умственного вращения",
         "fsm_group_class": MentalRotationStates,
         "start_function": mental_rotation_handlers.start_mental_rotation_test,
-        "save_function": mental_rotation_handlers.save_mental_rotation_results,
+        "save_function": _registry_save(
+            mental_rotation_handlers.save_mental_rotation_results,
+            trigger_message=True,
+            bot_arg=False,
+        ),
         "cleanup_function": mental_rotation_handlers.cleanup_mental_rotation_ui,
         "results_exist_check": check_if_mental_rotation_results_exist,
         "requires_active_profile": True,
@@ -140,7 +198,11 @@ TEST_REGISTRY = {
         "name": "Прогрессивные матрицы Равена",
         "fsm_group_class": RavenMatricesStates,
         "start_function": raven_matrices_handlers.start_raven_matrices_test,
-        "save_function": raven_matrices_handlers.save_raven_matrices_results,
+        "save_function": _registry_save(
+            raven_matrices_handlers.save_raven_matrices_results,
+            trigger_message=True,
+            bot_arg=False,
+        ),
         "cleanup_function": raven_matrices_handlers.cleanup_raven_ui,
         "results_exist_check": check_if_raven_matrices_results_exist,
         "requires_active_profile": True,
@@ -149,6 +211,101 @@ TEST_REGISTRY = {
 }
 
 
+def _find_active_test(
+    fsm_state_str: Optional[str],
+) -> Tuple[Optional[str], Optional[Dict[str, Any]]]:
+    """(TEST_REGISTRY key, config) of the test the FSM state belongs to."""
+    if fsm_state_str:
+        for key, cfg in TEST_REGISTRY.items():
+            fsm_group = cfg.get("fsm_group_class")
+            if fsm_group and fsm_state_str.startswith(fsm_group.__name__):
+                return key, cfg
+    return None, None
+
+
+def test_idle_ttl(fsm_state_str: Optional[str]) -> Optional[float]:
+    """Idle TTL of the running test, None if the state is not a test."""
+    test_key, _ = _find_active_test(fsm_state_str)
+    if test_key is None:
+        return None
+    return TEST_IDLE_TTL_S.get(test_key, TEST_IDLE_TTL_DEFAULT_S)
+
+
+async def _save_and_cleanup_interrupted_test(
+    test_cfg: Dict[str, Any],
+    state: FSMContext,
+    bot: Bot,
+):
+    """Generic interrupted save + UI cleanup via TEST_REGISTRY functions."""
+    test_name = test_cfg["name"]
+    save_func = test_cfg.get("save_function")
+    cleanup_func = test_cfg.get("cleanup_function")
+
+    if callable(save_func):
+        try:
+            await save_func(state, bot, is_interrupted=True)
+        except Exception as e_save:
+            logger.error(
+                f"Ошибка в общем save_func для {test_name}: {e_save}",
+                exc_info=True,
+            )
+
+    if callable(cleanup_func):
+        try:
+            await cleanup_func(
+                state, bot, final_text=f"Тест '{test_name}' прерван."
+            )
+        except Exception as e_cleanup:
+            logger.error(
+                f"Ошибка в общем cleanup_func для {test_name}: {e_cleanup}",
+                exc_info=True,
+            )
+
+
+async def interrupt_idle_test(state: FSMContext, bot: Bot):
+    """
+    Session reaper callback: stops an abandoned test like /stoptest, but
+    without a user update - results are saved as interrupted, the UI is
+    cleaned up, background tasks are cancelled and only the profile stays.
+    """
+    test_key, test_cfg = _find_active_test(await state.get_state())
+    if test_cfg is None:
+        return
+    test_name = test_cfg["name"]
+    chat_id = state.key.chat_id
+    logger.info(
+        f"Остановка неактивного теста: {test_name} (ключ: {test_key}), чат {chat_id}."
+    )
+    trigger_message_obj = make_service_message(bot, chat_id)
+    await _save_and_cleanup_interrupted_test(test_cfg, state, bot)
+    await session_tasks.cancel_all(state)
+
+    common_status_msg_id = (await state.get_data()).get(
+        "status_message_id_to_delete_later"
+    )
+    await _safe_delete_message(
+        bot, chat_id, common_status_msg_id, "idle test cleanup"
+    )
+    profile = await get_active_profile_from_fsm(state)
+    await _clear_fsm_and_set_profile(state, profile)
+
+    notice = f"Тест '{test_name}' остановлен из-за долгого отсутствия активности."
+    if profile:
+        await send_main_action_menu(
+            bot,
+            trigger_message_obj,
+            ACTION_SELECTION_KEYBOARD_RETURNING,
+            text=f"{notice}\nВыберите действие:",
+        )
+    else:
+        try:
+            await bot.send_message(chat_id, f"{notice} Пожалуйста, /start.")
+        except Exception as e:
+            logger.error(
+                f"Не удалось уведомить чат {chat_id} об остановке теста: {e}"
+            )
+
+
 # --- Command Handlers ---
 @router.message(CommandStart())
 async def start_command_handler(
@@ -157,6 +314,7 @@ async def start_command_handler(
     logger.info(
         f"Пользователь {message.from_user.id} инициировал команду /start."
     )
+    await session_tasks.cancel_all(state)
     await state.clear()
     await state.set_state(UserData.waiting_for_first_time_response)
     # Используем унифицированный текст и клавиатуру, как при неавторизованном доступе
@@ -230,19 +388,12 @@ async def stop_test_command_handler(
     bot: Bot,
     called_from_test_button: bool = False,
 ):
-    fsm_state_str = await state.get_state()
-    active_test_cfg = None
-    active_test_key = None
-    test_name = "активного теста"  # Default for messages
-
-    if fsm_state_str:
-        for key, cfg in TEST_REGISTRY.items():
-            fsm_group = cfg.get("fsm_group_class")
-            if fsm_group and fsm_state_str.startswith(fsm_group.__name__):
-                active_test_cfg = cfg
-                active_test_key = key
-                test_name = cfg["name"]
-                break
+    active_test_key, active_test_cfg = _find_active_test(
+        await state.get_state()
+    )
+    test_name = (
+        active_test_cfg["name"] if active_test_cfg else "активного теста"
+    )  # Default for messages
 
     trigger_message_obj = (
         trigger_event
@@ -281,8 +432,6 @@ async def stop_test_command_handler(
                 )
 
         end_func = active_test_cfg.get("end_test_function")
-        save_func = active_test_cfg.get("save_function")
-        cleanup_func = active_test_cfg.get("cleanup_function")
 
         if callable(end_func):
             logger.info(
@@ -327,38 +476,12 @@ async def stop_test_command_handler(
             logger.info(
                 f"Stoptest: Запуск общего save/cleanup для {test_name} (end_func не было, не выполнилась или не помечена как успешная)."
             )
-            if callable(save_func):
-                try:
-                    # Adjust based on actual save_func signatures
-                    if active_test_key in [
-                        "initiate_corsi_test",
-                        "initiate_stroop_test",
-                    ]:
-                        await save_func(
-                            trigger_message_obj,
-                            state,
-                            bot,
-                            is_interrupted=True,
-                        )
-                    else:
-                        await save_func(state, is_interrupted=True)
-                except Exception as e_save:
-                    logger.error(
-                        f"Ошибка в общем save_func для {test_name}: {e_save}",
-                        exc_info=True,
-                    )
-
-            if callable(cleanup_func):
-                try:
-                    await cleanup_func(
-                        state, bot, final_text=f"Тест '{test_name}' прерван."
-                    )
-                except Exception as e_cleanup:
-                    logger.error(
-                        f"Ошибка в общем cleanup_func для {test_name}: {e_cleanup}",
-                        exc_info=True,
-                    )
+            await _save_and_cleanup_interrupted_test(
+                active_test_cfg, state, bot
+            )
 
+        # Anything the test routines left running dies with the test
+        await session_tasks.cancel_all(state)
         profile_after_test_ops = await get_active_profile_from_fsm(state)
         await _clear_fsm_and_set_profile(
             state, profile_after_test_ops
@@ -444,6 +567,7 @@ async def command_restart_bot_session_handler(
             message, state, bot, called_from_test_button=True
         )
 
+    await session_tasks.cancel_all(state)
     await _clear_fsm_and_set_profile(state, None)
     await message.answer(
         "Все текущие операции были остановлены, ваш профиль и состояние теста в этой сессии сброшены.\n"
@@ -639,8 +763,8 @@ async def process_age_input(message: Message, state: FSMContext, bot: Bot):
     name = fsm_data.get("name_for_registration")
     bot_prompt_id = fsm_data.get("current_dialog_message_id")
 
-    new_uid = await asyncio.to_thread(
-        create_user_profile_in_excel, name, age_val, message.from_user.id
+    new_uid = await register_user_profile(
+        name, age_val, message.from_user.id
     )
 
     if new_uid:
@@ -726,8 +850,8 @@ async def process_unique_id_input(
         )
         return
 
-    found_profile_data = await asyncio.to_thread(
-        find_user_profile_in_excel, uid_str_input, message.from_user.id
+    found_profile_data = await find_user_profile(
+        uid_str_input, message.from_user.id
     )
 
     data = await state.get_data()
@@ -1270,17 +1394,34 @@ async def show_my_data_command(
     uid_to_check = str(profile.get("unique_id"))
     name_display = profile.get("name", "N/A")
     age_display = profile.get("age", "N/A")
+    # Memoized until this UID's next save
+    text_variant = (name_display, age_display)
+    cached_text = get_cached_user_data_text(uid_to_check, text_variant)
+    if cached_text is not None:
+        await message.answer(
+            cached_text + _format_norms_text(uid_to_check),
+            parse_mode=ParseMode.HTML,
+        )
+        return
+
+    data_version = get_user_data_version(uid_to_check)
     lines = [
         f"Данные для UID: <b>{uid_to_check}</b> (Имя: {name_display}, Возраст: {age_display})"
     ]
     excel_data = await asyncio.to_thread(
         get_all_user_data_from_excel, uid_to_check
     )
+    cacheable = False
     if "error" in excel_data:
         lines.append(excel_data["error"])
     elif "info" in excel_data:
         lines.append(excel_data["info"])
     else:
+        cacheable = True
+        # A profile field, not a test result: shown above the results
+        registered_at = excel_data.pop(REGISTERED_AT_HEADER, None)
+        if registered_at and registered_at != "нет данных":
+            lines.append(f"Дата регистрации: {registered_at}")
         lines.append("--- Результаты тестов из файла ---")
         for header_name, display_val in excel_data.items():
             if header_name in BASE_HEADERS and header_name not in [
@@ -1300,28 +1441,95 @@ async def show_my_data_command(
                 ):
                     continue
             lines.append(f"<b>{str(header_name)}:</b> {str(display_val)}")
-    await message.answer("\n".join(lines), parse_mode=ParseMode.HTML)
+    text = "\n".join(lines)
+    if cacheable:
+        cache_user_data_text(uid_to_check, text_variant, text, data_version)
+    # Norms move with everyone's saves, so they are never memoized
+    await message.answer(
+        text + _format_norms_text(uid_to_check), parse_mode=ParseMode.HTML
+    )
+
+
+def _format_norms_text(uid: str) -> str:
+    """Percentile lines for /mydata; empty if norms are unavailable."""
+    percentiles = get_user_percentiles(uid)
+    if not percentiles:
+        return ""
+    lines = ["", "--- Сравнение с другими участниками ---"]
+    for p in percentiles:
+        value = (
+            int(p.value) if p.value.is_integer() else round(p.value, 2)
+        )
+        line = (
+            f"<b>{p.metric.label}:</b> {value} — лучше, чем у "
+            f"{p.percentile:.0f}% участников (n={p.sample_size})"
+        )
+        if p.band_label is not None:
+            line += (
+                f"; возраст {p.band_label}: {p.band_percentile:.0f}% "
+                f"(n={p.band_sample_size})"
+            )
+        lines.append(line)
+    return "\n".join(lines)
 
 
 @router.message(Command("export"))
 async def export_data_to_excel_command(
-    message: Message,
+    message: Message, command: CommandObject
 ):  # No state or bot needed
-    if os.path.exists(EXCEL_FILENAME):
+    # /export [xlsx|csv|csv.gz] [tests=corsi,stroop] [from=ГГГГ-ММ-ДД] [to=ГГГГ-ММ-ДД]
+    try:
+        options = parse_export_args(command.args)
+    except ValueError as e:
+        await message.answer(str(e))
+        return
+    export = await asyncio.to_thread(build_export_file, options)
+    if export is None:
+        await message.answer("Не удалось подготовить файл экспорта.")
+        return
+    export_path, row_count = export
+    base_name = os.path.splitext(os.path.basename(EXCEL_FILENAME))[0]
+    try:
+        await message.reply_document(
+            FSInputFile(export_path, filename=f"{base_name}.{options.fmt}"),
+            caption=f"База данных пользователей и результатов (строк: {row_count}).",
+        )
+    except Exception as e:
+        logger.error(f"Не удалось отправить файл экспорта: {e}", exc_info=True)
+        await message.answer(f"Не удалось отправить файл: {e}")
+    finally:
         try:
-            await message.reply_document(
-                FSInputFile(EXCEL_FILENAME),
-                caption="База данных пользователей и результатов.",
-            )
-        except Exception as e:
-            logger.error(
-                f"Не удалось отправить Excel файл: {e}", exc_info=True
-            )
-            await message.answer(f"Не удалось отправить файл: {e}")
-    else:
-        await message.answer(
-            f"Файл данных '{EXCEL_FILENAME}' не найден на сервере."
+            os.remove(export_path)
+        except OSError:
+            pass
+
+
+@router.message(Command("stats"))
+async def show_result_stats_command(message: Message):
+    """Admin-only: running aggregates per result, no workbook scan."""
+    if message.from_user is None or message.from_user.id not in ADMIN_IDS:
+        await message.answer("Команда доступна только администраторам.")
+        return
+    summaries = get_result_stats()
+    if not summaries:
+        await message.answer("Статистика пока пуста: нет сохранённых результатов.")
+        return
+
+    def fmt(value: Optional[float]) -> str:
+        return "—" if value is None else f"{value:.4g}"
+
+    lines = ["<b>Статистика результатов</b> (все сохранения, включая повторные):"]
+    for header, summary in summaries.items():
+        stats = summary.stats
+        quantiles = " / ".join(
+            fmt(sketch.value()) for sketch in summary.quantiles.values()
+        )
+        lines.append(
+            f"<b>{header}:</b> n={stats.count}, среднее {fmt(stats.mean)}, "
+            f"SD {fmt(stats.variance ** 0.5)}, p50/p90/p99 {quantiles}"
         )
+    for text in split_message_text(lines):
+        await message.answer(text, parse_mode=ParseMode.HTML)
 
 
 @router.callback_query(F.data == "logout_profile", StateFilter(None))
@@ -1,7 +1,6 @@
 # handlers/tests/corsi_handlers.py
 import asyncio
 import logging
-import os
 import random
 import time
 from typing import (
@@ -25,13 +24,14 @@ from aiogram.types import (
 from aiogram.filters import StateFilter
 
 from fsm_states import CorsiTestStates
-from settings import ALL_EXPECTED_HEADERS, EXCEL_FILENAME
 from utils.bot_helpers import (
     send_main_action_menu,
     get_active_profile_from_fsm,
     _clear_fsm_and_set_profile, # <--- ИЗМЕНЕННЫЙ ИМПОРТ
     _safe_delete_message,       # <--- ИЗМЕНЕННЫЙ ИМПОРТ
 )
+from utils.excel_handler import save_test_results, save_test_trials
+from utils.test_sessions import CorsiSession
 
 # Импортируем _clear_fsm_and_set_profile для использования при завершении теста
 
@@ -49,30 +49,27 @@ CORSI_STOP_CALLBACK_DATA = "request_test_stop"
 
 # --- Helper for Message Management (scoped to Corsi) ---
 async def _safe_delete_corsi_specific_message(
-    bot: Bot, state: FSMContext, fsm_key: str, context_info: str = ""
+    bot: Bot,
+    chat_id: Optional[int],
+    message_id: Optional[int],
+    context_info: str = "",
 ):
-    """Safely deletes a Corsi-specific message ID stored in FSM."""
-    data = await state.get_data()
-    message_id = data.get(fsm_key)
-    chat_id = data.get("corsi_chat_id")  # Assumes corsi_chat_id is in FSM
-
+    """Safely deletes a Corsi-specific message (ID taken from CorsiSession)."""
     if message_id and chat_id:
         try:
             await bot.delete_message(chat_id, message_id)
             logger.debug(
-                f"Corsi: Сообщение ID {message_id} (ключ: {fsm_key}) удалено. {context_info}"
+                f"Corsi: Сообщение ID {message_id} удалено. {context_info}"
             )
         except TelegramBadRequest:
             logger.warning(
-                f"Corsi: Не удалось удалить сообщение ID {message_id} (ключ: {fsm_key}). {context_info}"
+                f"Corsi: Не удалось удалить сообщение ID {message_id}. {context_info}"
             )
         except Exception as e:
             logger.error(
-                f"Corsi: Ошибка удаления ID {message_id} (ключ: {fsm_key}): {e}. {context_info}"
+                f"Corsi: Ошибка удаления ID {message_id}: {e}. {context_info}"
             )
-        # Do not clear the key from FSM here, cleanup_corsi_messages will handle FSM data.
-        # Or, if called outside full cleanup, it can be cleared:
-        # await state.update_data({fsm_key: None})
+        # Do not clear the session field here, cleanup_corsi_messages will handle FSM data.
 
 
 # --- Test Logic Functions ---
@@ -80,27 +77,26 @@ async def cleanup_corsi_messages(
     state: FSMContext, bot_instance: Bot, final_text: Optional[str] = None
 ):
     logger.info(f"Corsi cleanup. Контекст: '{final_text}'")
-    data = await state.get_data()  # Get data once
-    chat_id = data.get("corsi_chat_id")
+    corsi = CorsiSession.from_fsm(await state.get_data())
+    chat_id = corsi.chat_id
 
     if chat_id:
-        corsi_message_ids_keys = [
-            "corsi_status_message_id",
-            "corsi_feedback_message_id",
-            "corsi_grid_message_id",
-        ]
-        for key in corsi_message_ids_keys:
-            msg_id_to_del = data.get(key)
-            if msg_id_to_del:  # Check if msg_id exists before calling helper
-                await _safe_delete_corsi_specific_message(
-                    bot_instance, state, key, "cleanup_corsi_messages"
-                )
-                # _safe_delete_corsi_specific_message does not clear FSM keys by default
-                # so we clear them here after attempting deletion.
-                current_data_for_key_clear = await state.get_data()
-                if key in current_data_for_key_clear:
-                    del current_data_for_key_clear[key]
-                    await state.set_data(current_data_for_key_clear)
+        for msg_id_to_del in (
+            corsi.status_message_id,
+            corsi.feedback_message_id,
+            corsi.grid_message_id,
+        ):
+            await _safe_delete_corsi_specific_message(
+                bot_instance, chat_id, msg_id_to_del, "cleanup_corsi_messages"
+            )
+        # _safe_delete_corsi_specific_message does not clear the IDs,
+        # so we clear them here after attempting deletion.
+        await CorsiSession.update_fsm(
+            state,
+            status_message_id=None,
+            feedback_message_id=None,
+            grid_message_id=None,
+        )
 
     # FSM data cleaning will be handled by _clear_fsm_and_set_profile
     # or by stop_test_command_handler if interrupted.
@@ -122,15 +118,15 @@ async def show_corsi_sequence(
         )
         return
 
-    data = await state.get_data()
-    current_sequence_length = data.get("current_sequence_length", 2)
-    corsi_chat_id = data.get("corsi_chat_id")
-    grid_msg_id = data.get("corsi_grid_message_id")
-    status_msg_id = data.get("corsi_status_message_id")
+    corsi = CorsiSession.from_fsm(await state.get_data())
+    current_sequence_length = corsi.current_sequence_length
+    corsi_chat_id = corsi.chat_id
+    grid_msg_id = corsi.grid_message_id
+    status_msg_id = corsi.status_message_id
 
     if not corsi_chat_id:
         logger.error(
-            "Corsi (show_sequence): corsi_chat_id не найден в FSM. Тест не может продолжаться."
+            "Corsi (show_sequence): chat_id не найден в сессии FSM. Тест не может продолжаться."
         )
         # UI cleanup should be done by caller if this fails critically
         await trigger_source_msg.answer(
@@ -144,9 +140,9 @@ async def show_corsi_sequence(
     indices = list(range(9))
     random.shuffle(indices)
     correct_seq_to_show = indices[:current_sequence_length]
-    await state.update_data(
-        correct_sequence=correct_seq_to_show, user_input_sequence=[]
-    )
+    corsi.correct_sequence = correct_seq_to_show
+    corsi.user_input_sequence = []
+    await state.update_data(corsi.as_fsm_data())
 
     base_grid_buttons = [
         IKB(text="🟪", callback_data=f"{CORSI_BUTTON_CALLBACK_PREFIX}{i}")
@@ -177,7 +173,7 @@ async def show_corsi_sequence(
                 corsi_chat_id, grid_message_text, reply_markup=base_markup
             )
             grid_msg_id = grid_msg_obj.message_id
-            await state.update_data(corsi_grid_message_id=grid_msg_id)
+            await CorsiSession.update_fsm(state, grid_message_id=grid_msg_id)
     except Exception as e_grid:
         logger.error(
             f"Corsi (show_sequence): Критическая ошибка при отправке/редактировании сетки: {e_grid}",
@@ -210,7 +206,9 @@ async def show_corsi_sequence(
                     corsi_chat_id, text
                 )
                 status_msg_id = status_msg_obj.message_id
-                await state.update_data(corsi_status_message_id=status_msg_id)
+                await CorsiSession.update_fsm(
+                    state, status_message_id=status_msg_id
+                )
             else:
                 await bot_instance.edit_message_text(
                     text=text, chat_id=corsi_chat_id, message_id=status_msg_id
@@ -222,8 +220,8 @@ async def show_corsi_sequence(
                 )
                 await _safe_delete_corsi_specific_message(
                     bot_instance,
-                    state,
-                    "corsi_status_message_id",
+                    corsi_chat_id,
+                    status_msg_id,
                     "status edit fail",
                 )
                 status_msg_id = None
@@ -232,8 +230,8 @@ async def show_corsi_sequence(
                         corsi_chat_id, text
                     )
                     status_msg_id = status_msg_obj_retry.message_id
-                    await state.update_data(
-                        corsi_status_message_id=status_msg_id
+                    await CorsiSession.update_fsm(
+                        state, status_message_id=status_msg_id
                     )
                 except Exception as e_resend:
                     logger.error(
@@ -298,9 +296,9 @@ async def show_corsi_sequence(
         return
 
     input_prompt = "Повторите последовательность, нажимая на плитки:"
-    status_msg_id_for_input = (await state.get_data()).get(
-        "corsi_status_message_id"
-    )
+    status_msg_id_for_input = CorsiSession.from_fsm(
+        await state.get_data()
+    ).status_message_id
     try:
         if status_msg_id_for_input:
             await bot_instance.edit_message_text(
@@ -312,13 +310,13 @@ async def show_corsi_sequence(
             new_status_msg = await bot_instance.send_message(
                 corsi_chat_id, input_prompt
             )
-            await state.update_data(
-                corsi_status_message_id=new_status_msg.message_id
+            await CorsiSession.update_fsm(
+                state, status_message_id=new_status_msg.message_id
             )
     except Exception as e_prompt:
         logger.error(f"Corsi: Ошибка установки промпта для ввода: {e_prompt}")
 
-    await state.update_data(sequence_start_time=time.time())
+    await CorsiSession.update_fsm(state, sequence_start_time=time.time())
     await state.set_state(CorsiTestStates.waiting_for_user_sequence)
     logger.info(
         f"Corsi: Последовательность длиной {current_sequence_length} показана. Ожидание ввода."
@@ -335,13 +333,14 @@ async def handle_corsi_button_press(
     await callback.answer()
 
     button_idx_pressed = int(callback.data.split("_")[-1])
-    data = await state.get_data()
-    user_sequence = data.get("user_input_sequence", []) + [button_idx_pressed]
-    await state.update_data(user_input_sequence=user_sequence)
+    corsi = CorsiSession.from_fsm(await state.get_data())
+    corsi.user_input_sequence.append(button_idx_pressed)
+    await state.update_data(corsi.as_fsm_data())
+    user_sequence = corsi.user_input_sequence
 
-    grid_msg_id = data.get("corsi_grid_message_id")
-    chat_id = data.get("corsi_chat_id")
-    correct_sequence = data.get("correct_sequence", [])
+    grid_msg_id = corsi.grid_message_id
+    chat_id = corsi.chat_id
+    correct_sequence = corsi.correct_sequence
 
     if not (grid_msg_id and chat_id and correct_sequence is not None):
         logger.error(
@@ -406,15 +405,16 @@ async def evaluate_user_sequence(
         )
         return
 
-    data = await state.get_data()
-    chat_id = data.get("corsi_chat_id", trigger_message.chat.id)
-    user_seq = data.get("user_input_sequence", [])
-    correct_seq = data.get("correct_sequence", [])
-    current_len = data.get("current_sequence_length", 0)
-    error_count = data.get("error_count", 0)
-    sequence_times_history = data.get("sequence_times", [])
-    seq_start_time = data.get("sequence_start_time", 0)
-    feedback_msg_id_from_fsm = data.get("corsi_feedback_message_id")
+    corsi = CorsiSession.from_fsm(await state.get_data())
+    chat_id = corsi.chat_id or trigger_message.chat.id
+    user_seq = corsi.user_input_sequence
+    correct_seq = corsi.correct_sequence
+    current_len = corsi.current_sequence_length
+    error_count = corsi.error_count
+    sequence_times_history = corsi.sequence_times
+    attempts_history = corsi.attempts
+    seq_start_time = corsi.sequence_start_time
+    feedback_msg_id_from_fsm = corsi.feedback_message_id
 
     time_taken = (time.time() - seq_start_time) if seq_start_time > 0 else 0.0
 
@@ -439,8 +439,8 @@ async def evaluate_user_sequence(
                     chat_id, text, parse_mode=effective_pm
                 )
                 feedback_msg_id_from_fsm = msg.message_id
-                await state.update_data(
-                    corsi_feedback_message_id=feedback_msg_id_from_fsm
+                await CorsiSession.update_fsm(
+                    state, feedback_message_id=feedback_msg_id_from_fsm
                 )
         except TelegramBadRequest as tb_err:
             if "message is not modified" not in str(tb_err).lower():
@@ -450,8 +450,8 @@ async def evaluate_user_sequence(
                 # Use the main _safe_delete_message from common_handlers, or a local one for Corsi
                 await _safe_delete_corsi_specific_message(
                     bot_instance,
-                    state,
-                    "corsi_feedback_message_id",
+                    chat_id,
+                    feedback_msg_id_from_fsm,
                     "feedback update fail",
                 )
                 feedback_msg_id_from_fsm = None
@@ -460,8 +460,8 @@ async def evaluate_user_sequence(
                         chat_id, text, parse_mode=effective_pm
                     )
                     feedback_msg_id_from_fsm = msg_retry.message_id
-                    await state.update_data(
-                        corsi_feedback_message_id=feedback_msg_id_from_fsm
+                    await CorsiSession.update_fsm(
+                        state, feedback_message_id=feedback_msg_id_from_fsm
                     )
                 except Exception as e_resend_fb:
                     logger.error(
@@ -476,7 +476,12 @@ async def evaluate_user_sequence(
     next_error_count = error_count
     test_should_continue = True
 
-    if user_seq == correct_seq:
+    is_correct = user_seq == correct_seq
+    # Every attempt, failed ones too (per-trial data)
+    attempts_history.append(
+        {"len": current_len, "correct": is_correct, "time": time_taken}
+    )
+    if is_correct:
         sequence_times_history.append({"len": current_len, "time": time_taken})
         next_len_to_try = current_len + 1
         next_error_count = 0
@@ -493,12 +498,14 @@ async def evaluate_user_sequence(
             test_should_continue = False
             delayed_msg = f"Ошибка! ({next_error_count}-я на длине {current_len}). Тест завершен."
 
-    await state.update_data(
+    await CorsiSession.update_fsm(
+        state,
         current_sequence_length=next_len_to_try,
         error_count=next_error_count,
         sequence_times=sequence_times_history,
+        attempts=attempts_history,
         user_input_sequence=[],
-        corsi_feedback_message_id=feedback_msg_id_from_fsm,
+        feedback_message_id=feedback_msg_id_from_fsm,
     )
 
     await asyncio.sleep(1.2 if test_should_continue else 1.8)
@@ -587,29 +594,11 @@ async def start_corsi_test(
     await state.set_state(CorsiTestStates.showing_sequence)
 
     uid = profile.get("unique_id")  # Используем стандартизированные ключи
-    name = profile.get("name")
-    age = profile.get("age")
-    tg_id = profile.get("telegram_id")
-
-    initial_test_data = {
-        "unique_id_for_test": uid,
-        "profile_name_for_test": name,
-        "profile_age_for_test": age,
-        "profile_telegram_id_for_test": tg_id,
-        "corsi_chat_id": test_chat_id,
-        "current_sequence_length": 2,
-        "error_count": 0,
-        "sequence_times": [],
-        "correct_sequence": [],
-        "user_input_sequence": [],
-        "sequence_start_time": 0,
-        "corsi_grid_message_id": None,
-        "corsi_status_message_id": None,
-        "corsi_feedback_message_id": None,
-    }
+    corsi = CorsiSession(chat_id=test_chat_id)
+    corsi.set_profile(profile)
     # Добавляем к существующим данным FSM (профиль уже должен быть там с active_* ключами,
     # и status_message_id_to_delete_later от common_handlers)
-    await state.update_data(**initial_test_data)
+    await state.update_data(corsi.as_fsm_data())
     logger.info(f"Тест Корси запущен для UID {uid} в чате {test_chat_id}.")
 
     await show_corsi_sequence(source_message, state, bot_instance)
@@ -622,24 +611,19 @@ async def save_corsi_results(
     is_interrupted: bool = False,
 ):
     data = await state.get_data()
+    corsi = CorsiSession.from_fsm(data)
 
-    uid = data.get("unique_id_for_test")
-    p_name = data.get("profile_name_for_test")
-    p_age = data.get("profile_age_for_test")
-    p_tgid = data.get("profile_telegram_id_for_test")
-
+    uid = corsi.unique_id
     if not uid:
         logger.warning(
-            "Corsi save: unique_id_for_test не найден в FSM. Попытка извлечь из активного профиля."
+            "Corsi save: UID не найден в сессии теста. Попытка извлечь из активного профиля."
         )
         active_profile = await get_active_profile_from_fsm(
             state
         )  # Вернет стандартизированные ключи
         if active_profile and active_profile.get("unique_id"):
-            uid = active_profile.get("unique_id")
-            p_name = active_profile.get("name", p_name)
-            p_age = active_profile.get("age", p_age)
-            p_tgid = active_profile.get("telegram_id", p_tgid)
+            corsi.set_profile(active_profile)
+            uid = corsi.unique_id
             logger.info(
                 f"Corsi save: Используются данные из активного профиля для UID {uid}."
             )
@@ -655,7 +639,7 @@ async def save_corsi_results(
                 )
             return
 
-    seq_times = data.get("sequence_times", [])
+    seq_times = corsi.sequence_times
     max_len = 0
     if seq_times and all(
         isinstance(item, dict) and "len" in item for item in seq_times
@@ -687,126 +671,32 @@ async def save_corsi_results(
     )
     interrupted_str = "Да" if is_interrupted else "Нет"
 
-    try:
-        from openpyxl import load_workbook
-
-        if not os.path.exists(EXCEL_FILENAME):
-            logger.error(
-                f"Corsi save: Файл Excel '{EXCEL_FILENAME}' не найден."
-            )
-            if await state.get_state() is not None:
-                await trigger_msg_context.answer(
-                    f"Ошибка: Файл для сохранения ('{EXCEL_FILENAME}') не найден."
-                )
-            return
-
-        wb = load_workbook(EXCEL_FILENAME)
-        ws = wb.active
-        excel_headers = [cell.value for cell in ws[1]]
-        if "Unique ID" not in excel_headers:
-            raise ValueError("Столбец 'Unique ID' не найден в Excel.")
-
-        uid_col_excel_idx = excel_headers.index("Unique ID")
-        target_row_num_excel = -1
-        for r_num_excel, row_data_tuple in enumerate(
-            ws.iter_rows(min_row=2, values_only=True), start=2
-        ):
-            if (
-                len(row_data_tuple) > uid_col_excel_idx
-                and row_data_tuple[uid_col_excel_idx] is not None
-                and str(row_data_tuple[uid_col_excel_idx]) == str(uid)
-            ):
-                target_row_num_excel = r_num_excel
-                break
-
-        if target_row_num_excel == -1:
-            logger.info(
-                f"Corsi save: UID {uid} не найден, добавление новой строки."
-            )
-            new_row_values = [""] * len(
-                excel_headers
-            )  # Base on actual excel headers count
-            new_row_values[uid_col_excel_idx] = (
-                uid  # Set UID in its actual column
-            )
-            # Populate other known base headers if they exist in excel_headers
-            if p_name and "Name" in excel_headers:
-                new_row_values[excel_headers.index("Name")] = p_name
-            if p_age and "Age" in excel_headers:
-                new_row_values[excel_headers.index("Age")] = p_age
-            if p_tgid and "Telegram ID" in excel_headers:
-                new_row_values[excel_headers.index("Telegram ID")] = p_tgid
-            ws.append(new_row_values)
-            target_row_num_excel = ws.max_row
-
-        corsi_headers_map = {}
-        for h_name in [
-            "Corsi - Max Correct Sequence Length",
-            "Corsi - Avg Time Per Element (s)",
-            "Corsi - Sequence Times Detail",
-            "Corsi - Interrupted",
-        ]:
-            if h_name in excel_headers:
-                corsi_headers_map[h_name] = excel_headers.index(h_name) + 1
-            else:
-                logger.warning(
-                    f"Corsi save: Заголовок '{h_name}' не найден в Excel. Пропуск."
-                )
-
-        if "Corsi - Max Correct Sequence Length" in corsi_headers_map:
-            ws.cell(
-                row=target_row_num_excel,
-                column=corsi_headers_map[
-                    "Corsi - Max Correct Sequence Length"
-                ],
-            ).value = max_len
-        if "Corsi - Avg Time Per Element (s)" in corsi_headers_map:
-            ws.cell(
-                row=target_row_num_excel,
-                column=corsi_headers_map["Corsi - Avg Time Per Element (s)"],
-            ).value = round(avg_time_per_el, 2)
-        if "Corsi - Sequence Times Detail" in corsi_headers_map:
-            ws.cell(
-                row=target_row_num_excel,
-                column=corsi_headers_map["Corsi - Sequence Times Detail"],
-            ).value = seq_details
-        if "Corsi - Interrupted" in corsi_headers_map:
-            ws.cell(
-                row=target_row_num_excel,
-                column=corsi_headers_map["Corsi - Interrupted"],
-            ).value = interrupted_str
-
-        wb.save(EXCEL_FILENAME)
+    saved = await save_test_results(
+        uid,
+        {
+            "Corsi - Max Correct Sequence Length": max_len,
+            "Corsi - Avg Time Per Element (s)": round(avg_time_per_el, 2),
+            "Corsi - Sequence Times Detail": seq_details,
+            "Corsi - Interrupted": interrupted_str,
+        },
+        profile=corsi.profile_for_save(data),
+    )
+    await save_test_trials(
+        "corsi",
+        uid,
+        [
+            (f"len{item['len']}", bool(item["correct"]), item["time"])
+            for item in corsi.attempts
+        ],
+    )
+    if saved:
         logger.info(
             f"Результаты Теста Корси для UID {uid} (Прерван: {is_interrupted}) сохранены."
         )
-
-    except FileNotFoundError:
-        logger.error(
-            f"Corsi save: Файл Excel '{EXCEL_FILENAME}' не найден (повторно)."
+    elif await state.get_state() is not None:
+        await trigger_msg_context.answer(
+            "Непредвиденная ошибка при сохранении Теста Корси."
         )
-        if await state.get_state() is not None:
-            await trigger_msg_context.answer(
-                f"Критическая ошибка: Файл для сохранения ('{EXCEL_FILENAME}') не найден."
-            )
-    except ValueError as ve_excel:
-        logger.error(
-            f"Corsi save: Ошибка конфигурации Excel для UID {uid}: {ve_excel}",
-            exc_info=True,
-        )
-        if await state.get_state() is not None:
-            await trigger_msg_context.answer(
-                "Ошибка конфигурации при сохранении Теста Корси."
-            )
-    except Exception as e_excel_gen:
-        logger.error(
-            f"Corsi save: Общая ошибка сохранения в Excel для UID {uid}: {e_excel_gen}",
-            exc_info=True,
-        )
-        if await state.get_state() is not None:
-            await trigger_msg_context.answer(
-                "Непредвиденная ошибка при сохранении Теста Корси."
-            )
 
     # Send summary message to user if test was not abruptly stopped (i.e., state is still somewhat valid)
     if await state.get_state() is not None:
@@ -13,8 +13,6 @@ from aiogram.types import (
     CallbackQuery,
     InlineKeyboardButton,
     InlineKeyboardMarkup,
-    FSInputFile,
-    InputMediaPhoto,
     Message,
     Chat,
     User,
@@ -24,8 +22,6 @@ import settings  # Импортируем модуль settings для дост
 
 from fsm_states import MentalRotationStates
 from settings import (  # Импортируем константы, которые не изменяются динамически
-    ALL_EXPECTED_HEADERS,
-    EXCEL_FILENAME,
     MENTAL_ROTATION_NUM_ITERATIONS,
     MR_REFERENCES_DIR,
     MR_CORRECT_PROJECTIONS_DIR,
@@ -36,7 +32,13 @@ from utils.image_processors import generate_mr_collage
 from utils.bot_helpers import (
     send_main_action_menu,
     get_active_profile_from_fsm,
+    message_from_ref,
+    message_ref,
 )
+from utils.excel_handler import save_test_results, save_test_trials
+from utils.file_id_cache import edit_photo_cached, send_photo_cached
+from utils.session_tasks import session_tasks
+from utils.test_sessions import MentalRotationSession
 from keyboards import (
     ACTION_SELECTION_KEYBOARD_RETURNING,
     ACTION_SELECTION_KEYBOARD_NEW,
@@ -50,8 +52,8 @@ IKB = InlineKeyboardButton
 async def _get_mr_stimulus_for_iteration(
     state: FSMContext,
 ) -> tuple[str | None, list[str] | None, int | None, str | None]:
-    data = await state.get_data()
-    used_references = data.get("mr_used_references", [])
+    mr = MentalRotationSession.from_fsm(await state.get_data())
+    used_references = mr.used_references
 
     # Используем settings. для доступа к изменяемым спискам
     if not settings.MR_REFERENCE_FILES:
@@ -167,7 +169,7 @@ async def _get_mr_stimulus_for_iteration(
     selected_distractor_paths = random.sample(
         valid_distractors, num_distractors_to_select
     )
-    await state.update_data(mr_used_references=used_references)
+    await state.update_data(mr.as_fsm_data())
 
     options_paths = [correct_projection_path] + selected_distractor_paths
     random.shuffle(options_paths)
@@ -191,7 +193,10 @@ async def _mr_schedule_feedback_revert(
         if (
             current_fsm_state_val is not None
             and current_fsm_state_val.startswith(MentalRotationStates.__name__)
-            and current_fsm_data.get("mr_feedback_message_id") == message_id
+            and MentalRotationSession.from_fsm(
+                current_fsm_data
+            ).feedback_message_id
+            == message_id
         ):
             try:
                 await bot_instance.edit_message_text(
@@ -234,9 +239,9 @@ async def _display_mr_stimulus(
     bot_instance: Bot,
     is_editing: bool = False,
 ):
-    data = await state.get_data()
-    current_iteration = data.get("mr_current_iteration", 0) + 1
-    await state.update_data(mr_current_iteration=current_iteration)
+    mr = MentalRotationSession.from_fsm(await state.get_data())
+    mr.current_iteration += 1
+    await state.update_data(mr.as_fsm_data())
 
     ref_path, opt_paths, correct_idx, err_msg = (
         await _get_mr_stimulus_for_iteration(state)
@@ -261,14 +266,14 @@ async def _display_mr_stimulus(
         return
 
     collage_input_file = (
-        None  # To hold FSInputFile or path string for deletion
+        None  # Collage bytes, or a path string (deleted afterwards)
     )
     try:
         collage_file_path_or_bytes = await generate_mr_collage(
             opt_paths
         )  # Assuming this returns a path or BytesIO
         if isinstance(collage_file_path_or_bytes, str):  # If it's a path
-            collage_input_file = FSInputFile(collage_file_path_or_bytes)
+            collage_input_file = collage_file_path_or_bytes
             path_to_delete_collage = collage_file_path_or_bytes
         elif hasattr(
             collage_file_path_or_bytes, 'read'
@@ -300,12 +305,12 @@ async def _display_mr_stimulus(
             )
             return
 
-        await state.update_data(
-            mr_correct_option_index_for_current_iter=correct_idx
+        mr = await MentalRotationSession.update_fsm(
+            state, correct_option_index=correct_idx
         )
 
-        ref_msg_id = data.get("mr_reference_message_id")
-        options_msg_id = data.get("mr_options_message_id")
+        ref_msg_id = mr.reference_message_id
+        options_msg_id = mr.options_message_id
 
         if not is_editing:
             if ref_msg_id and chat_id:
@@ -324,17 +329,15 @@ async def _display_mr_stimulus(
         # Send/Edit Reference Image
         try:
             if is_editing and ref_msg_id and chat_id:
-                await bot_instance.edit_message_media(
-                    chat_id=chat_id,
-                    message_id=ref_msg_id,
-                    media=InputMediaPhoto(media=FSInputFile(ref_path)),
+                await edit_photo_cached(
+                    bot_instance, chat_id, ref_msg_id, ref_path
                 )
             elif chat_id:
-                msg_ref = await bot_instance.send_photo(
-                    chat_id, FSInputFile(ref_path)
+                msg_ref = await send_photo_cached(
+                    bot_instance, chat_id, ref_path
                 )
-                await state.update_data(
-                    mr_reference_message_id=msg_ref.message_id
+                await MentalRotationSession.update_fsm(
+                    state, reference_message_id=msg_ref.message_id
                 )
             else:
                 raise ValueError("chat_id is None for reference image.")
@@ -373,18 +376,26 @@ async def _display_mr_stimulus(
 
         try:
             if is_editing and options_msg_id and chat_id:
-                await bot_instance.edit_message_media(
-                    chat_id=chat_id,
-                    message_id=options_msg_id,
-                    media=InputMediaPhoto(media=collage_input_file),
+                await edit_photo_cached(
+                    bot_instance,
+                    chat_id,
+                    options_msg_id,
+                    collage_input_file,
+                    persist=False,
                     reply_markup=reply_markup,
                 )
             elif chat_id:
-                msg_opts = await bot_instance.send_photo(
-                    chat_id, collage_input_file, reply_markup=reply_markup
+                # Identical option sets give identical collage bytes: the
+                # in-memory file_id LRU sends those without a new upload
+                msg_opts = await send_photo_cached(
+                    bot_instance,
+                    chat_id,
+                    collage_input_file,
+                    persist=False,
+                    reply_markup=reply_markup,
                 )
-                await state.update_data(
-                    mr_options_message_id=msg_opts.message_id
+                await MentalRotationSession.update_fsm(
+                    state, options_message_id=msg_opts.message_id
                 )
             else:
                 raise ValueError("chat_id is None for options collage.")
@@ -407,7 +418,9 @@ async def _display_mr_stimulus(
             )
             return
 
-        await state.update_data(mr_iteration_start_time=time.time())
+        await MentalRotationSession.update_fsm(
+            state, iteration_start_time=time.time()
+        )
         await state.set_state(MentalRotationStates.displaying_stimulus_mr)
 
     finally:  # Ensure temporary collage file (if path was returned) is deleted
@@ -427,18 +440,18 @@ async def _display_mr_stimulus(
 async def _mr_proceed_to_next_iteration_or_finish(
     state: FSMContext, bot_instance: Bot, chat_id: int
 ):
-    data = await state.get_data()
-    current_iteration = data.get("mr_current_iteration", 0)
+    current_iteration = MentalRotationSession.from_fsm(
+        await state.get_data()
+    ).current_iteration
 
     if current_iteration < MENTAL_ROTATION_NUM_ITERATIONS:
         await state.set_state(
             MentalRotationStates.inter_iteration_countdown_mr
         )
-        countdown_task = asyncio.create_task(
-            _mr_inter_iteration_countdown_task(state, bot_instance, chat_id)
-        )
-        await state.update_data(
-            mr_inter_iteration_countdown_task_ref=countdown_task
+        await session_tasks.start(
+            state,
+            "mr_inter_iteration_countdown",
+            _mr_inter_iteration_countdown_task(state, bot_instance, chat_id),
         )
     else:
         await _finish_mental_rotation_test(
@@ -477,7 +490,9 @@ async def _mr_inter_iteration_countdown_task(
             chat_id, "Следующее задание через: 3..."
         )
         countdown_msg_id_local = countdown_msg.message_id
-        await state.update_data(mr_countdown_message_id=countdown_msg_id_local)
+        await MentalRotationSession.update_fsm(
+            state, countdown_message_id=countdown_msg_id_local
+        )
 
         for i in range(2, 0, -1):
             await asyncio.sleep(1)
@@ -506,7 +521,9 @@ async def _mr_inter_iteration_countdown_task(
                 )
             except TelegramBadRequest:
                 pass
-        await state.update_data(mr_countdown_message_id=None)
+        await MentalRotationSession.update_fsm(
+            state, countdown_message_id=None
+        )
 
         await _display_mr_stimulus(
             chat_id, state, bot_instance, is_editing=True
@@ -542,11 +559,9 @@ async def _mr_inter_iteration_countdown_task(
                 )
     except asyncio.CancelledError:
         logger.info(f"MR Countdown task for chat {chat_id} was cancelled.")
-        data_on_cancel = await state.get_data()
-        chat_id_on_cancel = data_on_cancel.get("mr_chat_id")
-        countdown_msg_id_on_cancel = data_on_cancel.get(
-            "mr_countdown_message_id"
-        )
+        mr_on_cancel = MentalRotationSession.from_fsm(await state.get_data())
+        chat_id_on_cancel = mr_on_cancel.chat_id
+        countdown_msg_id_on_cancel = mr_on_cancel.countdown_message_id
         if countdown_msg_id_on_cancel and chat_id_on_cancel:
             try:
                 await bot_instance.delete_message(
@@ -569,8 +584,6 @@ async def _mr_inter_iteration_countdown_task(
                 is_interrupted=True,
                 error_occurred=True,
             )
-    finally:
-        await state.update_data(mr_inter_iteration_countdown_task_ref=None)
 
 
 async def _finish_mental_rotation_test(
@@ -615,22 +628,17 @@ async def _finish_mental_rotation_test(
         f"Finishing Mental Rotation Test. Interrupted: {is_interrupted}, Error: {error_occurred}, Called by Stop: {called_by_stop_command}"
     )
     data = await state.get_data()
-    effective_chat_id = data.get("mr_chat_id", chat_id)
-
-    for task_key in [
-        "mr_current_feedback_revert_task_ref",
-        "mr_inter_iteration_countdown_task_ref",
-    ]:
-        task = data.get(task_key)
-        if task and not task.done():
-            task.cancel()
-            await asyncio.sleep(0.01)  # Give a tick for cancellation
-        await state.update_data(**{task_key: None})
-
-    results_calc = data.get("mr_iteration_results", [])
+    mr = MentalRotationSession.from_fsm(data)
+    effective_chat_id = mr.chat_id or chat_id
+
+    await session_tasks.cancel(
+        state, "mr_feedback_revert", "mr_inter_iteration_countdown"
+    )
+
+    results_calc = mr.iteration_results
     correct_answers_calc = sum(1 for r in results_calc if r.get("is_correct"))
     total_iterations_done_calc = len(results_calc)
-    start_time = data.get("mr_test_start_time")
+    start_time = mr.test_start_time
     total_test_time_s_calc = (
         round(time.time() - start_time, 2) if start_time else 0.0
     )
@@ -652,12 +660,13 @@ async def _finish_mental_rotation_test(
     ]
     ind_resp_str_calc = "; ".join(ind_resp_parts) if ind_resp_parts else "N/A"
 
-    await state.update_data(
-        mr_final_correct_answers=correct_answers_calc,
-        mr_final_avg_reaction_time_s=avg_reaction_time_s_calc,
-        mr_final_total_test_time_s=total_test_time_s_calc,
-        mr_final_individual_responses_str=ind_resp_str_calc,
-        mr_final_interrupted_status=(is_interrupted or error_occurred),
+    await MentalRotationSession.update_fsm(
+        state,
+        final_correct_answers=correct_answers_calc,
+        final_avg_reaction_time_s=avg_reaction_time_s_calc,
+        final_total_test_time_s=total_test_time_s_calc,
+        final_individual_responses=ind_resp_str_calc,
+        final_interrupted=(is_interrupted or error_occurred),
     )
 
     mock_msg_for_save = None
@@ -752,7 +761,8 @@ async def _finish_mental_rotation_test(
         if profile_data_to_keep_final_nav.get("active_unique_id"):
             await state.set_data(profile_data_to_keep_final_nav)
             trigger_event_for_menu = (
-                data.get("mr_triggering_event_for_menu") or mock_msg_for_save
+                message_from_ref(bot_instance, mr.trigger_message)
+                or mock_msg_for_save
             )  # Use original trigger or mock
 
             message_context_for_menu_final = None
@@ -803,24 +813,11 @@ async def start_mental_rotation_test(
     chat_id = msg_ctx.chat.id
 
     await state.set_state(MentalRotationStates.initial_instructions_mr)
-    await state.update_data(
-        mr_unique_id_for_test=profile.get("unique_id"),
-        mr_profile_name_for_test=profile.get("name"),
-        mr_profile_age_for_test=profile.get("age"),
-        mr_profile_telegram_id_for_test=profile.get("telegram_id"),
-        mr_chat_id=chat_id,
-        mr_current_iteration=0,
-        mr_iteration_results=[],
-        mr_used_references=[],
-        mr_test_start_time=None,
-        mr_reference_message_id=None,
-        mr_options_message_id=None,
-        mr_countdown_message_id=None,
-        mr_feedback_message_id=None,
-        mr_inter_iteration_countdown_task_ref=None,
-        mr_current_feedback_revert_task_ref=None,
-        mr_triggering_event_for_menu=msg_ctx,
+    mr = MentalRotationSession(
+        chat_id=chat_id, trigger_message=message_ref(msg_ctx)
     )
+    mr.set_profile(profile)
+    await state.update_data(mr.as_fsm_data())
     instruction_text = (
         "<b>Тест умственного вращения</b>\n\n"
         "Вам будет показан 3D объект и 4 варианта 2D проекций. "
@@ -911,14 +908,16 @@ async def mr_ack_instructions_callback(
     callback: CallbackQuery, state: FSMContext, bot: Bot
 ):
     await callback.answer()
-    await state.update_data(mr_test_start_time=time.time())
+    mr = await MentalRotationSession.update_fsm(
+        state, test_start_time=time.time()
+    )
     if callback.message:
         try:
             await callback.message.delete()  # Delete the message with "Начать тест" button
         except TelegramBadRequest:
             pass
 
-    chat_id = (await state.get_data()).get("mr_chat_id")
+    chat_id = mr.chat_id
     if chat_id:
         await _display_mr_stimulus(chat_id, state, bot)
     else:
@@ -941,8 +940,8 @@ async def mr_answer_callback(
     callback: CallbackQuery, state: FSMContext, bot: Bot
 ):
     await callback.answer()
-    data = await state.get_data()
-    chat_id = data.get("mr_chat_id")
+    mr = MentalRotationSession.from_fsm(await state.get_data())
+    chat_id = mr.chat_id
     if not chat_id:
         logger.error("MR Answer Callback: chat_id missing. Aborting.")
         if callback.message:
@@ -954,16 +953,17 @@ async def mr_answer_callback(
         )
         return
 
-    iteration_start_time = data.get("mr_iteration_start_time", time.time())
+    iteration_start_time = mr.iteration_start_time or time.time()
     reaction_time_s = round(time.time() - iteration_start_time, 2)
 
     selected_option_num = int(callback.data.split("_")[-1])
     selected_option_idx = selected_option_num - 1
-    correct_option_idx = data.get("mr_correct_option_index_for_current_iter")
+    correct_option_idx = mr.correct_option_index
     is_correct = selected_option_idx == correct_option_idx
 
     iteration_data = {
-        "iteration": data.get("mr_current_iteration"),
+        "iteration": mr.current_iteration,
+        "reference": (mr.used_references or ["N/A"])[-1],
         "is_correct": is_correct,
         "reaction_time_s": reaction_time_s,
         "selected_option": selected_option_num,
@@ -971,18 +971,14 @@ async def mr_answer_callback(
             correct_option_idx + 1 if correct_option_idx is not None else "N/A"
         ),
     }
-    current_results = data.get("mr_iteration_results", [])
-    current_results.append(iteration_data)
-    await state.update_data(mr_iteration_results=current_results)
+    mr.iteration_results.append(iteration_data)
+    await state.update_data(mr.as_fsm_data())
 
     feedback_text_bold = f"<b>{'Верно!' if is_correct else 'Неверно!'}</b>"
     feedback_text_normal = f"{'Верно!' if is_correct else 'Неверно!'}"
-    feedback_msg_id = data.get("mr_feedback_message_id")
+    feedback_msg_id = mr.feedback_message_id
 
-    previous_revert_task = data.get("mr_current_feedback_revert_task_ref")
-    if previous_revert_task and not previous_revert_task.done():
-        previous_revert_task.cancel()
-        await asyncio.sleep(0.01)
+    await session_tasks.cancel(state, "mr_feedback_revert")
 
     try:
         if feedback_msg_id:
@@ -997,16 +993,17 @@ async def mr_answer_callback(
                 chat_id, feedback_text_bold, parse_mode=ParseMode.HTML
             )
             feedback_msg_id = msg_fb.message_id
-            await state.update_data(mr_feedback_message_id=feedback_msg_id)
+            await MentalRotationSession.update_fsm(
+                state, feedback_message_id=feedback_msg_id
+            )
 
         if feedback_msg_id:
-            revert_task = asyncio.create_task(
+            await session_tasks.start(
+                state,
+                "mr_feedback_revert",
                 _mr_schedule_feedback_revert(
                     chat_id, feedback_msg_id, feedback_text_normal, bot, state
-                )
-            )
-            await state.update_data(
-                mr_current_feedback_revert_task_ref=revert_task
+                ),
             )
     except TelegramBadRequest as e_tb_fb_ans:
         if "message is not modified" not in str(e_tb_fb_ans).lower():
@@ -1019,7 +1016,7 @@ async def mr_answer_callback(
             exc_info=True,
         )
 
-    options_msg_id = data.get("mr_options_message_id")
+    options_msg_id = mr.options_message_id
     if options_msg_id and chat_id:
         try:
             await bot.edit_message_reply_markup(
@@ -1041,87 +1038,50 @@ async def save_mental_rotation_results(
         f"Saving Mental Rotation results. Interrupted: {is_interrupted}"
     )
     data = await state.get_data()
-    uid = data.get("mr_unique_id_for_test", data.get("active_unique_id"))
-    p_tgid = data.get(
-        "mr_profile_telegram_id_for_test", data.get("active_telegram_id")
-    )
-    p_name = data.get("mr_profile_name_for_test", data.get("active_name"))
-    p_age = data.get("mr_profile_age_for_test", data.get("active_age"))
+    mr = MentalRotationSession.from_fsm(data)
+    uid = mr.unique_id or data.get("active_unique_id")
 
     if not uid:
         logger.error("MR Save Results: UID not found. Cannot save results.")
         return
 
-    correct_ans = data.get(
-        "mr_final_correct_answers", 0
-    )  # Default to 0 if missing
-    avg_rt = data.get("mr_final_avg_reaction_time_s", 0.0)
-    total_time = data.get("mr_final_total_test_time_s", 0.0)
-    ind_resp_str = data.get("mr_final_individual_responses_str", "N/A")
-    interrupted_status = (
-        "Да"
-        if data.get("mr_final_interrupted_status", is_interrupted)
-        else "Нет"
+    correct_ans = mr.final_correct_answers
+    avg_rt = mr.final_avg_reaction_time_s
+    total_time = mr.final_total_test_time_s
+    ind_resp_str = mr.final_individual_responses
+    if mr.final_interrupted is not None:
+        is_interrupted = mr.final_interrupted
+    interrupted_status = "Да" if is_interrupted else "Нет"
+
+    saved = await save_test_results(
+        uid,
+        {
+            "MentalRotation_CorrectAnswers": correct_ans,
+            "MentalRotation_AverageReactionTime_s": avg_rt,
+            "MentalRotation_TotalTime_s": total_time,
+            "MentalRotation_IndividualResponses": ind_resp_str,
+            "MentalRotation_Interrupted": interrupted_status,
+        },
+        profile=mr.profile_for_save(data),
     )
-
-    try:
-        from openpyxl import load_workbook
-
-        wb = load_workbook(EXCEL_FILENAME)
-        ws = wb.active
-        row_num = -1
-        if "Unique ID" not in ALL_EXPECTED_HEADERS:
-            raise ValueError(
-                "'Unique ID' header not found in settings.ALL_EXPECTED_HEADERS"
+    await save_test_trials(
+        "mental_rotation",
+        uid,
+        [
+            (
+                r.get("reference", "N/A"),
+                r.get("is_correct"),
+                r.get("reaction_time_s", 0.0),
             )
-        uid_col_idx = ALL_EXPECTED_HEADERS.index("Unique ID")
-
-        for r_idx, row_vals in enumerate(
-            ws.iter_rows(min_row=2, values_only=True), start=2
-        ):
-            if row_vals[uid_col_idx] is not None and str(
-                row_vals[uid_col_idx]
-            ) == str(uid):
-                row_num = r_idx
-                break
-
-        if row_num == -1:
-            new_row_excel_save = [""] * len(ALL_EXPECTED_HEADERS)
-            if p_tgid and "Telegram ID" in ALL_EXPECTED_HEADERS:
-                new_row_excel_save[
-                    ALL_EXPECTED_HEADERS.index("Telegram ID")
-                ] = p_tgid
-            new_row_excel_save[uid_col_idx] = uid
-            if p_name and "Name" in ALL_EXPECTED_HEADERS:
-                new_row_excel_save[ALL_EXPECTED_HEADERS.index("Name")] = p_name
-            if p_age and "Age" in ALL_EXPECTED_HEADERS:
-                new_row_excel_save[ALL_EXPECTED_HEADERS.index("Age")] = p_age
-            ws.append(new_row_excel_save)
-            row_num = ws.max_row
-
-        h = ALL_EXPECTED_HEADERS
-
-        def set_cell_val(hdr_name, val_to_set):
-            if hdr_name in h:
-                ws.cell(row=row_num, column=h.index(hdr_name) + 1).value = (
-                    val_to_set
-                )
-
-        set_cell_val("MentalRotation_CorrectAnswers", correct_ans)
-        set_cell_val("MentalRotation_AverageReactionTime_s", avg_rt)
-        set_cell_val("MentalRotation_TotalTime_s", total_time)
-        set_cell_val("MentalRotation_IndividualResponses", ind_resp_str)
-        set_cell_val("MentalRotation_Interrupted", interrupted_status)
-
-        wb.save(EXCEL_FILENAME)
+            for r in mr.iteration_results
+        ],
+    )
+    if saved:
         logger.info(
             f"Mental Rotation results for UID {uid} saved. Interrupted: {interrupted_status}"
         )
-    except Exception as e_save_excel_mr:
-        logger.error(
-            f"MR Save Results: Excel save error for UID {uid}: {e_save_excel_mr}",
-            exc_info=True,
-        )
+    else:
+        logger.error(f"MR Save Results: save error for UID {uid}.")
 
 
 async def cleanup_mental_rotation_ui(
@@ -1129,26 +1089,21 @@ async def cleanup_mental_rotation_ui(
     bot_instance: Bot,
     final_text: str | None = None,
 ):
-    data = await state.get_data()
-    chat_id = data.get("mr_chat_id")
+    mr = MentalRotationSession.from_fsm(await state.get_data())
+    chat_id = mr.chat_id
     logger.info(
         f"MR Cleanup UI: Chat {chat_id if chat_id else 'N/A'}. Final text directive (for stop_test): '{final_text}'"
     )
 
-    for task_key in [
-        "mr_inter_iteration_countdown_task_ref",
-        "mr_current_feedback_revert_task_ref",
-    ]:
-        task = data.get(task_key)
-        if task and not task.done():
-            task.cancel()
-            await asyncio.sleep(0.01)
+    await session_tasks.cancel(
+        state, "mr_inter_iteration_countdown", "mr_feedback_revert"
+    )
 
     mr_ui_msg_ids_to_clean = {
-        data.get("mr_reference_message_id"),
-        data.get("mr_options_message_id"),
-        data.get("mr_countdown_message_id"),
-        data.get("mr_feedback_message_id"),
+        mr.reference_message_id,
+        mr.options_message_id,
+        mr.countdown_message_id,
+        mr.feedback_message_id,
     }
     mr_ui_msg_ids_to_clean.discard(None)
 
@@ -1156,8 +1111,8 @@ async def cleanup_mental_rotation_ui(
         if (
             final_text
         ):  # Typically for interruption via stop_test_command_handler
-            options_msg_id_for_edit = data.get(
-                "mr_options_message_id"
+            options_msg_id_for_edit = (
+                mr.options_message_id
             )  # Prefer editing options message
             edited_one_msg = False
             if options_msg_id_for_edit:
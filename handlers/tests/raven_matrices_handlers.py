@@ -4,6 +4,7 @@ import logging
 import random
 import time
 import os
+from typing import Optional
 
 from aiogram import Bot, F, Router
 from aiogram.enums import ParseMode, ChatType
@@ -13,8 +14,6 @@ from aiogram.types import (
     CallbackQuery,
     InlineKeyboardButton,
     InlineKeyboardMarkup,
-    FSInputFile,
-    InputMediaPhoto,
     Message,
     Chat,
     User,
@@ -22,17 +21,23 @@ from aiogram.types import (
 
 from fsm_states import RavenMatricesStates
 from settings import (
-    ALL_EXPECTED_HEADERS,
-    EXCEL_FILENAME,
     RAVEN_NUM_TASKS_TO_PRESENT,
     RAVEN_ALL_TASK_FILES,
     RAVEN_BASE_DIR,
     RAVEN_FEEDBACK_DISPLAY_TIME_S,
 )
 from utils.bot_helpers import (
+    FSMSession,
+    fsm_session,
     send_main_action_menu,
     get_active_profile_from_fsm,
+    message_from_ref,
+    message_ref,
 )
+from utils.excel_handler import save_test_results, save_test_trials
+from utils.file_id_cache import edit_photo_cached, send_photo_cached
+from utils.session_tasks import session_tasks
+from utils.test_sessions import RavenSession
 from keyboards import (
     ACTION_SELECTION_KEYBOARD_RETURNING,
     ACTION_SELECTION_KEYBOARD_NEW,  # Included for completeness
@@ -85,7 +90,8 @@ async def _raven_delayed_feedback_revert(
         await asyncio.sleep(RAVEN_FEEDBACK_DISPLAY_TIME_S)
         current_fsm_data = await state_at_call.get_data()
         if (
-            current_fsm_data.get("raven_feedback_message_id") == message_id
+            RavenSession.from_fsm(current_fsm_data).feedback_message_id
+            == message_id
             and await state_at_call.get_state()
             is not None  # Check if state is still active
             and (await state_at_call.get_state()).startswith(
@@ -128,16 +134,26 @@ async def _raven_delayed_feedback_revert(
 
 
 async def _display_raven_task(
-    chat_id: int, state: FSMContext, bot_instance: Bot
+    chat_id: int,
+    state: FSMContext,
+    bot_instance: Bot,
+    session: Optional[FSMSession] = None,
 ):
-    data = await state.get_data()
-    current_iter_idx = data.get("raven_current_iteration_num", 0)
-    session_tasks = data.get("raven_session_task_filenames", [])
+    # One FSM read and one merged write per task; the answer handler
+    # passes its own session so its changes ride along in the same commit.
+    if session is None:
+        async with fsm_session(state) as session:
+            await _display_raven_task(chat_id, state, bot_instance, session)
+        return
+    raven = RavenSession.from_fsm(session.data)
+    current_iter_idx = raven.current_iteration
+    task_filenames = raven.task_filenames
 
-    if current_iter_idx >= len(session_tasks):
+    if current_iter_idx >= len(task_filenames):
         logger.info(
             "Raven: All tasks displayed. Finishing test via _display_raven_task."
         )
+        await session.commit()
         await _finish_raven_matrices_test(
             state,
             bot_instance,
@@ -147,7 +163,7 @@ async def _display_raven_task(
         )
         return
 
-    task_filename_only = session_tasks[current_iter_idx]
+    task_filename_only = task_filenames[current_iter_idx]
     task_image_full_path = os.path.join(RAVEN_BASE_DIR, task_filename_only)
     _, correct_option_1_based, num_total_options = _parse_raven_filename(
         task_filename_only
@@ -165,6 +181,7 @@ async def _display_raven_task(
             chat_id,
             f"Ошибка загрузки задания {current_iter_idx + 1}. Тест Матриц Равена прерван.",
         )
+        await session.commit()
         await _finish_raven_matrices_test(
             state,
             bot_instance,
@@ -174,11 +191,10 @@ async def _display_raven_task(
         )
         return
 
-    await state.update_data(
-        raven_correct_option_for_current_task=correct_option_1_based,
-        raven_num_options_for_current_task=num_total_options,
-        raven_current_task_filename=task_filename_only,
-    )
+    raven.correct_option = correct_option_1_based
+    raven.num_options = num_total_options
+    raven.current_task_filename = task_filename_only
+    session.update(raven.as_fsm_data())
 
     buttons_row, buttons_grid = [], []
     buttons_per_row = 3
@@ -200,28 +216,29 @@ async def _display_raven_task(
     )
     reply_markup = InlineKeyboardMarkup(inline_keyboard=buttons_grid)
 
-    task_message_id = data.get("raven_task_message_id")
-    caption_text = f"Задание {current_iter_idx + 1} из {len(session_tasks)}"
+    task_message_id = raven.task_message_id
+    caption_text = f"Задание {current_iter_idx + 1} из {len(task_filenames)}"
 
     try:
         if task_message_id:
-            media = InputMediaPhoto(
-                media=FSInputFile(task_image_full_path), caption=caption_text
-            )
-            await bot_instance.edit_message_media(
-                chat_id=chat_id,
-                message_id=task_message_id,
-                media=media,
+            await edit_photo_cached(
+                bot_instance,
+                chat_id,
+                task_message_id,
+                task_image_full_path,
+                caption=caption_text,
                 reply_markup=reply_markup,
             )
         else:
-            msg = await bot_instance.send_photo(
-                chat_id=chat_id,
-                photo=FSInputFile(task_image_full_path),
+            msg = await send_photo_cached(
+                bot_instance,
+                chat_id,
+                task_image_full_path,
                 caption=caption_text,
                 reply_markup=reply_markup,
             )
-            await state.update_data(raven_task_message_id=msg.message_id)
+            raven.task_message_id = msg.message_id
+            session.update(raven.as_fsm_data())
     except (TelegramBadRequest, FileNotFoundError) as e:
         logger.error(
             f"Raven: Error sending/editing task image '{task_filename_only}': {e}",
@@ -230,6 +247,7 @@ async def _display_raven_task(
         await bot_instance.send_message(
             chat_id, "Ошибка отображения задания. Тест Матриц Равена прерван."
         )
+        await session.commit()
         await _finish_raven_matrices_test(
             state,
             bot_instance,
@@ -239,8 +257,9 @@ async def _display_raven_task(
         )
         return
 
-    await state.update_data(raven_current_task_start_time=time.time())
-    await state.set_state(RavenMatricesStates.displaying_task_raven)
+    raven.task_start_time = time.time()
+    session.update(raven.as_fsm_data())
+    session.set_state(RavenMatricesStates.displaying_task_raven)
 
 
 async def _finish_raven_matrices_test(
@@ -265,26 +284,20 @@ async def _finish_raven_matrices_test(
     logger.info(
         f"Finishing Raven Matrices Test. Interrupted: {is_interrupted}, Error: {error_occurred}, Called by Stop: {called_by_stop_command}"
     )
-    data = await state.get_data()
-    effective_chat_id = data.get(
-        "raven_chat_id", chat_id
-    )  # Prefer FSM chat_id
+    raven = RavenSession.from_fsm(await state.get_data())
+    effective_chat_id = raven.chat_id or chat_id  # Prefer FSM chat_id
 
-    revert_task = data.get("raven_current_feedback_revert_task_ref")
-    if revert_task and not revert_task.done():
-        revert_task.cancel()
-        await asyncio.sleep(0.01)  # Give a tick
-    await state.update_data(raven_current_feedback_revert_task_ref=None)
+    await session_tasks.cancel(state, "raven_feedback_revert")
 
-    iteration_results = data.get("raven_iteration_results", [])
+    iteration_results = raven.iteration_results
     total_tasks_presented_calc = len(iteration_results)
     correct_answers_count_calc = sum(
         1 for r in iteration_results if r.get("is_correct")
     )
 
-    test_start_time = data.get("raven_total_test_start_time")
+    test_start_time = raven.test_start_time
     # Use actual end time if recorded, otherwise current time
-    test_end_time = data.get("raven_total_test_end_time_actual", time.time())
+    test_end_time = raven.test_end_time or time.time()
     total_test_time_s_calc = (
         round(test_end_time - test_start_time, 2) if test_start_time else 0.0
     )
@@ -313,15 +326,15 @@ async def _finish_raven_matrices_test(
         else 0.0
     )
 
-    await state.update_data(
-        raven_final_correct_answers=correct_answers_count_calc,
-        raven_final_total_test_time_s=total_test_time_s_calc,
-        raven_final_avg_time_correct_s=avg_time_correct_s_calc,
-        raven_final_individual_times_s_str=ind_times_s_str_calc,
-        raven_final_interrupted_status=(
+    await RavenSession.update_fsm(
+        state,
+        final_correct_answers=correct_answers_count_calc,
+        final_total_test_time_s=total_test_time_s_calc,
+        final_avg_time_correct_s=avg_time_correct_s_calc,
+        final_individual_times=ind_times_s_str_calc,
+        final_interrupted=(
             is_interrupted or error_occurred
         ),  # Mark interrupted if error
-        raven_final_total_tasks_attempted=total_tasks_presented_calc,
     )
 
     # Create a mock message context if needed for save_results or send_main_action_menu
@@ -349,9 +362,7 @@ async def _finish_raven_matrices_test(
 
     # Send final summary text ONLY if not called by stop_test_command (which handles its own menu/message)
     if not called_by_stop_command and effective_chat_id:
-        num_tasks_in_session = len(
-            data.get("raven_session_task_filenames", [])
-        )
+        num_tasks_in_session = len(raven.task_filenames)
         final_text_to_user = ""
         if is_interrupted or error_occurred:
             final_text_to_user = "Тест Матриц Равена был прерван"
@@ -437,7 +448,7 @@ async def _finish_raven_matrices_test(
             )  # Keep only profile data
 
             trigger_event_for_menu_nav = (
-                data.get("raven_triggering_event_for_menu")
+                message_from_ref(bot_instance, raven.trigger_message)
                 or mock_msg_for_context
             )
             message_context_for_menu_nav = None
@@ -525,22 +536,13 @@ async def start_raven_matrices_test(
     )
 
     await state.set_state(RavenMatricesStates.initial_instructions_raven)
-    await state.update_data(
-        raven_unique_id_for_test=profile.get("unique_id"),
-        raven_profile_name_for_test=profile.get("name"),
-        raven_profile_age_for_test=profile.get("age"),
-        raven_profile_telegram_id_for_test=profile.get("telegram_id"),
-        raven_chat_id=chat_id,
-        raven_session_task_filenames=session_task_filenames,
-        raven_current_iteration_num=0,
-        raven_iteration_results=[],
-        raven_total_test_start_time=None,
-        raven_current_task_start_time=None,
-        raven_task_message_id=None,
-        raven_feedback_message_id=None,
-        raven_current_feedback_revert_task_ref=None,
-        raven_triggering_event_for_menu=msg_ctx,  # For navigating back to menu correctly
+    raven = RavenSession(
+        chat_id=chat_id,
+        trigger_message=message_ref(msg_ctx),  # For navigating back to menu correctly
+        task_filenames=session_task_filenames,
     )
+    raven.set_profile(profile)
+    await state.update_data(raven.as_fsm_data())
     instruction_text = (
         "<b>Тест Прогрессивных Матриц Равена</b>\n\n"
         "Вам будет показана матрица с пропущенным элементом и несколько вариантов для его заполнения. "
@@ -596,7 +598,7 @@ async def raven_ack_instructions_callback(
     callback: CallbackQuery, state: FSMContext, bot: Bot
 ):
     await callback.answer()
-    await state.update_data(raven_total_test_start_time=time.time())
+    raven = await RavenSession.update_fsm(state, test_start_time=time.time())
     if (
         callback.message
     ):  # Delete the instruction message with "Начать тест" button
@@ -605,7 +607,7 @@ async def raven_ack_instructions_callback(
         except TelegramBadRequest:
             pass
 
-    chat_id_ack = (await state.get_data()).get("raven_chat_id")
+    chat_id_ack = raven.chat_id
     if chat_id_ack:
         await _display_raven_task(chat_id_ack, state, bot)
     else:
@@ -629,8 +631,15 @@ async def handle_raven_answer_callback(
     callback: CallbackQuery, state: FSMContext, bot: Bot
 ):
     await callback.answer()
-    data = await state.get_data()
-    chat_id = data.get("raven_chat_id")
+    async with fsm_session(state) as session:
+        await _process_raven_answer(callback, state, bot, session)
+
+
+async def _process_raven_answer(
+    callback: CallbackQuery, state: FSMContext, bot: Bot, session: FSMSession
+):
+    raven = RavenSession.from_fsm(session.data)
+    chat_id = raven.chat_id
     if not chat_id:
         logger.error(
             "Raven Answer Callback: chat_id missing. Aborting processing."
@@ -639,19 +648,20 @@ async def handle_raven_answer_callback(
             await callback.message.answer(
                 "Критическая ошибка: ID чата не найден. Тест прерван."
             )
+        await session.commit()
         await _finish_raven_matrices_test(
             state, bot, None, is_interrupted=True, error_occurred=True
         )
         return
 
-    task_start_time = data.get(
-        "raven_current_task_start_time", time.time()
+    task_start_time = (
+        raven.task_start_time or time.time()
     )  # Fallback if somehow missing
     reaction_time_s = round(time.time() - task_start_time, 2)
     user_choice_num_1_based = int(callback.data.split("raven_answer_")[-1])
-    correct_option_1_based = data.get("raven_correct_option_for_current_task")
+    correct_option_1_based = raven.correct_option
     is_correct = user_choice_num_1_based == correct_option_1_based
-    current_task_filename_ans = data.get("raven_current_task_filename", "N/A")
+    current_task_filename_ans = raven.current_task_filename or "N/A"
 
     iteration_result_data = {
         "task_filename": current_task_filename_ans,
@@ -660,22 +670,16 @@ async def handle_raven_answer_callback(
         "is_correct": is_correct,
         "reaction_time_s": reaction_time_s,
     }
-    current_results_list = data.get("raven_iteration_results", [])
-    current_results_list.append(iteration_result_data)
-    await state.update_data(raven_iteration_results=current_results_list)
+    raven.iteration_results.append(iteration_result_data)
+    session.update(raven.as_fsm_data())
 
     feedback_text_bold_ans = (
         f"<b>{'Верно! ✅' if is_correct else 'Неверно!'}</b>"
     )
     feedback_text_normal_ans = f"{'Верно!' if is_correct else 'Неверно!'}"
-    feedback_msg_id_ans = data.get("raven_feedback_message_id")
+    feedback_msg_id_ans = raven.feedback_message_id
 
-    previous_revert_task_ans = data.get(
-        "raven_current_feedback_revert_task_ref"
-    )
-    if previous_revert_task_ans and not previous_revert_task_ans.done():
-        previous_revert_task_ans.cancel()
-        await asyncio.sleep(0.01)
+    await session_tasks.cancel(state, "raven_feedback_revert")
 
     try:
         if feedback_msg_id_ans:
@@ -690,22 +694,20 @@ async def handle_raven_answer_callback(
                 chat_id, feedback_text_bold_ans, parse_mode=ParseMode.HTML
             )
             feedback_msg_id_ans = msg_fb_ans.message_id
-            await state.update_data(
-                raven_feedback_message_id=feedback_msg_id_ans
-            )
+            raven.feedback_message_id = feedback_msg_id_ans
+            session.update(raven.as_fsm_data())
 
         if feedback_msg_id_ans:
-            revert_task_ans = asyncio.create_task(
+            await session_tasks.start(
+                state,
+                "raven_feedback_revert",
                 _raven_delayed_feedback_revert(
                     chat_id,
                     feedback_msg_id_ans,
                     feedback_text_normal_ans,
                     bot,
                     state,
-                )
-            )
-            await state.update_data(
-                raven_current_feedback_revert_task_ref=revert_task_ans
+                ),
             )
     except TelegramBadRequest as e_tb_fb_ans_cb:
         if "message is not modified" not in str(e_tb_fb_ans_cb).lower():
@@ -718,16 +720,17 @@ async def handle_raven_answer_callback(
             exc_info=True,
         )
 
-    current_iter_idx_ans = data.get("raven_current_iteration_num", 0)
-    session_tasks_len_ans = len(data.get("raven_session_task_filenames", []))
-    next_iter_idx_ans = current_iter_idx_ans + 1
-    await state.update_data(raven_current_iteration_num=next_iter_idx_ans)
+    next_iter_idx_ans = raven.current_iteration + 1
+    raven.current_iteration = next_iter_idx_ans
+    session.update(raven.as_fsm_data())
 
-    if next_iter_idx_ans < session_tasks_len_ans:
-        await _display_raven_task(chat_id, state, bot)
+    if next_iter_idx_ans < len(raven.task_filenames):
+        await _display_raven_task(chat_id, state, bot, session)
     else:  # All tasks completed
-        await state.update_data(raven_total_test_end_time_actual=time.time())
+        raven.test_end_time = time.time()
+        session.update(raven.as_fsm_data())
         logger.info("Raven Matrices Test: All iterations completed by user.")
+        await session.commit()
         await _finish_raven_matrices_test(
             state, bot, chat_id, is_interrupted=False, error_occurred=False
         )
@@ -742,92 +745,51 @@ async def save_raven_matrices_results(
         f"Saving Raven Matrices results. Interrupted: {is_interrupted}"
     )
     data = await state.get_data()
-    uid = data.get("raven_unique_id_for_test", data.get("active_unique_id"))
-    p_tgid = data.get(
-        "raven_profile_telegram_id_for_test", data.get("active_telegram_id")
-    )
-    p_name = data.get("raven_profile_name_for_test", data.get("active_name"))
-    p_age = data.get("raven_profile_age_for_test", data.get("active_age"))
+    raven = RavenSession.from_fsm(data)
+    uid = raven.unique_id or data.get("active_unique_id")
 
     if not uid:
         logger.error("Raven Save Results: UID not found. Cannot save results.")
         return
 
-    correct_ans_save = data.get("raven_final_correct_answers", 0)
-    total_time_save = data.get("raven_final_total_test_time_s", 0.0)
-    avg_rt_correct_save = data.get("raven_final_avg_time_correct_s", 0.0)
-    ind_times_str_save = data.get("raven_final_individual_times_s_str", "N/A")
-    interrupted_status_save = (
-        "Да"
-        if data.get("raven_final_interrupted_status", is_interrupted)
-        else "Нет"
+    correct_ans_save = raven.final_correct_answers
+    total_time_save = raven.final_total_test_time_s
+    avg_rt_correct_save = raven.final_avg_time_correct_s
+    ind_times_str_save = raven.final_individual_times
+    if raven.final_interrupted is not None:
+        is_interrupted = raven.final_interrupted
+    interrupted_status_save = "Да" if is_interrupted else "Нет"
+
+    saved = await save_test_results(
+        uid,
+        {
+            "RavenMatrices_CorrectAnswers": correct_ans_save,
+            "RavenMatrices_TotalTime_s": total_time_save,
+            "RavenMatrices_AvgTimeCorrect_s": avg_rt_correct_save,
+            "RavenMatrices_IndividualTimes_s": ind_times_str_save,
+            "RavenMatrices_Interrupted": interrupted_status_save,
+        },
+        profile=raven.profile_for_save(data),
     )
-
-    try:
-        from openpyxl import load_workbook
-
-        wb = load_workbook(EXCEL_FILENAME)
-        ws = wb.active
-        row_num = -1
-        if "Unique ID" not in ALL_EXPECTED_HEADERS:
-            raise ValueError(
-                "'Unique ID' header not in settings.ALL_EXPECTED_HEADERS for Excel."
+    await save_test_trials(
+        "raven_matrices",
+        uid,
+        [
+            (
+                r.get("task_filename", "N/A"),
+                r.get("is_correct"),
+                r.get("reaction_time_s", 0.0),
             )
-        uid_col_idx = ALL_EXPECTED_HEADERS.index("Unique ID")
-
-        for r_idx_save, row_vals_save in enumerate(
-            ws.iter_rows(min_row=2, values_only=True), start=2
-        ):
-            if row_vals_save[uid_col_idx] is not None and str(
-                row_vals_save[uid_col_idx]
-            ) == str(uid):
-                row_num = r_idx_save
-                break
-
-        if row_num == -1:
-            new_row_excel_raven = [""] * len(ALL_EXPECTED_HEADERS)
-            if p_tgid and "Telegram ID" in ALL_EXPECTED_HEADERS:
-                new_row_excel_raven[
-                    ALL_EXPECTED_HEADERS.index("Telegram ID")
-                ] = p_tgid
-            new_row_excel_raven[uid_col_idx] = uid
-            if p_name and "Name" in ALL_EXPECTED_HEADERS:
-                new_row_excel_raven[ALL_EXPECTED_HEADERS.index("Name")] = (
-                    p_name
-                )
-            if p_age and "Age" in ALL_EXPECTED_HEADERS:
-                new_row_excel_raven[ALL_EXPECTED_HEADERS.index("Age")] = p_age
-            ws.append(new_row_excel_raven)
-            row_num = ws.max_row
-
-        h_excel = ALL_EXPECTED_HEADERS
-
-        def set_cell_val_raven(hdr_name_raven, val_to_set_raven):
-            if hdr_name_raven in h_excel:
-                ws.cell(
-                    row=row_num, column=h_excel.index(hdr_name_raven) + 1
-                ).value = val_to_set_raven
-
-        set_cell_val_raven("RavenMatrices_CorrectAnswers", correct_ans_save)
-        set_cell_val_raven("RavenMatrices_TotalTime_s", total_time_save)
-        set_cell_val_raven(
-            "RavenMatrices_AvgTimeCorrect_s", avg_rt_correct_save
-        )
-        set_cell_val_raven(
-            "RavenMatrices_IndividualTimes_s", ind_times_str_save
-        )
-        set_cell_val_raven(
-            "RavenMatrices_Interrupted", interrupted_status_save
-        )
-
-        wb.save(EXCEL_FILENAME)
+            for r in raven.iteration_results
+        ],
+    )
+    if saved:
         logger.info(
             f"Raven Matrices results for UID {uid} saved. Interrupted: {interrupted_status_save}"
         )
-    except Exception as e_save_excel_raven:
+    else:
         logger.error(
-            f"Raven Matrices Save Results: Excel save error for UID {uid}: {e_save_excel_raven}",
-            exc_info=True,
+            f"Raven Matrices Save Results: save error for UID {uid}."
         )
 
 
@@ -837,19 +799,16 @@ async def cleanup_raven_ui(
     final_text: str | None = None,
     # final_text is now effectively ignored for editing task_msg
 ):
-    data = await state.get_data()
-    chat_id = data.get("raven_chat_id")
+    raven = RavenSession.from_fsm(await state.get_data())
+    chat_id = raven.chat_id
     logger.info(
         f"Raven Cleanup UI: Chat {chat_id if chat_id else 'N/A'}. (final_text parameter is ignored for task msg edit)."
     )
 
-    revert_task_cleanup = data.get("raven_current_feedback_revert_task_ref")
-    if revert_task_cleanup and not revert_task_cleanup.done():
-        revert_task_cleanup.cancel()
-        await asyncio.sleep(0.01)
+    await session_tasks.cancel(state, "raven_feedback_revert")
 
-    task_msg_id_cleanup = data.get("raven_task_message_id")
-    feedback_msg_id_cleanup = data.get("raven_feedback_message_id")
+    task_msg_id_cleanup = raven.task_message_id
+    feedback_msg_id_cleanup = raven.feedback_message_id
 
     if chat_id:
         # Always delete task message if ID exists
@@ -6,25 +6,19 @@ import time
 import os
 
 from aiogram import Bot, F, Router
-from aiogram.enums import ParseMode, ChatType
+from aiogram.enums import ParseMode
 from aiogram.exceptions import TelegramBadRequest
 from aiogram.fsm.context import FSMContext
 from aiogram.types import (
     CallbackQuery,
     InlineKeyboardButton,
     InlineKeyboardMarkup,
-    FSInputFile,
-    InputMediaPhoto,
     Message,
-    Chat,
-    User,
 )
 from aiogram.filters import StateFilter
 
 from fsm_states import ReactionTimeTestStates
 from settings import (
-    ALL_EXPECTED_HEADERS,
-    EXCEL_FILENAME,
     REACTION_TIME_IMAGE_POOL,  # Populated in main_bot.py
     REACTION_TIME_MEMORIZATION_S,
     REACTION_TIME_STIMULUS_INTERVAL_S,
@@ -32,9 +26,16 @@ from settings import (
     REACTION_TIME_NUM_STIMULI_IN_SEQUENCE,
 )
 from utils.bot_helpers import (
+    FSMSession,
+    fsm_session,
     send_main_action_menu,
     get_active_profile_from_fsm,
+    make_service_message,
 )
+from utils.excel_handler import save_test_results
+from utils.file_id_cache import edit_photo_cached, send_photo_cached
+from utils.session_tasks import session_tasks
+from utils.test_sessions import ReactionTimeSession
 from keyboards import ACTION_SELECTION_KEYBOARD_RETURNING
 
 logger = logging.getLogger(__name__)
@@ -49,7 +50,7 @@ async def _delete_common_status_message(
     data = await state.get_data()
     common_status_msg_id = data.get("status_message_id_to_delete_later")
     # Ensure chat_id is available, try from FSM first, then passed arg
-    current_chat_id = data.get("rt_chat_id") or chat_id
+    current_chat_id = ReactionTimeSession.from_fsm(data).chat_id or chat_id
 
     if common_status_msg_id and current_chat_id:
         try:
@@ -74,6 +75,7 @@ async def _rt_go_to_main_menu_or_clear(
     state: FSMContext, trigger_message: Message, bot_instance: Bot
 ):
     """Navigates to the main menu or clears state if no profile. Called after all cleanups."""
+    await session_tasks.cancel(state, "rt_memorization", "rt_reaction_cycle")
     fsm_data = (
         await state.get_data()
     )  # Should ideally contain only profile data now
@@ -117,16 +119,18 @@ async def _rt_memorization_phase_task(state: FSMContext, bot_instance: Bot):
             logger.info("RT Memorization task: State changed, aborting.")
             return
 
-        data = await state.get_data()
-        chat_id = data.get("rt_chat_id")
-        memo_msg_id = data.get("rt_memorization_image_message_id")
+        rt = ReactionTimeSession.from_fsm(await state.get_data())
+        chat_id = rt.chat_id
+        memo_msg_id = rt.memorization_image_message_id
 
         if memo_msg_id and chat_id:
             try:
                 await bot_instance.delete_message(
                     chat_id=chat_id, message_id=memo_msg_id
                 )
-                await state.update_data(rt_memorization_image_message_id=None)
+                await ReactionTimeSession.update_fsm(
+                    state, memorization_image_message_id=None
+                )
                 logger.debug(
                     f"RT Memo task: Deleted memorization image message {memo_msg_id}."
                 )
@@ -149,8 +153,7 @@ async def _rt_memorization_phase_task(state: FSMContext, bot_instance: Bot):
         logger.error(
             f"RT Memorization task critical error: {e}", exc_info=True
         )
-        data = await state.get_data()
-        chat_id = data.get("rt_chat_id")
+        chat_id = ReactionTimeSession.from_fsm(await state.get_data()).chat_id
         if chat_id:
             await bot_instance.send_message(
                 chat_id,
@@ -169,21 +172,9 @@ async def _rt_memorization_phase_task(state: FSMContext, bot_instance: Bot):
             state, bot_instance, chat_id
         )  # Delete "Запускаем тест..."
 
-        mock_message = None
-        if chat_id:  # Create mock message for menu navigation
-            mock_user = User(
-                id=bot_instance.id if hasattr(bot_instance, 'id') else 1,
-                is_bot=True,
-                first_name="Bot",
-            )
-            mock_chat_obj = Chat(id=chat_id, type=ChatType.PRIVATE)
-            mock_message = Message(
-                message_id=0,
-                date=int(time.time()),
-                chat=mock_chat_obj,
-                from_user=mock_user,
-                text="mock",
-            )
+        mock_message = (  # For menu navigation
+            make_service_message(bot_instance, chat_id) if chat_id else None
+        )
 
         if mock_message:
             await _rt_go_to_main_menu_or_clear(
@@ -196,9 +187,9 @@ async def _rt_memorization_phase_task(state: FSMContext, bot_instance: Bot):
 async def _start_rt_reaction_phase(state: FSMContext, bot_instance: Bot):
     """Sets up and starts the reaction stimulus display cycle."""
     await state.set_state(ReactionTimeTestStates.reaction_stimulus_display)
-    data = await state.get_data()
-    chat_id = data.get("rt_chat_id")
-    target_image_path = data.get("rt_target_image_path")
+    rt = ReactionTimeSession.from_fsm(await state.get_data())
+    chat_id = rt.chat_id
+    target_image_path = rt.target_image_path
 
     if not REACTION_TIME_IMAGE_POOL:
         logger.error(
@@ -269,128 +260,137 @@ async def _start_rt_reaction_phase(state: FSMContext, bot_instance: Bot):
         )
         return
 
-    await state.update_data(
-        rt_stimuli_sequence=stimuli_sequence,
-        rt_current_stimulus_index=0,
-        rt_target_displayed_time=None,
-        rt_reacted_correctly_this_attempt=False,
-        rt_reaction_stimulus_message_id=None,
-        rt_target_missed_message_id=None,
-    )
-    reaction_task = asyncio.create_task(
-        _rt_reaction_cycle_task(state, bot_instance)
+    rt.stimuli_sequence = stimuli_sequence
+    rt.current_stimulus_index = 0
+    rt.target_displayed_time = None
+    rt.reacted_correctly = False
+    rt.stimulus_message_id = None
+    rt.target_missed_message_id = None
+    await state.update_data(rt.as_fsm_data())
+    await session_tasks.start(
+        state,
+        "rt_reaction_cycle",
+        _rt_reaction_cycle_task(state, bot_instance),
     )
-    await state.update_data(rt_reaction_cycle_task=reaction_task)
 
 
-async def _rt_reaction_cycle_task(state: FSMContext, bot_instance: Bot):
-    """Manages the display of individual stimuli and waits for reactions or interval timeout."""
-    try:
-        data = await state.get_data()
-        chat_id = data.get("rt_chat_id")
-        stimuli_sequence = data.get("rt_stimuli_sequence", [])
-        current_idx = data.get("rt_current_stimulus_index", 0)
-        stimulus_msg_id = data.get("rt_reaction_stimulus_message_id")
-
-        if current_idx >= len(stimuli_sequence):  # All stimuli shown
-            if data.get("rt_target_displayed_time") and not data.get(
-                "rt_reacted_correctly_this_attempt"
-            ):
-                logger.info(
-                    f"RT UID {data.get('rt_unique_id_for_test', 'N/A')}: Target missed (end of sequence)."
-                )
-                if chat_id:
-                    target_missed_msg = await bot_instance.send_message(
-                        chat_id, "Вы пропустили целевое изображение."
-                    )
-                    await state.update_data(
-                        rt_target_missed_message_id=target_missed_msg.message_id
-                    )
-                await _handle_rt_attempt_failure(
-                    state, bot_instance, "Цель пропущена"
+async def _rt_show_next_stimulus(
+    session: FSMSession, bot_instance: Bot
+) -> bool:
+    """Shows the next stimulus of the sequence; False if the cycle must stop."""
+    state = session.context
+    rt = ReactionTimeSession.from_fsm(session.data)
+    chat_id = rt.chat_id
+    stimuli_sequence = rt.stimuli_sequence
+    current_idx = rt.current_stimulus_index
+    stimulus_msg_id = rt.stimulus_message_id
+
+    if current_idx >= len(stimuli_sequence):  # All stimuli shown
+        if rt.target_displayed_time and not rt.reacted_correctly:
+            logger.info(
+                f"RT UID {rt.unique_id or 'N/A'}: Target missed (end of sequence)."
+            )
+            if chat_id:
+                target_missed_msg = await bot_instance.send_message(
+                    chat_id, "Вы пропустили целевое изображение."
                 )
-            return
+                rt.target_missed_message_id = target_missed_msg.message_id
+                session.update(rt.as_fsm_data())
+            await session.commit()
+            await _handle_rt_attempt_failure(
+                state, bot_instance, "Цель пропущена"
+            )
+        return False
 
-        current_stimulus = stimuli_sequence[current_idx]
-        image_path = current_stimulus["path"]
-        is_target = current_stimulus["is_target"]
-        await state.update_data(rt_current_displayed_image_is_target=is_target)
+    current_stimulus = stimuli_sequence[current_idx]
+    image_path = current_stimulus["path"]
+    is_target = current_stimulus["is_target"]
+    rt.current_is_target = is_target
+    session.update(rt.as_fsm_data())
 
-        caption_text = "РЕАГИРОВАТЬ!"
-        kbd = InlineKeyboardMarkup(
-            inline_keyboard=[
-                [
-                    IKB(
-                        text="💥 РЕАГИРОВАТЬ! 💥",
-                        callback_data="rt_react_button_pressed",
-                    )
-                ]
+    caption_text = "РЕАГИРОВАТЬ!"
+    kbd = InlineKeyboardMarkup(
+        inline_keyboard=[
+            [
+                IKB(
+                    text="💥 РЕАГИРОВАТЬ! 💥",
+                    callback_data="rt_react_button_pressed",
+                )
             ]
-        )
+        ]
+    )
 
-        try:
-            img_file = FSInputFile(image_path)
-            if not stimulus_msg_id:
-                msg = await bot_instance.send_photo(
-                    chat_id,
-                    photo=img_file,
-                    caption=caption_text,
-                    reply_markup=kbd,
-                )
-                stimulus_msg_id = msg.message_id
-                await state.update_data(
-                    rt_reaction_stimulus_message_id=stimulus_msg_id
-                )
-            else:
-                media = InputMediaPhoto(media=img_file, caption=caption_text)
-                await bot_instance.edit_message_media(
-                    chat_id=chat_id,
-                    message_id=stimulus_msg_id,
-                    media=media,
-                    reply_markup=kbd,
-                )
+    try:
+        # Cached file_id: no re-upload skewing the measured reaction time
+        if not stimulus_msg_id:
+            msg = await send_photo_cached(
+                bot_instance,
+                chat_id,
+                image_path,
+                caption=caption_text,
+                reply_markup=kbd,
+            )
+            stimulus_msg_id = msg.message_id
+            rt.stimulus_message_id = stimulus_msg_id
+            session.update(rt.as_fsm_data())
+        else:
+            await edit_photo_cached(
+                bot_instance,
+                chat_id,
+                stimulus_msg_id,
+                image_path,
+                caption=caption_text,
+                reply_markup=kbd,
+            )
 
-            if is_target:
-                await state.update_data(rt_target_displayed_time=time.time())
-                logger.info(
-                    f"RT UID {data.get('rt_unique_id_for_test', 'N/A')}: Target '{os.path.basename(image_path)}' displayed."
-                )
-        except Exception as e:
-            logger.error(
-                f"RT Reaction Cycle: Failed to send/edit stimulus image {image_path}: {e}",
-                exc_info=True,
+        if is_target:
+            rt.target_displayed_time = time.time()
+            session.update(rt.as_fsm_data())
+            logger.info(
+                f"RT UID {rt.unique_id or 'N/A'}: Target '{os.path.basename(image_path)}' displayed."
             )
-            if chat_id:
-                await bot_instance.send_message(
-                    chat_id, "Ошибка отображения стимула. Попытка прервана."
-                )
-            await _handle_rt_attempt_failure(
-                state, bot_instance, "Ошибка отображения стимула"
+    except Exception as e:
+        logger.error(
+            f"RT Reaction Cycle: Failed to send/edit stimulus image {image_path}: {e}",
+            exc_info=True,
+        )
+        if chat_id:
+            await bot_instance.send_message(
+                chat_id, "Ошибка отображения стимула. Попытка прервана."
             )
-            return
+        await session.commit()
+        await _handle_rt_attempt_failure(
+            state, bot_instance, "Ошибка отображения стимула"
+        )
+        return False
 
-        await state.update_data(rt_current_stimulus_index=current_idx + 1)
-
-        start_sleep = time.time()
-        while time.time() - start_sleep < REACTION_TIME_STIMULUS_INTERVAL_S:
-            await asyncio.sleep(0.05)
-            if (
-                await state.get_state()
-                != ReactionTimeTestStates.reaction_stimulus_display.state
-            ):
-                logger.info(
-                    "RT Reaction Cycle: State changed during stimulus display interval, aborting cycle."
-                )
+    rt.current_stimulus_index = current_idx + 1
+    session.update(rt.as_fsm_data())
+    return True
+
+
+async def _rt_reaction_cycle_task(state: FSMContext, bot_instance: Bot):
+    """Manages the display of individual stimuli and waits for reactions or interval timeout."""
+    try:
+        # One FSM read and one merged write per stimulus, committed before
+        # the wait so the react handler sees the stimulus on screen.
+        async with fsm_session(state) as session:
+            if not await _rt_show_next_stimulus(session, bot_instance):
                 return
 
+        # Every way out of the reaction phase cancels this task, so there
+        # is no need to poll the FSM state while the stimulus is shown.
+        await asyncio.sleep(REACTION_TIME_STIMULUS_INTERVAL_S)
+
         if (
             await state.get_state()
             == ReactionTimeTestStates.reaction_stimulus_display.state
         ):  # If still in reaction phase (no reaction yet)
-            new_reaction_task = asyncio.create_task(
-                _rt_reaction_cycle_task(state, bot_instance)
+            await session_tasks.start(
+                state,
+                "rt_reaction_cycle",
+                _rt_reaction_cycle_task(state, bot_instance),
             )
-            await state.update_data(rt_reaction_cycle_task=new_reaction_task)
 
     except asyncio.CancelledError:
         logger.info("RT Reaction cycle task cancelled.")
@@ -398,8 +398,7 @@ async def _rt_reaction_cycle_task(state: FSMContext, bot_instance: Bot):
         logger.error(
             f"RT Reaction cycle task critical error: {e}", exc_info=True
         )
-        data = await state.get_data()
-        chat_id = data.get("rt_chat_id")
+        chat_id = ReactionTimeSession.from_fsm(await state.get_data()).chat_id
         if chat_id:
             await bot_instance.send_message(
                 chat_id,
@@ -414,21 +413,9 @@ async def _rt_reaction_cycle_task(state: FSMContext, bot_instance: Bot):
         await cleanup_reaction_time_ui(state, bot_instance, final_text=None)
         await _delete_common_status_message(state, bot_instance, chat_id)
 
-        mock_message = None
-        if chat_id:
-            mock_user = User(
-                id=bot_instance.id if hasattr(bot_instance, 'id') else 1,
-                is_bot=True,
-                first_name="Bot",
-            )
-            mock_chat_obj = Chat(id=chat_id, type=ChatType.PRIVATE)
-            mock_message = Message(
-                message_id=0,
-                date=int(time.time()),
-                chat=mock_chat_obj,
-                from_user=mock_user,
-                text="mock",
-            )
+        mock_message = (
+            make_service_message(bot_instance, chat_id) if chat_id else None
+        )
 
         if mock_message:
             await _rt_go_to_main_menu_or_clear(
@@ -442,25 +429,20 @@ async def _handle_rt_attempt_failure(
     state: FSMContext, bot_instance: Bot, reason: str
 ):
     """Handles a failed attempt, offering retry or ending the test."""
-    data = await state.get_data()
-    current_attempt = data.get("rt_current_attempt", 1)
-    chat_id = data.get("rt_chat_id")
+    rt = ReactionTimeSession.from_fsm(await state.get_data())
+    current_attempt = rt.current_attempt
+    chat_id = rt.chat_id
 
-    reaction_cycle_task = data.get("rt_reaction_cycle_task")
-    if reaction_cycle_task and not reaction_cycle_task.done():
-        reaction_cycle_task.cancel()
-        try:
-            await asyncio.wait_for(reaction_cycle_task, timeout=0.2)
-        except (asyncio.CancelledError, asyncio.TimeoutError):
-            pass
-        await state.update_data(rt_reaction_cycle_task=None)
+    await session_tasks.cancel(state, "rt_reaction_cycle")
 
     # Delete "Вы пропустили целевое изображение" message if it exists
-    target_missed_msg_id = data.get("rt_target_missed_message_id")
+    target_missed_msg_id = rt.target_missed_message_id
     if target_missed_msg_id and chat_id:
         try:
             await bot_instance.delete_message(chat_id, target_missed_msg_id)
-            await state.update_data(rt_target_missed_message_id=None)
+            await ReactionTimeSession.update_fsm(
+                state, target_missed_message_id=None
+            )
             logger.debug(
                 f"RT Handle Failure: Deleted target_missed_message_id: {target_missed_msg_id}"
             )
@@ -473,12 +455,14 @@ async def _handle_rt_attempt_failure(
                 f"RT Handle Failure: Error deleting target_missed_message_id {target_missed_msg_id}: {e_del_missed}"
             )
 
-    # Delete the stimulus image message (rt_reaction_stimulus_message_id)
-    stimulus_msg_id = data.get("rt_reaction_stimulus_message_id")
+    # Delete the stimulus image message (stimulus_message_id)
+    stimulus_msg_id = rt.stimulus_message_id
     if stimulus_msg_id and chat_id:
         try:
             await bot_instance.delete_message(chat_id, stimulus_msg_id)
-            await state.update_data(rt_reaction_stimulus_message_id=None)
+            await ReactionTimeSession.update_fsm(
+                state, stimulus_message_id=None
+            )
             logger.debug(
                 f"RT Handle Failure: Deleted reaction_stimulus_message_id: {stimulus_msg_id}"
             )
@@ -492,7 +476,9 @@ async def _handle_rt_attempt_failure(
             )
 
     current_attempt += 1
-    await state.update_data(rt_current_attempt=current_attempt)
+    await ReactionTimeSession.update_fsm(
+        state, current_attempt=current_attempt
+    )
 
     if current_attempt <= REACTION_TIME_MAX_ATTEMPTS:
         await state.set_state(
@@ -518,8 +504,8 @@ async def _handle_rt_attempt_failure(
                 retry_prompt_msg = await bot_instance.send_message(
                     chat_id, retry_text, reply_markup=kbd
                 )
-                await state.update_data(
-                    rt_retry_confirmation_message_id=retry_prompt_msg.message_id
+                await ReactionTimeSession.update_fsm(
+                    state, retry_message_id=retry_prompt_msg.message_id
                 )
             except Exception as e_send_retry_prompt:
                 logger.error(
@@ -538,12 +524,8 @@ async def _handle_rt_attempt_failure(
                 await _delete_common_status_message(
                     state, bot_instance, chat_id
                 )
-                mock_message_crit_fail = Message(
-                    message_id=0,
-                    date=int(time.time()),
-                    chat=Chat(id=chat_id, type=ChatType.PRIVATE),
-                    from_user=User(id=1, is_bot=True, first_name="Bot"),
-                    text="mock",
+                mock_message_crit_fail = make_service_message(
+                    bot_instance, chat_id
                 )
                 await _rt_go_to_main_menu_or_clear(
                     state, mock_message_crit_fail, bot_instance
@@ -551,9 +533,9 @@ async def _handle_rt_attempt_failure(
                 return
     else:  # Max attempts exhausted
         logger.info(
-            f"RT UID {data.get('rt_unique_id_for_test', 'N/A')}: Max attempts reached. Reason: {reason}."
+            f"RT UID {rt.unique_id or 'N/A'}: Max attempts reached. Reason: {reason}."
         )
-        await state.update_data(rt_status="Failed")
+        await ReactionTimeSession.update_fsm(state, status="Failed")
         if chat_id:
             await bot_instance.send_message(
                 chat_id,
@@ -570,13 +552,7 @@ async def _handle_rt_attempt_failure(
             state, bot_instance, chat_id
         )  # Delete "Запускаем тест..."
 
-        mock_message_max = Message(
-            message_id=0,
-            date=int(time.time()),
-            chat=Chat(id=chat_id, type=ChatType.PRIVATE),
-            from_user=User(id=1, is_bot=True, first_name="Bot"),
-            text="mock",
-        )
+        mock_message_max = make_service_message(bot_instance, chat_id)
         await _rt_go_to_main_menu_or_clear(
             state, mock_message_max, bot_instance
         )
@@ -599,29 +575,9 @@ async def start_reaction_time_test(
     chat_id = msg_ctx.chat.id
 
     await state.set_state(ReactionTimeTestStates.initial_instructions)
-    await state.update_data(
-        rt_unique_id_for_test=profile.get("unique_id"),
-        rt_profile_name_for_test=profile.get("name"),
-        rt_profile_age_for_test=profile.get("age"),
-        rt_profile_telegram_id_for_test=profile.get("telegram_id"),
-        rt_chat_id=chat_id,
-        rt_current_attempt=1,
-        rt_reaction_time_ms=None,
-        rt_status="Pending",
-        rt_target_image_path=None,
-        rt_instruction_message_id=None,
-        rt_memorization_image_message_id=None,
-        rt_reaction_stimulus_message_id=None,
-        rt_retry_confirmation_message_id=None,
-        rt_target_missed_message_id=None,
-        rt_current_displayed_image_is_target=False,
-        rt_target_displayed_time=None,
-        rt_reacted_correctly_this_attempt=False,
-        rt_stimuli_sequence=[],
-        rt_current_stimulus_index=0,
-        rt_memorization_task=None,
-        rt_reaction_cycle_task=None,
-    )
+    rt = ReactionTimeSession(chat_id=chat_id)
+    rt.set_profile(profile)
+    await state.update_data(rt.as_fsm_data())
     instruction_text = (
         "<b>Тест на Скорость Реакции</b>\n\n"
         "1. Сначала вам будет показано изображение-цель на 10 секунд. Запомните его.\n"
@@ -643,7 +599,8 @@ async def start_reaction_time_test(
             reply_markup=kbd,
             parse_mode=ParseMode.HTML,
         )
-        await state.update_data(rt_instruction_message_id=instr_msg.message_id)
+        rt.instruction_message_id = instr_msg.message_id
+        await state.update_data(rt.as_fsm_data())
     except Exception as e:
         logger.error(
             f"RT start_reaction_time_test: Error sending initial instructions: {e}",
@@ -664,10 +621,10 @@ async def rt_on_instructions_acknowledged(
     callback: CallbackQuery, state: FSMContext, bot: Bot
 ):
     await callback.answer()
-    data = await state.get_data()
-    chat_id = data.get("rt_chat_id")
-    instruction_msg_id = data.get(
-        "rt_instruction_message_id"
+    rt = ReactionTimeSession.from_fsm(await state.get_data())
+    chat_id = rt.chat_id
+    instruction_msg_id = (
+        rt.instruction_message_id
     )  # This is the message with "Начать тест"
 
     if instruction_msg_id and chat_id:
@@ -678,18 +635,18 @@ async def rt_on_instructions_acknowledged(
                 message_id=instruction_msg_id,
                 reply_markup=None,
             )
-            # This message is now "Подготовка...", its ID is still rt_instruction_message_id
+            # This message is now "Подготовка...", its ID is still instruction_message_id
         except TelegramBadRequest:
             logger.debug(
                 f"RT Ack Instr: Failed to edit instruction_msg_id {instruction_msg_id}. Sending new prep message."
             )
-            # Original instruction msg might still be there. cleanup_reaction_time_ui should catch it based on FSM key.
+            # Original instruction msg might still be there. cleanup_reaction_time_ui should catch it based on the session.
             try:
                 prep_msg = await bot.send_message(
                     chat_id, "Подготовка к фазе запоминания..."
                 )
-                await state.update_data(
-                    rt_instruction_message_id=prep_msg.message_id
+                await ReactionTimeSession.update_fsm(
+                    state, instruction_message_id=prep_msg.message_id
                 )  # Update FSM to new prep message
             except Exception as e_send_prep_fallback:
                 logger.error(
@@ -724,20 +681,22 @@ async def rt_on_instructions_acknowledged(
         return
 
     target_image_path = random.choice(REACTION_TIME_IMAGE_POOL)
-    await state.update_data(rt_target_image_path=target_image_path)
+    await ReactionTimeSession.update_fsm(
+        state, target_image_path=target_image_path
+    )
     logger.info(
-        f"RT UID {data.get('rt_unique_id_for_test', 'N/A')}: Attempt {data.get('rt_current_attempt', 1)}. Target image: {os.path.basename(target_image_path)}"
+        f"RT UID {rt.unique_id or 'N/A'}: Attempt {rt.current_attempt}. Target image: {os.path.basename(target_image_path)}"
     )
 
     try:
-        img_file = FSInputFile(target_image_path)
-        memo_img_msg = await bot.send_photo(
-            chat_id=chat_id,
-            photo=img_file,
+        memo_img_msg = await send_photo_cached(
+            bot,
+            chat_id,
+            target_image_path,
             caption=f"Запомните это изображение! (Исчезнет через {REACTION_TIME_MEMORIZATION_S} сек)",
         )
-        await state.update_data(
-            rt_memorization_image_message_id=memo_img_msg.message_id
+        await ReactionTimeSession.update_fsm(
+            state, memorization_image_message_id=memo_img_msg.message_id
         )
     except Exception as e_send_memo_img:
         logger.error(
@@ -759,8 +718,9 @@ async def rt_on_instructions_acknowledged(
         await _rt_go_to_main_menu_or_clear(state, callback.message, bot)
         return
 
-    memo_task = asyncio.create_task(_rt_memorization_phase_task(state, bot))
-    await state.update_data(rt_memorization_task=memo_task)
+    await session_tasks.start(
+        state, "rt_memorization", _rt_memorization_phase_task(state, bot)
+    )
 
 
 @router.callback_query(
@@ -770,29 +730,20 @@ async def rt_on_instructions_acknowledged(
 async def on_rt_react_button_pressed(
     callback: CallbackQuery, state: FSMContext, bot: Bot
 ):
+    pressed_at = time.time()
     await callback.answer()
-    data = await state.get_data()
+    # Stop the stimulus cycle first: its last FSM commit must land before
+    # the snapshot below, or the two would overwrite each other
+    await session_tasks.cancel(state, "rt_reaction_cycle")
+    rt = ReactionTimeSession.from_fsm(await state.get_data())
 
-    reaction_cycle_task = data.get("rt_reaction_cycle_task")
-    if reaction_cycle_task and not reaction_cycle_task.done():
-        reaction_cycle_task.cancel()
-        try:
-            await asyncio.wait_for(reaction_cycle_task, timeout=0.2)
-        except (asyncio.CancelledError, asyncio.TimeoutError):
-            logger.debug(
-                "RT React Pressed: Reaction cycle task cancelled/timed out."
-            )
-        await state.update_data(rt_reaction_cycle_task=None)
-
-    chat_id = data.get("rt_chat_id")
-    is_target_displayed_now = data.get(
-        "rt_current_displayed_image_is_target", False
-    )
-    target_display_time = data.get("rt_target_displayed_time")
-    uid_for_test = data.get('rt_unique_id_for_test', 'N/A')
+    chat_id = rt.chat_id
+    is_target_displayed_now = rt.current_is_target
+    target_display_time = rt.target_displayed_time
+    uid_for_test = rt.unique_id or 'N/A'
 
     if is_target_displayed_now and target_display_time:
-        reaction_time_seconds = time.time() - target_display_time
+        reaction_time_seconds = pressed_at - target_display_time
 
         telegram_latency_seconds = 0.350
         corrected_reaction_time_seconds = (
@@ -805,21 +756,24 @@ async def on_rt_react_button_pressed(
             corrected_reaction_time_seconds = 0.001  # Clamp to 1ms
         reaction_time_ms = int(corrected_reaction_time_seconds * 1000)
 
-        await state.update_data(
-            rt_reaction_time_ms=reaction_time_ms,
-            rt_status="Passed",
-            rt_reacted_correctly_this_attempt=True,
+        await ReactionTimeSession.update_fsm(
+            state,
+            reaction_time_ms=reaction_time_ms,
+            status="Passed",
+            reacted_correctly=True,
         )
         logger.info(
             f"RT UID {uid_for_test}: Correct reaction. Raw RT: {reaction_time_seconds * 1000:.0f}ms. Corrected RT: {reaction_time_ms}ms."
         )
 
         # Delete stimulus message (which had the button)
-        stimulus_msg_id = data.get("rt_reaction_stimulus_message_id")
+        stimulus_msg_id = rt.stimulus_message_id
         if stimulus_msg_id and chat_id:
             try:
                 await bot.delete_message(chat_id, stimulus_msg_id)
-                await state.update_data(rt_reaction_stimulus_message_id=None)
+                await ReactionTimeSession.update_fsm(
+                    state, stimulus_message_id=None
+                )
             except TelegramBadRequest:
                 logger.debug(
                     f"RT React Correct: Stimulus msg {stimulus_msg_id} already deleted."
@@ -866,9 +820,9 @@ async def on_rt_retry_yes(
     callback: CallbackQuery, state: FSMContext, bot: Bot
 ):
     await callback.answer()
-    data = await state.get_data()
-    chat_id = data.get("rt_chat_id")
-    retry_msg_id = data.get("rt_retry_confirmation_message_id")
+    rt = ReactionTimeSession.from_fsm(await state.get_data())
+    chat_id = rt.chat_id
+    retry_msg_id = rt.retry_message_id
 
     if retry_msg_id and chat_id:
         try:
@@ -878,24 +832,18 @@ async def on_rt_retry_yes(
                 message_id=retry_msg_id,
                 reply_markup=None,
             )
-            await state.update_data(
-                rt_instruction_message_id=retry_msg_id,
-                rt_retry_confirmation_message_id=None,
-            )
+            rt.instruction_message_id = retry_msg_id
+            rt.retry_message_id = None
         except TelegramBadRequest:
             logger.debug(
                 f"RT Retry Yes: Failed to edit retry_msg_id {retry_msg_id}. Sending new."
             )
-            await state.update_data(
-                rt_retry_confirmation_message_id=None
-            )  # Clear old ID
+            rt.retry_message_id = None  # Clear old ID
             try:
                 new_prep_msg = await bot.send_message(
                     chat_id, "Готовим новую попытку..."
                 )
-                await state.update_data(
-                    rt_instruction_message_id=new_prep_msg.message_id
-                )
+                rt.instruction_message_id = new_prep_msg.message_id
             except Exception as e_send_new_prep:
                 logger.error(
                     f"RT Retry Yes: Failed to send new 'Готовим...' message: {e_send_new_prep}",
@@ -913,18 +861,8 @@ async def on_rt_retry_yes(
             await _rt_go_to_main_menu_or_clear(state, callback.message, bot)
             return
 
-    await state.update_data(  # Reset for new attempt
-        rt_target_image_path=None,
-        rt_memorization_image_message_id=None,
-        rt_reaction_stimulus_message_id=None,
-        rt_target_displayed_time=None,
-        rt_reacted_correctly_this_attempt=False,
-        rt_stimuli_sequence=[],
-        rt_current_stimulus_index=0,
-        rt_target_missed_message_id=None,
-        rt_memorization_task=None,
-        rt_reaction_cycle_task=None,
-    )
+    rt.reset_attempt()  # Reset for new attempt
+    await state.update_data(rt.as_fsm_data())
     await state.set_state(ReactionTimeTestStates.initial_instructions)
     await rt_on_instructions_acknowledged(callback, state, bot)
 
@@ -934,16 +872,16 @@ async def on_rt_retry_yes(
 )
 async def on_rt_retry_no(callback: CallbackQuery, state: FSMContext, bot: Bot):
     await callback.answer()
-    await state.update_data(rt_status="Failed (user declined retry)")
-
-    data = await state.get_data()
-    chat_id = data.get("rt_chat_id")
-    retry_msg_id = data.get("rt_retry_confirmation_message_id")
+    rt = await ReactionTimeSession.update_fsm(
+        state, status="Failed (user declined retry)"
+    )
+    chat_id = rt.chat_id
+    retry_msg_id = rt.retry_message_id
 
     if retry_msg_id and chat_id:
         try:
             await bot.delete_message(chat_id=chat_id, message_id=retry_msg_id)
-            await state.update_data(rt_retry_confirmation_message_id=None)
+            await ReactionTimeSession.update_fsm(state, retry_message_id=None)
         except TelegramBadRequest:
             logger.debug(
                 f"RT Retry No: Retry msg {retry_msg_id} already deleted."
@@ -974,12 +912,12 @@ async def save_reaction_time_results(
     is_interrupted: bool = False,
     status_override: str = None,
 ):
-    data = await state.get_data()
-    uid = data.get("rt_unique_id_for_test")
+    rt = ReactionTimeSession.from_fsm(await state.get_data())
+    uid = rt.unique_id
     p_tgid, p_name, p_age = (
-        data.get("rt_profile_telegram_id_for_test"),
-        data.get("rt_profile_name_for_test"),
-        data.get("rt_profile_age_for_test"),
+        rt.profile_telegram_id,
+        rt.profile_name,
+        rt.profile_age,
     )
 
     if (
@@ -997,9 +935,9 @@ async def save_reaction_time_results(
             logger.warning("RT Save Results: UID not found. Cannot save.")
             return
 
-    time_ms = data.get("rt_reaction_time_ms")
-    attempts = data.get("rt_current_attempt", 1)
-    final_status = status_override or data.get("rt_status", "Unknown")
+    time_ms = rt.reaction_time_ms
+    attempts = rt.current_attempt
+    final_status = status_override or rt.status
     if is_interrupted and final_status not in [
         "Passed",
         "Failed",
@@ -1015,103 +953,50 @@ async def save_reaction_time_results(
         f"RT Save: UID={uid}, Status={final_status}, TimeMs={time_ms}, Attempts={attempts}, Interrupted={interrupted_col_val}"
     )
 
-    try:
-        from openpyxl import load_workbook
-
-        wb = load_workbook(EXCEL_FILENAME)
-        ws = wb.active
-        row_num = -1
-        if "Unique ID" not in ALL_EXPECTED_HEADERS:
-            raise ValueError("'Unique ID' not in ALL_EXPECTED_HEADERS")
-        uid_col_idx = ALL_EXPECTED_HEADERS.index("Unique ID")
-
-        for idx, row_vals in enumerate(
-            ws.iter_rows(min_row=2, values_only=True), start=2
-        ):
-            if row_vals[uid_col_idx] is not None and str(
-                row_vals[uid_col_idx]
-            ) == str(uid):
-                row_num = idx
-                break
-
-        if row_num == -1:
-            new_row = [""] * len(ALL_EXPECTED_HEADERS)
-            if p_tgid and "Telegram ID" in ALL_EXPECTED_HEADERS:
-                new_row[ALL_EXPECTED_HEADERS.index("Telegram ID")] = p_tgid
-            new_row[uid_col_idx] = uid
-            if p_name and "Name" in ALL_EXPECTED_HEADERS:
-                new_row[ALL_EXPECTED_HEADERS.index("Name")] = p_name
-            if p_age and "Age" in ALL_EXPECTED_HEADERS:
-                new_row[ALL_EXPECTED_HEADERS.index("Age")] = p_age
-            ws.append(new_row)
-            row_num = ws.max_row
-
-        h = ALL_EXPECTED_HEADERS
-
-        def set_cell_value(header_name, value):
-            if header_name in h:
-                ws.cell(row=row_num, column=h.index(header_name) + 1).value = (
-                    value
-                )
-
-        set_cell_value(
-            "ReactionTime_Time_ms", time_ms if time_ms is not None else "N/A"
-        )
-        set_cell_value("ReactionTime_Attempts", attempts)
-        set_cell_value("ReactionTime_Status", final_status)
-        set_cell_value("ReactionTime_Interrupted", interrupted_col_val)
-
-        wb.save(EXCEL_FILENAME)
-    except Exception as e:
-        logger.error(
-            f"RT Save Results: Error saving to Excel for UID {uid}: {e}",
-            exc_info=True,
-        )
+    saved = await save_test_results(
+        uid,
+        {
+            "ReactionTime_Time_ms": time_ms if time_ms is not None else "N/A",
+            "ReactionTime_Attempts": attempts,
+            "ReactionTime_Status": final_status,
+            "ReactionTime_Interrupted": interrupted_col_val,
+        },
+        profile={"telegram_id": p_tgid, "name": p_name, "age": p_age},
+    )
+    if not saved:
+        logger.error(f"RT Save Results: Error saving results for UID {uid}.")
 
 
 async def cleanup_reaction_time_ui(
     state: FSMContext, bot_instance: Bot, final_text: str | None
 ):
-    data = await state.get_data()
-    chat_id = data.get("rt_chat_id")
+    rt = ReactionTimeSession.from_fsm(await state.get_data())
+    chat_id = rt.chat_id
     logger.info(
         f"RT Cleanup UI: Chat {chat_id if chat_id else 'N/A'}. Final text directive: '{final_text}'"
     )
 
     # Cancel active tasks
-    for task_key in ["rt_memorization_task", "rt_reaction_cycle_task"]:
-        task = data.get(task_key)
-        if task and not task.done():
-            task.cancel()
-            try:
-                await asyncio.wait_for(task, timeout=0.1)  # Short timeout
-            except (asyncio.CancelledError, asyncio.TimeoutError):
-                pass
-            await state.update_data(**{task_key: None})
+    await session_tasks.cancel(state, "rt_memorization", "rt_reaction_cycle")
 
     # Identify all specific RT UI message IDs
-    rt_message_ids_keys = [
-        "rt_instruction_message_id",
-        "rt_memorization_image_message_id",
-        "rt_reaction_stimulus_message_id",
-        "rt_retry_confirmation_message_id",
-        "rt_target_missed_message_id",
-    ]
-
-    ids_to_delete_explicitly = set()
-    for key in rt_message_ids_keys:
-        msg_id = data.get(key)
-        if msg_id:
-            ids_to_delete_explicitly.add(msg_id)
+    ids_to_delete_explicitly = {
+        rt.instruction_message_id,
+        rt.memorization_image_message_id,
+        rt.stimulus_message_id,
+        rt.retry_message_id,
+        rt.target_missed_message_id,
+    }
+    ids_to_delete_explicitly.discard(None)
 
     last_relevant_msg_id_for_edit = None
     if final_text:  # Only determine last relevant if we intend to edit
         last_relevant_msg_id_for_edit = (
-            data.get("rt_retry_confirmation_message_id")
-            or data.get("rt_reaction_stimulus_message_id")
-            or data.get("rt_memorization_image_message_id")
-            or data.get("rt_instruction_message_id")
-            or data.get("rt_target_missed_message_id")
+            rt.retry_message_id
+            or rt.stimulus_message_id
+            or rt.memorization_image_message_id
+            or rt.instruction_message_id
+            or rt.target_missed_message_id
         )
 
     if chat_id:
@@ -1135,8 +1020,8 @@ async def cleanup_reaction_time_ui(
         # If final_text is provided (likely from stop_test_command_handler)
         elif final_text and last_relevant_msg_id_for_edit:
             is_photo = last_relevant_msg_id_for_edit in [
-                data.get("rt_reaction_stimulus_message_id"),
-                data.get("rt_memorization_image_message_id"),
+                rt.stimulus_message_id,
+                rt.memorization_image_message_id,
             ]
             try:
                 if is_photo:
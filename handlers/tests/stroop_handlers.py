@@ -2,29 +2,22 @@
 import asyncio
 import logging
 import random
-import time
 from typing import Union, Optional, Dict, Any
-import os
 
 from aiogram import Bot, F, Router
-from aiogram.enums import ParseMode, ChatType
+from aiogram.enums import ParseMode
 from aiogram.exceptions import TelegramBadRequest
 from aiogram.fsm.context import FSMContext
 from aiogram.types import (
     CallbackQuery,
     InlineKeyboardButton,
     InlineKeyboardMarkup,
-    InputMediaPhoto,
     Message,
-    Chat,
-    User,
 )
 from aiogram.filters import StateFilter
 
 from fsm_states import StroopTestStates
 from settings import (
-    ALL_EXPECTED_HEADERS,
-    EXCEL_FILENAME,
     STROOP_COLOR_NAMES,
     STROOP_ITERATIONS_PER_PART,
     STROOP_INSTRUCTION_TEXT_PART1,
@@ -32,16 +25,19 @@ from settings import (
     STROOP_INSTRUCTION_TEXT_PART3,
     STROOP_COLORS_DEF,
 )
-from utils.image_processors import (
-    _generate_stroop_part2_image,
-    _generate_stroop_part3_image,
-)
+from utils.image_processors import get_stroop_stimulus_image
 from utils.bot_helpers import (
+    FSMSession,
+    fsm_session,
     send_main_action_menu,
     get_active_profile_from_fsm,
     _clear_fsm_and_set_profile,
     _safe_delete_message,
+    make_service_message,
 )
+from utils.excel_handler import save_test_results
+from utils.file_id_cache import edit_photo_cached, send_photo_cached
+from utils.test_sessions import StroopSession
 
 from keyboards import ACTION_SELECTION_KEYBOARD_RETURNING
 
@@ -52,44 +48,27 @@ IKB = InlineKeyboardButton
 
 # --- Helper Functions (scoped to Stroop) ---
 async def _safe_delete_stroop_specific_message(
-    bot: Bot, state: FSMContext, fsm_key: str, context_info: str = ""
+    bot: Bot,
+    chat_id: Optional[int],
+    message_id: Optional[int],
+    context_info: str = "",
 ):
-    """Safely deletes a Stroop-specific message ID stored in FSM."""
-    data = await state.get_data()
-    message_id = data.get(fsm_key)
-    chat_id = data.get("stroop_chat_id")
-
+    """Safely deletes a Stroop-specific message (ID taken from StroopSession)."""
     if message_id and chat_id:
         try:
             await bot.delete_message(chat_id, message_id)
             logger.debug(
-                f"Stroop: Сообщение ID {message_id} (ключ: {fsm_key}) удалено. {context_info}"
+                f"Stroop: Сообщение ID {message_id} удалено. {context_info}"
             )
         except TelegramBadRequest:
             logger.warning(
-                f"Stroop: Не удалось удалить ID {message_id} (ключ: {fsm_key}). {context_info}"
+                f"Stroop: Не удалось удалить ID {message_id}. {context_info}"
             )
         except Exception as e:
             logger.error(
-                f"Stroop: Ошибка удаления ID {message_id} (ключ: {fsm_key}): {e}. {context_info}"
+                f"Stroop: Ошибка удаления ID {message_id}: {e}. {context_info}"
             )
-        # Do not clear FSM key here; let cleanup_stroop_ui or final FSM set handle it.
-
-
-def _create_mock_message_stroop(
-    chat_id: int, bot_id: Optional[int]
-) -> Message:
-    """Creates a mock Message object for error handling in Stroop test."""
-    actual_bot_id = bot_id if bot_id is not None else 1
-    mock_user = User(id=actual_bot_id, is_bot=True, first_name="BotStroopErr")
-    mock_chat = Chat(id=chat_id, type=ChatType.PRIVATE)
-    return Message(
-        message_id=0,
-        date=int(time.time()),
-        chat=mock_chat,
-        from_user=mock_user,
-        text="Mock Stroop error message",
-    )
+        # Do not clear the session field here; let cleanup_stroop_ui or final FSM set handle it.
 
 
 async def _send_stroop_instruction_message(
@@ -113,7 +92,9 @@ async def _send_stroop_instruction_message(
         msg = await bot_instance.send_message(
             chat_id, text, reply_markup=markup, parse_mode=ParseMode.HTML
         )
-        await state.update_data(stroop_instruction_message_id=msg.message_id)
+        stroop = StroopSession.from_fsm(await state.get_data())
+        stroop.instruction_message_id = msg.message_id
+        await state.update_data(stroop.as_fsm_data())
     except Exception as e:
         logger.error(
             f"Stroop: Не удалось отправить инструкцию для части {part}: {e}",
@@ -141,15 +122,10 @@ async def _handle_stroop_critical_error(
             f"Stroop: Не удалось отправить сообщение о критической ошибке: {e_send_err}"
         )
 
-    bot_id_for_mock = (
-        bot_instance.id
-        if hasattr(bot_instance, "id") and bot_instance.id is not None
-        else 1
-    )
-    mock_msg = _create_mock_message_stroop(chat_id, bot_id_for_mock)
+    service_msg = make_service_message(bot_instance, chat_id)
 
     await save_stroop_results(
-        mock_msg, state, bot_instance, is_interrupted=True
+        service_msg, state, bot_instance, is_interrupted=True
     )
     await cleanup_stroop_ui(
         state, bot_instance, f"Тест Струпа прерван ({error_context_message})."
@@ -174,7 +150,7 @@ async def _handle_stroop_critical_error(
     if profile_after_error:  # Check if profile still exists
         await send_main_action_menu(
             bot_instance,
-            mock_msg,
+            service_msg,
             ACTION_SELECTION_KEYBOARD_RETURNING,
             text="Тест прерван из-за ошибки.",
         )
@@ -182,13 +158,24 @@ async def _handle_stroop_critical_error(
 
 
 async def _display_next_stroop_stimulus(
-    chat_id: int, state: FSMContext, bot_instance: Bot
+    chat_id: int,
+    state: FSMContext,
+    bot_instance: Bot,
+    session: Optional[FSMSession] = None,
 ):
-    data = await state.get_data()
-    current_part = data.get("stroop_current_part")
-    current_iteration = data.get("stroop_current_iteration")
-    stimulus_msg_id = data.get("stroop_stimulus_message_id")
-    current_stimulus_ui_type = data.get("stroop_stimulus_type")
+    # One FSM read and one merged write per stimulus; the answer handler
+    # passes its own session so its changes ride along in the same commit.
+    if session is None:
+        async with fsm_session(state) as session:
+            await _display_next_stroop_stimulus(
+                chat_id, state, bot_instance, session
+            )
+        return
+    stroop = StroopSession.from_fsm(session.data)
+    current_part = stroop.current_part
+    current_iteration = stroop.current_iteration
+    stimulus_msg_id = stroop.stimulus_message_id
+    current_stimulus_ui_type = stroop.stimulus_type
 
     image_to_send = None
     stimulus_text_for_part1 = ""
@@ -207,8 +194,8 @@ async def _display_next_stroop_stimulus(
         text_on_patch = (
             random.choice(text_choices) if text_choices else patch_color
         )
-        image_to_send = _generate_stroop_part2_image(
-            patch_color, text_on_patch
+        image_to_send = await get_stroop_stimulus_image(
+            2, patch_color, text_on_patch
         )
         correct_answer_color_name = patch_color
         new_stimulus_ui_type = "photo"
@@ -216,10 +203,13 @@ async def _display_next_stroop_stimulus(
         word_name = random.choice(all_colors)
         ink_choices = [c for c in all_colors if c != word_name]
         ink_name = random.choice(ink_choices) if ink_choices else word_name
-        image_to_send = _generate_stroop_part3_image(word_name, ink_name)
+        image_to_send = await get_stroop_stimulus_image(
+            3, word_name, ink_name
+        )
         correct_answer_color_name = ink_name
         new_stimulus_ui_type = "photo"
     else:
+        await session.commit()
         await _handle_stroop_critical_error(
             chat_id,
             state,
@@ -229,12 +219,14 @@ async def _display_next_stroop_stimulus(
         return
 
     if new_stimulus_ui_type == "photo" and not image_to_send:
+        await session.commit()
         await _handle_stroop_critical_error(
             chat_id, state, bot_instance, "Ошибка генерации изображения"
         )
         return
 
-    await state.update_data(stroop_correct_answer=correct_answer_color_name)
+    stroop.correct_answer = correct_answer_color_name
+    session.update(stroop.as_fsm_data())
 
     distractors = [c for c in all_colors if c != correct_answer_color_name]
     random.shuffle(distractors)
@@ -282,15 +274,16 @@ async def _display_next_stroop_stimulus(
             if stimulus_msg_id:
                 await _safe_delete_stroop_specific_message(
                     bot_instance,
-                    state,
-                    "stroop_stimulus_message_id",
+                    stroop.chat_id,
+                    stimulus_msg_id,
                     "_display_next type change",
                 )
                 stimulus_msg_id = None
             msg = await (
-                bot_instance.send_photo(
+                send_photo_cached(
+                    bot_instance,
                     chat_id,
-                    photo=image_to_send,
+                    image_to_send,
                     caption=full_caption,
                     reply_markup=reply_markup,
                     parse_mode=ParseMode.HTML,
@@ -306,15 +299,13 @@ async def _display_next_stroop_stimulus(
             stimulus_msg_id = msg.message_id
         else:
             if new_stimulus_ui_type == "photo":
-                media = InputMediaPhoto(
-                    media=image_to_send,
+                await edit_photo_cached(
+                    bot_instance,
+                    chat_id,
+                    stimulus_msg_id,
+                    image_to_send,
                     caption=full_caption,
                     parse_mode=ParseMode.HTML,
-                )
-                await bot_instance.edit_message_media(
-                    media=media,
-                    chat_id=chat_id,
-                    message_id=stimulus_msg_id,
                     reply_markup=reply_markup,
                 )
             else:
@@ -325,23 +316,22 @@ async def _display_next_stroop_stimulus(
                     reply_markup=reply_markup,
                     parse_mode=ParseMode.HTML,
                 )
-        await state.update_data(
-            stroop_stimulus_message_id=stimulus_msg_id,
-            stroop_stimulus_type=new_stimulus_ui_type,
-        )
+        stroop.stimulus_message_id = stimulus_msg_id
+        stroop.stimulus_type = new_stimulus_ui_type
     except TelegramBadRequest as e_ui:
         logger.warning(f"Stroop: Ошибка UI ({e_ui}). Попытка переотправки.")
         await _safe_delete_stroop_specific_message(
             bot_instance,
-            state,
-            "stroop_stimulus_message_id",
+            stroop.chat_id,
+            stroop.stimulus_message_id,
             "_display_next fallback delete",
         )
         try:
             msg_fb = await (
-                bot_instance.send_photo(
+                send_photo_cached(
+                    bot_instance,
                     chat_id,
-                    photo=image_to_send,
+                    image_to_send,
                     caption=full_caption,
                     reply_markup=reply_markup,
                     parse_mode=ParseMode.HTML,
@@ -354,11 +344,10 @@ async def _display_next_stroop_stimulus(
                     parse_mode=ParseMode.HTML,
                 )
             )
-            await state.update_data(
-                stroop_stimulus_message_id=msg_fb.message_id,
-                stroop_stimulus_type=new_stimulus_ui_type,
-            )
+            stroop.stimulus_message_id = msg_fb.message_id
+            stroop.stimulus_type = new_stimulus_ui_type
         except Exception as e_fb_send:
+            await session.commit()
             await _handle_stroop_critical_error(
                 chat_id,
                 state,
@@ -366,13 +355,14 @@ async def _display_next_stroop_stimulus(
                 f"Критическая ошибка UI при переотправке: {e_fb_send}",
             )
             return
+    session.update(stroop.as_fsm_data())
 
     if current_part == 1:
-        await state.set_state(StroopTestStates.part1_stimulus_response)
+        session.set_state(StroopTestStates.part1_stimulus_response)
     elif current_part == 2:
-        await state.set_state(StroopTestStates.part2_stimulus_response)
+        session.set_state(StroopTestStates.part2_stimulus_response)
     elif current_part == 3:
-        await state.set_state(StroopTestStates.part3_stimulus_response)
+        session.set_state(StroopTestStates.part3_stimulus_response)
 
 
 # --- Test Lifecycle Functions ---
@@ -392,30 +382,10 @@ async def start_stroop_test(
     chat_id = source_message.chat.id
 
     await state.set_state(StroopTestStates.initial_instructions)
-    initial_stroop_data = {
-        "unique_id_for_test": uid,
-        "profile_name_for_test": profile.get("name"),
-        "profile_age_for_test": profile.get("age"),
-        "profile_telegram_id_for_test": profile.get("telegram_id"),
-        "stroop_chat_id": chat_id,
-        "stroop_instruction_message_id": None,
-        "stroop_stimulus_message_id": None,
-        "stroop_stimulus_type": None,
-        "stroop_current_part": 0,
-        "stroop_current_iteration": 0,
-        "stroop_part1_errors": 0,
-        "stroop_part2_errors": 0,
-        "stroop_part3_errors": 0,
-        "stroop_part1_start_time": None,
-        "stroop_part2_start_time": None,
-        "stroop_part3_start_time": None,
-        "stroop_part1_total_time_s": None,
-        "stroop_part2_total_time_s": None,
-        "stroop_part3_total_time_s": None,
-        "stroop_correct_answer": None,
-    }
+    stroop = StroopSession(chat_id=chat_id)
+    stroop.set_profile(profile)
     # Важно: update_data добавляет/обновляет, не затирая существующие (например, профиль с active_* ключами)
-    await state.update_data(**initial_stroop_data)
+    await state.update_data(stroop.as_fsm_data())
     await _send_stroop_instruction_message(chat_id, 1, state, bot_instance)
 
 
@@ -426,18 +396,17 @@ async def handle_stroop_ack_part1(
     cb: CallbackQuery, state: FSMContext, bot: Bot
 ):
     await cb.answer()
-    await _safe_delete_stroop_specific_message(
-        bot, state, "stroop_instruction_message_id", "ack_part1"
-    )
-    await state.update_data(
-        stroop_current_part=1,
-        stroop_current_iteration=1,
-        stroop_part1_start_time=time.time(),
-    )
-    chat_id = (await state.get_data()).get(
-        "stroop_chat_id", cb.message.chat.id if cb.message else cb.from_user.id
-    )
-    await _display_next_stroop_stimulus(chat_id, state, bot)
+    async with fsm_session(state) as session:
+        stroop = StroopSession.from_fsm(session.data)
+        await _safe_delete_stroop_specific_message(
+            bot, stroop.chat_id, stroop.instruction_message_id, "ack_part1"
+        )
+        stroop.start_part(1)
+        session.update(stroop.as_fsm_data())
+        chat_id = stroop.chat_id or (
+            cb.message.chat.id if cb.message else cb.from_user.id
+        )
+        await _display_next_stroop_stimulus(chat_id, state, bot, session)
 
 
 @router.callback_query(
@@ -447,18 +416,17 @@ async def handle_stroop_ack_part2(
     cb: CallbackQuery, state: FSMContext, bot: Bot
 ):
     await cb.answer()
-    await _safe_delete_stroop_specific_message(
-        bot, state, "stroop_instruction_message_id", "ack_part2"
-    )
-    await state.update_data(
-        stroop_current_part=2,
-        stroop_current_iteration=1,
-        stroop_part2_start_time=time.time(),
-    )
-    chat_id = (await state.get_data()).get(
-        "stroop_chat_id", cb.message.chat.id if cb.message else cb.from_user.id
-    )
-    await _display_next_stroop_stimulus(chat_id, state, bot)
+    async with fsm_session(state) as session:
+        stroop = StroopSession.from_fsm(session.data)
+        await _safe_delete_stroop_specific_message(
+            bot, stroop.chat_id, stroop.instruction_message_id, "ack_part2"
+        )
+        stroop.start_part(2)
+        session.update(stroop.as_fsm_data())
+        chat_id = stroop.chat_id or (
+            cb.message.chat.id if cb.message else cb.from_user.id
+        )
+        await _display_next_stroop_stimulus(chat_id, state, bot, session)
 
 
 @router.callback_query(
@@ -468,18 +436,17 @@ async def handle_stroop_ack_part3(
     cb: CallbackQuery, state: FSMContext, bot: Bot
 ):
     await cb.answer()
-    await _safe_delete_stroop_specific_message(
-        bot, state, "stroop_instruction_message_id", "ack_part3"
-    )
-    await state.update_data(
-        stroop_current_part=3,
-        stroop_current_iteration=1,
-        stroop_part3_start_time=time.time(),
-    )
-    chat_id = (await state.get_data()).get(
-        "stroop_chat_id", cb.message.chat.id if cb.message else cb.from_user.id
-    )
-    await _display_next_stroop_stimulus(chat_id, state, bot)
+    async with fsm_session(state) as session:
+        stroop = StroopSession.from_fsm(session.data)
+        await _safe_delete_stroop_specific_message(
+            bot, stroop.chat_id, stroop.instruction_message_id, "ack_part3"
+        )
+        stroop.start_part(3)
+        session.update(stroop.as_fsm_data())
+        chat_id = stroop.chat_id or (
+            cb.message.chat.id if cb.message else cb.from_user.id
+        )
+        await _display_next_stroop_stimulus(chat_id, state, bot, session)
 
 
 @router.callback_query(
@@ -493,13 +460,20 @@ async def handle_stroop_ack_part3(
 async def handle_stroop_stimulus_response(
     cb: CallbackQuery, state: FSMContext, bot: Bot
 ):
-    data = await state.get_data()
+    async with fsm_session(state) as session:
+        await _process_stroop_answer(cb, state, bot, session)
+
+
+async def _process_stroop_answer(
+    cb: CallbackQuery, state: FSMContext, bot: Bot, session: FSMSession
+):
+    stroop = StroopSession.from_fsm(session.data)
     chosen_color = cb.data.split("stroop_answer_")[-1]
-    correct_answer = data.get("stroop_correct_answer")
-    current_part = data.get("stroop_current_part")
-    current_iter = data.get("stroop_current_iteration", 0)
-    chat_id = data.get(
-        "stroop_chat_id", cb.message.chat.id if cb.message else cb.from_user.id
+    correct_answer = stroop.correct_answer
+    current_part = stroop.current_part
+    current_iter = stroop.current_iteration
+    chat_id = stroop.chat_id or (
+        cb.message.chat.id if cb.message else cb.from_user.id
     )
 
     if chosen_color == correct_answer:
@@ -511,26 +485,21 @@ async def handle_stroop_stimulus_response(
             else "Ошибка!"
         )
         await cb.answer(text=error_fb, show_alert=False)
-        error_key = f"stroop_part{current_part}_errors"
-        await state.update_data({error_key: data.get(error_key, 0) + 1})
+        if stroop.part_running:
+            stroop.part_errors[current_part - 1] += 1
 
     current_iter += 1
 
     if current_iter > STROOP_ITERATIONS_PER_PART:
-        part_time_key = f"stroop_part{current_part}_start_time"
-        part_start_t = data.get(part_time_key)
-        if part_start_t:
-            total_t = round(time.time() - part_start_t, 2)
-            await state.update_data(
-                {f"stroop_part{current_part}_total_time_s": total_t}
-            )
+        if stroop.part_running:
+            stroop.finish_part_timer()
 
         current_part += 1
-        current_iter = 1
-        await state.update_data(
-            stroop_current_part=current_part,
-            stroop_current_iteration=current_iter,
-        )
+        stroop.current_part = current_part
+        stroop.current_iteration = 1
+        session.update(stroop.as_fsm_data())
+        # Part switch / finish: the routines below work on the FSMContext
+        await session.commit()
 
         if current_part == 2:
             await state.set_state(StroopTestStates.part2_instructions)
@@ -568,9 +537,7 @@ async def handle_stroop_stimulus_response(
                 msg_context_for_menu = (
                     cb.message
                     if cb.message
-                    else _create_mock_message_stroop(
-                        chat_id, bot.id if hasattr(bot, "id") else None
-                    )
+                    else make_service_message(bot, chat_id)
                 )
                 await send_main_action_menu(
                     bot,
@@ -590,8 +557,9 @@ async def handle_stroop_stimulus_response(
                     )
                 # FSM уже очищен _clear_fsm_and_set_profile
     else:
-        await state.update_data(stroop_current_iteration=current_iter)
-        await _display_next_stroop_stimulus(chat_id, state, bot)
+        stroop.current_iteration = current_iter
+        session.update(stroop.as_fsm_data())
+        await _display_next_stroop_stimulus(chat_id, state, bot, session)
 
 
 async def save_stroop_results(
@@ -604,23 +572,16 @@ async def save_stroop_results(
         f"Сохранение результатов Теста Струпа. Прерван: {is_interrupted}"
     )
     data = await state.get_data()
+    stroop = StroopSession.from_fsm(data)
 
-    uid = data.get("unique_id_for_test")
-    p_name = data.get(
-        "profile_name_for_test"
-    )  # These are for new row creation if UID not found
-    p_age = data.get("profile_age_for_test")
-    p_tgid = data.get("profile_telegram_id_for_test")
-
+    uid = stroop.unique_id
     if not uid:
         active_profile = await get_active_profile_from_fsm(
             state
         )  # Returns standardized keys
         if active_profile and active_profile.get("unique_id"):
-            uid = active_profile.get("unique_id")
-            p_name = active_profile.get("name", p_name)
-            p_age = active_profile.get("age", p_age)
-            p_tgid = active_profile.get("telegram_id", p_tgid)
+            stroop.set_profile(active_profile)
+            uid = stroop.unique_id
             logger.info(
                 f"Stroop save: Используются данные из активного профиля для UID {uid}."
             )
@@ -635,173 +596,64 @@ async def save_stroop_results(
                 )
             return
 
-    current_part_running = data.get("stroop_current_part", 0)
-    if is_interrupted and 1 <= current_part_running <= 3:
-        start_t_key = f"stroop_part{current_part_running}_start_time"
-        total_t_key = f"stroop_part{current_part_running}_total_time_s"
-        if data.get(start_t_key) and not data.get(total_t_key):
-            time_taken = round(time.time() - data.get(start_t_key), 2)
-            await state.update_data({total_t_key: time_taken})
-            data = await state.get_data()
-
-    p1t = data.get("stroop_part1_total_time_s")
-    p1e = data.get("stroop_part1_errors", 0)
-    p2t = data.get("stroop_part2_total_time_s")
-    p2e = data.get("stroop_part2_errors", 0)
-    p3t = data.get("stroop_part3_total_time_s")
-    p3e = data.get("stroop_part3_errors", 0)
-    intr_val = "Да" if is_interrupted else "Нет"
+    if is_interrupted and stroop.part_running:
+        stroop.finish_part_timer(keep_existing=True)
+        await state.update_data(stroop.as_fsm_data())
 
-    try:
-        from openpyxl import load_workbook
-
-        if not os.path.exists(EXCEL_FILENAME):
-            logger.error(
-                f"Stroop save: Файл Excel '{EXCEL_FILENAME}' не найден."
-            )
-            if (
-                hasattr(trigger_msg, "chat")
-                and await state.get_state() is not None
-            ):
-                await trigger_msg.answer(
-                    f"Ошибка: Файл для сохранения ('{EXCEL_FILENAME}') не найден."
-                )
-            return
-
-        wb = load_workbook(EXCEL_FILENAME)
-        ws = wb.active
-        excel_headers = [cell.value for cell in ws[1]]
-        if "Unique ID" not in excel_headers:
-            raise ValueError("Столбец 'Unique ID' не найден в Excel.")
-
-        uid_col_idx = excel_headers.index("Unique ID")
-        row_num_excel = -1
-        for r_idx, row_vals in enumerate(
-            ws.iter_rows(min_row=2, values_only=True), start=2
-        ):
-            if (
-                len(row_vals) > uid_col_idx
-                and row_vals[uid_col_idx] is not None
-                and str(row_vals[uid_col_idx]) == str(uid)
-            ):
-                row_num_excel = r_idx
-                break
-
-        if row_num_excel == -1:
-            logger.info(
-                f"Stroop save: UID {uid} не найден, добавление новой строки."
-            )
-            new_row = [""] * len(excel_headers)
-            new_row[uid_col_idx] = uid
-            if p_name and "Name" in excel_headers:
-                new_row[excel_headers.index("Name")] = p_name
-            if p_age and "Age" in excel_headers:
-                new_row[excel_headers.index("Age")] = p_age
-            if p_tgid and "Telegram ID" in excel_headers:
-                new_row[excel_headers.index("Telegram ID")] = p_tgid
-            ws.append(new_row)
-            row_num_excel = ws.max_row
-
-        stroop_headers_map = {
-            h: excel_headers.index(h) + 1
-            for h in [
-                "Stroop Part1 Time (s)",
-                "Stroop Part1 Errors",
-                "Stroop Part2 Time (s)",
-                "Stroop Part2 Errors",
-                "Stroop Part3 Time (s)",
-                "Stroop Part3 Errors",
-                "Stroop - Interrupted",
-            ]
-            if h in excel_headers
-        }
-
-        def set_cell(header, value):
-            if header in stroop_headers_map:
-                ws.cell(
-                    row=row_num_excel, column=stroop_headers_map[header]
-                ).value = value
-            else:
-                logger.warning(
-                    f"Stroop save: Заголовок '{header}' не найден в Excel для записи."
-                )
-
-        set_cell("Stroop Part1 Time (s)", p1t)
-        set_cell("Stroop Part1 Errors", p1e)
-        set_cell("Stroop Part2 Time (s)", p2t)
-        set_cell("Stroop Part2 Errors", p2e)
-        set_cell("Stroop Part3 Time (s)", p3t)
-        set_cell("Stroop Part3 Errors", p3e)
-        set_cell("Stroop - Interrupted", intr_val)
-
-        wb.save(EXCEL_FILENAME)
-        logger.info(
-            f"Результаты Теста Струпа для UID {uid} (Прерван: {is_interrupted}) сохранены."
-        )
-
-        if await state.get_state() is not None and hasattr(
-            trigger_msg, "chat"
-        ):
-            status = (
-                "ПРЕРВАНЫ И СОХРАНЕНЫ"
-                if is_interrupted
-                else "УСПЕШНО СОХРАНЕНЫ"
-            )
-            summary = [
-                f"Результаты Теста Струпа <b>{status}</b> для UID {uid}:",
-                f"Часть 1: Время {p1t if p1t is not None else 'N/A'} сек, Ошибок: {p1e}",
-                f"Часть 2: Время {p2t if p2t is not None else 'N/A'} сек, Ошибок: {p2e}",
-                f"Часть 3: Время {p3t if p3t is not None else 'N/A'} сек, Ошибок: {p3e}",
-            ]
-            if (
-                is_interrupted
-                and all(t is None for t in [p1t, p2t, p3t])
-                and all(e == 0 for e in [p1e, p2e, p3e])
-            ):
-                summary = [
-                    f"Тест Струпа был <b>ПРЕРВАН</b> досрочно для UID {uid}. Данные не зафиксированы."
-                ]
-            try:
-                await trigger_msg.answer(
-                    "\n".join(summary), parse_mode=ParseMode.HTML
-                )
-            except Exception as e_ans:
-                logger.error(
-                    f"Stroop save: Не удалось отправить итог: {e_ans}"
-                )
+    p1t, p2t, p3t = stroop.part_total_times
+    p1e, p2e, p3e = stroop.part_errors
+    intr_val = "Да" if is_interrupted else "Нет"
 
-    except FileNotFoundError:
-        logger.error(
-            f"Stroop save: Файл Excel '{EXCEL_FILENAME}' не найден (повторно)."
-        )
-        if await state.get_state() is not None and hasattr(
-            trigger_msg, "chat"
-        ):
-            await trigger_msg.answer(
-                f"Критическая ошибка: Файл для сохранения ('{EXCEL_FILENAME}') не найден."
-            )
-    except ValueError as ve:
-        logger.error(
-            f"Stroop save: Ошибка конфигурации Excel для UID {uid}: {ve}",
-            exc_info=True,
-        )
+    saved = await save_test_results(
+        uid,
+        {
+            "Stroop Part1 Time (s)": p1t,
+            "Stroop Part1 Errors": p1e,
+            "Stroop Part2 Time (s)": p2t,
+            "Stroop Part2 Errors": p2e,
+            "Stroop Part3 Time (s)": p3t,
+            "Stroop Part3 Errors": p3e,
+            "Stroop - Interrupted": intr_val,
+        },
+        profile=stroop.profile_for_save(data),
+    )
+    if not saved:
         if await state.get_state() is not None and hasattr(
             trigger_msg, "chat"
         ):
             await trigger_msg.answer(
-                "Ошибка конфигурации при сохранении Теста Струпа."
+                "Непредвиденная ошибка при сохранении Теста Струпа."
             )
-    except Exception as e_gen:
-        logger.error(
-            f"Stroop save: Общая ошибка сохранения в Excel для UID {uid}: {e_gen}",
-            exc_info=True,
+        return
+
+    logger.info(
+        f"Результаты Теста Струпа для UID {uid} (Прерван: {is_interrupted}) сохранены."
+    )
+
+    if await state.get_state() is not None and hasattr(trigger_msg, "chat"):
+        status = (
+            "ПРЕРВАНЫ И СОХРАНЕНЫ" if is_interrupted else "УСПЕШНО СОХРАНЕНЫ"
         )
-        if await state.get_state() is not None and hasattr(
-            trigger_msg, "chat"
+        summary = [
+            f"Результаты Теста Струпа <b>{status}</b> для UID {uid}:",
+            f"Часть 1: Время {p1t if p1t is not None else 'N/A'} сек, Ошибок: {p1e}",
+            f"Часть 2: Время {p2t if p2t is not None else 'N/A'} сек, Ошибок: {p2e}",
+            f"Часть 3: Время {p3t if p3t is not None else 'N/A'} сек, Ошибок: {p3e}",
+        ]
+        if (
+            is_interrupted
+            and all(t is None for t in [p1t, p2t, p3t])
+            and all(e == 0 for e in [p1e, p2e, p3e])
         ):
+            summary = [
+                f"Тест Струпа был <b>ПРЕРВАН</b> досрочно для UID {uid}. Данные не зафиксированы."
+            ]
+        try:
             await trigger_msg.answer(
-                "Непредвиденная ошибка при сохранении Теста Струпа."
+                "\n".join(summary), parse_mode=ParseMode.HTML
             )
+        except Exception as e_ans:
+            logger.error(f"Stroop save: Не удалось отправить итог: {e_ans}")
 
 
 async def cleanup_stroop_ui(
@@ -810,26 +662,26 @@ async def cleanup_stroop_ui(
     final_text: Optional[str] = None,
 ):
     logger.info(f"Stroop UI Cleanup. Контекст: '{final_text}'")
-    data = await state.get_data()
-    chat_id = data.get("stroop_chat_id")
+    stroop = StroopSession.from_fsm(await state.get_data())
+    chat_id = stroop.chat_id
 
     if chat_id:
         await _safe_delete_stroop_specific_message(
             bot_instance,
-            state,
-            "stroop_instruction_message_id",
+            chat_id,
+            stroop.instruction_message_id,
             "cleanup_stroop_ui",
         )
         await _safe_delete_stroop_specific_message(
             bot_instance,
-            state,
-            "stroop_stimulus_message_id",
+            chat_id,
+            stroop.stimulus_message_id,
             "cleanup_stroop_ui",
         )
-        # Ключи из FSM будут удалены через _clear_fsm_and_set_profile или stop_test_command_handler
+        # Сессия будет удалена из FSM через _clear_fsm_and_set_profile или stop_test_command_handler
     else:
         logger.warning(
-            "Stroop cleanup: stroop_chat_id не найден, невозможно удалить сообщения."
+            "Stroop cleanup: chat_id сессии Струпа не найден, невозможно удалить сообщения."
         )
 
     # Финальная очистка FSM и установка профиля будет выполнена вызывающей функцией
@@ -22,8 +22,6 @@ from aiogram.types import (
 
 from fsm_states import VerbalFluencyStates
 from settings import (
-    ALL_EXPECTED_HEADERS,
-    EXCEL_FILENAME,
     VERBAL_FLUENCY_DURATION_S,
     VERBAL_FLUENCY_TASK_POOL,
     VERBAL_FLUENCY_CATEGORY,
@@ -31,7 +29,12 @@ from settings import (
 from utils.bot_helpers import (
     send_main_action_menu,
     get_active_profile_from_fsm,
+    message_from_ref,
+    message_ref,
 )
+from utils.excel_handler import save_test_results
+from utils.session_tasks import session_tasks
+from utils.test_sessions import VerbalFluencySession
 from keyboards import (
     ACTION_SELECTION_KEYBOARD_RETURNING,
     ACTION_SELECTION_KEYBOARD_NEW,
@@ -43,15 +46,15 @@ IKB = InlineKeyboardButton
 
 
 async def _verbal_fluency_timer_task(state: FSMContext, bot_instance: Bot):
-    data = await state.get_data()
-    chat_id = data.get("vf_chat_id")
-    task_message_id = data.get("vf_task_message_id")
-    task_letter = data.get("vf_task_letter")
+    vf = VerbalFluencySession.from_fsm(await state.get_data())
+    chat_id = vf.chat_id
+    task_message_id = vf.task_message_id
+    task_letter = vf.task_letter
     last_displayed_text = ""
 
     if not all([chat_id, task_message_id, task_letter]):
         logger.error("Verbal Fluency timer: Missing critical data from FSM.")
-        trigger_event = data.get("vf_trigger_event_for_stop")
+        trigger_event = message_from_ref(bot_instance, vf.trigger_message)
         await _end_verbal_fluency_test(
             state, bot_instance, interrupted=True, trigger_event=trigger_event
         )
@@ -106,7 +109,7 @@ async def _verbal_fluency_timer_task(state: FSMContext, bot_instance: Bot):
             == VerbalFluencyStates.collecting_words.state
         ):  # Time is up
             logger.info("Verbal Fluency timer: Time is up.")
-            trigger_event = data.get("vf_trigger_event_for_stop")
+            trigger_event = message_from_ref(bot_instance, vf.trigger_message)
             if not trigger_event and chat_id:
                 mock_user = User(
                     id=bot_instance.id, is_bot=True, first_name="Bot"
@@ -131,7 +134,7 @@ async def _verbal_fluency_timer_task(state: FSMContext, bot_instance: Bot):
         logger.error(
             f"Verbal Fluency timer task unexpected error: {e}", exc_info=True
         )
-        trigger_event = data.get("vf_trigger_event_for_stop")
+        trigger_event = message_from_ref(bot_instance, vf.trigger_message)
         if not trigger_event and chat_id:
             mock_user = User(id=bot_instance.id, is_bot=True, first_name="Bot")
             mock_chat = Chat(id=chat_id, type=ChatType.PRIVATE)
@@ -162,21 +165,12 @@ async def _end_verbal_fluency_test(
         return
 
     logger.info(f"VF: Entering _end_test. Interrupted: {interrupted}")
-    data = await state.get_data()
-    chat_id = data.get("vf_chat_id")
-    task_message_id = data.get("vf_task_message_id")
-    timer_task = data.get("vf_timer_task")
-
-    if timer_task and not timer_task.done():
-        timer_task.cancel()
-        try:
-            await asyncio.wait_for(timer_task, timeout=0.5)
-        except (asyncio.CancelledError, asyncio.TimeoutError):
-            pass
-    await state.update_data(vf_timer_task=None)
+    vf = VerbalFluencySession.from_fsm(await state.get_data())
+    chat_id = vf.chat_id
+    task_message_id = vf.task_message_id
+    await session_tasks.cancel(state, "vf_timer")
 
-    collected_words = data.get("vf_collected_words", set())
-    word_count = len(collected_words)
+    word_count = len(vf.collected_words)
     await save_verbal_fluency_results(state, is_interrupted=interrupted)
 
     result_message_text = ""
@@ -241,9 +235,9 @@ async def _end_verbal_fluency_test(
                 f"VF _end_test: Fail to send result summary msg: {e_send_res}"
             )
 
-        await state.update_data(
-            vf_task_message_id=None
-        )  # Clear msg_id from FSM
+        vf = VerbalFluencySession.from_fsm(await state.get_data())
+        vf.task_message_id = None  # Clear msg_id from FSM
+        await state.update_data(vf.as_fsm_data())
 
     await cleanup_verbal_fluency_ui(
         state, bot_instance, final_text=None
@@ -338,19 +332,14 @@ async def start_verbal_fluency_test(
     task_letter = chosen_task["letter"]
 
     await state.set_state(VerbalFluencyStates.showing_instructions_and_task)
-    await state.update_data(
-        vf_unique_id_for_test=profile.get("unique_id"),
-        vf_profile_name_for_test=profile.get("name"),
-        vf_profile_age_for_test=profile.get("age"),
-        vf_profile_telegram_id_for_test=profile.get("telegram_id"),
-        vf_chat_id=chat_id,
-        vf_task_base_category=VERBAL_FLUENCY_CATEGORY,
-        vf_task_letter=task_letter,
-        vf_collected_words=set(),
-        vf_timer_task=None,
-        vf_task_message_id=None, # Будет установлен ID нового сообщения
-        vf_trigger_event_for_stop=msg_ctx, # Сохраняем оригинальный контекст для _end_test
+    vf = VerbalFluencySession(
+        chat_id=chat_id,
+        task_base_category=VERBAL_FLUENCY_CATEGORY,
+        task_letter=task_letter,
+        trigger_message=message_ref(msg_ctx), # Сохраняем оригинальный контекст для _end_test
     )
+    vf.set_profile(profile)
+    await state.update_data(vf.as_fsm_data())
     instruction_text = (
         f"<b>Тест на вербальную беглость</b>\n\n"
         f"Вам будет дана буква. Ваша задача – назвать как можно больше слов, "
@@ -370,7 +359,8 @@ async def start_verbal_fluency_test(
         sent_message = await bot_instance.send_message(
             chat_id, instruction_text, reply_markup=kbd, parse_mode=ParseMode.HTML # Добавлен parse_mode
         )
-        await state.update_data(vf_task_message_id=sent_message.message_id)
+        vf.task_message_id = sent_message.message_id
+        await state.update_data(vf.as_fsm_data())
     except TelegramBadRequest as e: # Этот блок теперь маловероятен для send_message, но оставим для общей обработки
         logger.error(
             f"Verbal Fluency start: Error sending instructions: {e}"
@@ -389,10 +379,10 @@ async def handle_verbal_fluency_start_ack(
     callback: CallbackQuery, state: FSMContext, bot: Bot
 ):
     await callback.answer()
-    data = await state.get_data()
-    task_msg_id = data.get("vf_task_message_id")
-    task_letter = data.get("vf_task_letter")
-    chat_id = data.get("vf_chat_id")
+    vf = VerbalFluencySession.from_fsm(await state.get_data())
+    task_msg_id = vf.task_message_id
+    task_letter = vf.task_letter
+    chat_id = vf.chat_id
 
     if not all([task_msg_id, task_letter, chat_id]):
         logger.error("VF: Missing critical data in FSM for start_ack.")
@@ -435,7 +425,8 @@ async def handle_verbal_fluency_start_ack(
                 parse_mode=ParseMode.HTML,
                 reply_markup=stop_button_markup,
             )
-            await state.update_data(vf_task_message_id=new_msg.message_id)
+            vf.task_message_id = new_msg.message_id
+            await state.update_data(vf.as_fsm_data())
             current_task_msg_id = new_msg.message_id
         except Exception as send_e:
             logger.critical(
@@ -462,17 +453,18 @@ async def handle_verbal_fluency_start_ack(
             )
 
     await state.set_state(VerbalFluencyStates.collecting_words)
-    timer_task = asyncio.create_task(_verbal_fluency_timer_task(state, bot))
-    await state.update_data(vf_timer_task=timer_task)
+    await session_tasks.start(
+        state, "vf_timer", _verbal_fluency_timer_task(state, bot)
+    )
 
 
 @router.message(VerbalFluencyStates.collecting_words, F.text)
 async def handle_verbal_fluency_word_input(
     message: Message, state: FSMContext
 ):
-    data = await state.get_data()
-    task_letter = data.get("vf_task_letter", "").lower()
-    collected_words_set = data.get("vf_collected_words", set())
+    vf = VerbalFluencySession.from_fsm(await state.get_data())
+    task_letter = (vf.task_letter or "").lower()
+    collected_words_set = vf.collected_words
 
     if not task_letter:
         await message.reply("Ошибка: буква для задания не определена.")
@@ -488,12 +480,13 @@ async def handle_verbal_fluency_word_input(
                 newly_added_count += 1
 
     if newly_added_count > 0:
-        await state.update_data(vf_collected_words=collected_words_set)
+        await state.update_data(vf.as_fsm_data())
 
 
 async def save_verbal_fluency_results(state: FSMContext, is_interrupted: bool):
     data = await state.get_data()
-    uid = data.get("vf_unique_id_for_test")
+    vf = VerbalFluencySession.from_fsm(data)
+    uid = vf.unique_id
     p_tgid, p_name, p_age = None, None, None
 
     if not uid:
@@ -507,72 +500,36 @@ async def save_verbal_fluency_results(state: FSMContext, is_interrupted: bool):
             logger.error("VF save: UID not found. Cannot save.")
             return
     else:
-        p_tgid = data.get(
-            "vf_profile_telegram_id_for_test", data.get("active_telegram_id")
-        )
-        p_name = data.get("vf_profile_name_for_test", data.get("active_name"))
-        p_age = data.get("vf_profile_age_for_test", data.get("active_age"))
+        saved_profile = vf.profile_for_save(data)
+        p_tgid = saved_profile["telegram_id"]
+        p_name = saved_profile["name"]
+        p_age = saved_profile["age"]
 
-    letter = data.get("vf_task_letter", "N/A")
-    collected_words = data.get("vf_collected_words", set())
+    letter = vf.task_letter or "N/A"
+    collected_words = vf.collected_words
     word_count = len(collected_words)
     words_list_str = ", ".join(sorted(list(collected_words)))
     interrupted_status = "Да" if is_interrupted else "Нет"
     excel_category_display = f"Слова на букву {letter}"
 
-    try:
-        from openpyxl import load_workbook
-
-        wb = load_workbook(EXCEL_FILENAME)
-        ws = wb.active
-        row_num = -1
-        uid_col_idx = ALL_EXPECTED_HEADERS.index("Unique ID")
-        for idx, row_vals in enumerate(
-            ws.iter_rows(min_row=2, values_only=True), start=2
-        ):
-            if row_vals[uid_col_idx] is not None and str(
-                row_vals[uid_col_idx]
-            ) == str(uid):
-                row_num = idx
-                break
-        if row_num == -1:
-            new_row_data = [""] * len(ALL_EXPECTED_HEADERS)
-            new_row_data[ALL_EXPECTED_HEADERS.index("Telegram ID")] = (
-                p_tgid if p_tgid else ""
-            )
-            new_row_data[uid_col_idx] = uid
-            new_row_data[ALL_EXPECTED_HEADERS.index("Name")] = (
-                p_name if p_name else ""
-            )
-            new_row_data[ALL_EXPECTED_HEADERS.index("Age")] = (
-                p_age if p_age else ""
-            )
-            ws.append(new_row_data)
-            row_num = ws.max_row
-
-        h = ALL_EXPECTED_HEADERS
-        ws.cell(
-            row=row_num, column=h.index("VerbalFluency_Category") + 1
-        ).value = excel_category_display
-        ws.cell(
-            row=row_num, column=h.index("VerbalFluency_Letter") + 1
-        ).value = letter
-        ws.cell(
-            row=row_num, column=h.index("VerbalFluency_WordCount") + 1
-        ).value = word_count
-        ws.cell(
-            row=row_num, column=h.index("VerbalFluency_WordsList") + 1
-        ).value = words_list_str
-        ws.cell(
-            row=row_num, column=h.index("VerbalFluency_Interrupted") + 1
-        ).value = interrupted_status
-        wb.save(EXCEL_FILENAME)
+    saved = await save_test_results(
+        uid,
+        {
+            "VerbalFluency_Category": excel_category_display,
+            "VerbalFluency_Letter": letter,
+            "VerbalFluency_WordCount": word_count,
+            "VerbalFluency_WordsList": words_list_str,
+            "VerbalFluency_Interrupted": interrupted_status,
+        },
+        profile={"telegram_id": p_tgid, "name": p_name, "age": p_age},
+    )
+    if saved:
         logger.info(
             f"VF results for UID {uid} saved. Cat: {excel_category_display}, L: {letter}, Cnt: {word_count}, Int: {interrupted_status}"
         )
-    except Exception as e:
-        logger.error(f"VF results save error UID {uid}: {e}", exc_info=True)
-        chat_id_for_err = data.get("vf_chat_id")
+    else:
+        logger.error(f"VF results save error UID {uid}.")
+        chat_id_for_err = vf.chat_id
         if chat_id_for_err and await state.get_state() is not None:
             # Cannot send message here as bot_instance is not passed to save_results
             logger.warning(
@@ -586,17 +543,10 @@ async def cleanup_verbal_fluency_ui(
     final_text: str | None = None,
 ):
     logger.info(f"VF: Entering cleanup_ui. Final text: '{final_text}'")
-    data = await state.get_data()
-    chat_id = data.get("vf_chat_id")
-    task_message_id = data.get("vf_task_message_id")
-    timer_task = data.get("vf_timer_task")
-
-    if timer_task and not timer_task.done():
-        timer_task.cancel()
-        try:
-            await asyncio.wait_for(timer_task, timeout=0.2)
-        except (asyncio.CancelledError, asyncio.TimeoutError):
-            pass
+    vf = VerbalFluencySession.from_fsm(await state.get_data())
+    chat_id = vf.chat_id
+    task_message_id = vf.task_message_id
+    await session_tasks.cancel(state, "vf_timer")
 
     if final_text and chat_id and task_message_id:
         try:
@@ -4,39 +4,11 @@ import logging
 import os
 import random  # Keep for now, verify usage in create_dummy_rt_image later
 
-from aiogram import Bot, Dispatcher
-from aiogram.client.default import DefaultBotProperties
-from aiogram.enums import ParseMode
-from aiogram.fsm.storage.memory import MemoryStorage
-
-# Pillow for image generation (optional check at startup)
-try:
-    from PIL import Image, ImageDraw, ImageFont, UnidentifiedImageError
-except ImportError:
-    Image = None
-    ImageDraw = None
-    ImageFont = None
-    UnidentifiedImageError = None
-    # Logging for missing Pillow will be done later
-
-import config as bot_config
 import settings as app_settings
 
-from utils.excel_handler import initialize_excel_file
-from utils.image_processors import create_dummy_rt_image
-from handlers.tests.raven_matrices_handlers import (
-    _parse_raven_filename,
-)
-
-from handlers import common_handlers
-from handlers.tests import (
-    corsi_handlers,
-    stroop_handlers,
-    reaction_time_handlers,
-    verbal_fluency_handlers,
-    mental_rotation_handlers,
-    raven_matrices_handlers,
-)
+# Render pool workers (spawn) re-import this file as __mp_main__: aiogram,
+# config (.env), the handlers and the data stores are imported inside the
+# functions below, so workers only load what utils.render_jobs needs.
 
 logging.basicConfig(
     level=logging.INFO,
@@ -65,6 +37,8 @@ def _ensure_directory(path: str, add_gitkeep: bool = False):
 
 def _populate_rt_resources():
     """Populates resources for the Reaction Time test."""
+    from utils.image_processors import PILLOW_AVAILABLE, create_dummy_rt_image
+
     if not _ensure_directory(app_settings.RT_IMAGES_DIR):
         logger.error(
             "RT Test: Не удалось создать директорию для изображений. "
@@ -77,7 +51,7 @@ def _populate_rt_resources():
         img_path = os.path.join(app_settings.RT_IMAGES_DIR, img_name)
         if os.path.exists(img_path):
             app_settings.REACTION_TIME_IMAGE_POOL.append(img_path)
-        elif Image and callable(create_dummy_rt_image):
+        elif PILLOW_AVAILABLE:
             logger.info(f"RT Test: Создание dummy-изображения: {img_path}")
             try:
                 create_dummy_rt_image(img_path, i)
@@ -179,6 +153,8 @@ def _populate_mr_resources():
 
 def _populate_raven_resources():
     """Populates resources for the Raven Matrices test."""
+    from handlers.tests.raven_matrices_handlers import _parse_raven_filename
+
     if not _ensure_directory(app_settings.RAVEN_BASE_DIR, add_gitkeep=True):
         logger.error(
             "Raven Test: Не удалось создать директорию для изображений. "
@@ -215,15 +191,19 @@ def _populate_raven_resources():
 
 def initialize_application_resources():
     """Initializes Excel, loads image pools, creates directories."""
+    from utils.excel_handler import initialize_excel_file, load_norms
+    from utils.file_id_cache import file_id_cache
+    from utils.image_processors import PILLOW_AVAILABLE, prerender_stroop_stimuli
+
     logger.info("Инициализация ресурсов приложения...")
 
-    if Image is None:
+    if not PILLOW_AVAILABLE:
         logger.error(
             "Библиотека Pillow (PIL) не установлена. "
             "Генерация изображений для некоторых тестов будет невозможна или ограничена."
         )
 
-    # 1. Initialize Excel file
+    # 1. Initialize Excel file (also replays the un-compacted results journal)
     try:
         initialize_excel_file()
         logger.info("Excel файл инициализирован успешно.")
@@ -234,6 +214,15 @@ def initialize_application_resources():
         # Decide if application should exit or continue
         # return # Example: exit if Excel is critical
 
+    # 1a. Build percentile norms (kept current by saves afterwards)
+    try:
+        load_norms()
+    except Exception as e_norms:
+        logger.error(f"Не удалось построить нормы: {e_norms}", exc_info=True)
+
+    # 1b. Telegram file_ids of already uploaded stimulus images
+    file_id_cache.load()
+
     # 2. Create base 'images' directory
     if not _ensure_directory("images"):
         # Depending on severity, you might want to exit
@@ -246,20 +235,71 @@ def initialize_application_resources():
     _populate_rt_resources()
     _populate_mr_resources()
     _populate_raven_resources()
+    logger.info(
+        f"Stroop: подготовлено {prerender_stroop_stimuli()} изображений стимулов."
+    )
 
     logger.info("Ресурсы приложения инициализированы.")
 
 
 async def main():
+    from aiogram import Bot, Dispatcher
+    from aiogram.client.default import DefaultBotProperties
+    from aiogram.client.session.aiohttp import AiohttpSession
+    from aiogram.client.telegram import TelegramAPIServer
+    from aiogram.enums import ParseMode
+    from aiogram.fsm.storage.memory import SimpleEventIsolation
+
+    import config as bot_config
+    from utils.excel_handler import (
+        flush_results_store,
+        run_results_flusher,
+        start_persistence_worker,
+        stop_persistence_worker,
+    )
+    from utils.asset_warmup import stimulus_assets, warmup_file_ids
+    from utils.file_id_cache import file_id_cache, run_file_id_cache_saver
+    from utils.fsm_storage import SQLiteStorage
+    from utils.session_tasks import session_tasks
+    from utils.session_reaper import session_activity, run_session_reaper
+    from utils.image_processors import render_service
+    from handlers import common_handlers
+    from handlers.tests import (
+        corsi_handlers,
+        stroop_handlers,
+        reaction_time_handlers,
+        verbal_fluency_handlers,
+        mental_rotation_handlers,
+        raven_matrices_handlers,
+    )
+
     initialize_application_resources()
 
+    bot_session = (
+        AiohttpSession(
+            api=TelegramAPIServer.from_base(bot_config.TELEGRAM_API_BASE)
+        )
+        if bot_config.TELEGRAM_API_BASE
+        else None
+    )
     bot = Bot(
         token=bot_config.BOT_TOKEN,
+        session=bot_session,
         default=DefaultBotProperties(parse_mode=ParseMode.HTML),
     )
-    # Default storage is MemoryStorage, explicitly setting for clarity
-    storage = MemoryStorage()
-    dp = Dispatcher(storage=storage)
+    # Persistent FSM: logged-in profiles survive restarts
+    storage = SQLiteStorage(
+        app_settings.FSM_STORAGE_DB_FILENAME,
+        app_settings.FSM_CACHE_MAX_SESSIONS,
+        app_settings.FSM_STORAGE_FLUSH_DELAY_S,
+    )
+    # Updates of one user are handled one at a time; the session reaper
+    # takes the same per-key lock before interrupting an idle test
+    events_isolation = SimpleEventIsolation()
+    dp = Dispatcher(storage=storage, events_isolation=events_isolation)
+    # Last user activity per session, for the idle test reaper
+    dp.update.outer_middleware(session_activity)
+    session_activity.seed(storage.keys_with_state())
 
     dp.include_router(common_handlers.router)
     dp.include_router(corsi_handlers.router)
@@ -269,6 +309,43 @@ async def main():
     dp.include_router(mental_rotation_handlers.router)
     dp.include_router(raven_matrices_handlers.router)
 
+    # Pillow rendering/encoding of per-trial images in worker processes
+    render_service.start()
+
+    # Single writer for all result/profile mutations + write-behind flushing
+    start_persistence_worker()
+    results_flusher_task = asyncio.create_task(run_results_flusher())
+    # New file_ids are written to disk in the background, not per upload
+    background_tasks = [asyncio.create_task(run_file_id_cache_saver())]
+    # Pre-upload stimulus images in the background; handlers fall back to
+    # uploading (and caching) anything not warmed up yet
+    if bot_config.ASSET_STORAGE_CHAT_ID:
+        background_tasks.append(
+            asyncio.create_task(
+                warmup_file_ids(
+                    bot,
+                    bot_config.ASSET_STORAGE_CHAT_ID,
+                    stimulus_assets(),
+                )
+            )
+        )
+    session_reaper_task = asyncio.create_task(
+        run_session_reaper(
+            storage,
+            events_isolation,
+            bot,
+            common_handlers.test_idle_ttl,
+            common_handlers.interrupt_idle_test,
+            app_settings.SESSION_REAPER_INTERVAL_S,
+            app_settings.SESSION_IDLE_TTL_S,
+            min(
+                app_settings.SESSION_IDLE_TTL_S,
+                app_settings.TEST_IDLE_TTL_DEFAULT_S,
+                *app_settings.TEST_IDLE_TTL_S.values(),
+            ),
+        )
+    )
+
     await bot.delete_webhook(drop_pending_updates=True)
     logger.info("Запуск поллинга...")
     try:
@@ -277,6 +354,22 @@ async def main():
         logger.critical(f"Ошибка поллинга: {e}", exc_info=True)
     finally:
         logger.info("Остановка бота и закрытие сессии...")
+        background_tasks += [results_flusher_task, session_reaper_task]
+        for background_task in background_tasks:
+            background_task.cancel()
+            try:
+                await background_task
+            except asyncio.CancelledError:
+                pass
+        # Stop test timers first: their cleanup may still queue result saves
+        await session_tasks.shutdown()
+        # Drain queued writes, then a final flush so nothing buffered is lost
+        await stop_persistence_worker()
+        if flush_results_store():
+            logger.info("Несохранённые результаты записаны в Excel.")
+        render_service.shutdown()
+        await asyncio.to_thread(file_id_cache.save)
+        await storage.close()
         await bot.session.close()
         logger.info("Сессия бота закрыта.")
 
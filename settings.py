@@ -4,7 +4,14 @@ import os
 # --- Excel Settings ---
 EXCEL_FILENAME = "persistent_user_data.xlsx"
 
-BASE_HEADERS = ["Telegram ID", "Unique ID", "Name", "Age"]
+REGISTERED_AT_HEADER = "Registered At"  # ISO дата-время регистрации
+BASE_HEADERS = [
+    "Telegram ID",
+    "Unique ID",
+    "Name",
+    "Age",
+    REGISTERED_AT_HEADER,
+]
 CORSI_HEADERS = [
     "Corsi - Max Correct Sequence Length",
     "Corsi - Avg Time Per Element (s)",
@@ -58,6 +65,121 @@ ALL_EXPECTED_HEADERS = (
     + RAVEN_MATRICES_HEADERS
 )
 
+RESULT_HEADER_GROUPS = {
+    "corsi": CORSI_HEADERS,
+    "stroop": STROOP_HEADERS,
+    "reaction_time": REACTION_TIME_HEADERS,
+    "verbal_fluency": VERBAL_FLUENCY_HEADERS,
+    "mental_rotation": MENTAL_ROTATION_HEADERS,
+    "raven_matrices": RAVEN_MATRICES_HEADERS,
+}
+
+# --- Storage Backend ---
+# "excel": живые данные в EXCEL_FILENAME.
+# "sqlite": живые данные в SQLITE_DB_FILENAME (WAL); /export строит
+# файл из БД. При первом запуске существующий EXCEL_FILENAME
+# импортируется в пустую БД.
+# "excel_sharded": живые данные в нескольких файлах RESULTS_SHARD_DIR,
+# по периодам регистрации длиной RESULTS_SHARD_PERIOD_MONTHS месяцев
+# (строки без даты регистрации - в отдельном шарде); список файлов в
+# RESULTS_SHARD_MANIFEST. /export объединяет шарды. При первом запуске
+# EXCEL_FILENAME разбивается на шарды.
+RESULTS_BACKEND = "excel"
+SQLITE_DB_FILENAME = "persistent_user_data.db"
+RESULTS_SHARD_DIR = "data_shards"
+RESULTS_SHARD_MANIFEST = os.path.join(RESULTS_SHARD_DIR, "manifest.json")
+RESULTS_SHARD_PERIOD_MONTHS = 3
+
+# --- Results Store Settings ---
+# Данные держатся в памяти и сбрасываются в EXCEL_FILENAME пакетно:
+# раз в RESULTS_FLUSH_INTERVAL_S секунд или сразу при накоплении
+# RESULTS_FLUSH_DIRTY_ROWS изменённых строк.
+RESULTS_FLUSH_INTERVAL_S = 10
+RESULTS_FLUSH_DIRTY_ROWS = 20
+RESULTS_FLUSH_CHECK_INTERVAL_S = 1
+# Каждое изменение сначала пишется (с fsync) в журнал; после успешного
+# сброса в EXCEL_FILENAME журнал очищается, при запуске его хвост
+# воспроизводится. Не используется с RESULTS_BACKEND = "sqlite".
+RESULTS_JOURNAL_FILENAME = "persistent_user_data.journal.jsonl"
+
+# --- UID Allocation ---
+# UID выдаются из сохранённого счётчика (UID_ALLOCATOR_FILENAME); каждый
+# процесс резервирует блок из UID_BLOCK_SIZE значений под файловой
+# блокировкой. UID служат кодами входа, поэтому счётчик переводится в UID
+# секретной перестановкой (ключ хранится в том же файле): по одному UID
+# нельзя вычислить другие. Формат: 7-значные числа из [UID_MIN, UID_MAX].
+UID_ALLOCATOR_FILENAME = "persistent_user_data.uid.json"
+UID_BLOCK_SIZE = 100
+UID_MIN = 1000000
+UID_MAX = 9999999
+
+# --- Trial-Level Data ---
+# Попытки (UID, номер, стимул, верность, RT в float32) дописываются в
+# бинарные файлы <тест>.trials.bin; загрузка в NumPy: utils.trial_store.
+TRIALS_DIR = "trials_data"
+
+# --- Norms ---
+# Возрастные группы (включительно) для перцентилей в /mydata; группа
+# или метрика показывается, только если в ней не меньше
+# NORMS_MIN_SAMPLE_SIZE участников.
+NORMS_AGE_BANDS = [(0, 17), (18, 29), (30, 44), (45, 59), (60, 120)]
+NORMS_MIN_SAMPLE_SIZE = 5
+
+# --- FSM Storage ---
+# Состояния и данные FSM (активный профиль, прогресс теста) хранятся в
+# SQLite и переживают перезапуск бота. В памяти держатся не более
+# FSM_CACHE_MAX_SESSIONS недавно активных сессий, остальные
+# подгружаются из БД по запросу.
+# Изменения пишутся в БД отложенно, одной транзакцией в отдельном потоке
+# через FSM_STORAGE_FLUSH_DELAY_S секунд после первого изменения (при
+# падении процесса теряются изменения только за этот интервал).
+FSM_STORAGE_DB_FILENAME = "fsm_storage.db"
+FSM_CACHE_MAX_SESSIONS = 1000
+FSM_STORAGE_FLUSH_DELAY_S = 0.2
+
+# --- Idle Sessions ---
+# Тест без действий пользователя дольше своего TEST_IDLE_TTL_S (ключ -
+# тест из TEST_REGISTRY, иначе TEST_IDLE_TTL_DEFAULT_S) прерывается:
+# результаты сохраняются как прерванные, UI и фоновые задачи очищаются,
+# остаётся только профиль. Сессии вне теста выгружаются из памяти после
+# SESSION_IDLE_TTL_S. Проверка раз в SESSION_REAPER_INTERVAL_S секунд.
+SESSION_REAPER_INTERVAL_S = 60
+SESSION_IDLE_TTL_S = 30 * 60
+TEST_IDLE_TTL_DEFAULT_S = 15 * 60
+TEST_IDLE_TTL_S = {
+    "initiate_corsi_test": 10 * 60,
+    "initiate_stroop_test": 10 * 60,
+    "initiate_reaction_time_test": 10 * 60,
+    "initiate_verbal_fluency_test": 10 * 60,
+    "initiate_mental_rotation_test": 15 * 60,
+    "initiate_raven_matrices_test": 20 * 60,
+}
+
+# --- Running Result Statistics (/stats) ---
+# Счётчик, среднее, дисперсия и оценки p50/p90/p99 по каждому числовому
+# результату обновляются при каждом сохранении и сохраняются в этот файл
+# вместе со сбросом данных.
+RESULT_STATS_FILENAME = "persistent_user_data.stats.json"
+
+# --- Telegram file_id Cache ---
+# Первая отправка изображения стимула загружает файл, полученный file_id
+# (по SHA-1 содержимого и ID бота) сохраняется сюда; дальше картинка
+# отправляется по file_id без повторной загрузки.
+FILE_ID_CACHE_FILENAME = "telegram_file_ids.json"
+# Файл перезаписывается в фоне не чаще раза в FILE_ID_CACHE_SAVE_INTERVAL_S
+# секунд (и при остановке бота). file_id разовых изображений (коллажи MR)
+# не сохраняются: они держатся в памяти, не более
+# FILE_ID_CACHE_TRANSIENT_MAX_ENTRIES последних.
+FILE_ID_CACHE_SAVE_INTERVAL_S = 30
+FILE_ID_CACHE_TRANSIENT_MAX_ENTRIES = 1024
+# Прогрев при запуске (если в .env задан ASSET_STORAGE_CHAT_ID): все
+# изображения RT, MR, Равена и Струпа без file_id один раз загружаются
+# в этот служебный чат. Не более WARMUP_CONCURRENCY загрузок одновременно,
+# отправки не чаще раза в WARMUP_MIN_SEND_INTERVAL_S секунд.
+WARMUP_CONCURRENCY = 4
+WARMUP_MIN_SEND_INTERVAL_S = 1.0
+WARMUP_MAX_ATTEMPTS = 3
+
 # --- Stroop Test Constants ---
 STROOP_COLORS_DEF = {
     "Красный": {"rgb": (220, 20, 60), "name": "КРАСНЫЙ", "emoji": "🟥"},
@@ -69,6 +191,10 @@ STROOP_COLORS_DEF = {
 STROOP_COLOR_NAMES = list(STROOP_COLORS_DEF.keys())
 STROOP_ITERATIONS_PER_PART = 6
 STROOP_FONT_PATH = "arial.ttf"  # Make sure this font is available
+# Каталоги, где сначала ищутся шрифты по относительному имени (шрифты,
+# поставляемые вместе с ботом); затем системные шрифты, затем шрифт
+# Pillow по умолчанию. Поиск выполняется один раз на имя шрифта.
+FONT_SEARCH_DIRS = ["fonts"]
 STROOP_IMAGE_SIZE = (300, 150)
 STROOP_TEXT_COLOR_ON_PATCH = (255, 255, 255)
 STROOP_INSTRUCTION_TEXT_PART1 = (
@@ -144,8 +270,25 @@ MR_ALL_DISTRACTORS_FILES: list[str] = []
 
 MR_COLLAGE_CELL_SIZE = (250, 250)
 MR_COLLAGE_BG_COLOR = (255, 255, 255)
+# Уменьшенные до MR_COLLAGE_CELL_SIZE изображения и готовые коллажи (PNG)
+# кэшируются в памяти (LRU) в пределах этих объёмов, байт.
+MR_THUMBNAIL_CACHE_MAX_BYTES = 64 * 1024 * 1024
+MR_COLLAGE_CACHE_MAX_BYTES = 16 * 1024 * 1024
 MR_FEEDBACK_DISPLAY_TIME_S = 0.75
 
+# --- Image Rendering ---
+# Отрисовка и PNG-кодирование (коллажи MR, стимулы Струпа) выполняются в
+# пуле из RENDER_POOL_WORKERS процессов (0 - в потоке процесса бота).
+# Не более RENDER_MAX_PENDING_JOBS задач одновременно, остальные ждут
+# своей очереди; задача дольше RENDER_JOB_TIMEOUT_S секунд считается
+# неудавшейся.
+RENDER_POOL_WORKERS = max(1, (os.cpu_count() or 2) - 1)
+RENDER_MAX_PENDING_JOBS = 32
+RENDER_JOB_TIMEOUT_S = 10
+# Кэш уменьшенных изображений MR в каждом процессе пула, байт
+# (0 - без кэша; всего до RENDER_POOL_WORKERS * этот объём).
+RENDER_WORKER_THUMBNAIL_CACHE_MAX_BYTES = 16 * 1024 * 1024
+
 
 # --- Raven Matrices Test Constants ---
 RAVEN_NUM_TASKS_TO_PRESENT = 20
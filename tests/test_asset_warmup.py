@@ -0,0 +1,139 @@
+# tests/test_asset_warmup.py
+import asyncio
+import time
+from datetime import datetime
+
+import pytest
+
+pytest.importorskip("aiogram")
+
+from aiogram import Bot  # noqa: E402
+from aiogram.client.session.base import BaseSession  # noqa: E402
+from aiogram.exceptions import TelegramRetryAfter  # noqa: E402
+from aiogram.methods import SendPhoto  # noqa: E402
+from aiogram.types import Chat, Message, PhotoSize  # noqa: E402
+
+import utils.asset_warmup as asset_warmup  # noqa: E402
+import utils.file_id_cache as file_id_cache_module  # noqa: E402
+from utils.file_id_cache import FileIdCache  # noqa: E402
+
+TOKEN = "42:TEST"
+STORAGE_CHAT_ID = -100
+INTERVAL_S = 0.05
+RETRY_AFTER_S = 0.2
+
+
+class StubSession(BaseSession):
+    """
+    Answers sendPhoto like the Bot API. The first send of retry_path
+    fails with RetryAfter.
+    """
+
+    def __init__(self, retry_path=None):
+        super().__init__()
+        self.retry_path = retry_path
+        self.sends = []  # (monotonic time, photo path, rate limited)
+
+    async def make_request(self, bot, method, timeout=None):
+        assert isinstance(method, SendPhoto)
+        path = method.photo.path
+        if path == self.retry_path:
+            self.retry_path = None
+            self.sends.append((time.monotonic(), path, True))
+            raise TelegramRetryAfter(
+                method=method,
+                message="Too Many Requests",
+                retry_after=RETRY_AFTER_S,
+            )
+        self.sends.append((time.monotonic(), path, False))
+        n = len(self.sends)
+        return Message(
+            message_id=n,
+            date=datetime.now(),
+            chat=Chat(id=method.chat_id, type="channel"),
+            photo=[
+                PhotoSize(
+                    file_id=f"file-{n}",
+                    file_unique_id=f"u-{n}",
+                    width=1,
+                    height=1,
+                )
+            ],
+        )
+
+    async def stream_content(self, *args, **kwargs):
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    cache = FileIdCache(str(tmp_path / "file_ids.json"), 10)
+    monkeypatch.setattr(file_id_cache_module, "file_id_cache", cache)
+    monkeypatch.setattr(asset_warmup, "file_id_cache", cache)
+    return cache
+
+
+def _images(tmp_path, count):
+    paths = []
+    for i in range(count):
+        path = tmp_path / f"img_{i}.png"
+        path.write_bytes(f"image {i}".encode())
+        paths.append(str(path))
+    return paths
+
+
+def _warmup(session, sources):
+    async def run():
+        bot = Bot(TOKEN, session=session)
+        return await asset_warmup.warmup_file_ids(
+            bot, STORAGE_CHAT_ID, sources, 4, INTERVAL_S
+        )
+
+    return asyncio.run(run())
+
+
+def test_uploads_are_paced_and_cached(tmp_path, cache):
+    paths = _images(tmp_path, 5)
+    duplicate = tmp_path / "copy_of_0.png"
+    duplicate.write_bytes(b"image 0")
+    session = StubSession()
+
+    assert _warmup(session, paths + [str(duplicate)]) == 5
+    times = sorted(t for t, _, _ in session.sends)
+    assert len(times) == 5  # Same content is uploaded once
+    assert all(b - a >= INTERVAL_S * 0.9 for a, b in zip(times, times[1:]))
+    for path in paths:
+        assert cache.get(42, cache.digest_for(path)) is not None
+
+    # Written once, off the send path; a reload sees every file_id
+    assert cache.dirty and cache.save()
+    reloaded = FileIdCache(cache.filename, 10)
+    reloaded.load()
+    assert len(reloaded) == 5
+
+    session = StubSession()
+    assert _warmup(session, paths) == 0
+    assert session.sends == []
+
+
+def test_retry_after_pauses_all_senders(tmp_path, cache):
+    paths = _images(tmp_path, 4)
+    session = StubSession(retry_path=paths[0])
+
+    assert _warmup(session, paths) == 4
+    limited_at = next(t for t, _, limited in session.sends if limited)
+    later = [t for t, _, _ in session.sends if t > limited_at]
+    assert later and min(later) - limited_at >= RETRY_AFTER_S * 0.9
+    uploaded = [path for _, path, limited in session.sends if not limited]
+    assert sorted(uploaded) == sorted(paths)  # The limited one is retried
+    assert len(cache) == 4
+
+
+def test_unreadable_file_is_skipped(tmp_path, cache):
+    paths = _images(tmp_path, 2)
+    session = StubSession()
+    assert _warmup(session, paths + [str(tmp_path / "missing.png")]) == 2
+    assert len(session.sends) == 2
@@ -0,0 +1,27 @@
+# tests/test_bot_helpers.py
+import pytest
+
+pytest.importorskip("aiogram")
+
+from utils.bot_helpers import split_message_text  # noqa: E402
+
+
+def test_short_text_is_one_message():
+    assert split_message_text(["a", "", "b"]) == ["a\n\nb"]
+
+
+def test_lines_are_never_split_between_messages():
+    lines = [f"<b>metric {i}:</b> " + "x" * 40 for i in range(300)]
+    chunks = split_message_text(lines)
+    assert len(chunks) > 1
+    assert all(len(chunk) <= 4096 for chunk in chunks)
+    assert "\n".join(chunks).split("\n") == lines
+
+
+def test_overlong_line_is_cut():
+    assert split_message_text(["ab", "x" * 7, "c"], max_len=3) == [
+        "ab",
+        "xxx",
+        "xxx",
+        "x\nc",
+    ]
@@ -0,0 +1,59 @@
+# tests/test_excel_handler.py
+import asyncio
+import threading
+
+import pytest
+
+openpyxl = pytest.importorskip("openpyxl")
+
+from utils import excel_handler  # noqa: E402
+from utils.results_store import ExcelResultsStore  # noqa: E402
+
+CORSI = "Corsi - Max Correct Sequence Length"
+OTHER = "Stroop Part2 Time (s)"
+
+
+def _install_store(tmp_path, monkeypatch, rows):
+    path = tmp_path / "results.xlsx"
+    wb = openpyxl.Workbook()
+    wb.active.append(["Unique ID", CORSI, OTHER])
+    for row in rows:
+        wb.active.append(row)
+    wb.save(path)
+    store = ExcelResultsStore(str(path), 60, 100)
+    store.load()
+    monkeypatch.setattr(excel_handler, "_results_store", store)
+    monkeypatch.setattr(excel_handler, "_completion_bits", {})
+    return store
+
+
+def test_bitmap_and_row_checks_agree_on_empty_values(tmp_path, monkeypatch):
+    _install_store(tmp_path, monkeypatch, [[1001, "", ""], [1002, 5, 1.5]])
+
+    async def run():
+        check = excel_handler.check_if_results_exist_generic
+        return [
+            await check(1001, CORSI),  # Served by the completion bitmap
+            await check(1001, OTHER),  # Served by the row itself
+            await check(1002, CORSI),
+            await check(1002, OTHER),
+        ]
+
+    assert asyncio.run(run()) == [False, False, True, True]
+
+
+def test_first_load_from_a_coroutine_runs_off_the_loop(monkeypatch):
+    loader_threads = []
+
+    def fake_get_results_store():
+        loader_threads.append(threading.get_ident())
+        return "store"
+
+    monkeypatch.setattr(excel_handler, "_results_store", None)
+    monkeypatch.setattr(excel_handler, "get_results_store", fake_get_results_store)
+
+    async def run():
+        return await excel_handler.get_results_store_async()
+
+    assert asyncio.run(run()) == "store"
+    assert loader_threads and loader_threads[0] != threading.get_ident()
@@ -0,0 +1,129 @@
+# tests/test_export.py
+import csv
+import gzip
+import os
+from datetime import date
+
+import pytest
+
+openpyxl = pytest.importorskip("openpyxl")
+
+from settings import (  # noqa: E402
+    ALL_EXPECTED_HEADERS,
+    BASE_HEADERS,
+    CORSI_HEADERS,
+    REGISTERED_AT_HEADER,
+)
+from utils import excel_handler  # noqa: E402
+from utils.export import (  # noqa: E402
+    ExportOptions,
+    parse_export_args,
+    write_export,
+)
+from utils.sharded_store import ShardedExcelResultsStore  # noqa: E402
+
+CORSI_MAX = CORSI_HEADERS[0]
+
+
+def test_parse_export_args_defaults_and_all_options():
+    assert parse_export_args(None) == ExportOptions()
+    assert parse_export_args(
+        "CSV.GZ tests=corsi,Stroop from=2025-01-01 to=2025-03-31"
+    ) == ExportOptions(
+        fmt="csv.gz",
+        tests=["corsi", "stroop"],
+        registered_from=date(2025, 1, 1),
+        registered_to=date(2025, 3, 31),
+    )
+
+
+@pytest.mark.parametrize(
+    "args",
+    ["pdf", "tests=chess", "tests=", "from=2025-13-01", "limit=5"],
+)
+def test_parse_export_args_rejects_bad_input(args):
+    with pytest.raises(ValueError):
+        parse_export_args(args)
+
+
+def _sharded_store(tmp_path):
+    # Three registration periods -> three shard files, one merged snapshot
+    store = ShardedExcelResultsStore(
+        str(tmp_path / "shards"),
+        str(tmp_path / "shards" / "manifest.json"),
+        "results",
+        ALL_EXPECTED_HEADERS,
+        3,
+        3600,
+        1000,
+    )
+    store.load()
+    rows = [
+        ("1000001", "2025-01-15T10:00:00", 5),
+        ("1000002", "2025-04-02T09:00:00", None),
+        ("1000003", "2025-07-20T18:30:00", 7),
+        ("1000004", None, 4),  # Registered before dates were recorded
+    ]
+    for uid, registered_at, corsi in rows:
+        store.append_row(
+            {
+                "Unique ID": uid,
+                "Name": f"user {uid}",
+                REGISTERED_AT_HEADER: registered_at,
+                CORSI_MAX: corsi,
+            }
+        )
+    store.flush()
+    return store
+
+
+def _read_csv(path, compressed):
+    opener = gzip.open if compressed else open
+    with opener(path, "rt", encoding="utf-8-sig", newline="") as f:
+        return list(csv.reader(f))
+
+
+def test_csv_export_merges_shards_and_filters_tests_and_dates(tmp_path):
+    store = _sharded_store(tmp_path)
+    options = parse_export_args("csv.gz tests=corsi from=2025-02-01")
+    path, count = write_export(store, options)
+    try:
+        header, *rows = _read_csv(path, compressed=True)
+    finally:
+        os.remove(path)
+    assert header == BASE_HEADERS + CORSI_HEADERS
+    # 1000001 is too early, 1000002 has no Corsi result, 1000004 no date
+    assert count == 1 and [row[1] for row in rows] == ["1000003"]
+    assert rows[0][header.index(CORSI_MAX)] == "7"
+
+
+def test_xlsx_export_keeps_every_row_and_numeric_uids(tmp_path):
+    store = _sharded_store(tmp_path)
+    path, count = write_export(store, ExportOptions())
+    try:
+        wb = openpyxl.load_workbook(path, read_only=True)
+        rows = list(wb.active.iter_rows(values_only=True))
+        wb.close()
+    finally:
+        os.remove(path)
+    assert list(rows[0]) == ALL_EXPECTED_HEADERS
+    assert count == 4
+    assert sorted(row[1] for row in rows[1:]) == [
+        1000001, 1000002, 1000003, 1000004
+    ]
+
+
+def test_build_export_file_uses_the_live_store(tmp_path, monkeypatch):
+    monkeypatch.setattr(excel_handler, "_results_store", _sharded_store(tmp_path))
+    path, count = excel_handler.build_export_file(parse_export_args("csv"))
+    try:
+        assert path.endswith(".csv") and count == 4
+        assert len(_read_csv(path, compressed=False)) == 5
+    finally:
+        os.remove(path)
+
+
+def test_build_export_file_reports_failure_as_none(tmp_path, monkeypatch):
+    monkeypatch.setattr(excel_handler, "_results_store", _sharded_store(tmp_path))
+    options = ExportOptions(fmt="csv", tests=["no_such_test"])
+    assert excel_handler.build_export_file(options) is None
@@ -0,0 +1,127 @@
+# tests/test_file_id_cache.py
+import asyncio
+import os
+import time
+
+import pytest
+
+pytest.importorskip("aiogram")
+
+from aiogram.enums import ChatType  # noqa: E402
+from aiogram.types import Chat, FSInputFile, Message, PhotoSize  # noqa: E402
+
+from utils import file_id_cache as cache_module  # noqa: E402
+from utils.file_id_cache import FileIdCache, send_photo_cached  # noqa: E402
+
+
+def _cache(tmp_path, transient_max_entries=2):
+    return FileIdCache(str(tmp_path / "file_ids.json"), transient_max_entries)
+
+
+def _rewrite(path, data):
+    # Bump mtime explicitly: coarse filesystem clocks may not change it
+    mtime_ns = os.stat(path).st_mtime_ns + 1_000_000_000
+    with open(path, "wb") as f:
+        f.write(data)
+    os.utime(path, ns=(mtime_ns, mtime_ns))
+
+
+def test_persisted_entries_round_trip_per_bot(tmp_path):
+    cache = _cache(tmp_path)
+    cache.put(1, "abc", "file-for-bot-1")
+    cache.put(2, "abc", "file-for-bot-2")
+    cache.put(1, "one-off", "collage", persist=False)
+    assert cache.save()
+    assert not cache.save()  # Nothing changed since
+
+    reloaded = _cache(tmp_path)
+    reloaded.load()
+    assert len(reloaded) == 2 and not reloaded.dirty
+    assert reloaded.get(1, "abc") == "file-for-bot-1"
+    assert reloaded.get(2, "abc") == "file-for-bot-2"
+    assert reloaded.get(3, "abc") is None  # file_ids belong to one bot
+    assert reloaded.get(1, "one-off") is None  # Transient, never saved
+
+    reloaded.forget(2, "abc")
+    assert reloaded.dirty and reloaded.save()
+    again = _cache(tmp_path)
+    again.load()
+    assert again.get(2, "abc") is None and again.get(1, "abc")
+
+
+def test_transient_entries_are_a_bounded_lru(tmp_path):
+    cache = _cache(tmp_path, transient_max_entries=2)
+    for digest in ("a", "b"):
+        cache.put(1, digest, f"id-{digest}", persist=False)
+    cache.get(1, "a")  # Most recently used now
+    cache.put(1, "c", "id-c", persist=False)
+    assert cache.get(1, "a") == "id-a" and cache.get(1, "b") is None
+    assert not cache.dirty and len(cache) == 0
+
+
+def test_corrupt_file_starts_empty(tmp_path):
+    cache = _cache(tmp_path)
+    with open(cache.filename, "w", encoding="utf-8") as f:
+        f.write("{not json")
+    cache.load()
+    assert len(cache) == 0
+
+
+def test_changed_file_gets_a_new_digest(tmp_path):
+    cache = _cache(tmp_path)
+    path = tmp_path / "stimulus.png"
+    path.write_bytes(b"first")
+    digest = cache.digest_for_path(str(path))
+    assert digest == cache.digest_for_bytes(b"first")
+    cache.put(1, digest, "old-file-id")
+
+    _rewrite(str(path), b"second")
+    new_digest = cache.digest_for_path(str(path))
+    assert new_digest == cache.digest_for_bytes(b"second")
+    assert cache.get(1, new_digest) is None  # Uploaded again, not reused
+
+
+class _FakeBot:
+    id = 42
+
+    def __init__(self):
+        self.sent = []
+
+    async def send_photo(self, chat_id, photo, **kwargs):
+        self.sent.append(photo)
+        file_id = photo if isinstance(photo, str) else f"upload-{len(self.sent)}"
+        return Message(
+            message_id=len(self.sent),
+            date=int(time.time()),
+            chat=Chat(id=chat_id, type=ChatType.PRIVATE),
+            photo=[
+                PhotoSize(
+                    file_id=file_id,
+                    file_unique_id=file_id,
+                    width=1,
+                    height=1,
+                )
+            ],
+        )
+
+
+def test_send_photo_cached_reuses_file_id_until_the_file_changes(
+    tmp_path, monkeypatch
+):
+    cache = _cache(tmp_path)
+    monkeypatch.setattr(cache_module, "file_id_cache", cache)
+    path = tmp_path / "stimulus.png"
+    path.write_bytes(b"first")
+    bot = _FakeBot()
+
+    async def run():
+        for _ in range(2):
+            await send_photo_cached(bot, 7, str(path))
+        _rewrite(str(path), b"second")
+        await send_photo_cached(bot, 7, str(path))
+
+    asyncio.run(run())
+    assert isinstance(bot.sent[0], FSInputFile)
+    assert bot.sent[1] == "upload-1"
+    assert isinstance(bot.sent[2], FSInputFile)
+    assert cache.get(42, cache.digest_for_bytes(b"second")) == "upload-3"
@@ -0,0 +1,156 @@
+# tests/test_fsm_storage.py
+import asyncio
+import sqlite3
+import threading
+
+import pytest
+
+pytest.importorskip("aiogram")
+
+from aiogram.fsm.storage.base import StorageKey  # noqa: E402
+
+from utils.fsm_storage import FSM_TABLE, SQLiteStorage  # noqa: E402
+from utils.test_sessions import CorsiSession  # noqa: E402
+
+KEY = StorageKey(bot_id=1, chat_id=10, user_id=10)
+OTHER_KEY = StorageKey(bot_id=1, chat_id=20, user_id=20, thread_id=5)
+
+
+def _rows(path):
+    with sqlite3.connect(path) as conn:
+        return dict(
+            conn.execute(f"SELECT key, state FROM {FSM_TABLE}").fetchall()
+        )
+
+
+def test_round_trip_survives_reopen(tmp_path):
+    path = str(tmp_path / "fsm.db")
+
+    async def write():
+        storage = SQLiteStorage(path, 10, 60)
+        await storage.set_state(KEY, "Test:running")
+        session = CorsiSession(chat_id=10, correct_sequence=[1, 2, 3])
+        await storage.set_data(KEY, {"active_unique_id": 42, **session.as_fsm_data()})
+        await storage.close()  # Flushes the pending writes
+
+    async def read():
+        storage = SQLiteStorage(path, 10, 60)
+        state = await storage.get_state(KEY)
+        data = await storage.get_data(KEY)
+        keys = storage.keys_with_state()
+        await storage.close()
+        return state, data, keys
+
+    asyncio.run(write())
+    state, data, keys = asyncio.run(read())
+    assert state == "Test:running"
+    assert data["active_unique_id"] == 42
+    assert CorsiSession.from_fsm(data).correct_sequence == [1, 2, 3]
+    assert keys == [KEY]
+
+
+def test_writes_are_batched_after_the_delay(tmp_path):
+    path = str(tmp_path / "fsm.db")
+
+    async def run():
+        storage = SQLiteStorage(path, 10, 0.05)
+        await storage.set_state(KEY, "A")
+        await storage.set_state(OTHER_KEY, "B")
+        await storage.set_data(KEY, {"x": 1})
+        before = _rows(path)
+        cached = await storage.get_data(KEY)
+        await asyncio.sleep(0.2)
+        after = _rows(path)
+        await storage.close()
+        return before, cached, after
+
+    before, cached, after = asyncio.run(run())
+    assert before == {}  # Nothing written on the loop
+    assert cached == {"x": 1}
+    assert sorted(after.values()) == ["A", "B"]
+
+
+def test_cleared_session_row_is_deleted(tmp_path):
+    path = str(tmp_path / "fsm.db")
+
+    async def run():
+        storage = SQLiteStorage(path, 10, 60)
+        await storage.set_state(KEY, "A")
+        await storage.set_data(KEY, {"x": 1})
+        await storage.flush()
+        written = _rows(path)
+        await storage.set_state(KEY, None)
+        await storage.set_data(KEY, {})
+        await storage.flush()
+        await storage.close()
+        return written
+
+    assert len(asyncio.run(run())) == 1
+    assert _rows(path) == {}
+
+
+def test_released_dirty_session_is_not_lost(tmp_path):
+    path = str(tmp_path / "fsm.db")
+
+    async def run():
+        storage = SQLiteStorage(path, 1, 60)
+        await storage.set_data(KEY, {"x": 1})
+        assert not storage.release(KEY)  # Write still pending
+        await storage.get_data(OTHER_KEY)  # Would evict KEY if it were clean
+        data = await storage.get_data(KEY)
+        await storage.flush()
+        assert storage.release(KEY)
+        reloaded = await storage.get_data(KEY)
+        await storage.close()
+        return data, reloaded
+
+    assert asyncio.run(run()) == ({"x": 1}, {"x": 1})
+
+
+def test_cache_misses_are_read_off_the_loop(tmp_path):
+    path = str(tmp_path / "fsm.db")
+
+    async def run():
+        storage = SQLiteStorage(path, 10, 60)
+        await storage.set_data(KEY, {"x": 1})
+        await storage.flush()
+        assert storage.release(KEY)
+
+        reader_threads = []
+        read_row = storage._read_row
+
+        def tracking_read_row(db_key):
+            reader_threads.append(threading.get_ident())
+            return read_row(db_key)
+
+        storage._read_row = tracking_read_row
+        data = await storage.get_data(KEY)
+        await storage.get_data(KEY)  # Cached now
+        await storage.close()
+        return data, reader_threads
+
+    data, reader_threads = asyncio.run(run())
+    assert data == {"x": 1}
+    assert len(reader_threads) == 1
+    assert reader_threads[0] != threading.get_ident()
+
+
+def test_unpicklable_values_stay_in_memory(tmp_path):
+    path = str(tmp_path / "fsm.db")
+
+    async def run():
+        storage = SQLiteStorage(path, 10, 60)
+        task = asyncio.ensure_future(asyncio.sleep(0))
+        await storage.set_data(KEY, {"task": task, "x": 1})
+        await storage.flush()
+        assert not storage.release(KEY)  # Pinned by the task
+        assert (await storage.get_data(KEY))["task"] is task
+        await task
+        await storage.close()
+
+        storage = SQLiteStorage(path, 10, 60)
+        data = await storage.get_data(KEY)
+        await storage.close()
+        return data
+
+    assert asyncio.run(run()) == {"x": 1}
@@ -0,0 +1,122 @@
+# tests/test_norms.py
+import pytest
+
+pytest.importorskip("numpy")
+
+from utils.norms import NORMS_HEADERS, NormsEngine  # noqa: E402
+
+AGE_BANDS = [(18, 30), (31, 60)]
+CORSI = "Corsi - Max Correct Sequence Length"
+RT = "ReactionTime_Time_ms"
+
+
+def _engine(rows, min_sample_size=3):
+    engine = NormsEngine(AGE_BANDS, min_sample_size)
+    engine.load(
+        [tuple(row.get(h) for h in NORMS_HEADERS) for row in rows],
+        NORMS_HEADERS,
+    )
+    return engine
+
+
+def _by_key(engine, uid):
+    return {p.metric.key: p for p in engine.percentiles_for(uid)}
+
+
+def test_higher_and_lower_is_better():
+    engine = _engine(
+        [
+            {"Unique ID": 1, "Age": 20, CORSI: 4, RT: 200},
+            {"Unique ID": 2, "Age": 20, CORSI: 5, RT: 300},
+            {"Unique ID": 3, "Age": 20, CORSI: 6, RT: 400},
+            {"Unique ID": 4, "Age": 20, CORSI: 7, RT: 500},
+        ]
+    )
+    top = _by_key(engine, "4")
+    assert top["corsi_span"].percentile == 100.0
+    assert top["corsi_span"].sample_size == 4
+    assert top["reaction_time"].percentile == 0.0  # Slowest
+    assert _by_key(engine, "3")["corsi_span"].percentile == pytest.approx(
+        200 / 3
+    )
+
+
+def test_ties_count_as_half():
+    engine = _engine(
+        [{"Unique ID": uid, CORSI: 5} for uid in (1, 2, 3)]
+        + [{"Unique ID": 4, CORSI: 9}]
+    )
+    # Beats nobody, ties with two of the three others
+    assert _by_key(engine, "1")["corsi_span"].percentile == pytest.approx(
+        100 / 3
+    )
+
+
+def test_interrupted_and_non_numeric_values_are_excluded():
+    engine = _engine(
+        [
+            {"Unique ID": 1, CORSI: 4},
+            {"Unique ID": 2, CORSI: 5},
+            {"Unique ID": 3, CORSI: "N/A"},
+            {"Unique ID": 4, CORSI: 9, "Corsi - Interrupted": "Да"},
+            {"Unique ID": 5, CORSI: 6},
+        ]
+    )
+    assert _by_key(engine, "5")["corsi_span"].sample_size == 3
+    assert engine.percentiles_for("3") == []
+    assert engine.percentiles_for("4") == []
+
+
+def test_stroop_interference_is_part3_minus_part2():
+    engine = _engine(
+        [
+            {
+                "Unique ID": uid,
+                "Stroop Part2 Time (s)": 10.0,
+                "Stroop Part3 Time (s)": 10.0 + delta,
+            }
+            for uid, delta in ((1, 2.0), (2, 4.0), (3, 8.0))
+        ]
+    )
+    best = _by_key(engine, "1")["stroop_interference"]
+    assert best.value == 2.0
+    assert best.percentile == 100.0
+
+
+def test_small_samples_and_age_bands():
+    engine = _engine(
+        [
+            {"Unique ID": 1, "Age": 20, CORSI: 4},
+            {"Unique ID": 2, "Age": 25, CORSI: 5},
+            {"Unique ID": 3, "Age": 40, CORSI: 6},
+        ]
+    )
+    overall = _by_key(engine, "3")["corsi_span"]
+    assert overall.sample_size == 3
+    assert overall.band_label is None  # Only one participant aged 31-60
+    assert overall.band_sample_size == 1
+
+    small = _engine([{"Unique ID": 1, CORSI: 4}, {"Unique ID": 2, CORSI: 5}])
+    assert small.percentiles_for("1") == []
+
+
+def test_update_row_moves_the_participant():
+    engine = _engine(
+        [
+            {"Unique ID": 1, "Age": 20, CORSI: 4},
+            {"Unique ID": 2, "Age": 22, CORSI: 5},
+            {"Unique ID": 3, "Age": 24, CORSI: 6},
+        ]
+    )
+    assert _by_key(engine, "1")["corsi_span"].percentile == 0.0
+
+    engine.update_row("1", {"Unique ID": 1, "Age": 20, CORSI: 8})
+    updated = _by_key(engine, "1")["corsi_span"]
+    assert updated.percentile == 100.0
+    assert updated.sample_size == 3  # Replaced, not added
+    assert updated.band_label == "18–30"
+    assert updated.band_percentile == 100.0
+
+    engine.update_row("4", {"Unique ID": 4, "Age": 50, CORSI: 1})
+    assert _by_key(engine, "4")["corsi_span"].sample_size == 4
+    assert _by_key(engine, "1")["corsi_span"].sample_size == 4
@@ -0,0 +1,38 @@
+# tests/test_render_service.py
+import asyncio
+import threading
+
+import pytest
+
+pytest.importorskip("aiogram")
+
+from utils.image_processors import RenderService  # noqa: E402
+
+
+def _failing_job():
+    raise ValueError("boom")
+
+
+def test_without_pool_jobs_run_inline():
+    service = RenderService(0, 2, 5)
+    service.start()  # workers = 0: stays without a pool
+    caller = threading.get_ident()
+
+    async def run():
+        thread_id = await service.run(threading.get_ident)
+        failed = await service.run(_failing_job)
+        return thread_id, failed
+
+    assert not service.pooled
+    assert asyncio.run(run()) == (caller, None)
+
+
+def test_pool_runs_jobs_in_workers():
+    service = RenderService(1, 2, 30)
+    service.start()
+    try:
+        assert service.pooled
+        assert asyncio.run(service.run(bytes, 3)) == b"\x00\x00\x00"
+    finally:
+        service.shutdown()
+    assert not service.pooled
@@ -0,0 +1,99 @@
+# tests/test_results_journal.py
+from utils.results_journal import ResultsJournal
+
+
+def _replay(journal):
+    records = []
+    journal.replay(records.append)
+    for record in records:
+        record.pop("seq", None)  # Pre-seq journals have none
+    return records
+
+
+def test_append_and_replay_in_order(tmp_path):
+    journal = ResultsJournal(str(tmp_path / "journal.jsonl"))
+    journal.append({"op": "append", "values": {"Unique ID": 1}})
+    journal.append({"op": "update", "uid": "1", "values": {"Name": "A"}})
+    assert [r["op"] for r in _replay(journal)] == ["append", "update"]
+    journal.close()
+
+
+def test_truncate_drops_records(tmp_path):
+    journal = ResultsJournal(str(tmp_path / "journal.jsonl"))
+    journal.append({"op": "append", "values": {"Unique ID": 1}})
+    journal.truncate()
+    assert _replay(journal) == []
+    journal.append({"op": "append", "values": {"Unique ID": 2}})
+    assert _replay(journal) == [{"op": "append", "values": {"Unique ID": 2}}]
+    journal.close()
+
+
+def test_torn_tail_is_cut_before_next_append(tmp_path):
+    path = tmp_path / "journal.jsonl"
+    journal = ResultsJournal(str(path))
+    journal.append({"op": "append", "values": {"Unique ID": 1}})
+    journal.close()
+    with open(path, "ab") as f:
+        f.write(b'{"op": "update", "uid": "1", "val')  # Crash mid-append
+
+    journal = ResultsJournal(str(path))
+    journal.append({"op": "update", "uid": "1", "values": {"Age": 30}})
+    journal.close()
+
+    records = _replay(ResultsJournal(str(path)))
+    assert records == [
+        {"op": "append", "values": {"Unique ID": 1}},
+        {"op": "update", "uid": "1", "values": {"Age": 30}},
+    ]
+
+
+def test_torn_only_record_is_dropped(tmp_path):
+    path = tmp_path / "journal.jsonl"
+    path.write_bytes(b'{"op": "app')
+    journal = ResultsJournal(str(path))
+    assert path.read_bytes() == b""
+    journal.append({"op": "append", "values": {"Unique ID": 7}})
+    assert _replay(journal) == [{"op": "append", "values": {"Unique ID": 7}}]
+    journal.close()
+
+
+def test_corrupt_middle_line_is_skipped(tmp_path):
+    path = tmp_path / "journal.jsonl"
+    path.write_bytes(
+        b'{"op": "append", "values": {}}\n'
+        b"not json\n"
+        b'{"op": "update", "uid": "1", "values": {}}\n'
+    )
+    journal = ResultsJournal(str(path))
+    assert [r["op"] for r in _replay(journal)] == ["append", "update"]
+    journal.close()
+
+
+def test_seq_increases_across_truncate_and_reopen(tmp_path):
+    path = str(tmp_path / "journal.jsonl")
+    journal = ResultsJournal(path)
+    assert journal.append({"op": "append", "values": {}}) == 1
+    assert journal.append({"op": "append", "values": {}}) == 2
+    journal.close()
+
+    journal = ResultsJournal(path)
+    assert journal.last_seq == 2
+    journal.truncate()
+    assert journal.append({"op": "append", "values": {}}) == 3
+    journal.truncate()
+    journal.close()
+
+    journal = ResultsJournal(path)  # Empty: numbering comes from the caller
+    journal.advance_seq(3)
+    assert journal.append({"op": "append", "values": {}}) == 4
+    journal.close()
+
+
+def test_replay_passes_seq(tmp_path):
+    journal = ResultsJournal(str(tmp_path / "journal.jsonl"))
+    journal.append({"op": "append", "values": {}})
+    journal.append({"op": "update", "uid": "1", "values": {}})
+    records = []
+    journal.replay(records.append)
+    assert [r["seq"] for r in records] == [1, 2]
+    journal.close()
@@ -0,0 +1,179 @@
+# tests/test_results_store.py
+import threading
+
+import pytest
+
+openpyxl = pytest.importorskip("openpyxl")
+
+from utils.results_store import ExcelResultsStore  # noqa: E402
+
+HEADERS = ["Unique ID", "Telegram ID", "Name", "Score"]
+
+
+def _workbook(path, rows, headers=HEADERS):
+    wb = openpyxl.Workbook()
+    wb.active.append(headers)
+    for row in rows:
+        wb.active.append(row)
+    wb.save(path)
+
+
+def _read(path):
+    wb = openpyxl.load_workbook(path, read_only=True)
+    try:
+        rows = [list(row) for row in wb.active.iter_rows(values_only=True)]
+    finally:
+        wb.close()
+    width = len(rows[0])  # read_only drops trailing empty cells
+    return [row + [None] * (width - len(row)) for row in rows]
+
+
+def _store(path, flush_interval_s=60, flush_dirty_rows=100):
+    store = ExcelResultsStore(str(path), flush_interval_s, flush_dirty_rows)
+    store.load()
+    return store
+
+
+def test_indexes_are_built_on_load_and_kept_on_append(tmp_path):
+    path = tmp_path / "results.xlsx"
+    _workbook(
+        path,
+        [
+            [1001, 5, "A", 1],
+            [1001, 6, "duplicate", 2],
+            [1002, 5, "B", None],
+        ],
+    )
+    store = _store(path)
+    assert store.get_row("1001")["Name"] == "A"  # First row wins
+    assert store.find_uid_by_telegram_id(5) == "1002"  # Latest row wins
+    store.append_row({"Unique ID": 1003, "Telegram ID": 5, "Unknown": 1})
+    assert store.find_uid_by_telegram_id("5") == "1003"
+    assert "1003" in store.uid_keys()
+    assert store.row_count() == 4
+
+
+def test_flush_writes_changes_once_and_round_trips(tmp_path):
+    path = tmp_path / "results.xlsx"
+    _workbook(path, [[1001, 5, "A", 1]])
+    store = _store(path)
+    assert not store.flush()  # Nothing dirty
+
+    assert store.update_row("1001", {"Score": 7, "Name": ""})
+    assert not store.update_row("9999", {"Score": 1})
+    store.append_row({"Unique ID": 1002, "Name": "B"})
+    assert store.dirty_count == 2
+    assert store.flush()
+    assert store.dirty_count == 0
+    assert not store.flush()
+
+    assert _read(path) == [
+        HEADERS,
+        [1001, 5, None, 7],
+        [1002, None, "B", None],
+    ]
+    assert _store(path).get_row("1002")["Name"] == "B"
+
+
+def test_needs_flush_by_dirty_rows_or_interval(tmp_path):
+    path = tmp_path / "results.xlsx"
+    _workbook(path, [[1001, 5, "A", 1]])
+    store = _store(path, flush_interval_s=60, flush_dirty_rows=2)
+    store.update_row("1001", {"Score": 2})
+    assert not store.needs_flush()
+    store.append_row({"Unique ID": 1002})
+    assert store.needs_flush()
+
+    store = _store(path, flush_interval_s=0, flush_dirty_rows=100)
+    assert not store.needs_flush()  # Interval alone does not flush
+    store.update_row("1001", {"Score": 2})
+    assert store.needs_flush()
+
+
+def test_added_headers_reuse_unnamed_columns(tmp_path):
+    path = tmp_path / "results.xlsx"
+    _workbook(path, [[1001, "A", None, "stray"]], ["Unique ID", "Name"])
+    store = _store(path)
+    assert store.add_headers(["Name", "Score", "Time", "Score"]) == [
+        "Score",
+        "Time",
+    ]
+    assert store.add_headers(["Score"]) == []
+    assert store.needs_flush()
+    store.update_row("1001", {"Score": 3})
+    store.flush()
+    assert _read(path) == [
+        ["Unique ID", "Name", "Score", "Time"],
+        [1001, "A", 3, "stray"],
+    ]
+
+
+def test_rows_are_copy_on_write(tmp_path):
+    path = tmp_path / "results.xlsx"
+    _workbook(path, [[1001, 5, "A", 1], [1002, 6, "B", 2]])
+    store = _store(path)
+    snapshot = store.iter_snapshot(["Unique ID", "Score"])
+    assert next(snapshot) == (1001, 1)
+    store.update_row("1002", {"Score": 99})
+    assert next(snapshot) == (1002, 2)  # Taken before the update
+    assert store.get_row("1002")["Score"] == 99
+
+
+def test_update_during_flush_stays_dirty(tmp_path):
+    path = tmp_path / "results.xlsx"
+    _workbook(path, [[1001, 5, "A", 1]])
+    store = _store(path)
+    store.update_row("1001", {"Score": 2})
+    write_workbook = store._write_workbook
+
+    def write_and_update(headers, rows):
+        store.update_row("1001", {"Score": 3})  # A writer during the flush
+        write_workbook(headers, rows)
+
+    store._write_workbook = write_and_update
+    assert store.flush()
+    assert _read(path)[1][3] == 2  # The snapshot, not the later write
+    assert store.dirty_count == 1
+    store._write_workbook = write_workbook
+    assert store.flush()
+    assert _read(path)[1][3] == 3
+
+
+def test_failed_flush_keeps_rows_dirty(tmp_path):
+    path = tmp_path / "results.xlsx"
+    _workbook(path, [[1001, 5, "A", 1]])
+    store = _store(path)
+    store.update_row("1001", {"Score": 2})
+
+    def fail(headers, rows):
+        raise OSError("disk full")
+
+    write_workbook, store._write_workbook = store._write_workbook, fail
+    with pytest.raises(OSError):
+        store.flush()
+    assert store.dirty_count == 1
+    store._write_workbook = write_workbook
+    assert store.flush()
+    assert _read(path)[1][3] == 2
+
+
+def test_append_racing_add_headers_keeps_rows_full_width(tmp_path):
+    path = tmp_path / "results.xlsx"
+    _workbook(path, [[1001, 5, "A", 1]])
+    store = _store(path)
+
+    class RacingValues(dict):
+        # add_headers() from another thread while append_row builds the row
+        def items(self):
+            adder = threading.Thread(target=store.add_headers, args=(["Extra"],))
+            adder.start()
+            adder.join(timeout=0.2)
+            self.adder = adder
+            return super().items()
+
+    values = RacingValues({"Unique ID": 1003, "Score": 3})
+    store.append_row(values)
+    values.adder.join()
+    assert list(store.iter_snapshot(HEADERS + ["Extra"]))[-1] == (
+        1003, None, None, 3, None
+    )
@@ -0,0 +1,45 @@
+# tests/test_session_encoding.py
+import json
+import marshal
+import pickle
+from dataclasses import fields
+
+import pytest
+
+from utils.test_sessions import (
+    SESSION_FORMAT_VERSION,
+    CorsiSession,
+    VerbalFluencySession,
+)
+
+
+def test_encoding_is_versioned_json():
+    session = CorsiSession(chat_id=10, correct_sequence=[1, 2, 3])
+    version, values = json.loads(session.to_bytes())
+    assert version == SESSION_FORMAT_VERSION
+    assert len(values) == len(fields(CorsiSession))
+
+
+def test_round_trip_keeps_sets_and_nested_values():
+    session = VerbalFluencySession(collected_words={"дом", "дерево"})
+    session.set_profile({"unique_id": "1234567", "name": "Аня", "age": 30})
+    restored = VerbalFluencySession.from_bytes(session.to_bytes())
+    assert restored == session
+    assert isinstance(restored.collected_words, set)
+
+    corsi = CorsiSession(attempts=[{"len": 3, "ok": True, "time": 1.5}])
+    # SQLiteStorage pickles FSM data
+    assert pickle.loads(pickle.dumps(corsi)) == corsi
+
+
+def test_legacy_marshal_blob_is_read():
+    session = CorsiSession(chat_id=10, correct_sequence=[4, 5])
+    legacy = marshal.dumps(
+        tuple(getattr(session, f.name) for f in fields(session))
+    )
+    assert CorsiSession.from_bytes(legacy) == session
+
+
+def test_unknown_version_is_rejected():
+    with pytest.raises(ValueError):
+        CorsiSession.from_bytes(b"[999,[]]")
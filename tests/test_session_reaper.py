@@ -0,0 +1,153 @@
+# tests/test_session_reaper.py
+import asyncio
+import time
+
+import pytest
+
+pytest.importorskip("aiogram")
+
+from aiogram.fsm.context import FSMContext  # noqa: E402
+from aiogram.fsm.storage.base import StorageKey  # noqa: E402
+from aiogram.fsm.storage.memory import SimpleEventIsolation  # noqa: E402
+
+from utils import session_reaper  # noqa: E402
+from utils.fsm_storage import SQLiteStorage  # noqa: E402
+from utils.session_reaper import SessionActivity  # noqa: E402
+from utils.session_tasks import SessionTaskRegistry  # noqa: E402
+
+IDLE_TTL_S = 100.0
+TEST_TTL_S = 10.0
+TEST_STATE = "CorsiTestStates:showing_sequence"
+
+
+def _key(chat_id):
+    return StorageKey(bot_id=1, chat_id=chat_id, user_id=chat_id)
+
+
+def _test_idle_ttl(fsm_state):
+    return TEST_TTL_S if fsm_state == TEST_STATE else None
+
+
+@pytest.fixture
+def activity(monkeypatch):
+    activity = SessionActivity()
+    monkeypatch.setattr(session_reaper, "session_activity", activity)
+    return activity
+
+
+def _idle(activity, key, idle_s):
+    activity._last_seen[key] = time.monotonic() - idle_s
+
+
+async def _storage(path, states):
+    storage = SQLiteStorage(str(path), 10, 60)
+    for key, fsm_state in states.items():
+        await storage.set_state(key, fsm_state)
+    await storage.flush()  # Dirty sessions are never released
+    return storage
+
+
+def test_expired_test_is_interrupted_and_its_tasks_cancelled(tmp_path, activity):
+    expired, fresh = _key(1), _key(2)
+
+    async def run():
+        storage = await _storage(
+            tmp_path / "fsm.db", {expired: TEST_STATE, fresh: TEST_STATE}
+        )
+        registry, interrupted = SessionTaskRegistry(), []
+
+        async def interrupt_test(state, bot):
+            interrupted.append(state.key)
+            await registry.cancel_all(state)
+            await state.set_state(None)
+
+        tasks = {}
+        for key in (expired, fresh):
+            state = FSMContext(storage=storage, key=key)
+            tasks[key] = await registry.start(state, "timer", asyncio.sleep(60))
+        _idle(activity, expired, TEST_TTL_S + 1)
+        _idle(activity, fresh, TEST_TTL_S - 1)
+
+        count = await session_reaper.reap_idle_sessions(
+            storage,
+            SimpleEventIsolation(),
+            object(),
+            _test_idle_ttl,
+            interrupt_test,
+            IDLE_TTL_S,
+            min_idle_s=1,
+        )
+        assert count == 1 and interrupted == [expired]
+        assert tasks[expired].cancelled() and not tasks[fresh].done()
+        assert await storage.get_state(expired) is None
+        assert await storage.get_state(fresh) == TEST_STATE
+        assert activity.idle_sessions(0).keys() == {fresh}
+        await registry.shutdown()
+        await storage.close()
+
+    asyncio.run(run())
+
+
+def test_idle_session_outside_a_test_is_only_released(tmp_path, activity):
+    stale, recent = _key(1), _key(2)
+
+    async def run():
+        storage = await _storage(
+            tmp_path / "fsm.db", {stale: "Menu:main", recent: "Menu:main"}
+        )
+        _idle(activity, stale, IDLE_TTL_S + 1)
+        _idle(activity, recent, IDLE_TTL_S - 1)
+
+        async def interrupt_test(state, bot):
+            raise AssertionError("not a test state")
+
+        count = await session_reaper.reap_idle_sessions(
+            storage,
+            SimpleEventIsolation(),
+            object(),
+            _test_idle_ttl,
+            interrupt_test,
+            IDLE_TTL_S,
+            min_idle_s=1,
+        )
+        assert count == 0
+        assert not storage.release(stale)  # Already dropped from the cache
+        assert storage.release(recent)
+        assert await storage.get_state(stale) == "Menu:main"  # Row kept
+        await storage.close()
+
+    asyncio.run(run())
+
+
+def test_user_returning_while_waiting_for_the_lock_is_skipped(
+    tmp_path, activity
+):
+    key = _key(1)
+
+    async def run():
+        storage = await _storage(tmp_path / "fsm.db", {key: TEST_STATE})
+        isolation, interrupted = SimpleEventIsolation(), []
+        _idle(activity, key, TEST_TTL_S + 1)
+
+        async def interrupt_test(state, bot):
+            interrupted.append(state.key)
+
+        async with isolation.lock(key):  # An update of this user is running
+            reaper = asyncio.create_task(
+                session_reaper.reap_idle_sessions(
+                    storage,
+                    isolation,
+                    object(),
+                    _test_idle_ttl,
+                    interrupt_test,
+                    IDLE_TTL_S,
+                    min_idle_s=1,
+                )
+            )
+            await asyncio.sleep(0.01)
+            activity.touch(key)
+        assert await reaper == 0 and interrupted == []
+        assert await storage.get_state(key) == TEST_STATE
+        await storage.close()
+
+    asyncio.run(run())
@@ -0,0 +1,120 @@
+# tests/test_session_tasks.py
+import asyncio
+
+import pytest
+
+pytest.importorskip("aiogram")
+
+from aiogram.fsm.context import FSMContext  # noqa: E402
+from aiogram.fsm.storage.base import StorageKey  # noqa: E402
+from aiogram.fsm.storage.memory import MemoryStorage  # noqa: E402
+
+from utils.session_tasks import SessionTaskRegistry  # noqa: E402
+
+
+def _state(chat_id):
+    key = StorageKey(bot_id=1, chat_id=chat_id, user_id=chat_id)
+    return FSMContext(storage=MemoryStorage(), key=key)
+
+
+async def _until_cancelled(log, label):
+    try:
+        await asyncio.sleep(60)
+    except asyncio.CancelledError:
+        await asyncio.sleep(0.01)  # Cleanup still runs inside cancel()
+        log.append(label)
+        raise
+
+
+def test_start_replaces_and_awaits_the_old_task():
+    async def run():
+        registry, state, log = SessionTaskRegistry(), _state(1), []
+        old = await registry.start(
+            state, "timer", _until_cancelled(log, "old")
+        )
+        await asyncio.sleep(0)
+        new = await registry.start(
+            state, "timer", _until_cancelled(log, "new")
+        )
+        # The old task finished its cleanup before start() returned
+        assert old.cancelled() and log == ["old"]
+        assert registry.get(state, "timer") is new
+        await asyncio.sleep(0)
+        await registry.cancel_all(state)
+        return log, registry
+
+    log, registry = asyncio.run(run())
+    assert log == ["old", "new"]
+    assert registry._sessions == {}
+
+
+def test_cancel_only_touches_named_slots_of_one_session():
+    async def run():
+        registry, log = SessionTaskRegistry(), []
+        first, second = _state(1), _state(2)
+        await registry.start(first, "timer", _until_cancelled(log, "1:timer"))
+        await registry.start(first, "cycle", _until_cancelled(log, "1:cycle"))
+        await registry.start(second, "timer", _until_cancelled(log, "2:timer"))
+        await asyncio.sleep(0)
+
+        await registry.cancel(first, "timer", "missing")
+        running = [
+            registry.is_running(first, "timer"),
+            registry.is_running(first, "cycle"),
+            registry.is_running(second, "timer"),
+        ]
+        await registry.shutdown()
+        return log, running, registry
+
+    log, running, registry = asyncio.run(run())
+    assert running == [False, True, True]
+    assert log[0] == "1:timer"
+    assert sorted(log[1:]) == ["1:cycle", "2:timer"]
+    assert registry._sessions == {}
+
+
+def test_finished_tasks_drop_out_of_the_registry():
+    async def run():
+        registry, state = SessionTaskRegistry(), _state(1)
+        task = await registry.start(state, "revert", asyncio.sleep(0))
+        await task
+        await asyncio.sleep(0)  # Done callbacks run on the next iteration
+        return registry, state
+
+    registry, state = asyncio.run(run())
+    assert registry.get(state, "revert") is None
+    assert registry._sessions == {}
+
+
+def test_a_task_can_cancel_its_own_session():
+    async def run():
+        registry, state, log = SessionTaskRegistry(), _state(1), []
+
+        async def timer():
+            await asyncio.sleep(0.01)
+            await registry.cancel_all(state)  # Ends its own test
+            log.append("cleanup done")
+
+        await registry.start(state, "cycle", _until_cancelled(log, "cycle"))
+        task = await registry.start(state, "timer", timer())
+        await task
+        return log
+
+    assert asyncio.run(run()) == ["cycle", "cleanup done"]
+
+
+def test_task_errors_are_logged_not_raised(caplog):
+    async def failing():
+        try:
+            await asyncio.sleep(60)
+        finally:
+            raise RuntimeError("boom")
+
+    async def run():
+        registry, state = SessionTaskRegistry(), _state(1)
+        await registry.start(state, "timer", failing())
+        await asyncio.sleep(0)
+        await registry.cancel(state, "timer")
+
+    asyncio.run(run())
+    assert "boom" in caplog.text
@@ -0,0 +1,183 @@
+# tests/test_sharded_store.py
+import json
+import os
+
+import pytest
+
+pytest.importorskip("openpyxl")
+
+from openpyxl import Workbook  # noqa: E402
+
+from settings import REGISTERED_AT_HEADER  # noqa: E402
+from utils.results_store import ExcelResultsStore  # noqa: E402
+from utils.sharded_store import (  # noqa: E402
+    OTHER_SHARD,
+    SHARD_SCHEME,
+    ShardedExcelResultsStore,
+)
+
+HEADERS = ["Unique ID", "Telegram ID", "Name", REGISTERED_AT_HEADER, "Score"]
+
+
+def _store(tmp_path, import_from_excel=None, period_months=3):
+    return ShardedExcelResultsStore(
+        str(tmp_path / "shards"),
+        str(tmp_path / "shards" / "manifest.json"),
+        "results",
+        HEADERS,
+        period_months,
+        3600,
+        1000,
+        import_from_excel=import_from_excel,
+    )
+
+
+def _manifest(tmp_path):
+    with open(tmp_path / "shards" / "manifest.json", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _row(uid, registered_at, tgid=None):
+    return {
+        "Unique ID": uid,
+        "Telegram ID": tgid,
+        REGISTERED_AT_HEADER: registered_at,
+    }
+
+
+def test_rows_are_routed_by_registration_period(tmp_path):
+    store = _store(tmp_path)
+    store.load()
+    store.append_row(_row(1000001, "2025-01-15T10:00:00"))
+    store.append_row(_row(9999999, "2025-03-31T23:59:59"))
+    store.append_row(_row(5000000, "2025-04-01T00:00:00"))
+    store.append_row(_row(7000000, None))
+    store.flush()
+
+    shards = _manifest(tmp_path)["shards"]
+    assert sorted(shards) == ["2025-01", "2025-04", OTHER_SHARD]
+    first_quarter = ExcelResultsStore(shards["2025-01"], 3600, 1000)
+    first_quarter.load()
+    assert first_quarter.existing_uids() == {"1000001", "9999999"}
+
+
+def test_manifest_reload_restores_lookups(tmp_path):
+    store = _store(tmp_path)
+    store.load()
+    store.append_row(_row(1234567, "2024-11-02T08:00:00", tgid=55))
+    store.update_row("1234567", {"Score": 9})
+    store.flush()
+
+    reloaded = _store(tmp_path)
+    reloaded.load()
+    manifest = _manifest(tmp_path)
+    assert manifest["scheme"] == SHARD_SCHEME
+    assert manifest["period_months"] == 3
+    assert reloaded.has_uid("1234567")
+    assert "1234567" in reloaded.uid_keys()
+    assert reloaded.get_row("1234567")["Score"] == 9
+    assert reloaded.find_uid_by_telegram_id(55) == "1234567"
+    assert reloaded.update_row("1234567", {"Score": 10})
+    assert not reloaded.update_row("7654321", {"Score": 1})
+
+
+def test_flush_rewrites_only_changed_shards(tmp_path):
+    store = _store(tmp_path)
+    store.load()
+    store.append_row(_row(1000001, "2023-02-01T00:00:00"))
+    store.append_row(_row(1000002, "2025-02-01T00:00:00"))
+    store.flush()
+    shards = _manifest(tmp_path)["shards"]
+    old_mtime = os.stat(shards["2023-01"]).st_mtime_ns
+
+    store.update_row("1000002", {"Score": 3})
+    assert store.dirty_count == 1
+    store.flush()
+    assert os.stat(shards["2023-01"]).st_mtime_ns == old_mtime
+
+
+def _write_workbook(path, rows):
+    wb = Workbook()
+    ws = wb.active
+    ws.append(HEADERS)
+    for row in rows:
+        ws.append(row)
+    wb.save(path)
+
+
+def test_legacy_file_is_imported_once(tmp_path):
+    legacy_path = str(tmp_path / "legacy.xlsx")
+    _write_workbook(
+        legacy_path,
+        [
+            [2000000, 7, "A", "2025-06-30T12:00:00", 5],
+            [3000000, None, "B", None, None],
+        ],
+    )
+    store = _store(tmp_path, import_from_excel=legacy_path)
+    store.load()
+    assert sorted(_manifest(tmp_path)["shards"]) == ["2025-04", OTHER_SHARD]
+    assert store.find_uid_by_telegram_id(7) == "2000000"
+
+    store.append_row(_row(4000000, "2025-07-01T00:00:00"))
+    store.flush()
+    reloaded = _store(tmp_path, import_from_excel=legacy_path)
+    reloaded.load()  # Manifest exists: no second import
+    assert reloaded.row_count() == 3
+
+
+def test_uid_range_manifest_is_resharded(tmp_path):
+    shard_dir = tmp_path / "shards"
+    shard_dir.mkdir()
+    old_shard = str(shard_dir / "results_0000.xlsx")
+    _write_workbook(
+        old_shard,
+        [
+            [1000001, None, "A", "2024-12-31T00:00:00", 1],
+            [1000002, None, "B", "2025-01-01T00:00:00", 2],
+        ],
+    )
+    with open(shard_dir / "manifest.json", "w", encoding="utf-8") as f:
+        json.dump(
+            {"scheme": "uid_range", "uid_span": 500000, "shards": {"0000": old_shard}},
+            f,
+        )
+
+    store = _store(tmp_path)
+    store.load()
+    assert sorted(_manifest(tmp_path)["shards"]) == ["2024-10", "2025-01"]
+    assert store.get_row("1000002")["Score"] == 2
+    assert not os.path.exists(old_shard)  # Removed after the new manifest
+
+
+def test_interrupted_resplit_keeps_every_row(tmp_path, monkeypatch):
+    store = _store(tmp_path, period_months=3)
+    store.load()
+    for uid, registered_at in (
+        (1000001, "2025-01-10T00:00:00"),
+        (1000002, "2025-02-10T00:00:00"),
+        (1000003, "2025-03-10T00:00:00"),
+    ):
+        store.append_row(_row(uid, registered_at))
+    store.flush()
+    old_files = list(_manifest(tmp_path)["shards"].values())
+
+    def fail(self):
+        raise OSError("disk full")
+
+    with monkeypatch.context() as m:
+        m.setattr(ExcelResultsStore, "flush", fail)
+        with pytest.raises(OSError):
+            _store(tmp_path, period_months=1).load()
+    assert _manifest(tmp_path)["period_months"] == 3
+    assert all(os.path.exists(f) for f in old_files)
+
+    restarted = _store(tmp_path, period_months=1)
+    restarted.load()
+    assert restarted.row_count() == 3
+    assert sorted(_manifest(tmp_path)["shards"]) == [
+        "2025-01",
+        "2025-02",
+        "2025-03",
+    ]
+    assert not any(os.path.exists(f) for f in old_files)
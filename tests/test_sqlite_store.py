@@ -0,0 +1,104 @@
+# tests/test_sqlite_store.py
+import sqlite3
+
+import pytest
+
+openpyxl = pytest.importorskip("openpyxl")
+
+from utils.sqlite_store import SQLiteResultsStore  # noqa: E402
+
+BASE = ["Unique ID", "Telegram ID", "Name"]
+GROUPS = {"corsi": ["Corsi Span"], "stroop": ["Stroop Time", "Stroop Errors"]}
+
+
+def _store(tmp_path, groups=GROUPS, import_from_excel=None):
+    store = SQLiteResultsStore(
+        str(tmp_path / "results.db"), BASE, groups, import_from_excel
+    )
+    store.load()
+    return store
+
+
+def test_rows_are_joined_across_test_tables(tmp_path):
+    store = _store(tmp_path)
+    store.append_row({"Unique ID": 1001, "Telegram ID": 5, "Name": "A"})
+    assert store.update_row("1001", {"Corsi Span": 6, "Stroop Time": 12.5})
+    assert store.update_row("1001", {"Stroop Errors": 2, "Name": ""})
+    assert not store.update_row("9999", {"Corsi Span": 1})
+
+    assert store.get_row("1001") == {
+        "Unique ID": "1001",
+        "Telegram ID": 5,
+        "Name": None,  # "" clears a cell
+        "Corsi Span": 6,
+        "Stroop Time": 12.5,
+        "Stroop Errors": 2,
+    }
+    assert store.get_row("9999") is None
+    assert "1001" in store.uid_keys() and 1001 in store.uid_keys()
+    assert store.existing_uids() == {"1001"}
+    store.close()
+
+
+def test_find_uid_by_telegram_id_matches_int_and_text(tmp_path):
+    store = _store(tmp_path)
+    store.append_row({"Unique ID": "1", "Telegram ID": 77})
+    store.append_row({"Unique ID": "2", "Telegram ID": "88"})
+    store.append_row({"Unique ID": "3", "Telegram ID": 77})  # Re-registered
+    assert store.find_uid_by_telegram_id("77") == "3"
+    assert store.find_uid_by_telegram_id(88) == "2"
+    assert store.find_uid_by_telegram_id(99) is None
+    store.close()
+
+
+def test_failed_append_is_rolled_back(tmp_path):
+    store = _store(tmp_path)
+    store.append_row({"Unique ID": "1", "Corsi Span": 4})
+    with pytest.raises(sqlite3.IntegrityError):
+        store.append_row({"Unique ID": "1", "Corsi Span": 5})  # Duplicate
+    assert store.row_count() == 1
+    assert store.get_row("1")["Corsi Span"] == 4
+    store.close()
+
+
+def test_new_headers_are_added_on_reopen(tmp_path):
+    store = _store(tmp_path)
+    store.append_row({"Unique ID": "1", "Corsi Span": 4})
+    store.close()
+
+    groups = {**GROUPS, "corsi": ["Corsi Span", "Corsi Time"]}
+    store = _store(tmp_path, groups)
+    assert store.update_row("1", {"Corsi Time": 30})
+    assert store.get_row("1")["Corsi Span"] == 4
+    assert store.get_row("1")["Corsi Time"] == 30
+    store.close()
+
+
+def test_snapshot_projects_onto_requested_headers(tmp_path):
+    store = _store(tmp_path)
+    store.append_row({"Unique ID": "1", "Name": "A", "Corsi Span": 4})
+    store.append_row({"Unique ID": "2", "Name": "B", "Stroop Time": 9.0})
+    rows = list(store.iter_snapshot(["Name", "Stroop Time", "Unknown"]))
+    assert rows == [("A", None, None), ("B", 9.0, None)]
+    store.close()
+
+
+def test_legacy_workbook_is_imported_once(tmp_path):
+    excel_path = tmp_path / "legacy.xlsx"
+    wb = openpyxl.Workbook()
+    wb.active.append(["Unique ID", "Name", "Corsi Span", "Dropped Column"])
+    wb.active.append([1001, "A", 5, "x"])
+    wb.active.append([None, "no uid", 1, None])
+    wb.active.append([1002, "B", None, None])
+    wb.save(excel_path)
+
+    store = _store(tmp_path, import_from_excel=str(excel_path))
+    assert store.row_count() == 2
+    assert store.get_row("1001")["Corsi Span"] == 5
+    store.close()
+
+    wb.active.append([1003, "C", 7, None])
+    wb.save(excel_path)
+    store = _store(tmp_path, import_from_excel=str(excel_path))
+    assert store.row_count() == 2  # Only an empty database imports
+    store.close()
@@ -0,0 +1,82 @@
+# tests/test_stats_sketch.py
+import random
+import statistics
+
+import pytest
+
+from utils.stats_sketch import P2Quantile, ResultStats, RunningStats
+
+
+def test_running_stats_match_statistics():
+    values = [3.0, 1.5, 4.0, 1.0, 5.5, 9.0, 2.5]
+    stats = RunningStats()
+    for x in values:
+        stats.add(x)
+    assert stats.count == len(values)
+    assert abs(stats.mean - statistics.mean(values)) < 1e-9
+    assert abs(stats.variance - statistics.variance(values)) < 1e-9
+    assert (stats.min, stats.max) == (1.0, 9.0)
+
+
+def test_p2_is_exact_for_first_values():
+    sketch = P2Quantile(0.5)
+    assert sketch.value() is None
+    for x in (7.0, 1.0, 4.0):
+        sketch.add(x)
+    assert sketch.value() == 4.0
+
+
+def test_p2_tracks_quantiles_of_a_large_stream():
+    rng = random.Random(42)
+    values = [rng.uniform(0, 1000) for _ in range(20000)]
+    for p in (0.5, 0.9, 0.99):
+        sketch = P2Quantile(p)
+        for x in values:
+            sketch.add(x)
+        exact = sorted(values)[int(p * len(values))]
+        assert abs(sketch.value() - exact) < 15  # 1.5% of the range
+
+
+def test_p2_round_trips_mid_stream():
+    rng = random.Random(7)
+    original = P2Quantile(0.9)
+    for _ in range(500):
+        original.add(rng.gauss(300, 50))
+    restored = P2Quantile.from_dict(original.to_dict())
+    for _ in range(500):
+        x = rng.gauss(300, 50)
+        original.add(x)
+        restored.add(x)
+    assert restored.value() == original.value()
+
+
+def test_result_stats_skip_untracked_and_non_numeric(tmp_path):
+    stats = ResultStats(str(tmp_path / "stats.json"), ["Score", "Time"])
+    stats.add_results({"Score": 5, "Time": "N/A", "Name": 3, "Flag": True})
+    stats.add_results({"Score": 7, "Time": float("nan")})
+    summaries = stats.summaries()
+    assert list(summaries) == ["Score"]
+    assert summaries["Score"].stats.mean == 6.0
+
+
+def test_result_stats_save_load_keeps_journal_seq(tmp_path):
+    path = str(tmp_path / "stats.json")
+    stats = ResultStats(path, ["Score"])
+    assert not stats.save(5)  # Nothing changed
+    stats.add_results({"Score": 10})
+    assert stats.save(12)
+
+    loaded = ResultStats(path, ["Score"])
+    loaded.load()
+    assert loaded.journal_seq == 12
+    assert loaded.summaries()["Score"].stats.count == 1
+    assert not loaded.dirty
+
+
+def test_failed_save_keeps_journal_seq_and_dirty(tmp_path):
+    stats = ResultStats(str(tmp_path / "missing_dir" / "stats.json"), ["Score"])
+    stats.add_results({"Score": 10})
+    with pytest.raises(OSError):
+        stats.save(12)
+    assert stats.journal_seq == 0  # Nothing on disk covers the journal yet
+    assert stats.dirty
@@ -0,0 +1,92 @@
+# tests/test_trial_store.py
+import json
+
+import pytest
+
+from utils.trial_store import (
+    TRIAL_FIELDS,
+    TRIAL_RECORD,
+    TrialStore,
+    latest_session_mask,
+    load_trials,
+)
+
+
+def _records(path):
+    data = path.read_bytes()
+    return [
+        TRIAL_RECORD.unpack_from(data, offset)
+        for offset in range(0, len(data), TRIAL_RECORD.size)
+    ]
+
+
+def test_record_layout(tmp_path):
+    store = TrialStore(str(tmp_path))
+    trials = [("red", True, 0.5), ("blue", False, 1.25), ("red", None, 2.0)]
+    assert store.append("stroop", "1234567", trials, ts=1000) == 3
+
+    assert TRIAL_RECORD.size == 19  # Packed, no padding
+    assert json.loads((tmp_path / "stroop.items.json").read_text()) == [
+        "red",
+        "blue",
+    ]
+    assert _records(tmp_path / "stroop.trials.bin") == [
+        (1234567, 1000, 0, 0, 1, 0.5),
+        (1234567, 1000, 1, 1, 0, 1.25),
+        (1234567, 1000, 2, 0, -1, 2.0),
+    ]
+
+
+def test_item_ids_are_stable_across_instances(tmp_path):
+    TrialStore(str(tmp_path)).append("mr", "1", [("a", True, 1.0)], ts=1)
+    TrialStore(str(tmp_path)).append(
+        "mr", "1", [("b", True, 1.0), ("a", False, 1.0)], ts=2
+    )
+    items = [record[3] for record in _records(tmp_path / "mr.trials.bin")]
+    assert items == [0, 1, 0]
+
+
+def test_non_numeric_uid_and_empty_saves_write_nothing(tmp_path):
+    store = TrialStore(str(tmp_path))
+    assert store.append("raven", "N/A", [("a", True, 1.0)]) == 0
+    assert store.append("raven", "1", []) == 0
+    assert not (tmp_path / "raven.trials.bin").exists()
+
+
+def test_torn_record_is_realigned_before_append(tmp_path):
+    store = TrialStore(str(tmp_path))
+    store.append("corsi", "1", [("3", True, 1.0)], ts=1)
+    path = tmp_path / "corsi.trials.bin"
+    with open(path, "ab") as f:
+        f.write(b"\x01\x02\x03")  # Crash mid-write
+    store.append("corsi", "2", [("4", False, 2.0)], ts=2)
+    assert [record[0] for record in _records(path)] == [1, 2]
+
+
+def test_loader_and_latest_session_mask(tmp_path):
+    np = pytest.importorskip("numpy")
+    store = TrialStore(str(tmp_path))
+    store.append("rt", "1", [("x", None, 0.3), ("x", None, 0.4)], ts=10)
+    store.append("rt", "2", [("y", None, 0.5)], ts=15)
+    store.append("rt", "1", [("x", None, 0.2)], ts=20)  # Retake
+    with open(tmp_path / "rt.trials.bin", "ab") as f:
+        f.write(b"\x00" * 5)  # Torn trailing record
+
+    records, items = load_trials(str(tmp_path), "rt")
+    assert records.dtype == np.dtype(TRIAL_FIELDS)
+    assert records.size == 4
+    assert items == ["x", "y"]
+    assert records["rt"].dtype == np.float32
+
+    latest = records[latest_session_mask(records)]
+    assert sorted(zip(latest["uid"].tolist(), latest["ts"].tolist())) == [
+        (1, 20),
+        (2, 15),
+    ]
+
+
+def test_loader_on_missing_file(tmp_path):
+    pytest.importorskip("numpy")
+    records, items = load_trials(str(tmp_path), "none")
+    assert records.size == 0 and items == []
+    assert latest_session_mask(records).size == 0
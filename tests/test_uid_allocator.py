@@ -0,0 +1,69 @@
+# tests/test_uid_allocator.py
+import json
+
+from utils.uid_allocator import UidAllocator, UidPermutation
+
+KEY = bytes(range(32))
+
+
+def _allocator(tmp_path, min_uid=1000000, max_uid=9999999, block_size=10):
+    return UidAllocator(
+        str(tmp_path / "uid.json"), min_uid, max_uid, block_size
+    )
+
+
+def _write_state(tmp_path, high_water, key=KEY):
+    with open(tmp_path / "uid.json", "w", encoding="utf-8") as f:
+        json.dump({"high_water": high_water, "key": key.hex()}, f)
+
+
+def test_permutation_is_a_bijection():
+    for range_size in (1, 7, 100, 1000):
+        permutation = UidPermutation(KEY, range_size)
+        assert sorted(permutation(n) for n in range(range_size)) == list(
+            range(range_size)
+        )
+
+
+def test_uids_follow_the_keyed_permutation(tmp_path):
+    _write_state(tmp_path, 0)
+    allocator = _allocator(tmp_path)
+    permutation = UidPermutation(KEY, 9000000)
+    uids = [allocator.allocate(set()) for _ in range(20)]
+    assert uids == [1000000 + permutation(n) for n in range(20)]
+    steps = {(b - a) % 9000000 for a, b in zip(uids, uids[1:])}
+    assert len(steps) > 1  # Not a fixed stride
+
+
+def test_counter_and_key_persist_across_processes(tmp_path):
+    first = _allocator(tmp_path)
+    second = _allocator(tmp_path)  # Another process on the same file
+    uids = [
+        first.allocate(set()),
+        second.allocate(set()),
+        first.allocate(set()),
+    ]
+    assert len(set(uids)) == 3
+
+    with open(tmp_path / "uid.json", encoding="utf-8") as f:
+        state = json.load(f)
+    assert state["high_water"] == 20  # Two blocks reserved
+    assert len(bytes.fromhex(state["key"])) == 32
+
+    restarted = _allocator(tmp_path)
+    assert restarted.allocate(set()) not in uids
+
+
+def test_existing_uids_are_skipped(tmp_path):
+    _write_state(tmp_path, 0)
+    permutation = UidPermutation(KEY, 100)
+    taken = {str(10 + permutation(0)), str(10 + permutation(1))}
+    allocator = _allocator(tmp_path, 10, 109)
+    assert allocator.allocate(taken) == 10 + permutation(2)
+
+
+def test_exhausted_range_returns_none(tmp_path):
+    allocator = _allocator(tmp_path, 10, 12, block_size=2)
+    uids = {allocator.allocate(set()) for _ in range(3)}
+    assert uids == {10, 11, 12}
+    assert allocator.allocate(set()) is None
@@ -0,0 +1,122 @@
+# utils/asset_warmup.py
+import asyncio
+import logging
+import os
+import time
+from typing import Iterable, List
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramAPIError, TelegramRetryAfter
+
+from settings import (
+    REACTION_TIME_IMAGE_POOL,
+    MR_REFERENCES_DIR,
+    MR_REFERENCE_FILES,
+    RAVEN_BASE_DIR,
+    RAVEN_ALL_TASK_FILES,
+    WARMUP_CONCURRENCY,
+    WARMUP_MIN_SEND_INTERVAL_S,
+    WARMUP_MAX_ATTEMPTS,
+)
+from utils.file_id_cache import PhotoSource, file_id_cache, send_photo_cached
+from utils.image_processors import stroop_stimulus_images
+
+logger = logging.getLogger(__name__)
+
+
+def stimulus_assets() -> List[PhotoSource]:
+    """
+    Stimulus images sent as-is: the file pools filled by main_bot plus the
+    pre-rendered Stroop bank.
+    """
+    return (
+        list(REACTION_TIME_IMAGE_POOL)
+        + [os.path.join(MR_REFERENCES_DIR, f) for f in MR_REFERENCE_FILES]
+        + [os.path.join(RAVEN_BASE_DIR, f) for f in RAVEN_ALL_TASK_FILES]
+        + stroop_stimulus_images()
+    )
+
+
+class _SendPacer:
+    """Spaces consecutive sends to one chat at least interval_s apart."""
+
+    def __init__(self, interval_s: float):
+        self.interval_s = interval_s
+        self._next_ts = 0.0
+        self._lock = asyncio.Lock()
+
+    async def wait(self):
+        async with self._lock:
+            # Re-checked after sleeping: a RetryAfter may have pushed it back
+            delay = self._next_ts - time.monotonic()
+            while delay > 0:
+                await asyncio.sleep(delay)
+                delay = self._next_ts - time.monotonic()
+            self._next_ts = time.monotonic() + self.interval_s
+
+    def back_off(self, delay_s: float):
+        self._next_ts = max(self._next_ts, time.monotonic() + delay_s)
+
+
+async def warmup_file_ids(
+    bot: Bot,
+    storage_chat_id: int,
+    sources: Iterable[PhotoSource],
+    concurrency: int = WARMUP_CONCURRENCY,
+    min_send_interval_s: float = WARMUP_MIN_SEND_INTERVAL_S,
+) -> int:
+    """
+    Uploads every image without a cached file_id once to storage_chat_id,
+    so the first participant gets file_ids too. At most 'concurrency'
+    uploads in flight, sends paced per min_send_interval_s; RetryAfter
+    pauses all senders. Returns the number of images uploaded.
+    """
+    pending, seen = [], set()
+    for source in sources:
+        try:
+            digest = file_id_cache.digest_for(source)
+        except OSError as e:
+            logger.warning(f"Прогрев: файл '{source}' недоступен: {e}")
+            continue
+        if digest in seen or file_id_cache.get(bot.id, digest) is not None:
+            continue
+        seen.add(digest)
+        pending.append(source)
+    if not pending:
+        logger.info("Прогрев: все изображения уже имеют file_id.")
+        return 0
+
+    logger.info(f"Прогрев: загрузка {len(pending)} изображений...")
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    pacer = _SendPacer(min_send_interval_s)
+
+    async def upload(source: PhotoSource) -> bool:
+        async with semaphore:
+            for _ in range(WARMUP_MAX_ATTEMPTS):
+                await pacer.wait()
+                try:
+                    await send_photo_cached(
+                        bot,
+                        storage_chat_id,
+                        source,
+                        disable_notification=True,
+                    )
+                    return True
+                except TelegramRetryAfter as e:
+                    logger.warning(
+                        f"Прогрев: лимит Telegram, пауза {e.retry_after} с."
+                    )
+                    pacer.back_off(e.retry_after)
+                except (TelegramAPIError, OSError) as e:
+                    name = getattr(source, "filename", source)
+                    logger.error(f"Прогрев: не удалось загрузить '{name}': {e}")
+                    return False
+            return False
+
+    started = time.monotonic()
+    uploaded = sum(await asyncio.gather(*(upload(p) for p in pending)))
+    logger.info(
+        f"Прогрев: загружено {uploaded}/{len(pending)} изображений "
+        f"за {time.monotonic() - started:.1f} с."
+    )
+    return uploaded
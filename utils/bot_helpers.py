@@ -1,39 +1,42 @@
 # utils/bot_helpers.py
 import logging
-from typing import Optional, Dict, Any, Union
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional, Dict, Any, Iterable, List, Union
 
 from aiogram import Bot
+from aiogram.enums import ChatType
 from aiogram.fsm.context import FSMContext
-from aiogram.types import InlineKeyboardMarkup, Message, CallbackQuery
+from aiogram.fsm.state import State
+from aiogram.types import (
+    InlineKeyboardMarkup,
+    Message,
+    CallbackQuery,
+    Chat,
+    User,
+)
 from aiogram.exceptions import TelegramBadRequest
 
 logger = logging.getLogger(__name__)
 
+# Telegram rejects longer message texts
+TELEGRAM_MESSAGE_MAX_LEN = 4096
+
 
 async def get_active_profile_from_fsm(
     state: FSMContext,
 ) -> Optional[Dict[str, Any]]:
     """
     Retrieves the active user profile data from FSM storage.
-    Prioritizes 'active_*' keys, then test-specific keys, then raw keys.
+    Prioritizes 'active_*' keys, then raw keys.
     Returns a dictionary with standardized keys: 'unique_id', 'name', 'age', 'telegram_id'.
     """
     data = await state.get_data()
 
-    uid = data.get(
-        "active_unique_id",
-        data.get("unique_id_for_test", data.get("unique_id")),
-    )
-    name = data.get(
-        "active_name", data.get("profile_name_for_test", data.get("name"))
-    )
-    age_raw = data.get(
-        "active_age", data.get("profile_age_for_test", data.get("age"))
-    )
-    tgid = data.get(
-        "active_telegram_id",
-        data.get("profile_telegram_id_for_test", data.get("telegram_id")),
-    )
+    uid = data.get("active_unique_id", data.get("unique_id"))
+    name = data.get("active_name", data.get("name"))
+    age_raw = data.get("active_age", data.get("age"))
+    tgid = data.get("active_telegram_id", data.get("telegram_id"))
 
     age: Optional[int] = None
     if age_raw is not None:
@@ -71,6 +74,69 @@ async def get_active_profile_from_fsm(
     return None
 
 
+class FSMSession:
+    """
+    Batched view of one FSM session for a single handler run.
+    State and data are read once; get()/update()/set_state() work on the
+    local copy and commit() sends the changed keys in one update_data call
+    (plus set_state only if the state really changed). Commit before calling
+    code that reads or clears the FSMContext itself (save/cleanup routines).
+    """
+
+    def __init__(
+        self,
+        state: FSMContext,
+        state_name: Optional[str],
+        data: Dict[str, Any],
+    ):
+        self.context = state
+        self.data = data
+        self._state_name = state_name
+        self._pending_state: Union[str, None, bool] = False  # False: unchanged
+        self._dirty: Dict[str, Any] = {}
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return self.data.get(key, default)
+
+    def update(self, values: Optional[Dict[str, Any]] = None, **kwargs: Any):
+        changes = {**(values or {}), **kwargs}
+        self.data.update(changes)
+        self._dirty.update(changes)
+
+    @property
+    def state_name(self) -> Optional[str]:
+        if self._pending_state is not False:
+            return self._pending_state
+        return self._state_name
+
+    def set_state(self, new_state: Union[State, str, None]):
+        self._pending_state = (
+            new_state.state if isinstance(new_state, State) else new_state
+        )
+
+    async def commit(self):
+        if self._dirty:
+            changes, self._dirty = self._dirty, {}
+            await self.context.update_data(changes)
+        if self._pending_state is not False:
+            new_state, self._pending_state = self._pending_state, False
+            if new_state != self._state_name:
+                await self.context.set_state(new_state)
+                self._state_name = new_state
+
+
+@asynccontextmanager
+async def fsm_session(state: FSMContext) -> AsyncIterator[FSMSession]:
+    """Loads the FSM once and commits the merged changes on exit."""
+    session = FSMSession(
+        state, await state.get_state(), await state.get_data()
+    )
+    try:
+        yield session
+    finally:
+        await session.commit()
+
+
 async def send_main_action_menu(
     bot_instance: Bot,
     trigger_event_or_message: Union[Message, CallbackQuery],
@@ -123,6 +189,78 @@ async def send_main_action_menu(
         )
 
 
+def make_service_message(bot_instance: Bot, chat_id: int) -> Message:
+    """
+    Bot-bound stand-in Message for code paths that run without a user update
+    (e.g. the idle session reaper); .answer() sends to chat_id.
+    """
+    return Message(
+        message_id=0,
+        date=int(time.time()),
+        chat=Chat(id=chat_id, type=ChatType.PRIVATE),
+        from_user=User(id=bot_instance.id, is_bot=True, first_name="Bot"),
+        text="",
+    ).as_(bot_instance)
+
+
+def split_message_text(
+    lines: Iterable[str], max_len: int = TELEGRAM_MESSAGE_MAX_LEN
+) -> List[str]:
+    """
+    Joins lines into as few message texts of at most max_len characters as
+    possible, breaking only between lines (so HTML tags stay balanced); a
+    single longer line is cut.
+    """
+    chunks: List[str] = []
+    current: Optional[str] = None
+    for line in lines:
+        while len(line) > max_len:
+            if current is not None:
+                chunks.append(current)
+                current = None
+            chunks.append(line[:max_len])
+            line = line[max_len:]
+        if current is None:
+            current = line
+        elif len(current) + 1 + len(line) <= max_len:
+            current += "\n" + line
+        else:
+            chunks.append(current)
+            current = line
+    if current is not None:
+        chunks.append(current)
+    return chunks
+
+
+def message_ref(message: Message) -> Dict[str, Optional[int]]:
+    """Plain stand-in for a Message kept in FSM data (Message is not)."""
+    return {
+        "chat_id": message.chat.id,
+        "user_id": message.from_user.id if message.from_user else None,
+        "message_id": message.message_id,
+    }
+
+
+def message_from_ref(
+    bot_instance: Bot, ref: Optional[Dict[str, Optional[int]]]
+) -> Optional[Message]:
+    """Bot-bound Message rebuilt from message_ref(); None if ref is empty."""
+    if not isinstance(ref, dict) or not ref.get("chat_id"):
+        return None
+    user_id = ref.get("user_id")
+    if user_id is None:
+        user = User(id=bot_instance.id, is_bot=True, first_name="Bot")
+    else:
+        user = User(id=user_id, is_bot=False, first_name="")
+    return Message(
+        message_id=ref.get("message_id") or 0,
+        date=int(time.time()),
+        chat=Chat(id=ref["chat_id"], type=ChatType.PRIVATE),
+        from_user=user,
+        text="",
+    ).as_(bot_instance)
+
+
 # --- НОВЫЕ ПЕРЕМЕЩЕННЫЕ ФУНКЦИИ ---
 async def _safe_delete_message(
     bot: Bot, chat_id: int, message_id: Optional[int], context_info: str = ""
@@ -1,28 +1,124 @@
 # utils/excel_handler.py
+import asyncio
 import os
 import logging
-import random  # For UID generation
-from typing import Optional, Dict, Any, Set, Union  # Updated type hints
+import threading
+from datetime import datetime
+from typing import (  # Updated type hints
+    Callable,
+    Optional,
+    Dict,
+    Any,
+    Container,
+    List,
+    Tuple,
+    Union,
+)
 
-from openpyxl import Workbook, load_workbook
+from openpyxl import Workbook
 from openpyxl.utils.exceptions import InvalidFileException
 
 from settings import (
     EXCEL_FILENAME,
     ALL_EXPECTED_HEADERS,
-    # BASE_HEADERS, # Not directly used here after refactoring common_handlers
+    RESULTS_FLUSH_INTERVAL_S,
+    RESULTS_FLUSH_DIRTY_ROWS,
+    RESULTS_FLUSH_CHECK_INTERVAL_S,
+    RESULTS_BACKEND,
+    SQLITE_DB_FILENAME,
+    BASE_HEADERS,
+    RESULT_HEADER_GROUPS,
+    REGISTERED_AT_HEADER,
+    RESULTS_JOURNAL_FILENAME,
+    UID_ALLOCATOR_FILENAME,
+    UID_BLOCK_SIZE,
+    UID_MIN,
+    UID_MAX,
+    RESULTS_SHARD_DIR,
+    RESULTS_SHARD_MANIFEST,
+    RESULTS_SHARD_PERIOD_MONTHS,
+    TRIALS_DIR,
+    NORMS_AGE_BANDS,
+    NORMS_MIN_SAMPLE_SIZE,
+    RESULT_STATS_FILENAME,
+)
+from utils.export import ExportOptions, write_export
+from utils.results_journal import ResultsJournal
+from utils.results_store import ExcelResultsStore
+from utils.sharded_store import ShardedExcelResultsStore
+from utils.sqlite_store import SQLiteResultsStore
+from utils.uid_allocator import UidAllocator
+from utils.persistence_worker import (
+    PersistenceCommand,
+    PersistenceWorker,
+    RegisterUser,
+    UpdateTelegramId,
+    WriteTestResult,
+    WriteTrials,
+    FlushStore,
 )
+from utils.trial_store import Trial, TrialStore
+from utils.norms import NORMS_HEADERS, NormsEngine, Percentile
+from utils.stats_sketch import MetricSummary, ResultStats
 
 logger = logging.getLogger(__name__)
 
+ResultsStore = Union[
+    ExcelResultsStore, ShardedExcelResultsStore, SQLiteResultsStore
+]
+# In-memory workbook stores: schema-migrated on load, journaled and flushed.
+ExcelBackedStore = Union[ExcelResultsStore, ShardedExcelResultsStore]
+
+# Loaded once by initialize_excel_file(); all reads and writes go through it.
+_results_store: Optional[ResultsStore] = None
+_results_store_init_lock = threading.Lock()
+# Excel backends only: mutations are journaled before they reach memory.
+_results_journal: Optional[ResultsJournal] = None
+_trial_store = TrialStore(TRIALS_DIR)
+# Called as listener(uid, saved_results, full_row) after every result save,
+# in the persistence worker thread.
+ResultsListener = Callable[[str, Dict[str, Any], Dict[str, Any]], None]
+_results_listeners: List[ResultsListener] = []
+norms_engine = NormsEngine(NORMS_AGE_BANDS, NORMS_MIN_SAMPLE_SIZE)
+result_stats = ResultStats(
+    RESULT_STATS_FILENAME,
+    [h for headers in RESULT_HEADER_GROUPS.values() for h in headers],
+)
+_uid_allocator = UidAllocator(
+    UID_ALLOCATOR_FILENAME, UID_MIN, UID_MAX, UID_BLOCK_SIZE
+)
+
+# Header whose value marks a test as completed; bit i = i-th entry.
+TEST_COMPLETION_HEADERS = [
+    "Corsi - Max Correct Sequence Length",
+    "Stroop Part1 Time (s)",
+    "ReactionTime_Status",
+    "VerbalFluency_WordCount",
+    "MentalRotation_CorrectAnswers",
+    "RavenMatrices_CorrectAnswers",
+]
+_COMPLETION_BIT = {h: 1 << i for i, h in enumerate(TEST_COMPLETION_HEADERS)}
+# UID -> completion bitmap; filled when a profile is read, kept current by saves.
+_completion_bits: Dict[str, int] = {}
+# UID -> (variant, rendered /mydata text); dropped on any write to that UID.
+_user_data_text_cache: Dict[str, Tuple[Any, str]] = {}
+_user_data_versions: Dict[str, int] = {}
+
 
 def initialize_excel_file():
     """
     Initializes the Excel file.
     Creates it with all expected headers if it doesn't exist.
-    If it exists, checks and adds any missing headers from ALL_EXPECTED_HEADERS
-    to the end of the first row.
+    Loads the file into the in-memory results store; if any headers from
+    ALL_EXPECTED_HEADERS are missing, they are appended to the first row.
+    With RESULTS_BACKEND = "sqlite" or "excel_sharded" the xlsx is only an
+    export, so this just opens the database or the shards (importing
+    EXCEL_FILENAME into them on first run).
     """
+    if RESULTS_BACKEND in ("sqlite", "excel_sharded"):
+        _load_results_store()
+        return
+
     if not os.path.exists(EXCEL_FILENAME):
         wb = Workbook()
         ws = wb.active
@@ -32,178 +128,358 @@ def initialize_excel_file():
             logger.info(
                 f"Файл '{EXCEL_FILENAME}' создан со всеми заголовками."
             )
+            _load_results_store()
         except Exception as e_save:
             logger.error(
                 f"Не удалось сохранить новый файл '{EXCEL_FILENAME}': {e_save}"
             )
     else:
+        # The schema check uses the header row parsed by the store load;
+        # the file is rewritten only if expected headers are missing.
+        _load_results_store()
+
+
+# --- Results Store Access ---
+def _load_results_store() -> Optional[ResultsStore]:
+    """Opens the configured results backend (RESULTS_BACKEND)."""
+    global _results_store
+    store: ResultsStore
+    if RESULTS_BACKEND == "sqlite":
+        store = SQLiteResultsStore(
+            SQLITE_DB_FILENAME,
+            BASE_HEADERS,
+            RESULT_HEADER_GROUPS,
+            import_from_excel=EXCEL_FILENAME,
+        )
+        source = SQLITE_DB_FILENAME
+    elif RESULTS_BACKEND == "excel_sharded":
+        store = ShardedExcelResultsStore(
+            RESULTS_SHARD_DIR,
+            RESULTS_SHARD_MANIFEST,
+            os.path.splitext(os.path.basename(EXCEL_FILENAME))[0],
+            ALL_EXPECTED_HEADERS,
+            RESULTS_SHARD_PERIOD_MONTHS,
+            RESULTS_FLUSH_INTERVAL_S,
+            RESULTS_FLUSH_DIRTY_ROWS,
+            import_from_excel=EXCEL_FILENAME,
+        )
+        source = RESULTS_SHARD_MANIFEST
+    else:
+        store = ExcelResultsStore(
+            EXCEL_FILENAME, RESULTS_FLUSH_INTERVAL_S, RESULTS_FLUSH_DIRTY_ROWS
+        )
+        source = EXCEL_FILENAME
+    try:
+        store.load()
+    except InvalidFileException:
+        logger.error(
+            f"Файл '{source}' поврежден. Хранилище результатов не загружено."
+        )
+        return None
+    except Exception as e:
+        logger.error(
+            f"Ошибка загрузки хранилища результатов из '{source}': {e}",
+            exc_info=True,
+        )
+        return None
+    result_stats.load()  # Before the journal replay, which updates it
+    if isinstance(store, (ExcelResultsStore, ShardedExcelResultsStore)):
+        _migrate_headers(store)
+        _open_results_journal(store)
+    _results_store = store
+    return store
+
+
+def _migrate_headers(store: ExcelBackedStore):
+    """Appends missing expected headers; rewrites the file only if needed."""
+    added = store.add_headers(ALL_EXPECTED_HEADERS)
+    if not added:
+        logger.info(f"Заголовки в '{EXCEL_FILENAME}' актуальны.")
+        return
+    try:
+        store.flush()
+        logger.info(
+            f"В '{EXCEL_FILENAME}' добавлены недостающие заголовки: {added}"
+        )
+    except Exception as e:
+        # Kept in memory; written by the next flush
+        logger.error(
+            f"Не удалось записать новые заголовки в '{EXCEL_FILENAME}': {e}",
+            exc_info=True,
+        )
+
+
+def _open_results_journal(store: ExcelBackedStore):
+    """
+    Replays the un-compacted journal tail into the freshly loaded store,
+    folds it into EXCEL_FILENAME and keeps the journal open for new writes.
+    """
+    global _results_journal
+    if _results_journal is not None:
+        _results_journal.close()
+    journal = ResultsJournal(RESULTS_JOURNAL_FILENAME)
+    journal.advance_seq(result_stats.journal_seq)
+    try:
+        replayed = journal.replay(
+            lambda record: _apply_journal_record(store, record)
+        )
+    except Exception as e:
+        logger.error(
+            f"Ошибка воспроизведения журнала '{RESULTS_JOURNAL_FILENAME}': {e}",
+            exc_info=True,
+        )
+        replayed = 0
+    if replayed:
+        logger.info(
+            f"Журнал результатов: воспроизведено {replayed} записей из '{RESULTS_JOURNAL_FILENAME}'."
+        )
         try:
-            wb = load_workbook(EXCEL_FILENAME)
-            ws = wb.active
-
-            if ws.max_row == 0:
-                ws.append(ALL_EXPECTED_HEADERS)
-                wb.save(EXCEL_FILENAME)
-                logger.info(
-                    f"Лист в '{EXCEL_FILENAME}' был пуст. Добавлены все заголовки."
-                )
-                return
-
-            current_header_values = [cell.value for cell in ws[1]]
-            existing_header_set = set(filter(None, current_header_values))
-            headers_actually_added_to_file = []
-
-            start_col_for_new_headers = 0
-            for col_idx_plus_1, cell_val in enumerate(
-                current_header_values, 1
-            ):
-                if cell_val is not None:
-                    start_col_for_new_headers = col_idx_plus_1
-            start_col_for_new_headers += 1
-
-            if not existing_header_set and not any(
-                current_header_values
-            ):  # if all are None or empty
-                start_col_for_new_headers = 1
-
-            for header_to_add in ALL_EXPECTED_HEADERS:
-                if header_to_add not in existing_header_set:
-                    # Find the next available column dynamically if there are gaps
-                    current_max_col_with_data = 0
-                    for cell_idx_in_row1, cell_in_row1 in enumerate(ws[1], 1):
-                        if cell_in_row1.value is not None:
-                            current_max_col_with_data = cell_idx_in_row1
-
-                    col_to_write = current_max_col_with_data + 1
-                    if not existing_header_set and not any(
-                        current_header_values
-                    ):  # First header in an "empty" row
-                        col_to_write = 1
-
-                    # Ensure we are not overwriting existing headers if logic got complex
-                    # For now, simple append logic at calculated start_col_for_new_headers
-                    # The refined logic: iterate through ALL_EXPECTED_HEADERS, if a header is missing,
-                    # find the first empty column in row 1 (or one after last known header) and write it.
-                    # This part can be tricky if headers are sparse.
-
-                    # Simplified: Add to the determined 'start_col_for_new_headers' and increment it
-                    ws.cell(row=1, column=start_col_for_new_headers).value = (
-                        header_to_add
-                    )
-                    headers_actually_added_to_file.append(header_to_add)
-                    existing_header_set.add(
-                        header_to_add
-                    )  # Add to set to track for this run
-                    start_col_for_new_headers += 1
-
-            if headers_actually_added_to_file:
-                logger.info(
-                    f"В '{EXCEL_FILENAME}' добавлены недостающие заголовки: {headers_actually_added_to_file}"
-                )
-                wb.save(EXCEL_FILENAME)
-            else:
-                logger.info(f"Заголовки в '{EXCEL_FILENAME}' актуальны.")
-
-        except InvalidFileException:
-            logger.error(
-                f"Файл '{EXCEL_FILENAME}' поврежден или не является валидным Excel файлом. "
-                "Требуется ручная проверка."
-            )
+            store.flush()
+            result_stats.save(journal.last_seq)
+            journal.truncate()
         except Exception as e:
+            # The journal is kept and replayed again on the next start
             logger.error(
-                f"Ошибка при инициализации/обновлении Excel файла '{EXCEL_FILENAME}': {e}. "
-                "Требуется ручная проверка.",
+                f"Не удалось свернуть журнал в '{EXCEL_FILENAME}': {e}",
                 exc_info=True,
             )
+    _results_journal = journal
 
 
-# --- New Profile Management Functions ---
-def generate_unique_id(existing_ids: Set[str]) -> Optional[int]:
-    """Generates a unique ID (integer) not present in existing_ids (set of strings)."""
-    min_uid, max_uid = 1000000, 9999999  # Example range for 7-digit UIDs
-    attempts = 0
-    max_attempts = 1000  # Prevent infinite loop
-    while attempts < max_attempts:
-        candidate_uid = random.randint(min_uid, max_uid)
-        if str(candidate_uid) not in existing_ids:
-            return candidate_uid
-        attempts += 1
-    logger.critical(
-        f"Не удалось сгенерировать уникальный UID после {max_attempts} попыток."
+def _apply_journal_record(store: ResultsStore, record: Dict[str, Any]):
+    values = dict(record.get("values") or {})
+    seq = record.get("seq")
+    # Already in the saved stats if they were saved before the compaction
+    skip = (
+        (_fold_result_stats,)
+        if isinstance(seq, int) and seq <= result_stats.journal_seq
+        else ()
     )
-    return None
+    if record.get("op") == "append":
+        uid = str(values.get("Unique ID"))
+        if not store.has_uid(uid):
+            store.append_row(values)
+        else:
+            values.pop("Unique ID", None)  # Flushed before the crash
+            store.update_row(uid, values)
+    else:
+        uid = str(record.get("uid"))
+        store.update_row(uid, values)
+    _notify_results_listeners(store, uid, values, skip)
+
+
+def _store_append_row(store: ResultsStore, values: Dict[str, Any]):
+    if _results_journal is not None:
+        _results_journal.append({"op": "append", "values": values})
+    store.append_row(values)
+    _invalidate_user_data_text(str(values.get("Unique ID")))
+
+
+def _store_update_row(
+    store: ResultsStore, uid: str, values: Dict[str, Any]
+) -> bool:
+    """Like store.update_row; only existing rows are journaled."""
+    if not store.has_uid(uid):
+        return False
+    if _results_journal is not None:
+        _results_journal.append({"op": "update", "uid": uid, "values": values})
+    updated = store.update_row(uid, values)
+    _invalidate_user_data_text(uid)
+    return updated
+
+
+def get_results_store() -> Optional[ResultsStore]:
+    """
+    Returns the in-memory results store, initializing the Excel file and
+    loading the store on first use. Returns None if the file is unusable.
+    """
+    if _results_store is None:
+        with _results_store_init_lock:
+            if _results_store is None:
+                initialize_excel_file()
+    return _results_store
+
+
+async def get_results_store_async() -> Optional[ResultsStore]:
+    """
+    get_results_store() for coroutines: the store is loaded at startup, and
+    if that failed the retry runs in a thread, not on the event loop.
+    """
+    if _results_store is not None:
+        return _results_store
+    return await asyncio.to_thread(get_results_store)
+
+
+def flush_results_store() -> bool:
+    """
+    Writes pending in-memory changes to EXCEL_FILENAME and compacts the
+    journal once nothing is left unflushed. Call it from the persistence
+    worker, or after the worker has stopped.
+    This is a synchronous function. Returns True if the file was written.
+    """
+    if _results_store is None:
+        return False
+    try:
+        written = _results_store.flush()
+    except Exception as e:
+        logger.error(
+            f"Ошибка сброса хранилища результатов в '{EXCEL_FILENAME}': {e}",
+            exc_info=True,
+        )
+        return False
+    journal_seq = _results_journal.last_seq if _results_journal else 0
+    try:
+        result_stats.save(journal_seq)
+    except OSError as e:
+        logger.error(
+            f"Не удалось записать статистику в '{RESULT_STATS_FILENAME}': {e}"
+        )
+        return written  # The journal still holds the unsaved stats input
+    if _results_journal is not None and _results_store.dirty_count == 0:
+        try:
+            _results_journal.truncate()
+        except OSError as e:
+            logger.error(
+                f"Не удалось очистить журнал '{RESULTS_JOURNAL_FILENAME}': {e}"
+            )
+    return written
+
+
+def build_export_file(options: ExportOptions) -> Optional[Tuple[str, int]]:
+    """
+    Streams a snapshot of the results store into a temporary export file.
+    Returns (path, row_count) or None on failure; the caller deletes the file.
+    Never touches EXCEL_FILENAME, so saves and flushes are not blocked.
+    This is a synchronous function.
+    """
+    store = get_results_store()
+    if store is None:
+        return None
+    try:
+        return write_export(store, options)
+    except Exception as e:
+        logger.error(f"Ошибка подготовки файла экспорта: {e}", exc_info=True)
+        return None
+
+
+async def run_results_flusher():
+    """
+    Background task: flushes the results store whenever the flush interval
+    has elapsed or enough rows are dirty. Runs until cancelled.
+    The flush goes through the persistence worker so it never races a write.
+    """
+    while True:
+        await asyncio.sleep(RESULTS_FLUSH_CHECK_INTERVAL_S)
+        if _results_store_needs_flush():
+            await _submit_persistence_command(FlushStore())
+
+
+# --- Single-Writer Persistence Worker ---
+def _results_store_needs_flush() -> bool:
+    if _results_store is None:
+        return False
+    return _results_store.needs_flush() or result_stats.needs_save(
+        RESULTS_FLUSH_INTERVAL_S
+    )
+
+
+def _apply_persistence_command(command: PersistenceCommand) -> Any:
+    """Applies one queued mutation. Runs in the worker thread."""
+    if isinstance(command, RegisterUser):
+        return create_user_profile_in_excel(
+            command.name, command.age, command.tgid
+        )
+    if isinstance(command, UpdateTelegramId):
+        return _update_telegram_id_in_store(command.uid, command.tgid)
+    if isinstance(command, WriteTestResult):
+        return _write_test_results_to_store(
+            command.uid, command.results, command.profile
+        )
+    if isinstance(command, WriteTrials):
+        return _trial_store.append(command.test, command.uid, command.trials)
+    if isinstance(command, FlushStore):
+        return flush_results_store()
+    raise TypeError(f"Неизвестная команда: {type(command).__name__}")
+
+
+_persistence_worker = PersistenceWorker(
+    _apply_persistence_command,
+    flush_results_store,
+    _results_store_needs_flush,
+)
+
+
+def start_persistence_worker() -> asyncio.Task:
+    """Starts the single writer; call once from the running event loop."""
+    return _persistence_worker.start()
+
+
+async def stop_persistence_worker():
+    """Applies all queued mutations, flushes and stops the writer."""
+    await _persistence_worker.stop()
+
+
+async def _submit_persistence_command(command: PersistenceCommand) -> Any:
+    """
+    Enqueues a mutation and awaits its acknowledgement.
+    Without a running worker (e.g. scripts) the command is applied directly
+    in a thread.
+    """
+    if _persistence_worker.is_running:
+        return await _persistence_worker.submit(command)
+    return await asyncio.to_thread(_apply_persistence_command, command)
+
+
+# --- New Profile Management Functions ---
+def generate_unique_id(existing_ids: Container[str]) -> Optional[int]:
+    """
+    Allocates a unique ID (integer) not present in existing_ids (strings).
+    Backed by the persisted UID_ALLOCATOR_FILENAME counter, so it is O(1).
+    """
+    try:
+        return _uid_allocator.allocate(existing_ids)
+    except Exception as e:
+        logger.critical(f"Не удалось выделить UID: {e}", exc_info=True)
+        return None
 
 
 def create_user_profile_in_excel(
     name: str, age: int, tgid: int
 ) -> Optional[int]:
     """
-    Registers a new user in the Excel file and returns their UID.
+    Registers a new user in the results store and returns their UID.
     Returns None if registration fails.
     This is a synchronous function.
     """
     try:
-        if not os.path.exists(EXCEL_FILENAME):
+        store = get_results_store()
+        if store is None:
             logger.error(
-                f"Excel файл '{EXCEL_FILENAME}' не найден. Невозможно создать профиль."
+                f"Excel файл '{EXCEL_FILENAME}' недоступен. Невозможно создать профиль."
             )
-            # Initialize if not exists (optional, depends on desired behavior)
-            initialize_excel_file()
-            if not os.path.exists(
-                EXCEL_FILENAME
-            ):  # Check again after init attempt
-                return None
-
-        wb = load_workbook(EXCEL_FILENAME)
-        ws = wb.active
-
-        # Ensure headers are present (especially 'Unique ID')
-        excel_headers = [cell.value for cell in ws[1]]
-        if not excel_headers or "Unique ID" not in excel_headers:
+            return None
+        if not store.has_header("Unique ID"):
             logger.error(
-                "Excel: 'Unique ID' заголовок отсутствует или файл пуст. Попытка инициализации..."
+                "Excel: 'Unique ID' заголовок отсутствует. Невозможно создать профиль."
             )
-            initialize_excel_file()  # Try to re-initialize headers
-            wb = load_workbook(EXCEL_FILENAME)  # Re-load after potential init
-            ws = wb.active
-            excel_headers = [cell.value for cell in ws[1]]
-            if "Unique ID" not in excel_headers:
-                logger.error(
-                    "Excel: 'Unique ID' все еще отсутствует после повторной инициализации."
-                )
-                return None
-
-        uid_col_idx_excel = excel_headers.index("Unique ID")
-
-        existing_ids_from_excel: Set[str] = set()
-        for row_tuple in ws.iter_rows(min_row=2, values_only=True):
-            if (
-                uid_col_idx_excel < len(row_tuple)
-                and row_tuple[uid_col_idx_excel] is not None
-            ):
-                existing_ids_from_excel.add(str(row_tuple[uid_col_idx_excel]))
+            return None
 
-        new_uid = generate_unique_id(existing_ids_from_excel)
+        new_uid = generate_unique_id(store.uid_keys())
         if new_uid is None:
             return None  # Failed to generate UID
 
-        # Use ALL_EXPECTED_HEADERS to map data to the correct columns
-        new_row_data = [""] * len(ALL_EXPECTED_HEADERS)
-        header_to_index_map = {
-            header: i for i, header in enumerate(ALL_EXPECTED_HEADERS)
-        }
-
-        if "Telegram ID" in header_to_index_map:
-            new_row_data[header_to_index_map["Telegram ID"]] = tgid
-        if "Unique ID" in header_to_index_map:
-            new_row_data[header_to_index_map["Unique ID"]] = new_uid
-        if "Name" in header_to_index_map:
-            new_row_data[header_to_index_map["Name"]] = name
-        if "Age" in header_to_index_map:
-            new_row_data[header_to_index_map["Age"]] = age
-
-        ws.append(new_row_data)
-        wb.save(EXCEL_FILENAME)
+        _store_append_row(
+            store,
+            {
+                "Telegram ID": tgid,
+                "Unique ID": new_uid,
+                "Name": name,
+                "Age": age,
+                REGISTERED_AT_HEADER: datetime.now().isoformat(
+                    timespec="seconds"
+                ),
+            },
+        )
         logger.info(
             f"Новый пользователь зарегистрирован в Excel: UID {new_uid}, TGID {tgid}, Имя '{name}', Возраст {age}"
         )
@@ -216,222 +492,194 @@ def create_user_profile_in_excel(
         return None
 
 
-def find_user_profile_in_excel(
+def _read_user_profile(
     uid_to_find: str, current_tgid: Optional[int] = None
 ) -> Optional[Dict[str, Any]]:
     """
-    Finds a user profile by UID in Excel. Optionally updates Telegram ID.
-    Returns a dictionary with profile data if found, else None.
-    Keys in returned dict: 'unique_id', 'telegram_id', 'name', 'age'.
-    This is a synchronous function.
+    Reads a profile from the results store without modifying it.
+    Adds a private '_stored_telegram_id' key (the raw stored value or None)
+    so callers can decide whether the Telegram ID needs updating.
     """
     try:
-        if not os.path.exists(EXCEL_FILENAME):
-            logger.warning(
-                f"Excel файл '{EXCEL_FILENAME}' не найден при поиске профиля UID {uid_to_find}."
-            )
-            return None
-
-        wb = load_workbook(EXCEL_FILENAME)
-        ws = wb.active
-
-        if ws.max_row < 1:  # No headers
+        store = get_results_store()
+        if store is None:
             logger.warning(
-                f"Excel файл '{EXCEL_FILENAME}' пуст (нет заголовков) при поиске UID {uid_to_find}."
+                f"Excel файл '{EXCEL_FILENAME}' недоступен при поиске профиля UID {uid_to_find}."
             )
             return None
-
-        header_row_excel = [cell.value for cell in ws[1]]
-
-        if "Unique ID" not in header_row_excel:
+        if not store.has_header("Unique ID"):
             logger.error(
                 "Excel: 'Unique ID' заголовок отсутствует в файле при поиске профиля."
             )
             return None
 
-        # Get column indices based on actual headers in the file
-        try:
-            uid_col_idx = header_row_excel.index("Unique ID")
-            tg_id_col_idx = (
-                header_row_excel.index("Telegram ID")
-                if "Telegram ID" in header_row_excel
-                else -1
-            )
-            name_col_idx = (
-                header_row_excel.index("Name")
-                if "Name" in header_row_excel
-                else -1
-            )
-            age_col_idx = (
-                header_row_excel.index("Age")
-                if "Age" in header_row_excel
-                else -1
-            )
-        except (
-            ValueError
-        ) as ve:  # Should not happen if "Unique ID" check passed, but for safety
-            logger.error(f"Excel: Ошибка поиска индекса заголовка: {ve}")
+        row = store.get_row(uid_to_find)
+        if row is None:
             return None
+        _completion_bits.setdefault(
+            str(uid_to_find), _completion_bits_from_row(row)
+        )
 
-        found_profile_data: Optional[Dict[str, Any]] = None
-        row_to_update_tgid_excel_num = -1  # 1-based Excel row number
-
-        for row_idx_excel, row_values in enumerate(
-            ws.iter_rows(min_row=2, values_only=True), start=2
-        ):
-            excel_uid_value = (
-                row_values[uid_col_idx]
-                if uid_col_idx < len(row_values)
-                else None
-            )
-            if (
-                excel_uid_value is not None
-                and str(excel_uid_value) == uid_to_find
-            ):
-                found_profile_data = {
-                    "unique_id": str(excel_uid_value),
-                    "telegram_id": (
-                        str(row_values[tg_id_col_idx])
-                        if tg_id_col_idx != -1
-                        and tg_id_col_idx < len(row_values)
-                        and row_values[tg_id_col_idx] is not None
-                        else str(current_tgid or "N/A")
-                    ),
-                    "name": (
-                        str(row_values[name_col_idx])
-                        if name_col_idx != -1
-                        and name_col_idx < len(row_values)
-                        and row_values[name_col_idx] is not None
-                        else "N/A"
-                    ),
-                    "age": (
-                        str(row_values[age_col_idx])
-                        if age_col_idx != -1
-                        and age_col_idx < len(row_values)
-                        and row_values[age_col_idx] is not None
-                        else "N/A"
-                    ),
-                }
-                if current_tgid and tg_id_col_idx != -1:
-                    current_tg_id_in_excel_str = (
-                        str(row_values[tg_id_col_idx])
-                        if tg_id_col_idx < len(row_values)
-                        and row_values[tg_id_col_idx] is not None
-                        else None
-                    )
-                    if current_tg_id_in_excel_str != str(current_tgid):
-                        row_to_update_tgid_excel_num = row_idx_excel
-                break  # Found the UID
-
-        if (
-            row_to_update_tgid_excel_num != -1 and tg_id_col_idx != -1
-        ):  # TG ID needs update
-            ws.cell(
-                row=row_to_update_tgid_excel_num,
-                column=tg_id_col_idx + 1,
-                value=str(current_tgid),
-            )  # +1 for 1-based column
-            wb.save(EXCEL_FILENAME)
-            logger.info(
-                f"Обновлен Telegram ID для UID {uid_to_find} на {current_tgid} в Excel."
-            )
-            if (
-                found_profile_data
-            ):  # Update in-memory profile if it was already fetched
-                found_profile_data["telegram_id"] = str(current_tgid)
-
+        tg_id_value = row.get("Telegram ID")
+        name_value = row.get("Name")
+        age_value = row.get("Age")
+        found_profile_data: Dict[str, Any] = {
+            "unique_id": str(row.get("Unique ID")),
+            "telegram_id": (
+                str(tg_id_value)
+                if tg_id_value is not None
+                else str(current_tgid or "N/A")
+            ),
+            "name": str(name_value) if name_value is not None else "N/A",
+            "age": str(age_value) if age_value is not None else "N/A",
+            "_stored_telegram_id": (
+                str(tg_id_value) if tg_id_value is not None else None
+            ),
+        }
         return found_profile_data
-    except (
-        FileNotFoundError
-    ):  # Should be caught by os.path.exists earlier, but for safety
+    except Exception as e:
         logger.error(
-            f"Excel файл '{EXCEL_FILENAME}' не найден при поиске профиля (повторно)."
+            f"Ошибка поиска профиля UID {uid_to_find} в Excel: {e}",
+            exc_info=True,
         )
         return None
-    except InvalidFileException:
-        logger.error(
-            f"Excel файл '{EXCEL_FILENAME}' поврежден. Невозможно найти профиль."
-        )
+
+
+def _telegram_id_needs_update(
+    profile: Dict[str, Any], current_tgid: Optional[int]
+) -> bool:
+    store = _results_store
+    return bool(
+        current_tgid
+        and store is not None
+        and store.has_header("Telegram ID")
+        and profile.get("_stored_telegram_id") != str(current_tgid)
+    )
+
+
+def _update_telegram_id_in_store(uid: str, tgid: int) -> bool:
+    store = get_results_store()
+    if store is None or not _store_update_row(
+        store, uid, {"Telegram ID": str(tgid)}
+    ):
+        return False
+    logger.info(f"Обновлен Telegram ID для UID {uid} на {tgid} в Excel.")
+    return True
+
+
+def find_user_profile_in_excel(
+    uid_to_find: str, current_tgid: Optional[int] = None
+) -> Optional[Dict[str, Any]]:
+    """
+    Finds a user profile by UID in the results store. Optionally updates Telegram ID.
+    Returns a dictionary with profile data if found, else None.
+    Keys in returned dict: 'unique_id', 'telegram_id', 'name', 'age'.
+    This is a synchronous function; handlers should use find_user_profile().
+    """
+    profile = _read_user_profile(uid_to_find, current_tgid)
+    if profile is None:
+        return None
+    if _telegram_id_needs_update(profile, current_tgid):
+        if _update_telegram_id_in_store(uid_to_find, current_tgid):
+            profile["telegram_id"] = str(current_tgid)
+    profile.pop("_stored_telegram_id", None)
+    return profile
+
+
+async def find_user_profile(
+    uid_to_find: str, current_tgid: Optional[int] = None
+) -> Optional[Dict[str, Any]]:
+    """
+    Async version of find_user_profile_in_excel(): the read is served from
+    memory and a Telegram ID change is queued to the persistence worker.
+    """
+    await get_results_store_async()
+    profile = _read_user_profile(uid_to_find, current_tgid)
+    if profile is None:
         return None
+    if _telegram_id_needs_update(profile, current_tgid):
+        if await _submit_persistence_command(
+            UpdateTelegramId(uid=uid_to_find, tgid=current_tgid)
+        ):
+            profile["telegram_id"] = str(current_tgid)
+    profile.pop("_stored_telegram_id", None)
+    return profile
+
+
+async def register_user_profile(
+    name: str, age: int, tgid: int
+) -> Optional[int]:
+    """
+    Queues a registration to the persistence worker and returns the new UID,
+    or None if registration fails.
+    """
+    try:
+        return await _submit_persistence_command(
+            RegisterUser(name=name, age=age, tgid=tgid)
+        )
     except Exception as e:
         logger.error(
-            f"Ошибка поиска профиля UID {uid_to_find} в Excel: {e}",
+            f"Ошибка регистрации пользователя (Имя '{name}', TGID {tgid}): {e}",
             exc_info=True,
         )
         return None
 
 
+def find_uid_by_telegram_id(tgid: Union[str, int]) -> Optional[str]:
+    """
+    Returns the UID most recently linked to the Telegram ID, or None.
+    O(1) lookup in the results store's reverse index.
+    """
+    store = get_results_store()
+    if store is None:
+        return None
+    return store.find_uid_by_telegram_id(tgid)
+
+
 def get_all_user_data_from_excel(uid_to_find: str) -> Dict[str, Any]:
     """
-    Fetches all data for a given UID from Excel for display.
+    Fetches all data for a given UID from the results store for display.
     Returns a dictionary of data or a dictionary with an 'error' or 'info' key.
     This is a synchronous function.
     """
     data_for_display: Dict[str, Any] = {}
     try:
-        if not os.path.exists(EXCEL_FILENAME):
-            return {"error": f"Файл данных '{EXCEL_FILENAME}' не найден."}
-
-        wb = load_workbook(EXCEL_FILENAME)
-        ws = wb.active
+        store = get_results_store()
+        if store is None:
+            return {
+                "error": f"Файл данных '{EXCEL_FILENAME}' не найден или поврежден."
+            }
 
-        if ws.max_row < 1:
+        if not store.headers:
             return {
                 "info": f"Файл Excel '{EXCEL_FILENAME}' пуст (нет заголовков)."
             }
 
-        header_row_values = [cell.value for cell in ws[1]]
-
-        if "Unique ID" not in header_row_values:
+        if not store.has_header("Unique ID"):
             return {
                 "error": "Столбец 'Unique ID' не найден в заголовках файла Excel."
             }
 
-        uid_col_idx_excel = header_row_values.index("Unique ID")
-        found_in_excel = False
-
-        for row_tuple in ws.iter_rows(min_row=2, values_only=True):
-            excel_uid_val = (
-                row_tuple[uid_col_idx_excel]
-                if uid_col_idx_excel < len(row_tuple)
-                else None
-            )
-            if excel_uid_val is not None and str(excel_uid_val) == uid_to_find:
-                found_in_excel = True
-                for i, header_name in enumerate(header_row_values):
-                    if header_name is None:
-                        continue  # Skip empty header cells
-                    val_from_excel = (
-                        row_tuple[i] if i < len(row_tuple) else None
-                    )
-                    display_val = (
-                        val_from_excel
-                        if val_from_excel is not None
-                        else "нет данных"
-                    )
-                    if (
-                        isinstance(val_from_excel, float)
-                        and val_from_excel.is_integer()
-                    ):
-                        display_val = int(val_from_excel)
-                    data_for_display[str(header_name)] = str(display_val)
-                break  # Found and processed the user's row
-
-        if not found_in_excel:
+        row = store.get_row(uid_to_find)
+        if row is None:
             data_for_display["info"] = (
                 "Профиль с указанным UID не найден в файле Excel."
-                if ws.max_row > 1
+                if store.row_count() > 0
                 else "Файл Excel пуст (содержит только заголовки или пуст)."
             )
+            return data_for_display
+
+        for header_name, val_from_excel in row.items():
+            display_val = (
+                val_from_excel if val_from_excel is not None else "нет данных"
+            )
+            if (
+                isinstance(val_from_excel, float)
+                and val_from_excel.is_integer()
+            ):
+                display_val = int(val_from_excel)
+            data_for_display[str(header_name)] = str(display_val)
 
-    except InvalidFileException:
-        data_for_display["error"] = (
-            f"Файл '{EXCEL_FILENAME}' поврежден. Невозможно загрузить данные."
-        )
-    except ValueError as ve:  # e.g., header "Unique ID" not found by .index()
-        data_for_display["error"] = (
-            f"Ошибка конфигурации заголовков в файле Excel: {ve}"
-        )
     except Exception as e:
         data_for_display["error"] = (
             f"Ошибка при загрузке данных из Excel для UID {uid_to_find}: {e}"
@@ -440,6 +688,227 @@ def get_all_user_data_from_excel(uid_to_find: str) -> Dict[str, Any]:
     return data_for_display
 
 
+# --- Rendered /mydata Cache ---
+def _invalidate_user_data_text(uid: str):
+    _user_data_versions[uid] = _user_data_versions.get(uid, 0) + 1
+    _user_data_text_cache.pop(uid, None)
+
+
+def get_user_data_version(uid: str) -> int:
+    """Changes on every write to the UID's row; read it before the row."""
+    return _user_data_versions.get(str(uid), 0)
+
+
+def get_cached_user_data_text(uid: str, variant: Any) -> Optional[str]:
+    """
+    Returns the memoized /mydata text for the UID, or None.
+    'variant' covers render inputs that are not in the row (e.g. the name
+    shown from the session profile).
+    """
+    cached = _user_data_text_cache.get(str(uid))
+    if cached is None or cached[0] != variant:
+        return None
+    return cached[1]
+
+
+def cache_user_data_text(uid: str, variant: Any, text: str, version: int):
+    """Memoizes the text unless the row changed since 'version' was read."""
+    uid = str(uid)
+    if _user_data_versions.get(uid, 0) == version:
+        _user_data_text_cache[uid] = (variant, text)
+
+
+# --- Test Result Saving (async) ---
+async def save_test_results(
+    profile_unique_id: Union[str, int],
+    results: Dict[str, Any],
+    profile: Optional[Dict[str, Any]] = None,
+) -> bool:
+    """
+    Writes a test's result columns ({header: value}) for the UID.
+    The write is queued to the persistence worker and acknowledged once it is
+    applied to the results store; it reaches disk on the next flush.
+    If the UID has no row yet, one is created from 'profile'
+    ('telegram_id', 'name', 'age'). Returns False on failure.
+    """
+    try:
+        return await _submit_persistence_command(
+            WriteTestResult(
+                uid=str(profile_unique_id), results=results, profile=profile
+            )
+        )
+    except Exception as e:
+        logger.error(
+            f"Ошибка сохранения результатов для UID {profile_unique_id}: {e}",
+            exc_info=True,
+        )
+        return False
+
+
+async def save_test_trials(
+    test: str, profile_unique_id: Union[str, int], trials: List[Trial]
+) -> bool:
+    """
+    Appends per-trial data (item, correct, RT) to the test's binary trial
+    file (see utils/trial_store.py), alongside the summary columns.
+    Goes through the persistence worker. Returns False on failure.
+    """
+    try:
+        await _submit_persistence_command(
+            WriteTrials(test=test, uid=str(profile_unique_id), trials=trials)
+        )
+        return True
+    except Exception as e:
+        logger.error(
+            f"Ошибка сохранения попыток {test} для UID {profile_unique_id}: {e}",
+            exc_info=True,
+        )
+        return False
+
+
+def _write_test_results_to_store(
+    profile_unique_id: Union[str, int],
+    results: Dict[str, Any],
+    profile: Optional[Dict[str, Any]] = None,
+) -> bool:
+    """Applies a WriteTestResult command. Runs in the worker thread."""
+    uid_str = str(profile_unique_id)
+    try:
+        store = get_results_store()
+        if store is None:
+            logger.error(
+                f"Сохранение результатов: файл '{EXCEL_FILENAME}' недоступен (UID {uid_str})."
+            )
+            return False
+        if not store.has_header("Unique ID"):
+            raise ValueError("Столбец 'Unique ID' не найден в Excel.")
+
+        if not _store_update_row(store, uid_str, results):
+            logger.info(
+                f"Сохранение результатов: UID {uid_str} не найден, добавление новой строки."
+            )
+            profile = profile or {}
+            new_row_values: Dict[str, Any] = {"Unique ID": profile_unique_id}
+            if profile.get("telegram_id"):
+                new_row_values["Telegram ID"] = profile["telegram_id"]
+            if profile.get("name"):
+                new_row_values["Name"] = profile["name"]
+            if profile.get("age"):
+                new_row_values["Age"] = profile["age"]
+            new_row_values.update(results)
+            _store_append_row(store, new_row_values)
+        _update_completion_bits(store, uid_str, results)
+        _notify_results_listeners(store, uid_str, results)
+        return True
+    except Exception as e:
+        logger.error(
+            f"Ошибка сохранения результатов для UID {uid_str}: {e}",
+            exc_info=True,
+        )
+        return False
+
+
+# --- Results Listeners ---
+def add_results_listener(listener: ResultsListener):
+    """Registers a callback invoked after every saved test result."""
+    _results_listeners.append(listener)
+
+
+def _notify_results_listeners(
+    store: ResultsStore,
+    uid: str,
+    results: Dict[str, Any],
+    skip: Container[ResultsListener] = (),
+):
+    row = store.get_row(uid) or {}
+    for listener in _results_listeners:
+        if listener in skip:
+            continue
+        try:
+            listener(uid, results, row)
+        except Exception as e:
+            logger.error(
+                f"Ошибка обработчика сохранения результатов для UID {uid}: {e}",
+                exc_info=True,
+            )
+
+
+# --- Norms ---
+def load_norms():
+    """
+    Builds the percentile norms from one snapshot of the results store;
+    afterwards they follow every save. This is a synchronous function.
+    """
+    store = get_results_store()
+    if store is None or not norms_engine.enabled:
+        return
+    norms_engine.load(store.iter_snapshot(NORMS_HEADERS), NORMS_HEADERS)
+
+
+def get_user_percentiles(uid: str) -> List[Percentile]:
+    return norms_engine.percentiles_for(uid)
+
+
+add_results_listener(
+    lambda uid, results, row: norms_engine.update_row(uid, row)
+)
+
+
+# --- Running Result Statistics ---
+def get_result_stats() -> Dict[str, MetricSummary]:
+    """Header -> running summary, for headers with at least one value."""
+    return result_stats.summaries()
+
+
+def _fold_result_stats(uid: str, results: Dict[str, Any], row: Dict[str, Any]):
+    result_stats.add_results(results)
+
+
+add_results_listener(_fold_result_stats)
+
+
+# --- Per-User Completion Bitmap ---
+def _has_result_value(value: Any) -> bool:
+    """Whether a result cell counts as filled in (test completed)."""
+    return value not in (None, "")
+
+
+def _completion_bits_from_row(row: Dict[str, Any]) -> int:
+    bits = 0
+    for header, bit in _COMPLETION_BIT.items():
+        if _has_result_value(row.get(header)):
+            bits |= bit
+    return bits
+
+
+def _update_completion_bits(
+    store: ResultsStore, uid: str, results: Dict[str, Any]
+):
+    """Called by the write path after the row is updated."""
+    bits = _completion_bits.get(uid)
+    if bits is None:
+        row = store.get_row(uid)
+        _completion_bits[uid] = _completion_bits_from_row(row) if row else 0
+        return
+    for header, value in results.items():
+        bit = _COMPLETION_BIT.get(header)
+        if bit is not None:
+            bits = bits | bit if _has_result_value(value) else bits & ~bit
+    _completion_bits[uid] = bits
+
+
+def _get_completion_bits(store: ResultsStore, uid: str) -> int:
+    """Cached bitmap for the UID; computed in one pass over its row if absent."""
+    bits = _completion_bits.get(uid)
+    if bits is not None:
+        return bits
+    row = store.get_row(uid)
+    if row is None:
+        return 0
+    # setdefault: a concurrent save may already have stored a fresher value
+    return _completion_bits.setdefault(uid, _completion_bits_from_row(row))
+
+
 # --- Existing Generic Result Check Functions (async) ---
 async def check_if_results_exist_generic(
     profile_unique_id: Union[str, int], result_header_to_check: str
@@ -456,62 +925,33 @@ async def check_if_results_exist_generic(
         return False
 
     try:
-        # This function is async, but openpyxl is sync.
-        # For frequent calls, consider making it sync and calling via to_thread
-        # or finding an async Excel library if performance becomes an issue.
-        # For now, keeping it as is, assuming calls are not extremely frequent.
-        if not os.path.exists(EXCEL_FILENAME):  # Check before loading
+        store = await get_results_store_async()
+        if store is None:
             logger.info(
-                f"Excel файл {EXCEL_FILENAME} не найден для проверки результатов (generic)."
+                f"Excel файл {EXCEL_FILENAME} недоступен для проверки результатов (generic)."
             )
             return False
 
-        wb = load_workbook(EXCEL_FILENAME)  # This is a sync I/O operation
-        ws = wb.active
-
-        if ws.max_row < 2:
-            return False
-
-        header_row_values = [cell.value for cell in ws[1]]
-
-        try:
-            uid_col_idx = header_row_values.index("Unique ID")
-        except ValueError:
+        if not store.has_header("Unique ID"):
             logger.error(
                 "Excel check (generic): Заголовок 'Unique ID' не найден."
             )
             return False
 
-        try:
-            result_col_idx = header_row_values.index(result_header_to_check)
-        except ValueError:
+        if not store.has_header(result_header_to_check):
             logger.warning(
                 f"Excel check (generic): Заголовок результата '{result_header_to_check}' не найден."
             )
             return False
 
-        for row_idx in range(2, ws.max_row + 1):
-            uid_cell = ws.cell(row=row_idx, column=uid_col_idx + 1)
-            if (
-                uid_cell.value is not None
-                and str(uid_cell.value) == uid_to_check_str
-            ):
-                result_cell = ws.cell(row=row_idx, column=result_col_idx + 1)
-                if result_cell.value is not None:
-                    return True
-        return False
-    except (
-        FileNotFoundError
-    ):  # Should be caught by os.path.exists, but defensive
-        logger.info(
-            f"Excel файл {EXCEL_FILENAME} не найден для проверки результатов (generic, fallback)."
+        completion_bit = _COMPLETION_BIT.get(result_header_to_check)
+        if completion_bit is not None:
+            bits = _get_completion_bits(store, uid_to_check_str)
+            return bool(bits & completion_bit)
+        row = store.get_row(uid_to_check_str)
+        return row is not None and _has_result_value(
+            row.get(result_header_to_check)
         )
-        return False
-    except InvalidFileException:
-        logger.error(
-            f"Excel файл {EXCEL_FILENAME} поврежден. Невозможно проверить результаты (generic)."
-        )
-        return False
     except Exception as e:
         logger.error(
             f"Ошибка при проверке результатов (generic) для UID {profile_unique_id}, заголовок '{result_header_to_check}': {e}",
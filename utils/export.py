@@ -0,0 +1,180 @@
+# utils/export.py
+import csv
+import gzip
+import logging
+import os
+import tempfile
+from dataclasses import dataclass
+from datetime import date, datetime
+from typing import Any, Iterable, List, Optional, Tuple
+
+from openpyxl import Workbook
+
+from settings import (
+    BASE_HEADERS,
+    REGISTERED_AT_HEADER,
+    RESULT_HEADER_GROUPS,
+)
+
+logger = logging.getLogger(__name__)
+
+EXPORT_FORMATS = ("xlsx", "csv", "csv.gz")
+
+
+@dataclass
+class ExportOptions:
+    fmt: str = "xlsx"
+    tests: Optional[List[str]] = None  # Keys of RESULT_HEADER_GROUPS
+    registered_from: Optional[date] = None
+    registered_to: Optional[date] = None  # Inclusive
+
+
+def parse_export_args(args: Optional[str]) -> ExportOptions:
+    """
+    Parses '/export [xlsx|csv|csv.gz] [tests=corsi,stroop]
+    [from=YYYY-MM-DD] [to=YYYY-MM-DD]'. Raises ValueError with a
+    user-facing message on bad input.
+    """
+    options = ExportOptions()
+    for token in (args or "").split():
+        key, sep, value = token.partition("=")
+        key = key.lower()
+        if not sep:
+            if key not in EXPORT_FORMATS:
+                raise ValueError(
+                    f"Неизвестный формат '{token}'. Доступны: {', '.join(EXPORT_FORMATS)}."
+                )
+            options.fmt = key
+        elif key == "tests":
+            tests = [t.strip().lower() for t in value.split(",") if t.strip()]
+            unknown = [t for t in tests if t not in RESULT_HEADER_GROUPS]
+            if unknown or not tests:
+                raise ValueError(
+                    f"Неизвестные тесты: {', '.join(unknown) or '(пусто)'}. "
+                    f"Доступны: {', '.join(RESULT_HEADER_GROUPS)}."
+                )
+            options.tests = tests
+        elif key in ("from", "to"):
+            try:
+                parsed = date.fromisoformat(value)
+            except ValueError:
+                raise ValueError(
+                    f"Неверная дата '{value}'. Ожидается формат ГГГГ-ММ-ДД."
+                ) from None
+            if key == "from":
+                options.registered_from = parsed
+            else:
+                options.registered_to = parsed
+        else:
+            raise ValueError(f"Неизвестный параметр '{key}'.")
+    return options
+
+
+def export_headers(options: ExportOptions) -> List[str]:
+    test_keys = options.tests or list(RESULT_HEADER_GROUPS)
+    return list(BASE_HEADERS) + [
+        h for key in test_keys for h in RESULT_HEADER_GROUPS[key]
+    ]
+
+
+def _registration_date(value: Any) -> Optional[date]:
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    if isinstance(value, str) and len(value) >= 10:
+        try:
+            return date.fromisoformat(value[:10])
+        except ValueError:
+            return None
+    return None
+
+
+def _filter_rows(
+    rows: Iterable[Tuple[Any, ...]],
+    headers: List[str],
+    options: ExportOptions,
+) -> Iterable[Tuple[Any, ...]]:
+    date_filtered = bool(options.registered_from or options.registered_to)
+    reg_idx = headers.index(REGISTERED_AT_HEADER) if date_filtered else -1
+    # With a test subset, only rows with results for at least one of them
+    test_idx = (
+        [i for i, h in enumerate(headers) if h not in BASE_HEADERS]
+        if options.tests
+        else []
+    )
+    for row in rows:
+        if date_filtered:
+            reg_date = _registration_date(row[reg_idx])
+            if reg_date is None:
+                continue  # Registered before dates were recorded
+            if options.registered_from and reg_date < options.registered_from:
+                continue
+            if options.registered_to and reg_date > options.registered_to:
+                continue
+        if test_idx and all(row[i] in (None, "") for i in test_idx):
+            continue
+        yield row
+
+
+def _write_xlsx(
+    path: str, headers: List[str], rows: Iterable[Tuple[Any, ...]]
+):
+    # write_only mode streams rows to disk without building cell objects
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet(title="Sheet")
+    ws.append(headers)
+    uid_idx = headers.index("Unique ID")
+    for row in rows:
+        uid = row[uid_idx]
+        if isinstance(uid, str) and uid.isdigit():
+            row = list(row)
+            row[uid_idx] = int(uid)  # UIDs are numeric in xlsx
+        ws.append(row)
+    wb.save(path)
+
+
+def _write_csv(
+    path: str,
+    headers: List[str],
+    rows: Iterable[Tuple[Any, ...]],
+    compress: bool,
+):
+    opener = gzip.open if compress else open
+    # utf-8-sig so that Excel opens Cyrillic text correctly
+    with opener(path, "wt", encoding="utf-8-sig", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(headers)
+        writer.writerows(rows)
+
+
+def write_export(store, options: ExportOptions) -> Tuple[str, int]:
+    """
+    Streams a snapshot of the results store into a temporary file and
+    returns (path, row_count). The caller owns the file and must delete it.
+    This is a synchronous function.
+    """
+    headers = export_headers(options)
+    counted = 0
+
+    def rows():
+        nonlocal counted
+        snapshot = store.iter_snapshot(headers)
+        for row in _filter_rows(snapshot, headers, options):
+            counted += 1
+            yield row
+
+    fd, path = tempfile.mkstemp(prefix="export_", suffix=f".{options.fmt}")
+    os.close(fd)
+    try:
+        if options.fmt == "xlsx":
+            _write_xlsx(path, headers, rows())
+        else:
+            _write_csv(path, headers, rows(), compress=options.fmt == "csv.gz")
+    except Exception:
+        os.remove(path)
+        raise
+    logger.info(
+        f"Экспорт: {counted} строк записано в '{path}' ({options.fmt})."
+    )
+    return path, counted
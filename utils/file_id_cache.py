@@ -0,0 +1,256 @@
+# utils/file_id_cache.py
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple, Union
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import (
+    BufferedInputFile,
+    FSInputFile,
+    InputMediaPhoto,
+    Message,
+)
+
+from settings import (
+    FILE_ID_CACHE_FILENAME,
+    FILE_ID_CACHE_SAVE_INTERVAL_S,
+    FILE_ID_CACHE_TRANSIENT_MAX_ENTRIES,
+)
+
+logger = logging.getLogger(__name__)
+
+# Path on disk or already encoded image bytes
+PhotoSource = Union[str, BufferedInputFile]
+
+
+class FileIdCache:
+    """
+    Persistent map from image content (SHA-1) to the Telegram file_id the
+    bot got back for it. file_ids belong to one bot, so entries are keyed
+    by bot id too. Reads are served from memory; changes only mark the
+    cache dirty and the small JSON file is rewritten off the event loop
+    (run_file_id_cache_saver, and once at shutdown).
+    One-off images (per-trial MR collages) are not persisted: they go to
+    a bounded in-memory LRU of transient_max_entries.
+    """
+
+    def __init__(self, filename: str, transient_max_entries: int):
+        self.filename = filename
+        self.transient_max_entries = transient_max_entries
+        self._file_ids: Dict[str, str] = {}
+        self._transient: "OrderedDict[str, str]" = OrderedDict()
+        self.dirty = False
+        # path -> ((size, mtime_ns), digest): files are hashed once
+        self._path_digests: Dict[str, Tuple[Tuple[int, int], str]] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._file_ids)
+
+    @staticmethod
+    def _key(bot_id: int, digest: str) -> str:
+        return f"{bot_id}:{digest}"
+
+    def get(self, bot_id: int, digest: str) -> Optional[str]:
+        key = self._key(bot_id, digest)
+        file_id = self._file_ids.get(key)
+        if file_id is None:
+            file_id = self._transient.get(key)
+            if file_id is not None:
+                self._transient.move_to_end(key)
+        return file_id
+
+    def put(
+        self, bot_id: int, digest: str, file_id: str, persist: bool = True
+    ):
+        key = self._key(bot_id, digest)
+        if not persist:
+            self._transient[key] = file_id
+            self._transient.move_to_end(key)
+            while len(self._transient) > self.transient_max_entries:
+                self._transient.popitem(last=False)
+            return
+        if self._file_ids.get(key) == file_id:
+            return
+        with self._lock:  # save() may be copying the map in a thread
+            self._file_ids[key] = file_id
+            self.dirty = True
+
+    def forget(self, bot_id: int, digest: str):
+        key = self._key(bot_id, digest)
+        self._transient.pop(key, None)
+        with self._lock:
+            if self._file_ids.pop(key, None) is not None:
+                self.dirty = True
+
+    def digest_for_path(self, path: str) -> str:
+        stat = os.stat(path)
+        fingerprint = (stat.st_size, stat.st_mtime_ns)
+        cached = self._path_digests.get(path)
+        if cached is not None and cached[0] == fingerprint:
+            return cached[1]
+        with open(path, "rb") as f:
+            digest = hashlib.sha1(f.read()).hexdigest()
+        self._path_digests[path] = (fingerprint, digest)
+        return digest
+
+    @staticmethod
+    def digest_for_bytes(data: bytes) -> str:
+        return hashlib.sha1(data).hexdigest()
+
+    def digest_for(self, source: PhotoSource) -> str:
+        if isinstance(source, BufferedInputFile):
+            return self.digest_for_bytes(source.data)
+        return self.digest_for_path(source)
+
+    def load(self):
+        if not os.path.exists(self.filename):
+            return
+        try:
+            with open(self.filename, "r", encoding="utf-8") as f:
+                file_ids = json.load(f).get("file_ids", {})
+        except (ValueError, AttributeError) as e:
+            logger.error(
+                f"Кэш file_id '{self.filename}' повреждён и будет создан заново: {e}"
+            )
+            return
+        with self._lock:
+            self._file_ids = {str(k): str(v) for k, v in file_ids.items()}
+            self.dirty = False
+        logger.info(f"Кэш file_id: загружено {len(self._file_ids)} записей.")
+
+    def save(self) -> bool:
+        """
+        Rewrites the JSON file if anything changed. Blocking: called via
+        asyncio.to_thread. Returns True if the file was written.
+        """
+        with self._lock:
+            if not self.dirty:
+                return False
+            data = {"file_ids": dict(self._file_ids)}
+            self.dirty = False
+        tmp_filename = f"{self.filename}.tmp"
+        try:
+            with open(tmp_filename, "w", encoding="utf-8") as f:
+                json.dump(data, f)
+            os.replace(tmp_filename, self.filename)
+        except OSError as e:
+            logger.error(f"Не удалось сохранить кэш file_id: {e}")
+            self.dirty = True  # Retried on the next pass
+            return False
+        return True
+
+
+file_id_cache = FileIdCache(
+    FILE_ID_CACHE_FILENAME, FILE_ID_CACHE_TRANSIENT_MAX_ENTRIES
+)
+
+
+async def run_file_id_cache_saver(
+    interval_s: float = FILE_ID_CACHE_SAVE_INTERVAL_S,
+):
+    """Background task: saves the file_id cache from a thread every interval_s."""
+    while True:
+        await asyncio.sleep(interval_s)
+        if file_id_cache.dirty:
+            await asyncio.to_thread(file_id_cache.save)
+
+
+def _photo_file_id(message: Any) -> Optional[str]:
+    if isinstance(message, Message) and message.photo:
+        return message.photo[-1].file_id
+    return None
+
+
+def _is_file_id_error(error: TelegramBadRequest) -> bool:
+    # "wrong file identifier", "wrong remote file identifier specified", ...
+    return "file" in str(error).lower()
+
+
+def _as_input_file(source: PhotoSource):
+    return FSInputFile(source) if isinstance(source, str) else source
+
+
+async def send_photo_cached(
+    bot: Bot,
+    chat_id: int,
+    source: PhotoSource,
+    persist: bool = True,
+    **kwargs: Any,
+) -> Message:
+    """
+    bot.send_photo that sends a known image by file_id and remembers the
+    file_id of a first upload (persist=False: only in the in-memory LRU).
+    A file_id Telegram rejects is dropped and the image uploaded again.
+    """
+    digest = file_id_cache.digest_for(source)
+    file_id = file_id_cache.get(bot.id, digest)
+    if file_id is not None:
+        try:
+            return await bot.send_photo(chat_id, photo=file_id, **kwargs)
+        except TelegramBadRequest as e:
+            if not _is_file_id_error(e):
+                raise
+            logger.warning(
+                f"Кэш file_id: file_id отклонён ({e}), повторная загрузка."
+            )
+            file_id_cache.forget(bot.id, digest)
+    msg = await bot.send_photo(chat_id, photo=_as_input_file(source), **kwargs)
+    new_file_id = _photo_file_id(msg)
+    if new_file_id:
+        file_id_cache.put(bot.id, digest, new_file_id, persist)
+    return msg
+
+
+async def edit_photo_cached(
+    bot: Bot,
+    chat_id: int,
+    message_id: int,
+    source: PhotoSource,
+    caption: Optional[str] = None,
+    parse_mode: Optional[str] = None,
+    persist: bool = True,
+    **kwargs: Any,
+) -> Union[Message, bool]:
+    """bot.edit_message_media with an InputMediaPhoto, via the file_id cache."""
+
+    def media(photo) -> InputMediaPhoto:
+        if parse_mode is None:
+            return InputMediaPhoto(media=photo, caption=caption)
+        return InputMediaPhoto(
+            media=photo, caption=caption, parse_mode=parse_mode
+        )
+
+    digest = file_id_cache.digest_for(source)
+    file_id = file_id_cache.get(bot.id, digest)
+    if file_id is not None:
+        try:
+            return await bot.edit_message_media(
+                chat_id=chat_id,
+                message_id=message_id,
+                media=media(file_id),
+                **kwargs,
+            )
+        except TelegramBadRequest as e:
+            if not _is_file_id_error(e):
+                raise
+            logger.warning(
+                f"Кэш file_id: file_id отклонён ({e}), повторная загрузка."
+            )
+            file_id_cache.forget(bot.id, digest)
+    result = await bot.edit_message_media(
+        chat_id=chat_id,
+        message_id=message_id,
+        media=media(_as_input_file(source)),
+        **kwargs,
+    )
+    new_file_id = _photo_file_id(result)
+    if new_file_id:
+        file_id_cache.put(bot.id, digest, new_file_id, persist)
+    return result
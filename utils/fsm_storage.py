@@ -0,0 +1,320 @@
+# utils/fsm_storage.py
+import asyncio
+import logging
+import pickle
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Mapping, Optional, Tuple
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+
+logger = logging.getLogger(__name__)
+
+FSM_TABLE = "fsm_sessions"
+
+
+def _storage_key(key: StorageKey) -> str:
+    return ":".join(
+        str(part) if part is not None else ""
+        for part in (
+            key.bot_id,
+            key.chat_id,
+            key.user_id,
+            key.thread_id,
+            key.business_connection_id,
+            key.destiny,
+        )
+    )
+
+
+def _parse_storage_key(db_key: str) -> StorageKey:
+    bot_id, chat_id, user_id, thread_id, business_id, destiny = db_key.split(
+        ":", 5
+    )
+    return StorageKey(
+        bot_id=int(bot_id),
+        chat_id=int(chat_id),
+        user_id=int(user_id),
+        thread_id=int(thread_id) if thread_id else None,
+        business_connection_id=business_id or None,
+        destiny=destiny,
+    )
+
+
+def _state_name(state: StateType) -> Optional[str]:
+    return state.state if isinstance(state, State) else state
+
+
+class _Session:
+    __slots__ = ("state", "data", "pinned")
+
+    def __init__(self, state: Optional[str], data: Dict[str, Any]):
+        self.state = state
+        self.data = data
+        # Holds values that cannot be persisted (e.g. running asyncio.Task);
+        # such sessions are never evicted, or those values would be lost.
+        self.pinned = False
+
+
+class SQLiteStorage(BaseStorage):
+    """
+    aiogram FSM storage on stdlib sqlite3 (WAL) with a write-behind LRU
+    cache. Reads are served from memory; a session missing from the cache is
+    loaded on a worker thread. set_state/set_data only update the cache and
+    mark the session dirty. Dirty sessions are written flush_delay_s
+    later as one transaction on a worker thread, so the event loop never
+    waits on sqlite and a burst of updates to one session costs one row
+    write. Cold sessions are evicted beyond max_cached_sessions and
+    reloaded lazily, so a restart keeps logged-in profiles. Data is
+    pickled; values that cannot be pickled (running tasks) stay in memory
+    only and pin their session in the cache.
+    """
+
+    def __init__(
+        self, db_filename: str, max_cached_sessions: int, flush_delay_s: float
+    ):
+        self.db_filename = db_filename
+        self.max_cached_sessions = max_cached_sessions
+        self.flush_delay_s = flush_delay_s
+        self._cache: "OrderedDict[str, _Session]" = OrderedDict()
+        # Dirty sessions not yet handed to the writer / the batch being written
+        self._pending: Dict[str, _Session] = {}
+        self._flushing: Dict[str, _Session] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+        self._flush_lock = asyncio.Lock()
+        self._conn = sqlite3.connect(db_filename, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {FSM_TABLE} "
+            "(key TEXT PRIMARY KEY, state TEXT, data BLOB)"
+        )
+        # Used only by the flush, one batch at a time, off the event loop
+        self._writer_conn = sqlite3.connect(
+            db_filename, isolation_level=None, check_same_thread=False
+        )
+        self._writer_conn.execute("PRAGMA synchronous=NORMAL")
+        # Cache misses, read off the event loop (one at a time)
+        self._reader_conn = sqlite3.connect(
+            db_filename, isolation_level=None, check_same_thread=False
+        )
+        self._reader_lock = threading.Lock()
+        row = self._conn.execute(f"SELECT COUNT(*) FROM {FSM_TABLE}").fetchone()
+        logger.info(
+            f"FSM хранилище: открыто '{db_filename}', сохранённых сессий: {row[0]}."
+        )
+
+    # --- Cache ---
+    def _cached_session(self, db_key: str) -> Optional[_Session]:
+        session = self._cache.get(db_key)
+        if session is not None:
+            self._cache.move_to_end(db_key)
+            return session
+        session = self._pending.get(db_key) or self._flushing.get(db_key)
+        if session is not None:  # Released while its write is pending
+            self._cache[db_key] = session
+            self._evict()
+        return session
+
+    async def _session(self, key: StorageKey) -> Tuple[str, _Session]:
+        db_key = _storage_key(key)
+        session = self._cached_session(db_key)
+        if session is not None:
+            return db_key, session
+        loaded = await asyncio.to_thread(self._read_row, db_key)
+        # Another update of this key may have loaded or created it meanwhile
+        session = self._cached_session(db_key)
+        if session is not None:
+            return db_key, session
+        self._cache[db_key] = loaded
+        self._evict()
+        return db_key, loaded
+
+    def _read_row(self, db_key: str) -> _Session:
+        """Runs in a worker thread."""
+        with self._reader_lock:
+            row = self._reader_conn.execute(
+                f"SELECT state, data FROM {FSM_TABLE} WHERE key = ?", (db_key,)
+            ).fetchone()
+        data: Dict[str, Any] = {}
+        if row is not None and row[1] is not None:
+            try:
+                data = pickle.loads(row[1])
+            except Exception as e:
+                logger.error(
+                    f"FSM хранилище: данные сессии '{db_key}' повреждены и сброшены: {e}"
+                )
+        return _Session(row[0] if row is not None else None, data)
+
+    def _evict(self):
+        excess = len(self._cache) - self.max_cached_sessions
+        if excess <= 0:
+            return
+        # Oldest first; pinned sessions stay (they are active by definition)
+        for db_key in [
+            k for k, s in self._cache.items() if not s.pinned and not self._dirty(k)
+        ]:
+            if excess <= 0:
+                break
+            del self._cache[db_key]
+            excess -= 1
+
+    # --- Persistence ---
+    @staticmethod
+    def _dump_data(session: _Session) -> bytes:
+        try:
+            session.pinned = False
+            return pickle.dumps(session.data, pickle.HIGHEST_PROTOCOL)
+        except Exception:
+            pass
+        persistable = {}
+        for name, value in session.data.items():
+            try:
+                pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+            except Exception:
+                session.pinned = True
+                continue
+            persistable[name] = value
+        return pickle.dumps(persistable, pickle.HIGHEST_PROTOCOL)
+
+    def _dirty(self, db_key: str) -> bool:
+        return db_key in self._pending or db_key in self._flushing
+
+    def _mark_dirty(self, db_key: str, session: _Session):
+        self._pending[db_key] = session
+        self._schedule_flush()
+
+    def _schedule_flush(self):
+        if self._flush_task is None:
+            self._flush_task = asyncio.get_running_loop().create_task(
+                self._flush_later()
+            )
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.flush_delay_s)
+        self._flush_task = None  # Writes from here on schedule the next one
+        await self.flush()
+
+    async def flush(self) -> int:
+        """
+        Writes all dirty sessions in one transaction on a worker thread.
+        Data is pickled here, on the loop, so the batch is a consistent
+        snapshot. Returns the number of rows written or deleted.
+        """
+        async with self._flush_lock:
+            if not self._pending:
+                return 0
+            batch, self._pending = self._pending, {}
+            self._flushing = batch
+            rows = [
+                (
+                    db_key,
+                    session.state,
+                    None
+                    if session.state is None and not session.data
+                    else self._dump_data(session),
+                )
+                for db_key, session in batch.items()
+            ]
+            try:
+                await asyncio.to_thread(self._write_rows, rows)
+            except sqlite3.Error as e:
+                logger.error(
+                    f"FSM хранилище: не удалось записать {len(rows)} сессий, повтор: {e}"
+                )
+                for db_key, session in batch.items():
+                    self._pending.setdefault(db_key, session)
+                self._schedule_flush()
+                return 0
+            finally:
+                self._flushing = {}
+        for db_key, _, data in rows:
+            if data is None:
+                batch[db_key].pinned = False
+        return len(rows)
+
+    def _write_rows(self, rows: List[Tuple[str, Optional[str], Optional[bytes]]]):
+        """Runs in a worker thread."""
+        conn = self._writer_conn
+        conn.execute("BEGIN")
+        try:
+            conn.executemany(
+                f"DELETE FROM {FSM_TABLE} WHERE key = ?",
+                [(db_key,) for db_key, _, data in rows if data is None],
+            )
+            conn.executemany(
+                f"INSERT INTO {FSM_TABLE} (key, state, data) VALUES (?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET state = excluded.state, "
+                "data = excluded.data",
+                [row for row in rows if row[2] is not None],
+            )
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    # --- BaseStorage ---
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        db_key, session = await self._session(key)
+        new_state = _state_name(state)
+        if new_state == session.state:
+            return
+        session.state = new_state
+        self._mark_dirty(db_key, session)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return (await self._session(key))[1].state
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        if not isinstance(data, dict):
+            data = dict(data)
+        db_key, session = await self._session(key)
+        session.data = data.copy()
+        self._mark_dirty(db_key, session)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        return (await self._session(key))[1].data.copy()
+
+    # --- Session housekeeping ---
+    def release(self, key: StorageKey) -> bool:
+        """Drops an idle session from the cache (its row stays in the DB)."""
+        db_key = _storage_key(key)
+        session = self._cache.get(db_key)
+        if session is None or session.pinned or self._dirty(db_key):
+            return False
+        del self._cache[db_key]
+        return True
+
+    def keys_with_state(self) -> List[StorageKey]:
+        """Keys of all stored sessions that are in some FSM state."""
+        in_state = {
+            db_key: True
+            for (db_key,) in self._conn.execute(
+                f"SELECT key FROM {FSM_TABLE} WHERE state IS NOT NULL"
+            )
+        }
+        for db_key, session in {**self._flushing, **self._pending}.items():
+            in_state[db_key] = session.state is not None
+        keys = []
+        for db_key in (k for k, has_state in in_state.items() if has_state):
+            try:
+                keys.append(_parse_storage_key(db_key))
+            except ValueError:
+                logger.warning(f"FSM хранилище: нераспознанный ключ '{db_key}'.")
+        return keys
+
+    async def close(self) -> None:
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+        await self.flush()
+        self._cache.clear()
+        self._conn.close()
+        self._writer_conn.close()
+        with self._reader_lock:
+            self._reader_conn.close()
@@ -1,176 +1,206 @@
 # utils/image_processors.py
+import asyncio
 import logging
+import multiprocessing
 import random
-from io import BytesIO
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Dict, List, Optional, Tuple
 
 # Conditional import for Pillow components
 try:
-    from PIL import Image, ImageDraw, ImageFont, UnidentifiedImageError
+    from PIL import Image, ImageDraw
 
     PILLOW_AVAILABLE = True
 except ImportError:
-    Image, ImageDraw, ImageFont, UnidentifiedImageError = (
-        None,
-        None,
-        None,
-        None,
-    )
+    Image, ImageDraw = None, None
     PILLOW_AVAILABLE = False
 
 from aiogram.types import BufferedInputFile
 from settings import (
-    STROOP_COLORS_DEF,
+    STROOP_COLOR_NAMES,
     STROOP_FONT_PATH,
-    STROOP_IMAGE_SIZE,
-    STROOP_TEXT_COLOR_ON_PATCH,
-    MR_COLLAGE_CELL_SIZE,
-    MR_COLLAGE_BG_COLOR,
+    MR_COLLAGE_CACHE_MAX_BYTES,
+    RENDER_POOL_WORKERS,
+    RENDER_MAX_PENDING_JOBS,
+    RENDER_JOB_TIMEOUT_S,
+    RENDER_WORKER_THUMBNAIL_CACHE_MAX_BYTES,
+)
+from utils.render_jobs import (
+    ByteBoundedLRU,
+    get_font,
+    init_render_worker,
+    render_mr_collage_png,
+    render_stroop_png,
 )
 
 logger = logging.getLogger(__name__)
 
 
-def _get_font(font_path: str, size: int):
-    if not PILLOW_AVAILABLE or not ImageFont:
-        return None
-    try:
-        return ImageFont.truetype(font_path, size)
-    except IOError:
-        logger.warning(
-            f"Шрифт '{font_path}' не найден. Используется шрифт Pillow по умолчанию."
+# --- Render service ---
+class RenderService:
+    """
+    Runs CPU-bound render/encode jobs (functions of utils.render_jobs,
+    returning bytes) in a ProcessPoolExecutor, so Pillow work never stalls
+    other users' callbacks. At most max_pending jobs run at once, later
+    callers wait for a slot (backpressure). A job that misses timeout_s
+    yields None, like any failed render; its slot stays taken until the job
+    has really stopped. Without a pool (workers = 0, before start() or
+    after the pool broke) jobs are called directly in this process.
+    """
+
+    def __init__(self, workers: int, max_pending: int, timeout_s: float):
+        self.workers = workers
+        self.timeout_s = timeout_s
+        self._slots = asyncio.Semaphore(max(1, max_pending))
+        self._pool: Optional[ProcessPoolExecutor] = None
+
+    @property
+    def pooled(self) -> bool:
+        return self._pool is not None
+
+    def start(self):
+        if self.workers <= 0 or self._pool is not None:
+            return
+        # spawn: forking a process with a running loop and threads is unsafe.
+        # Workers re-import the main script, which defers its heavy imports
+        # to main(), and then utils.render_jobs
+        self._pool = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=init_render_worker,
+            initargs=(RENDER_WORKER_THUMBNAIL_CACHE_MAX_BYTES,),
+        )
+        # Workers are spawned by submit(), one per submit while none is
+        # idle: start them all now, so their import time is not paid in a trial
+        for _ in range(self.workers):
+            self._pool.submit(int)
+        logger.info(f"Рендеринг: пул из {self.workers} процессов запущен.")
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def _pool_broken(self):
+        logger.error(
+            "Рендеринг: пул процессов недоступен, "
+            "дальше рендеринг в процессе бота."
         )
+        self.shutdown()
+
+    @staticmethod
+    def _run_inline(job: Callable[..., Optional[bytes]], *args: Any):
+        try:
+            return job(*args)
+        except Exception as e:
+            logger.error(f"Рендеринг: ошибка {job.__name__}: {e}")
+            return None
+
+    def _release_slot(self, loop: asyncio.AbstractEventLoop):
+        if not loop.is_closed():
+            loop.call_soon_threadsafe(self._slots.release)
+
+    async def run(self, job: Callable[..., Optional[bytes]], *args: Any):
+        if self._pool is None:
+            return self._run_inline(job, *args)
+        await self._slots.acquire()
+        loop = asyncio.get_running_loop()
         try:
-            return ImageFont.load_default(size=size)
-        except TypeError:
-            logger.warning(
-                f"Не удалось загрузить шрифт по умолчанию Pillow с размером {size}. "
-                "Загрузка со стандартным размером."
+            if self._pool is None:  # Broke while this call waited for a slot
+                raise BrokenProcessPool()
+            job_future = self._pool.submit(job, *args)
+        except BrokenProcessPool:
+            self._slots.release()
+            self._pool_broken()
+            return self._run_inline(job, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        # The slot is freed when the job ends, not when the caller gives up:
+        # a job that has started cannot be stopped, so it still counts
+        job_future.add_done_callback(lambda _: self._release_slot(loop))
+        try:
+            # On timeout wait_for cancels the job if it has not started yet
+            return await asyncio.wait_for(
+                asyncio.wrap_future(job_future), self.timeout_s
             )
-            return ImageFont.load_default()
-        except Exception as e_def:
+        except asyncio.TimeoutError:
             logger.error(
-                f"Ошибка при загрузке шрифта Pillow по умолчанию: {e_def}"
+                f"Рендеринг: {job.__name__} не уложился в {self.timeout_s} с."
             )
-            return None
-    except Exception as e_generic:
-        logger.error(
-            f"Общая ошибка при загрузке шрифта {font_path}: {e_generic}"
-        )
+        except BrokenProcessPool:
+            self._pool_broken()
+        except Exception as e:
+            logger.error(f"Рендеринг: ошибка {job.__name__}: {e}")
         return None
 
 
-def _generate_stroop_part2_image(
-    patch_color_name: str, text_on_patch_name: str
-) -> BufferedInputFile | None:
-    if not PILLOW_AVAILABLE:
-        logger.warning(
-            "Stroop P2: Pillow недоступен, изображение не будет сгенерировано."
-        )
-        return None
+render_service = RenderService(
+    RENDER_POOL_WORKERS, RENDER_MAX_PENDING_JOBS, RENDER_JOB_TIMEOUT_S
+)
 
-    patch_rgb = STROOP_COLORS_DEF[patch_color_name]["rgb"]
-    text_rgb = STROOP_TEXT_COLOR_ON_PATCH
-    img = Image.new("RGB", STROOP_IMAGE_SIZE, color=patch_rgb)
-    draw = ImageDraw.Draw(img)
-    font = _get_font(STROOP_FONT_PATH, 40)
-    text_to_draw = STROOP_COLORS_DEF[text_on_patch_name]["name"]
 
-    if font:
-        try:
-            # Preferred method for text dimensions
-            bbox = draw.textbbox((0, 0), text_to_draw, font=font)
-            tw, th = bbox[2] - bbox[0], bbox[3] - bbox[1]
-        except Exception as e_text_measure:
-            logger.error(
-                f"Stroop P2: Ошибка измерения текста ('{text_to_draw}') через textbbox: {e_text_measure}. "
-                "Используется оценка."
-            )
-            # Fallback to rough estimate if text measurement fails
-            tw, th = (
-                STROOP_IMAGE_SIZE[0] * 0.8,
-                STROOP_IMAGE_SIZE[1] * 0.5,
-            )
+# --- Stroop stimulus bank ---
+# (part, first color, second color) -> encoded PNG. Part 2 is keyed by
+# (patch, text), part 3 by (word, ink): 20 + 20 images for 5 colors.
+_stroop_image_bank: Dict[Tuple[int, str, str], BufferedInputFile] = {}
 
-        x = (STROOP_IMAGE_SIZE[0] - tw) / 2
-        y = (STROOP_IMAGE_SIZE[1] - th) / 2
-        draw.text((x, y), text_to_draw, fill=text_rgb, font=font)
-    else:
-        draw.text((10, 10), "Font Error", fill=text_rgb)
-        logger.error("Stroop P2: Не удалось загрузить шрифт.")
 
-    bio = BytesIO()
-    bio.name = f"s_p2_{patch_color_name}_{text_on_patch_name}.png"
-    try:
-        img.save(bio, "PNG")
-        bio.seek(0)
-        return BufferedInputFile(bio.read(), filename=bio.name)
-    except Exception as e_save:
-        logger.error(f"Stroop P2: Ошибка сохранения изображения: {e_save}")
-        return None
+def _add_to_stroop_bank(
+    key: Tuple[int, str, str], png: bytes
+) -> BufferedInputFile:
+    part, first_color, second_color = key
+    image = BufferedInputFile(
+        png, filename=f"s_p{part}_{first_color}_{second_color}.png"
+    )
+    _stroop_image_bank[key] = image
+    return image
 
 
-def _generate_stroop_part3_image(
-    word_name: str, ink_name: str
-) -> BufferedInputFile | None:
+async def get_stroop_stimulus_image(
+    part: int, first_color: str, second_color: str
+) -> Optional[BufferedInputFile]:
+    """Stroop part 2/3 stimulus, rendered once and then served from memory."""
+    key = (part, first_color, second_color)
+    image = _stroop_image_bank.get(key)
+    if image is None:
+        png = await render_service.run(render_stroop_png, *key)
+        if png is None:
+            return None  # Not cached: the next trial retries
+        image = _add_to_stroop_bank(key, png)
+    return image
+
+
+def prerender_stroop_stimuli() -> int:
+    """Renders every part 2/3 color pair at startup. Returns the bank size."""
     if not PILLOW_AVAILABLE:
-        logger.warning(
-            "Stroop P3: Pillow недоступен, изображение не будет сгенерировано."
-        )
-        return None
+        return 0
+    for part in (2, 3):
+        for first_color in STROOP_COLOR_NAMES:
+            for second_color in STROOP_COLOR_NAMES:
+                key = (part, first_color, second_color)
+                if first_color == second_color or key in _stroop_image_bank:
+                    continue
+                png = render_stroop_png(*key)
+                if png is not None:
+                    _add_to_stroop_bank(key, png)
+    return len(_stroop_image_bank)
 
-    ink_rgb = STROOP_COLORS_DEF[ink_name]["rgb"]
-    bg_rgb = (255, 255, 255)
-    img = Image.new("RGB", STROOP_IMAGE_SIZE, color=bg_rgb)
-    draw = ImageDraw.Draw(img)
-    font = _get_font(STROOP_FONT_PATH, 50)
-    text_to_draw = STROOP_COLORS_DEF[word_name]["name"]
 
-    if font:
-        try:
-            bbox = draw.textbbox((0, 0), text_to_draw, font=font)
-            tw, th = bbox[2] - bbox[0], bbox[3] - bbox[1]
-        except Exception as e_text_measure:
-            logger.error(
-                f"Stroop P3: Ошибка измерения текста ('{text_to_draw}') через textbbox: {e_text_measure}. "
-                "Используется оценка."
-            )
-            tw, th = (
-                STROOP_IMAGE_SIZE[0] * 0.8,
-                STROOP_IMAGE_SIZE[1] * 0.5,
-            )
+def stroop_stimulus_images() -> List[BufferedInputFile]:
+    return list(_stroop_image_bank.values())
 
-        x = (STROOP_IMAGE_SIZE[0] - tw) / 2
-        y = (STROOP_IMAGE_SIZE[1] - th) / 2
-        stroke_width = 1 if ink_name == "Желтый" else 0
-        stroke_fill = (100, 100, 100) if stroke_width > 0 else None
-
-        draw.text(
-            (x, y),
-            text_to_draw,
-            fill=ink_rgb,
-            font=font,
-            stroke_width=stroke_width,
-            stroke_fill=stroke_fill,
-        )
-    else:
-        draw.text((10, 10), "Font Error", fill=ink_rgb)
-        logger.error("Stroop P3: Не удалось загрузить шрифт.")
 
-    bio = BytesIO()
-    bio.name = f"s_p3_{word_name}_{ink_name}.png"
-    try:
-        img.save(bio, "PNG")
-        bio.seek(0)
-        return BufferedInputFile(bio.read(), filename=bio.name)
-    except Exception as e_save:
-        logger.error(f"Stroop P3: Ошибка сохранения изображения: {e_save}")
-        return None
+# --- Mental Rotation collages ---
+# tuple of the 4 option paths -> encoded collage
+_mr_collage_cache = ByteBoundedLRU(MR_COLLAGE_CACHE_MAX_BYTES)
 
 
 async def generate_mr_collage(
     option_image_paths: list[str],
 ) -> BufferedInputFile | None:
-    if not PILLOW_AVAILABLE or not UnidentifiedImageError:
+    if not PILLOW_AVAILABLE:
         logger.error(
             "MR Collage: Pillow или его компоненты недоступны, коллаж не будет сгенерирован."
         )
@@ -182,57 +212,17 @@ async def generate_mr_collage(
         )
         return None
 
-    images_to_collage = []
-    for path in option_image_paths:
-        try:
-            img = Image.open(path)
-            if img.mode not in ("RGB", "RGBA"):
-                img = img.convert("RGB")
-            img = img.resize(MR_COLLAGE_CELL_SIZE, Image.Resampling.LANCZOS)
-            images_to_collage.append(img)
-        except FileNotFoundError:
-            logger.error(f"MR Collage: Файл изображения не найден: {path}")
-            return None
-        except UnidentifiedImageError:
-            logger.error(
-                f"MR Collage: Не удалось идентифицировать файл изображения: {path}"
-            )
-            return None
-        except Exception as e:
-            logger.error(
-                f"MR Collage: Ошибка открытия/изменения размера изображения {path}: {e}"
-            )
-            return None
-
-    collage_width = MR_COLLAGE_CELL_SIZE[0] * 2
-    collage_height = MR_COLLAGE_CELL_SIZE[1] * 2
-    collage = Image.new(
-        "RGB", (collage_width, collage_height), MR_COLLAGE_BG_COLOR
-    )
-
-    try:
-        collage.paste(images_to_collage[0], (0, 0))
-        collage.paste(images_to_collage[1], (MR_COLLAGE_CELL_SIZE[0], 0))
-        collage.paste(images_to_collage[2], (0, MR_COLLAGE_CELL_SIZE[1]))
-        collage.paste(
-            images_to_collage[3],
-            (MR_COLLAGE_CELL_SIZE[0], MR_COLLAGE_CELL_SIZE[1]),
-        )
-    except Exception as e_paste:
-        logger.error(f"MR Collage: Ошибка при сборке коллажа: {e_paste}")
-        return None
-
-    bio = BytesIO()
-    bio.name = "mr_collage.png"
-    try:
-        collage.save(bio, "PNG")
-        bio.seek(0)
-        return BufferedInputFile(bio.read(), filename=bio.name)
-    except Exception as e_save:
-        logger.error(
-            f"MR Collage: Ошибка сохранения изображения коллажа: {e_save}"
-        )
+    key = tuple(option_image_paths)
+    collage = _mr_collage_cache.get(key)
+    if collage is not None:
+        return collage
+    # Decoding, resizing and PNG encoding run in the render service
+    png = await render_service.run(render_mr_collage_png, key)
+    if png is None:
         return None
+    collage = BufferedInputFile(png, filename="mr_collage.png")
+    _mr_collage_cache.put(key, collage, len(png))
+    return collage
 
 
 def create_dummy_rt_image(image_path: str, number: int):
@@ -260,7 +250,7 @@ def create_dummy_rt_image(image_path: str, number: int):
             ),
         )
         draw = ImageDraw.Draw(img)
-        font = _get_font(
+        font = get_font(
             STROOP_FONT_PATH, 30
         )  # Using a common font path from settings
 
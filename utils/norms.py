@@ -0,0 +1,277 @@
+# utils/norms.py
+import logging
+import threading
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+# Conditional import: norms are disabled without NumPy
+try:
+    import numpy as np
+
+    NUMPY_AVAILABLE = True
+except ImportError:
+    np = None
+    NUMPY_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+
+def _to_float(value: Any) -> Optional[float]:
+    if value is None or isinstance(value, bool):
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None  # "N/A", "Нет данных", ...
+
+
+@dataclass(frozen=True)
+class NormMetric:
+    key: str
+    label: str
+    headers: Tuple[str, ...]  # Values passed to the metric, in order
+    interrupted_header: str  # Interrupted runs are not part of the norms
+    higher_is_better: bool
+
+    def extract(self, row: Dict[str, Any]) -> Optional[float]:
+        if row.get(self.interrupted_header) == "Да":
+            return None
+        values = [_to_float(row.get(h)) for h in self.headers]
+        if any(v is None for v in values):
+            return None
+        if len(values) == 2:  # Difference metric: second minus first
+            return values[1] - values[0]
+        return values[0]
+
+
+NORM_METRICS: List[NormMetric] = [
+    NormMetric(
+        "corsi_span",
+        "Тест Корси (макс. длина)",
+        ("Corsi - Max Correct Sequence Length",),
+        "Corsi - Interrupted",
+        True,
+    ),
+    NormMetric(
+        "stroop_interference",
+        "Струп: интерференция (Ч3 − Ч2, с)",
+        ("Stroop Part2 Time (s)", "Stroop Part3 Time (s)"),
+        "Stroop - Interrupted",
+        False,
+    ),
+    NormMetric(
+        "reaction_time",
+        "Время реакции (мс)",
+        ("ReactionTime_Time_ms",),
+        "ReactionTime_Interrupted",
+        False,
+    ),
+    NormMetric(
+        "verbal_fluency",
+        "Вербальная беглость (слов)",
+        ("VerbalFluency_WordCount",),
+        "VerbalFluency_Interrupted",
+        True,
+    ),
+    NormMetric(
+        "mental_rotation",
+        "Мысленное вращение (верных)",
+        ("MentalRotation_CorrectAnswers",),
+        "MentalRotation_Interrupted",
+        True,
+    ),
+    NormMetric(
+        "raven",
+        "Матрицы Равена (верных)",
+        ("RavenMatrices_CorrectAnswers",),
+        "RavenMatrices_Interrupted",
+        True,
+    ),
+]
+
+NORMS_HEADERS: List[str] = list(
+    dict.fromkeys(
+        ["Unique ID", "Age"]
+        + [
+            h
+            for m in NORM_METRICS
+            for h in m.headers + (m.interrupted_header,)
+        ]
+    )
+)
+
+
+@dataclass(frozen=True)
+class Percentile:
+    metric: NormMetric
+    value: float
+    percentile: float  # Share of other participants this result beats, %
+    sample_size: int
+    band_label: Optional[str] = None
+    band_percentile: Optional[float] = None
+    band_sample_size: int = 0
+
+
+class NormsEngine:
+    """
+    Percentile norms for every NORM_METRICS entry, overall and per age band.
+    Keeps one sorted NumPy array per (metric, band); queries are a pair of
+    binary searches. load() builds the arrays once from a store snapshot and
+    update_row() moves a single participant's values on every save, so the
+    workbook is never rescanned.
+    """
+
+    def __init__(
+        self,
+        age_bands: Sequence[Tuple[int, int]],
+        min_sample_size: int,
+        metrics: Sequence[NormMetric] = tuple(NORM_METRICS),
+    ):
+        self.age_bands = list(age_bands)
+        self.min_sample_size = min_sample_size
+        self.metrics = list(metrics)
+        self._values: Dict[str, Dict[str, float]] = {}
+        self._bands: Dict[str, Optional[str]] = {}
+        self._sorted: Dict[Tuple[str, Optional[str]], Any] = {}
+        self._loaded = False
+        self._lock = threading.RLock()
+
+    @property
+    def enabled(self) -> bool:
+        return NUMPY_AVAILABLE
+
+    @property
+    def is_loaded(self) -> bool:
+        return self._loaded
+
+    def _band_for_age(self, age: Any) -> Optional[str]:
+        age_f = _to_float(age)
+        if age_f is None:
+            return None
+        for low, high in self.age_bands:
+            if low <= age_f <= high:
+                return f"{low}–{high}"
+        return None
+
+    # --- Building ---
+    def load(self, rows: Iterable[Tuple[Any, ...]], headers: List[str]):
+        """Builds all sorted arrays from rows projected onto 'headers'."""
+        if not self.enabled:
+            return
+        collected: Dict[Tuple[str, Optional[str]], List[float]] = {}
+        values: Dict[str, Dict[str, float]] = {m.key: {} for m in self.metrics}
+        bands: Dict[str, Optional[str]] = {}
+        with self._lock:
+            for row_values in rows:
+                row = dict(zip(headers, row_values))
+                if row.get("Unique ID") is None:
+                    continue
+                uid = str(row["Unique ID"])
+                band = bands[uid] = self._band_for_age(row.get("Age"))
+                for metric in self.metrics:
+                    value = metric.extract(row)
+                    if value is None:
+                        continue
+                    values[metric.key][uid] = value
+                    collected.setdefault((metric.key, None), []).append(value)
+                    if band is not None:
+                        collected.setdefault((metric.key, band), []).append(
+                            value
+                        )
+            self._values = values
+            self._bands = bands
+            self._sorted = {
+                key: np.sort(np.asarray(vals, dtype=np.float64))
+                for key, vals in collected.items()
+            }
+            self._loaded = True
+        logger.info(
+            f"Нормы: загружено {len(bands)} участников, "
+            f"{len(self._sorted)} распределений."
+        )
+
+    def _insert(self, key: Tuple[str, Optional[str]], value: float):
+        arr = self._sorted.get(key)
+        if arr is None:
+            self._sorted[key] = np.array([value], dtype=np.float64)
+            return
+        self._sorted[key] = np.insert(arr, np.searchsorted(arr, value), value)
+
+    def _remove(self, key: Tuple[str, Optional[str]], value: float):
+        arr = self._sorted.get(key)
+        if arr is None:
+            return
+        idx = np.searchsorted(arr, value)
+        if idx < arr.size and arr[idx] == value:
+            self._sorted[key] = np.delete(arr, idx)
+
+    def update_row(self, uid: str, row: Dict[str, Any]):
+        """Re-reads one participant's metrics after a save (O(n) memmove)."""
+        uid = str(uid)
+        with self._lock:  # Waits for a running load()
+            if not self.enabled or not self._loaded:
+                return  # load() will pick the row up
+            old_band = self._bands.get(uid)
+            band = self._bands[uid] = self._band_for_age(row.get("Age"))
+            for metric in self.metrics:
+                metric_values = self._values.setdefault(metric.key, {})
+                old = metric_values.get(uid)
+                new = metric.extract(row)
+                if old == new and old_band == band:
+                    continue
+                if old is not None:
+                    self._remove((metric.key, None), old)
+                    if old_band is not None:
+                        self._remove((metric.key, old_band), old)
+                    del metric_values[uid]
+                if new is not None:
+                    self._insert((metric.key, None), new)
+                    if band is not None:
+                        self._insert((metric.key, band), new)
+                    metric_values[uid] = new
+
+    # --- Queries ---
+    def _percentile(
+        self, metric: NormMetric, band: Optional[str], value: float
+    ) -> Tuple[Optional[float], int]:
+        arr = self._sorted.get((metric.key, band))
+        n = 0 if arr is None else int(arr.size)
+        if n < max(self.min_sample_size, 2):
+            return None, n
+        left = int(np.searchsorted(arr, value, side="left"))
+        right = int(np.searchsorted(arr, value, side="right"))
+        beaten = left if metric.higher_is_better else n - right
+        # Ties (other than the participant) count as half
+        return 100.0 * (beaten + 0.5 * (right - left - 1)) / (n - 1), n
+
+    def percentiles_for(self, uid: str) -> List[Percentile]:
+        if not self.enabled or not self._loaded:
+            return []
+        uid = str(uid)
+        result: List[Percentile] = []
+        with self._lock:
+            band = self._bands.get(uid)
+            for metric in self.metrics:
+                value = self._values.get(metric.key, {}).get(uid)
+                if value is None:
+                    continue
+                pct, n = self._percentile(metric, None, value)
+                if pct is None:
+                    continue
+                band_pct, band_n = (
+                    self._percentile(metric, band, value)
+                    if band is not None
+                    else (None, 0)
+                )
+                result.append(
+                    Percentile(
+                        metric,
+                        value,
+                        pct,
+                        n,
+                        band if band_pct is not None else None,
+                        band_pct,
+                        band_n,
+                    )
+                )
+        return result
@@ -0,0 +1,156 @@
+# utils/persistence_worker.py
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from utils.trial_store import Trial
+
+logger = logging.getLogger(__name__)
+
+
+# --- Mutation Commands ---
+@dataclass
+class PersistenceCommand:
+    """Base class; 'future' is resolved with the command's result."""
+
+    future: Optional[asyncio.Future] = field(
+        default=None, init=False, repr=False, compare=False
+    )
+
+
+@dataclass
+class RegisterUser(PersistenceCommand):
+    name: str = ""
+    age: int = 0
+    tgid: int = 0
+
+
+@dataclass
+class UpdateTelegramId(PersistenceCommand):
+    uid: str = ""
+    tgid: int = 0
+
+
+@dataclass
+class WriteTestResult(PersistenceCommand):
+    uid: str = ""
+    results: Dict[str, Any] = field(default_factory=dict)
+    profile: Optional[Dict[str, Any]] = None
+
+
+@dataclass
+class WriteTrials(PersistenceCommand):
+    test: str = ""
+    uid: str = ""
+    trials: List[Trial] = field(default_factory=list)
+
+
+@dataclass
+class FlushStore(PersistenceCommand):
+    """Forces a flush regardless of the write-behind policy."""
+
+
+class PersistenceWorker:
+    """
+    Single writer for the results store.
+    Commands are queued by handlers and applied strictly in order in a worker
+    thread, so the event loop never blocks on disk I/O. Everything queued at
+    the moment the worker wakes up is applied as one batch followed by at most
+    one flush, which coalesces concurrent completions into a single save.
+    """
+
+    def __init__(
+        self,
+        apply_command: Callable[[PersistenceCommand], Any],
+        flush: Callable[[], Any],
+        needs_flush: Callable[[], bool],
+        max_batch_size: int = 100,
+    ):
+        self._apply_command = apply_command
+        self._flush = flush
+        self._needs_flush = needs_flush
+        self._max_batch_size = max_batch_size
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def is_running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self) -> asyncio.Task:
+        self._queue = asyncio.Queue()
+        self._task = asyncio.create_task(self._run())
+        return self._task
+
+    async def submit(self, command: PersistenceCommand) -> Any:
+        """Enqueues a command and waits until it has been applied."""
+        if not self.is_running:
+            raise RuntimeError("Persistence worker is not running.")
+        command.future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait(command)
+        return await command.future
+
+    async def stop(self):
+        """Applies everything still queued, flushes, and stops the worker."""
+        if not self.is_running:
+            return
+        await self.submit(FlushStore())
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self):
+        while True:
+            batch = [await self._queue.get()]
+            while len(batch) < self._max_batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except asyncio.QueueEmpty:
+                    break
+            try:
+                outcomes = await asyncio.to_thread(self._apply_batch, batch)
+            except Exception as e:  # Should not happen: errors are per command
+                logger.error(
+                    f"Persistence worker: сбой применения пакета: {e}",
+                    exc_info=True,
+                )
+                outcomes = [(False, e)] * len(batch)
+            for command, (ok, value) in zip(batch, outcomes):
+                if command.future is None or command.future.done():
+                    continue
+                if ok:
+                    command.future.set_result(value)
+                else:
+                    command.future.set_exception(value)
+
+    def _apply_batch(
+        self, batch: List[PersistenceCommand]
+    ) -> List[Tuple[bool, Any]]:
+        outcomes: List[Tuple[bool, Any]] = []
+        force_flush = False
+        for command in batch:
+            if isinstance(command, FlushStore):
+                force_flush = True
+                outcomes.append((True, None))
+                continue
+            try:
+                outcomes.append((True, self._apply_command(command)))
+            except Exception as e:
+                logger.error(
+                    f"Persistence worker: ошибка команды {type(command).__name__}: {e}",
+                    exc_info=True,
+                )
+                outcomes.append((False, e))
+        if force_flush or self._needs_flush():
+            try:
+                self._flush()
+            except Exception as e:
+                logger.error(
+                    f"Persistence worker: ошибка сброса на диск: {e}",
+                    exc_info=True,
+                )
+        return outcomes
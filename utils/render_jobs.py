@@ -0,0 +1,342 @@
+# utils/render_jobs.py
+"""
+Pillow render jobs of the render service (utils.image_processors). They
+run in spawned pool worker processes, which import this module, settings
+and the bot's main script; main_bot.py keeps aiogram, config and the data
+stores out of its module level, so workers stay light. Everything here
+takes and returns plain picklable values.
+"""
+import logging
+import os
+import threading
+from collections import OrderedDict
+from io import BytesIO
+from typing import Any, Dict, Optional, Tuple
+
+# Conditional import for Pillow components
+try:
+    from PIL import Image, ImageDraw, ImageFont, UnidentifiedImageError
+
+    PILLOW_AVAILABLE = True
+except ImportError:
+    Image, ImageDraw, ImageFont, UnidentifiedImageError = (
+        None,
+        None,
+        None,
+        None,
+    )
+    PILLOW_AVAILABLE = False
+
+from settings import (
+    STROOP_COLORS_DEF,
+    STROOP_FONT_PATH,
+    FONT_SEARCH_DIRS,
+    STROOP_IMAGE_SIZE,
+    STROOP_TEXT_COLOR_ON_PATCH,
+    MR_COLLAGE_CELL_SIZE,
+    MR_COLLAGE_BG_COLOR,
+    MR_THUMBNAIL_CACHE_MAX_BYTES,
+)
+
+logger = logging.getLogger(__name__)
+
+
+# --- Fonts ---
+# Process-wide: (requested path, size) -> font object (None if unusable)
+_font_cache: Dict[Tuple[str, int], Any] = {}
+# Requested path -> loadable font file, None for Pillow's default font
+_font_files: Dict[str, Optional[str]] = {}
+
+
+def _resolve_font_file(font_path: str) -> Optional[str]:
+    """Finds the font once: FONT_SEARCH_DIRS, then Pillow's own lookup."""
+    if font_path in _font_files:
+        return _font_files[font_path]
+    candidates = [font_path]
+    if not os.path.isabs(font_path):
+        candidates = [
+            os.path.join(font_dir, font_path) for font_dir in FONT_SEARCH_DIRS
+        ] + candidates
+    resolved = None
+    for candidate in candidates:
+        try:
+            ImageFont.truetype(candidate, 10)
+        except OSError:
+            continue
+        resolved = candidate
+        break
+    if resolved is None:
+        logger.warning(
+            f"Шрифт '{font_path}' не найден (каталоги: {FONT_SEARCH_DIRS}). "
+            "Используется шрифт Pillow по умолчанию."
+        )
+    _font_files[font_path] = resolved
+    return resolved
+
+
+def _load_default_font(size: int):
+    try:
+        return ImageFont.load_default(size=size)
+    except TypeError:
+        logger.warning(
+            f"Не удалось загрузить шрифт по умолчанию Pillow с размером {size}. "
+            "Загрузка со стандартным размером."
+        )
+        return ImageFont.load_default()
+    except Exception as e_def:
+        logger.error(f"Ошибка при загрузке шрифта Pillow по умолчанию: {e_def}")
+        return None
+
+
+def get_font(font_path: str, size: int):
+    if not PILLOW_AVAILABLE or not ImageFont:
+        return None
+    key = (font_path, size)
+    if key in _font_cache:
+        return _font_cache[key]
+    font = None
+    try:
+        font_file = _resolve_font_file(font_path)
+        font = (
+            ImageFont.truetype(font_file, size)
+            if font_file is not None
+            else _load_default_font(size)
+        )
+    except Exception as e_generic:
+        logger.error(
+            f"Общая ошибка при загрузке шрифта {font_path}: {e_generic}"
+        )
+    _font_cache[key] = font  # Failures too: no retry and log per stimulus
+    return font
+
+
+# --- Stroop stimuli ---
+def _render_stroop_part2(
+    patch_color_name: str, text_on_patch_name: str
+) -> Optional[bytes]:
+    if not PILLOW_AVAILABLE:
+        logger.warning(
+            "Stroop P2: Pillow недоступен, изображение не будет сгенерировано."
+        )
+        return None
+
+    patch_rgb = STROOP_COLORS_DEF[patch_color_name]["rgb"]
+    text_rgb = STROOP_TEXT_COLOR_ON_PATCH
+    img = Image.new("RGB", STROOP_IMAGE_SIZE, color=patch_rgb)
+    draw = ImageDraw.Draw(img)
+    font = get_font(STROOP_FONT_PATH, 40)
+    text_to_draw = STROOP_COLORS_DEF[text_on_patch_name]["name"]
+
+    if font:
+        try:
+            # Preferred method for text dimensions
+            bbox = draw.textbbox((0, 0), text_to_draw, font=font)
+            tw, th = bbox[2] - bbox[0], bbox[3] - bbox[1]
+        except Exception as e_text_measure:
+            logger.error(
+                f"Stroop P2: Ошибка измерения текста ('{text_to_draw}') через textbbox: {e_text_measure}. "
+                "Используется оценка."
+            )
+            # Fallback to rough estimate if text measurement fails
+            tw, th = (
+                STROOP_IMAGE_SIZE[0] * 0.8,
+                STROOP_IMAGE_SIZE[1] * 0.5,
+            )
+
+        x = (STROOP_IMAGE_SIZE[0] - tw) / 2
+        y = (STROOP_IMAGE_SIZE[1] - th) / 2
+        draw.text((x, y), text_to_draw, fill=text_rgb, font=font)
+    else:
+        draw.text((10, 10), "Font Error", fill=text_rgb)
+        logger.error("Stroop P2: Не удалось загрузить шрифт.")
+
+    bio = BytesIO()
+    try:
+        img.save(bio, "PNG")
+        return bio.getvalue()
+    except Exception as e_save:
+        logger.error(f"Stroop P2: Ошибка сохранения изображения: {e_save}")
+        return None
+
+
+def _render_stroop_part3(
+    word_name: str, ink_name: str
+) -> Optional[bytes]:
+    if not PILLOW_AVAILABLE:
+        logger.warning(
+            "Stroop P3: Pillow недоступен, изображение не будет сгенерировано."
+        )
+        return None
+
+    ink_rgb = STROOP_COLORS_DEF[ink_name]["rgb"]
+    bg_rgb = (255, 255, 255)
+    img = Image.new("RGB", STROOP_IMAGE_SIZE, color=bg_rgb)
+    draw = ImageDraw.Draw(img)
+    font = get_font(STROOP_FONT_PATH, 50)
+    text_to_draw = STROOP_COLORS_DEF[word_name]["name"]
+
+    if font:
+        try:
+            bbox = draw.textbbox((0, 0), text_to_draw, font=font)
+            tw, th = bbox[2] - bbox[0], bbox[3] - bbox[1]
+        except Exception as e_text_measure:
+            logger.error(
+                f"Stroop P3: Ошибка измерения текста ('{text_to_draw}') через textbbox: {e_text_measure}. "
+                "Используется оценка."
+            )
+            tw, th = (
+                STROOP_IMAGE_SIZE[0] * 0.8,
+                STROOP_IMAGE_SIZE[1] * 0.5,
+            )
+
+        x = (STROOP_IMAGE_SIZE[0] - tw) / 2
+        y = (STROOP_IMAGE_SIZE[1] - th) / 2
+        stroke_width = 1 if ink_name == "Желтый" else 0
+        stroke_fill = (100, 100, 100) if stroke_width > 0 else None
+
+        draw.text(
+            (x, y),
+            text_to_draw,
+            fill=ink_rgb,
+            font=font,
+            stroke_width=stroke_width,
+            stroke_fill=stroke_fill,
+        )
+    else:
+        draw.text((10, 10), "Font Error", fill=ink_rgb)
+        logger.error("Stroop P3: Не удалось загрузить шрифт.")
+
+    bio = BytesIO()
+    try:
+        img.save(bio, "PNG")
+        return bio.getvalue()
+    except Exception as e_save:
+        logger.error(f"Stroop P3: Ошибка сохранения изображения: {e_save}")
+        return None
+
+
+def render_stroop_png(
+    part: int, first_color: str, second_color: str
+) -> Optional[bytes]:
+    """Render job: part 2 is (patch, text), part 3 is (word, ink)."""
+    if part == 2:
+        return _render_stroop_part2(first_color, second_color)
+    if part == 3:
+        return _render_stroop_part3(first_color, second_color)
+    return None
+
+
+# --- Mental Rotation collages ---
+class ByteBoundedLRU:
+    """Thread-safe LRU bounded by the total size of its values, in bytes."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self._items: "OrderedDict[Any, Tuple[Any, int]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def get(self, key: Any) -> Any:
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            self._items.move_to_end(key)
+            return item[0]
+
+    def put(self, key: Any, value: Any, size: int):
+        if size > self.max_bytes:
+            return  # Would evict everything else
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self.total_bytes -= old[1]
+            self._items[key] = (value, size)
+            self.total_bytes += size
+            while self.total_bytes > self.max_bytes:
+                _, (_, evicted_size) = self._items.popitem(last=False)
+                self.total_bytes -= evicted_size
+
+
+# path -> image resized to MR_COLLAGE_CELL_SIZE (decoded pixels)
+_mr_thumbnail_cache = ByteBoundedLRU(MR_THUMBNAIL_CACHE_MAX_BYTES)
+
+
+def _get_mr_thumbnail(path: str):
+    """Option image at cell size; each file is decoded and resized once."""
+    thumbnail = _mr_thumbnail_cache.get(path)
+    if thumbnail is not None:
+        return thumbnail
+    with Image.open(path) as img:
+        if img.mode not in ("RGB", "RGBA"):
+            img = img.convert("RGB")
+        thumbnail = img.resize(MR_COLLAGE_CELL_SIZE, Image.Resampling.LANCZOS)
+    _mr_thumbnail_cache.put(
+        path,
+        thumbnail,
+        thumbnail.width * thumbnail.height * len(thumbnail.getbands()),
+    )
+    return thumbnail
+
+
+def render_mr_collage_png(
+    option_image_paths: Tuple[str, ...],
+) -> Optional[bytes]:
+    """
+    Render job. Tiles are cached per process, in a pool worker up to
+    RENDER_WORKER_THUMBNAIL_CACHE_MAX_BYTES (see init_render_worker).
+    """
+    images_to_collage = []
+    for path in option_image_paths:
+        try:
+            images_to_collage.append(_get_mr_thumbnail(path))
+        except FileNotFoundError:
+            logger.error(f"MR Collage: Файл изображения не найден: {path}")
+            return None
+        except UnidentifiedImageError:
+            logger.error(
+                f"MR Collage: Не удалось идентифицировать файл изображения: {path}"
+            )
+            return None
+        except Exception as e:
+            logger.error(
+                f"MR Collage: Ошибка открытия/изменения размера изображения {path}: {e}"
+            )
+            return None
+
+    collage_width = MR_COLLAGE_CELL_SIZE[0] * 2
+    collage_height = MR_COLLAGE_CELL_SIZE[1] * 2
+    collage = Image.new(
+        "RGB", (collage_width, collage_height), MR_COLLAGE_BG_COLOR
+    )
+
+    try:
+        collage.paste(images_to_collage[0], (0, 0))
+        collage.paste(images_to_collage[1], (MR_COLLAGE_CELL_SIZE[0], 0))
+        collage.paste(images_to_collage[2], (0, MR_COLLAGE_CELL_SIZE[1]))
+        collage.paste(
+            images_to_collage[3],
+            (MR_COLLAGE_CELL_SIZE[0], MR_COLLAGE_CELL_SIZE[1]),
+        )
+    except Exception as e_paste:
+        logger.error(f"MR Collage: Ошибка при сборке коллажа: {e_paste}")
+        return None
+
+    bio = BytesIO()
+    try:
+        collage.save(bio, "PNG")
+        return bio.getvalue()
+    except Exception as e_save:
+        logger.error(
+            f"MR Collage: Ошибка сохранения изображения коллажа: {e_save}"
+        )
+        return None
+
+
+def init_render_worker(thumbnail_cache_max_bytes: int):
+    """Pool worker initializer: caps the worker's own tile cache."""
+    global _mr_thumbnail_cache
+    _mr_thumbnail_cache = ByteBoundedLRU(thumbnail_cache_max_bytes)
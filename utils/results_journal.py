@@ -0,0 +1,139 @@
+# utils/results_journal.py
+import json
+import logging
+import os
+import threading
+from typing import Any, Callable, Dict
+
+logger = logging.getLogger(__name__)
+
+
+class ResultsJournal:
+    """
+    Append-only JSONL journal of results store mutations.
+    Every record is written as one line and fsync'd before the mutation is
+    applied in memory, so an acknowledged write survives a crash even if the
+    workbook has not been flushed yet. After a successful flush the journal
+    is compacted (truncated); on startup the remaining tail is replayed.
+    Records carry a monotonically increasing "seq", so state saved outside
+    the workbook (running stats) can record how far it already got.
+    Must only be written by the single persistence writer.
+    """
+
+    _TAIL_CHUNK = 64 * 1024
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        self._lock = threading.Lock()
+        self._file = open(filename, "ab")
+        self._drop_torn_tail()
+        self._seq = self._read_last_seq()
+
+    def _drop_torn_tail(self):
+        """
+        Cuts a torn last line (crash mid-append) back to the last complete
+        record, so the next append starts on a line of its own instead of
+        being glued onto the torn bytes and lost with them on replay.
+        """
+        end = self._file.seek(0, os.SEEK_END)
+        keep = end
+        with open(self.filename, "rb") as f:
+            while keep > 0:
+                start = max(0, keep - self._TAIL_CHUNK)
+                f.seek(start)
+                newline = f.read(keep - start).rfind(b"\n")
+                if newline != -1:
+                    keep = start + newline + 1
+                    break
+                keep = start
+        if keep == end:
+            return
+        logger.warning(
+            f"Журнал '{self.filename}': оборванная запись ({end - keep} байт) удалена."
+        )
+        self._file.truncate(keep)
+        os.fsync(self._file.fileno())
+
+    def _read_last_seq(self) -> int:
+        end = self._file.seek(0, os.SEEK_END)
+        if end == 0:
+            return 0
+        with open(self.filename, "rb") as f:
+            start = max(0, end - self._TAIL_CHUNK)
+            f.seek(start)
+            lines = f.read(end - start).splitlines()
+        for raw_line in reversed(lines):
+            try:
+                seq = json.loads(raw_line).get("seq")
+            except (ValueError, AttributeError):
+                continue  # Corrupt, or cut by the chunk start
+            if isinstance(seq, int):
+                return seq
+        return 0
+
+    @property
+    def last_seq(self) -> int:
+        """Seq of the last appended (or replayed) record."""
+        return self._seq
+
+    def advance_seq(self, seq: int):
+        """
+        Continues numbering after seq. A truncated journal restarts empty,
+        so the caller passes the highest seq it has persisted elsewhere.
+        """
+        with self._lock:
+            self._seq = max(self._seq, seq)
+
+    def append(self, record: Dict[str, Any]) -> int:
+        """Journals record with the next seq and returns that seq."""
+        with self._lock:
+            seq = self._seq + 1
+            line = json.dumps(
+                {"seq": seq, **record}, ensure_ascii=False, default=str
+            )
+            self._file.write((line + "\n").encode("utf-8"))
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._seq = seq
+        return seq
+
+    def replay(self, apply_record: Callable[[Dict[str, Any]], Any]) -> int:
+        """
+        Feeds every journaled record to apply_record, in order.
+        Lines that fail to parse are skipped. Returns the count.
+        """
+        replayed = 0
+        with self._lock:
+            with open(self.filename, "rb") as f:
+                for line_no, raw_line in enumerate(f, 1):
+                    if not raw_line.strip():
+                        continue
+                    try:
+                        record = json.loads(raw_line)
+                    except ValueError:
+                        logger.warning(
+                            f"Журнал '{self.filename}': повреждённая строка {line_no} пропущена."
+                        )
+                        continue
+                    seq = record.get("seq")
+                    if isinstance(seq, int):
+                        self._seq = max(self._seq, seq)
+                    apply_record(record)
+                    replayed += 1
+        return replayed
+
+    def truncate(self):
+        """
+        Drops all records; call only once they are durable elsewhere.
+        The seq keeps counting from where it was.
+        """
+        with self._lock:
+            if self._file.tell() == 0:
+                return
+            self._file.truncate(0)
+            self._file.seek(0)
+            os.fsync(self._file.fileno())
+
+    def close(self):
+        with self._lock:
+            self._file.close()
@@ -0,0 +1,285 @@
+# utils/results_store.py
+import logging
+import os
+import threading
+import time
+from typing import (
+    Any,
+    Dict,
+    Iterator,
+    KeysView,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    Union,
+)
+
+from openpyxl import Workbook, load_workbook
+
+logger = logging.getLogger(__name__)
+
+
+class ExcelResultsStore:
+    """
+    In-memory copy of the results workbook with write-behind flushing.
+    The file is parsed once in load(); reads and row mutations are served from
+    memory, and flush() writes the accumulated changes back in a single pass.
+    Rows are copy-on-write, so a flush can snapshot them without blocking writers.
+    A Unique ID -> row index and a Telegram ID -> Unique ID index are built in
+    load() and maintained on every append, so lookups are O(1).
+    """
+
+    def __init__(
+        self, filename: str, flush_interval_s: float, flush_dirty_rows: int
+    ):
+        self.filename = filename
+        self.flush_interval_s = flush_interval_s
+        self.flush_dirty_rows = flush_dirty_rows
+        self.headers: List[Optional[str]] = []
+        self._col_index: Dict[str, int] = {}
+        self._rows: List[List[Any]] = []
+        self._uid_to_row: Dict[str, int] = {}
+        self._tgid_to_uid: Dict[str, str] = {}
+        self._dirty_rows: Set[int] = set()
+        self._headers_dirty = False
+        self._sheet_title = "Sheet"
+        self._last_flush_ts = time.monotonic()
+        self._lock = threading.RLock()  # Guards rows and dirty set
+        self._flush_lock = threading.Lock()  # One writer to disk at a time
+
+    # --- Loading ---
+    def load(self):
+        """Parses the workbook once (values only) into memory."""
+        wb = load_workbook(self.filename, read_only=True)
+        try:
+            ws = wb.active
+            self._sheet_title = ws.title
+            rows_iter = ws.iter_rows(values_only=True)
+            header_row = next(rows_iter, ())
+            headers = [
+                str(h) if h is not None else None for h in header_row
+            ]
+            width = len(headers)
+            rows: List[List[Any]] = []
+            for row_values in rows_iter:
+                if all(v is None for v in row_values):
+                    continue  # read_only mode may report trailing empty rows
+                row = list(row_values[:width])
+                row.extend([None] * (width - len(row)))
+                rows.append(row)
+        finally:
+            wb.close()
+
+        with self._lock:
+            self.headers = headers
+            self._col_index = {
+                h: i for i, h in enumerate(headers) if h is not None
+            }
+            self._rows = rows
+            self._rebuild_indexes()
+            self._dirty_rows.clear()
+            self._headers_dirty = False
+            self._last_flush_ts = time.monotonic()
+        logger.info(
+            f"Хранилище результатов: загружено {len(rows)} строк из '{self.filename}'."
+        )
+
+    # --- Schema ---
+    def add_headers(self, expected_headers: List[str]) -> List[str]:
+        """
+        Adds the expected headers missing from the sheet, in one pass, after
+        the last named column (unnamed columns past it are reused).
+        Rows are widened in memory; the file is rewritten on the next flush.
+        Returns the headers actually added.
+        """
+        with self._lock:
+            missing = [
+                h
+                for h in dict.fromkeys(expected_headers)
+                if h not in self._col_index
+            ]
+            if not missing:
+                return []
+            headers = list(self.headers)
+            pos = 1 + max(
+                (i for i, h in enumerate(headers) if h is not None),
+                default=-1,
+            )
+            for header in missing:
+                if pos < len(headers):
+                    headers[pos] = header
+                else:
+                    headers.append(header)
+                pos += 1
+            width = len(headers)
+            self._rows = [
+                row + [None] * (width - len(row)) if len(row) < width else row
+                for row in self._rows
+            ]
+            self.headers = headers
+            self._col_index = {
+                h: i for i, h in enumerate(headers) if h is not None
+            }
+            self._headers_dirty = True
+        return missing
+
+    # --- Indexes ---
+    def _rebuild_indexes(self):
+        self._uid_to_row = {}
+        self._tgid_to_uid = {}
+        for idx, row in enumerate(self._rows):
+            self._index_row(idx, row)
+
+    def _index_row(self, idx: int, row: List[Any]):
+        uid_col = self._col_index.get("Unique ID")
+        if uid_col is None or row[uid_col] is None:
+            return
+        uid = str(row[uid_col])
+        # Duplicate UIDs: the first row wins, as with the old top-down scan
+        self._uid_to_row.setdefault(uid, idx)
+        tg_col = self._col_index.get("Telegram ID")
+        if tg_col is not None and row[tg_col] is not None:
+            # One Telegram account may own several UIDs: the latest row wins
+            self._tgid_to_uid[str(row[tg_col])] = uid
+
+    # --- Reads ---
+    def has_header(self, header: str) -> bool:
+        return header in self._col_index
+
+    def _find_row_index(self, uid: str) -> int:
+        return self._uid_to_row.get(uid, -1)
+
+    def has_uid(self, uid: str) -> bool:
+        return str(uid) in self._uid_to_row
+
+    def get_row(self, uid: str) -> Optional[Dict[str, Any]]:
+        """Returns {header: value} for the UID's row, or None if absent."""
+        with self._lock:
+            idx = self._find_row_index(str(uid))
+            if idx == -1:
+                return None
+            row = self._rows[idx]
+        return {
+            h: row[i] for i, h in enumerate(self.headers) if h is not None
+        }
+
+    def existing_uids(self) -> Set[str]:
+        with self._lock:
+            return set(self._uid_to_row)
+
+    def uid_keys(self) -> KeysView[str]:
+        """Live view of indexed UIDs (O(1) membership, no copy)."""
+        return self._uid_to_row.keys()
+
+    def find_uid_by_telegram_id(self, tgid: Union[str, int]) -> Optional[str]:
+        return self._tgid_to_uid.get(str(tgid))
+
+    def row_count(self) -> int:
+        return len(self._rows)
+
+    def iter_snapshot(self, headers: List[str]) -> Iterator[Tuple[Any, ...]]:
+        """
+        Yields every row projected onto 'headers' (None for unknown ones).
+        The lock is held only to copy the row references: rows are
+        copy-on-write, so writers proceed while the snapshot is consumed.
+        """
+        with self._lock:
+            rows = list(self._rows)
+            cols = [self._col_index.get(h) for h in headers]
+        for row in rows:
+            yield tuple(None if c is None else row[c] for c in cols)
+
+    # --- Mutations ---
+    def append_row(self, values: Dict[str, Any]):
+        """Appends a new row; headers missing from the file are ignored."""
+        with self._lock:
+            # Sized under the lock so a concurrent add_headers() cannot
+            # leave it shorter than the header list.
+            row: List[Any] = [None] * len(self.headers)
+            for header, value in values.items():
+                col = self._col_index.get(header)
+                if col is not None:
+                    row[col] = None if value == "" else value
+            self._rows.append(row)
+            idx = len(self._rows) - 1
+            self._index_row(idx, row)
+            self._dirty_rows.add(idx)
+
+    def update_row(self, uid: str, values: Dict[str, Any]) -> bool:
+        """
+        Sets the given header values in the UID's row.
+        Returns False if the UID has no row.
+        """
+        with self._lock:
+            idx = self._find_row_index(str(uid))
+            if idx == -1:
+                return False
+            row = list(self._rows[idx])  # Copy-on-write
+            for header, value in values.items():
+                col = self._col_index.get(header)
+                if col is None:
+                    logger.warning(
+                        f"Хранилище результатов: заголовок '{header}' не найден. Пропуск."
+                    )
+                    continue
+                row[col] = None if value == "" else value
+            self._rows[idx] = row
+            if "Telegram ID" in values:
+                self._index_row(idx, row)
+            self._dirty_rows.add(idx)
+        return True
+
+    # --- Flushing ---
+    @property
+    def dirty_count(self) -> int:
+        return len(self._dirty_rows)
+
+    def needs_flush(self) -> bool:
+        if self._headers_dirty:
+            return True
+        if not self._dirty_rows:
+            return False
+        if len(self._dirty_rows) >= self.flush_dirty_rows:
+            return True
+        return (
+            time.monotonic() - self._last_flush_ts >= self.flush_interval_s
+        )
+
+    def flush(self) -> bool:
+        """
+        Writes all pending changes to disk. Returns True if a write happened.
+        The file is replaced atomically, so a crash mid-write keeps the old copy.
+        """
+        with self._flush_lock:
+            with self._lock:
+                if not self._dirty_rows and not self._headers_dirty:
+                    return False
+                headers = list(self.headers)
+                rows = list(self._rows)  # Rows are copy-on-write
+                flushed_dirty = set(self._dirty_rows)
+                flushed_headers = self._headers_dirty
+                self._dirty_rows.clear()
+                self._headers_dirty = False
+            try:
+                self._write_workbook(headers, rows)
+            except Exception:
+                with self._lock:
+                    self._dirty_rows.update(flushed_dirty)
+                    self._headers_dirty |= flushed_headers
+                raise
+            self._last_flush_ts = time.monotonic()
+        logger.info(
+            f"Хранилище результатов: сброшено {len(flushed_dirty)} изменённых строк в '{self.filename}'."
+        )
+        return True
+
+    def _write_workbook(self, headers: List[Optional[str]], rows: List[List[Any]]):
+        wb = Workbook(write_only=True)
+        ws = wb.create_sheet(title=self._sheet_title)
+        ws.append(headers)
+        for row in rows:
+            ws.append(row)
+        tmp_filename = f"{self.filename}.tmp"
+        wb.save(tmp_filename)
+        os.replace(tmp_filename, self.filename)
@@ -0,0 +1,171 @@
+# utils/session_reaper.py
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional
+
+from aiogram import BaseMiddleware, Bot
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.storage.base import BaseEventIsolation, StorageKey
+from aiogram.types import TelegramObject
+
+from utils.fsm_storage import SQLiteStorage
+
+logger = logging.getLogger(__name__)
+
+
+class SessionActivity(BaseMiddleware):
+    """
+    Outer update middleware recording when each FSM session last received
+    an update from its user. Only user updates count: background tasks that
+    keep writing FSM data (RT cycle, timers) do not keep a session alive.
+    """
+
+    def __init__(self):
+        self._last_seen: Dict[StorageKey, float] = {}
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        state: Optional[FSMContext] = data.get("state")
+        if state is not None:
+            self.touch(state.key)
+        return await handler(event, data)
+
+    def touch(self, key: StorageKey):
+        self._last_seen[key] = time.monotonic()
+
+    def seed(self, keys: Iterable[StorageKey]):
+        """Sessions restored from storage get a full TTL from now."""
+        for key in keys:
+            self._last_seen.setdefault(key, time.monotonic())
+
+    def idle_for(self, key: StorageKey) -> float:
+        last_seen = self._last_seen.get(key)
+        return 0.0 if last_seen is None else time.monotonic() - last_seen
+
+    def forget(self, key: StorageKey):
+        self._last_seen.pop(key, None)
+
+    def __len__(self) -> int:
+        return len(self._last_seen)
+
+    def idle_sessions(self, min_idle_s: float) -> Dict[StorageKey, float]:
+        now = time.monotonic()
+        return {
+            key: now - last_seen
+            for key, last_seen in self._last_seen.items()
+            if now - last_seen >= min_idle_s
+        }
+
+
+# Registered on dp.update in main_bot; read by the reaper
+session_activity = SessionActivity()
+
+
+async def reap_idle_sessions(
+    storage: SQLiteStorage,
+    events_isolation: BaseEventIsolation,
+    bot: Bot,
+    test_idle_ttl: Callable[[Optional[str]], Optional[float]],
+    interrupt_test: Callable[[FSMContext, Bot], Awaitable[Any]],
+    idle_ttl_s: float,
+    min_idle_s: float,
+) -> int:
+    """
+    One reaper pass. A session in a test state idle past that test's TTL
+    is interrupted via interrupt_test (save as interrupted, clean up UI,
+    cancel tasks, keep only the profile); any session idle past
+    idle_ttl_s is released from the FSM cache. Sessions idle less than
+    min_idle_s (the smallest TTL) are not even looked up.
+    Each session is handled under the dispatcher's event-isolation lock
+    for its key, so an update of that user is never processed halfway
+    through an interruption. Returns the number of tests interrupted.
+    """
+    interrupted = 0
+    candidates = session_activity.idle_sessions(min_idle_s)
+    for key, idle_s in candidates.items():
+        async with events_isolation.lock(key):
+            if await _reap_session(
+                storage,
+                key,
+                idle_s,
+                bot,
+                test_idle_ttl,
+                interrupt_test,
+                idle_ttl_s,
+            ):
+                interrupted += 1
+    return interrupted
+
+
+async def _reap_session(
+    storage: SQLiteStorage,
+    key: StorageKey,
+    idle_s: float,
+    bot: Bot,
+    test_idle_ttl: Callable[[Optional[str]], Optional[float]],
+    interrupt_test: Callable[[FSMContext, Bot], Awaitable[Any]],
+    idle_ttl_s: float,
+) -> bool:
+    """One reaper step for one session. Returns True if a test was interrupted."""
+    interrupted = False
+    state = FSMContext(storage=storage, key=key)
+    ttl_s = test_idle_ttl(await state.get_state())
+    if ttl_s is not None:
+        if idle_s < ttl_s:
+            return False
+        if session_activity.idle_for(key) < ttl_s:
+            return False  # The user came back meanwhile
+        logger.info(
+            f"Сессия {key.chat_id}: тест без активности {idle_s:.0f} с, прерывание."
+        )
+        try:
+            await interrupt_test(state, bot)
+            interrupted = True
+        except Exception as e:
+            logger.error(
+                f"Сессия {key.chat_id}: ошибка прерывания неактивного теста: {e}",
+                exc_info=True,
+            )
+    elif idle_s < idle_ttl_s:
+        return False
+    session_activity.forget(key)
+    storage.release(key)
+    return interrupted
+
+
+async def run_session_reaper(
+    storage: SQLiteStorage,
+    events_isolation: BaseEventIsolation,
+    bot: Bot,
+    test_idle_ttl: Callable[[Optional[str]], Optional[float]],
+    interrupt_test: Callable[[FSMContext, Bot], Awaitable[Any]],
+    interval_s: float,
+    idle_ttl_s: float,
+    min_idle_s: float,
+):
+    """Background task: runs reap_idle_sessions every interval_s until cancelled."""
+    while True:
+        await asyncio.sleep(interval_s)
+        try:
+            interrupted = await reap_idle_sessions(
+                storage,
+                events_isolation,
+                bot,
+                test_idle_ttl,
+                interrupt_test,
+                idle_ttl_s,
+                min_idle_s,
+            )
+        except Exception as e:
+            logger.error(f"Ошибка прохода очистки сессий: {e}", exc_info=True)
+            continue
+        if interrupted:
+            logger.info(
+                f"Очистка сессий: прервано неактивных тестов: {interrupted}, "
+                f"отслеживается сессий: {len(session_activity)}."
+            )
@@ -0,0 +1,88 @@
+# utils/session_tasks.py
+import asyncio
+import logging
+from typing import Coroutine, Dict, List, Optional
+
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.storage.base import StorageKey
+
+logger = logging.getLogger(__name__)
+
+
+class SessionTaskRegistry:
+    """
+    Owns the background tasks of each (chat, user) FSM session (timers,
+    stimulus cycles, feedback reverts), keyed by the session's StorageKey
+    and a slot name. FSM data stays plain and serializable.
+    Cancelling a slot or a whole session cancels its tasks and awaits them,
+    so when the call returns nothing from the old run is still executing.
+    The calling task itself is never cancelled or awaited: a timer that
+    ends its own test can safely run the shared cleanup.
+    """
+
+    def __init__(self):
+        self._sessions: Dict[StorageKey, Dict[str, asyncio.Task]] = {}
+
+    async def start(
+        self, state: FSMContext, name: str, coro: Coroutine
+    ) -> asyncio.Task:
+        """Runs coro in slot 'name', replacing (and awaiting) its old task."""
+        await self.cancel(state, name)
+        task = asyncio.create_task(coro, name=f"{name}:{state.key.chat_id}")
+        self._sessions.setdefault(state.key, {})[name] = task
+        task.add_done_callback(
+            lambda t, key=state.key: self._forget(key, name, t)
+        )
+        return task
+
+    def _forget(self, key: StorageKey, name: str, task: asyncio.Task):
+        slots = self._sessions.get(key)
+        if slots is None or slots.get(name) is not task:
+            return  # Already replaced
+        del slots[name]
+        if not slots:
+            del self._sessions[key]
+
+    def get(self, state: FSMContext, name: str) -> Optional[asyncio.Task]:
+        return self._sessions.get(state.key, {}).get(name)
+
+    def is_running(self, state: FSMContext, name: str) -> bool:
+        task = self.get(state, name)
+        return task is not None and not task.done()
+
+    async def cancel(self, state: FSMContext, *names: str):
+        """Cancels the named slots of this session and waits for them."""
+        slots = self._sessions.get(state.key, {})
+        await self._cancel_and_wait(
+            [slots[name] for name in names if name in slots]
+        )
+
+    async def cancel_all(self, state: FSMContext):
+        """Cancels every task of this session and waits for them."""
+        await self._cancel_and_wait(
+            list(self._sessions.get(state.key, {}).values())
+        )
+
+    async def shutdown(self):
+        """Cancels the tasks of all sessions (bot shutdown)."""
+        await self._cancel_and_wait(
+            [t for slots in self._sessions.values() for t in slots.values()]
+        )
+
+    @staticmethod
+    async def _cancel_and_wait(tasks: List[asyncio.Task]):
+        current = asyncio.current_task()
+        pending = [t for t in tasks if t is not current and not t.done()]
+        for task in pending:
+            task.cancel()
+        if not pending:
+            return
+        for result in await asyncio.gather(*pending, return_exceptions=True):
+            if isinstance(result, Exception):
+                logger.error(
+                    f"Фоновая задача сессии завершилась с ошибкой: {result!r}"
+                )
+
+
+# Shared by all handlers; slot names are the former FSM data keys' stems.
+session_tasks = SessionTaskRegistry()
@@ -0,0 +1,325 @@
+# utils/sharded_store.py
+import json
+import logging
+import os
+import threading
+from datetime import date
+from typing import (
+    Any,
+    Dict,
+    Iterator,
+    KeysView,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    Union,
+)
+
+from openpyxl import Workbook
+
+from settings import REGISTERED_AT_HEADER
+from utils.results_store import ExcelResultsStore
+
+logger = logging.getLogger(__name__)
+
+SHARD_SCHEME = "registration_period"
+OTHER_SHARD = "undated"  # Rows registered before dates were recorded
+
+
+class ShardedExcelResultsStore:
+    """
+    Results split across several workbooks by registration period: a row
+    goes to the shard of the period_months-long calendar period its
+    REGISTERED_AT_HEADER falls in (e.g. "2025-04" for April-June with
+    period_months=3). UIDs are drawn uniformly at random, so UID ranges
+    would all grow at the same rate forever; a period stops receiving new
+    rows once it is over, so every shard stays bounded and old shards are
+    never rewritten again. A UID -> shard index built on load routes
+    lookups and writes to exactly one ExcelResultsStore, and a flush
+    rewrites only the shards that changed. The manifest lists the shard
+    files; each (re-)split bumps its generation, which is part of the
+    shard file names, so a split never writes over the files it reads.
+    Exposes the same interface as ExcelResultsStore; iter_snapshot()
+    merges all shards for /export.
+    """
+
+    def __init__(
+        self,
+        shard_dir: str,
+        manifest_filename: str,
+        file_prefix: str,
+        headers: List[str],
+        period_months: int,
+        flush_interval_s: float,
+        flush_dirty_rows: int,
+        import_from_excel: Optional[str] = None,
+    ):
+        self.shard_dir = shard_dir
+        self.manifest_filename = manifest_filename
+        self.file_prefix = file_prefix
+        self.headers: List[str] = list(headers)
+        self.period_months = period_months
+        self.flush_interval_s = flush_interval_s
+        self.flush_dirty_rows = flush_dirty_rows
+        self.import_from_excel = import_from_excel
+        self._shards: Dict[str, ExcelResultsStore] = {}
+        self._uid_to_shard: Dict[str, str] = {}
+        self._tgid_to_uid: Dict[str, str] = {}
+        self._lock = threading.RLock()  # Guards the shard map and manifest
+        self._importing = False
+        self._generation = 0
+
+    # --- Setup ---
+    def load(self):
+        """
+        Loads every shard in the manifest. Splits the legacy file on first
+        start, and re-splits shards listed by a manifest of another scheme.
+        """
+        os.makedirs(self.shard_dir, exist_ok=True)
+        manifest = self._read_manifest()
+        with self._lock:
+            self._shards = {}
+            self._uid_to_shard = {}
+            self._tgid_to_uid = {}
+            if manifest is None:
+                sources = [self.import_from_excel] if self.import_from_excel else []
+                self._generation = 1
+                self._import_files(sources)
+                return
+            generation = manifest.get("generation", 0)
+            if (
+                manifest.get("scheme") != SHARD_SCHEME
+                or manifest.get("period_months") != self.period_months
+            ):
+                logger.warning(
+                    f"Манифест '{self.manifest_filename}' другой схемы "
+                    f"({manifest.get('scheme')}), шарды будут разбиты заново."
+                )
+                self._generation = generation + 1
+                old_files = list(manifest["shards"].values())
+                self._import_files(old_files, remove_sources=True)
+                return
+            self._generation = generation
+            for key, filename in manifest["shards"].items():
+                shard = self._new_shard_store(filename)
+                shard.load()
+                self._shards[key] = shard
+                self._index_shard(key, shard)
+        logger.info(
+            f"Шардированное хранилище: загружено {len(self._shards)} шардов, "
+            f"строк: {self.row_count()}."
+        )
+
+    def _read_manifest(self) -> Optional[Dict[str, Any]]:
+        if not os.path.exists(self.manifest_filename):
+            return None
+        with open(self.manifest_filename, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def _write_manifest(self):
+        manifest = {
+            "scheme": SHARD_SCHEME,
+            "period_months": self.period_months,
+            "generation": self._generation,
+            "shards": {
+                key: shard.filename
+                for key, shard in sorted(self._shards.items())
+            },
+        }
+        tmp_filename = f"{self.manifest_filename}.tmp"
+        with open(tmp_filename, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=1)
+        os.replace(tmp_filename, self.manifest_filename)
+
+    def _import_files(self, sources: List[str], remove_sources: bool = False):
+        """
+        Copies the rows of the given workbooks into shards of the new
+        generation. The manifest is written last and the sources are
+        deleted (remove_sources) only after that, so an interrupted import
+        still finds the old manifest and its files and simply starts over.
+        """
+        self._importing = True  # Defers manifest writes until the end
+        try:
+            imported = self._copy_rows(sources)
+        finally:
+            self._importing = False
+        self._write_manifest()
+        if remove_sources:
+            current = {shard.filename for shard in self._shards.values()}
+            for source in sources:
+                if source in current or not os.path.exists(source):
+                    continue
+                try:
+                    os.remove(source)
+                except OSError as e:
+                    logger.warning(
+                        f"Шардированное хранилище: не удалось удалить старый шард '{source}': {e}"
+                    )
+        logger.info(
+            f"Шардированное хранилище: импортировано {imported} строк из "
+            f"{sources} в {len(self._shards)} шардов."
+        )
+
+    def _copy_rows(self, sources: List[str]) -> int:
+        imported = 0
+        for source in sources:
+            if not os.path.exists(source):
+                continue
+            legacy = ExcelResultsStore(
+                source, self.flush_interval_s, self.flush_dirty_rows
+            )
+            legacy.load()
+            for row in legacy.iter_snapshot(self.headers):
+                values = dict(zip(self.headers, row))
+                if values.get("Unique ID") is None:
+                    continue
+                self.append_row(values)
+                imported += 1
+        self.flush()
+        return imported
+
+    def _new_shard_store(self, filename: str) -> ExcelResultsStore:
+        return ExcelResultsStore(
+            filename, self.flush_interval_s, self.flush_dirty_rows
+        )
+
+    def _create_shard(self, key: str) -> ExcelResultsStore:
+        filename = os.path.join(
+            self.shard_dir,
+            f"{self.file_prefix}_g{self._generation}_{key}.xlsx",
+        )
+        wb = Workbook(write_only=True)
+        ws = wb.create_sheet(title="Sheet")
+        ws.append(self.headers)
+        wb.save(filename)  # Overwrites leftovers not listed in the manifest
+        shard = self._new_shard_store(filename)
+        shard.load()
+        self._shards[key] = shard
+        if not self._importing:
+            self._write_manifest()
+        logger.info(f"Шардированное хранилище: создан шард '{filename}'.")
+        return shard
+
+    def _index_shard(self, key: str, shard: ExcelResultsStore):
+        for uid, tgid in shard.iter_snapshot(["Unique ID", "Telegram ID"]):
+            if uid is None:
+                continue
+            self._uid_to_shard[str(uid)] = key
+            if tgid is not None:
+                self._tgid_to_uid[str(tgid)] = str(uid)
+
+    # --- Routing ---
+    def _shard_key(self, registered_at: Any) -> str:
+        """Shard of a registration date ("YYYY-MM..." string or date)."""
+        if isinstance(registered_at, date):
+            year, month = registered_at.year, registered_at.month
+        elif isinstance(registered_at, str) and registered_at[4:5] == "-":
+            try:
+                year, month = int(registered_at[:4]), int(registered_at[5:7])
+            except ValueError:
+                return OTHER_SHARD
+            if not 1 <= month <= 12:
+                return OTHER_SHARD
+        else:
+            return OTHER_SHARD
+        first_month = (month - 1) // self.period_months * self.period_months + 1
+        return f"{year:04d}-{first_month:02d}"
+
+    def _shard_for(self, uid: Union[str, int]) -> Optional[ExcelResultsStore]:
+        key = self._uid_to_shard.get(str(uid))
+        return self._shards.get(key) if key is not None else None
+
+    # --- Schema ---
+    def add_headers(self, expected_headers: List[str]) -> List[str]:
+        added: Dict[str, None] = {}
+        with self._lock:
+            for shard in self._shards.values():
+                for header in shard.add_headers(expected_headers):
+                    added[header] = None
+            for header in expected_headers:
+                if header not in self.headers:
+                    self.headers.append(header)
+                    added[header] = None
+        return list(added)
+
+    # --- Reads ---
+    def has_header(self, header: str) -> bool:
+        return header in self.headers
+
+    def has_uid(self, uid: str) -> bool:
+        return str(uid) in self._uid_to_shard
+
+    def get_row(self, uid: str) -> Optional[Dict[str, Any]]:
+        shard = self._shard_for(uid)
+        return shard.get_row(str(uid)) if shard is not None else None
+
+    def existing_uids(self) -> Set[str]:
+        with self._lock:
+            return set(self._uid_to_shard)
+
+    def uid_keys(self) -> KeysView[str]:
+        """Live view of indexed UIDs (O(1) membership, no copy)."""
+        return self._uid_to_shard.keys()
+
+    def find_uid_by_telegram_id(self, tgid: Union[str, int]) -> Optional[str]:
+        return self._tgid_to_uid.get(str(tgid))
+
+    def row_count(self) -> int:
+        with self._lock:
+            shards = list(self._shards.values())
+        return sum(shard.row_count() for shard in shards)
+
+    def iter_snapshot(self, headers: List[str]) -> Iterator[Tuple[Any, ...]]:
+        """Merged snapshot of all shards, in shard order."""
+        with self._lock:
+            shards = [self._shards[key] for key in sorted(self._shards)]
+        for shard in shards:
+            yield from shard.iter_snapshot(headers)
+
+    # --- Mutations ---
+    def append_row(self, values: Dict[str, Any]):
+        uid = values.get("Unique ID")
+        key = self._shard_key(values.get(REGISTERED_AT_HEADER))
+        with self._lock:
+            shard = self._shards.get(key) or self._create_shard(key)
+        shard.append_row(values)
+        self._uid_to_shard[str(uid)] = key
+        if values.get("Telegram ID") not in (None, ""):
+            self._tgid_to_uid[str(values["Telegram ID"])] = str(uid)
+
+    def update_row(self, uid: str, values: Dict[str, Any]) -> bool:
+        shard = self._shard_for(uid)
+        if shard is None or not shard.update_row(str(uid), values):
+            return False
+        if values.get("Telegram ID") not in (None, ""):
+            self._tgid_to_uid[str(values["Telegram ID"])] = str(uid)
+        return True
+
+    # --- Flushing ---
+    def _shard_list(self) -> List[ExcelResultsStore]:
+        with self._lock:
+            return list(self._shards.values())
+
+    @property
+    def dirty_count(self) -> int:
+        return sum(shard.dirty_count for shard in self._shard_list())
+
+    def needs_flush(self) -> bool:
+        return any(shard.needs_flush() for shard in self._shard_list())
+
+    def flush(self) -> bool:
+        """Rewrites only the shards with pending changes."""
+        written = False
+        first_error: Optional[Exception] = None
+        for shard in self._shard_list():
+            try:
+                written = shard.flush() or written
+            except Exception as e:  # Keep flushing the other shards
+                logger.error(
+                    f"Шардированное хранилище: ошибка сброса '{shard.filename}': {e}"
+                )
+                first_error = first_error or e
+        if first_error is not None:
+            raise first_error
+        return written
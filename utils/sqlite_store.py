@@ -0,0 +1,342 @@
+# utils/sqlite_store.py
+import logging
+import os
+import sqlite3
+import threading
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple, Union
+
+from openpyxl import load_workbook
+
+logger = logging.getLogger(__name__)
+
+USERS_TABLE = "users"
+
+
+def _q(identifier: str) -> str:
+    """Quotes a column/table name (headers contain spaces and brackets)."""
+    return '"' + identifier.replace('"', '""') + '"'
+
+
+class _UidMembership:
+    """Container view over the users table for 'uid in ...' checks."""
+
+    def __init__(self, store: "SQLiteResultsStore"):
+        self._store = store
+
+    def __contains__(self, uid: object) -> bool:
+        return self._store.has_uid(str(uid))
+
+
+class SQLiteResultsStore:
+    """
+    Results backend on stdlib sqlite3 in WAL mode.
+    A users table holds the base headers and each test gets its own table
+    with columns named exactly like its headers in settings.py, keyed by
+    Unique ID. Exposes the same interface as ExcelResultsStore; every
+    mutation is its own short transaction, so there is nothing to flush.
+    """
+
+    def __init__(
+        self,
+        db_filename: str,
+        base_headers: List[str],
+        test_header_groups: Dict[str, List[str]],
+        import_from_excel: Optional[str] = None,
+    ):
+        self.db_filename = db_filename
+        self.base_headers = list(base_headers)
+        self.test_header_groups = {
+            table: list(headers) for table, headers in test_header_groups.items()
+        }
+        self.import_from_excel = import_from_excel
+        self.headers: List[str] = self.base_headers + [
+            h for headers in self.test_header_groups.values() for h in headers
+        ]
+        self._header_table: Dict[str, str] = {
+            h: USERS_TABLE for h in self.base_headers
+        }
+        for table, headers in self.test_header_groups.items():
+            for h in headers:
+                self._header_table[h] = table
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.RLock()
+        self._select_sql = self._build_select_sql(self.headers)
+
+    # --- Setup ---
+    def load(self):
+        """Opens the database, creates/migrates tables, imports legacy xlsx."""
+        conn = sqlite3.connect(
+            self.db_filename, check_same_thread=False, isolation_level=None
+        )
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA foreign_keys=ON")
+        with self._lock:
+            self._conn = conn
+            self._create_tables()
+            if self.row_count() == 0 and self.import_from_excel:
+                self._import_excel(self.import_from_excel)
+        logger.info(
+            f"SQLite хранилище: открыто '{self.db_filename}', пользователей: {self.row_count()}."
+        )
+
+    def _create_tables(self):
+        uid_col = _q("Unique ID")
+        other_base = [h for h in self.base_headers if h != "Unique ID"]
+        base_cols = ", ".join(_q(h) for h in other_base)
+        self._conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {USERS_TABLE} "
+            f"({uid_col} TEXT PRIMARY KEY{', ' + base_cols if base_cols else ''})"
+        )
+        if "Telegram ID" in self.base_headers:
+            self._conn.execute(
+                f"CREATE INDEX IF NOT EXISTS idx_users_tgid "
+                f"ON {USERS_TABLE} ({_q('Telegram ID')})"
+            )
+        self._add_missing_columns(USERS_TABLE, other_base)
+        for table, headers in self.test_header_groups.items():
+            cols = ", ".join(_q(h) for h in headers)
+            self._conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {_q(table)} ("
+                f"{uid_col} TEXT PRIMARY KEY "
+                f"REFERENCES {USERS_TABLE}({uid_col}) ON DELETE CASCADE, "
+                f"{cols})"
+            )
+            self._add_missing_columns(table, headers)
+
+    def _add_missing_columns(self, table: str, headers: List[str]):
+        existing = {
+            row[1]
+            for row in self._conn.execute(f"PRAGMA table_info({_q(table)})")
+        }
+        for h in headers:
+            if h not in existing:
+                self._conn.execute(
+                    f"ALTER TABLE {_q(table)} ADD COLUMN {_q(h)}"
+                )
+                logger.info(
+                    f"SQLite хранилище: в таблицу '{table}' добавлен столбец '{h}'."
+                )
+
+    def _import_excel(self, excel_filename: str):
+        if not os.path.exists(excel_filename):
+            return
+        wb = load_workbook(excel_filename, read_only=True)
+        imported = 0
+        try:
+            rows_iter = wb.active.iter_rows(values_only=True)
+            file_headers = list(next(rows_iter, ()))
+            self._conn.execute("BEGIN")
+            for row_values in rows_iter:
+                values = {
+                    str(h): v
+                    for h, v in zip(file_headers, row_values)
+                    if h is not None and v is not None
+                }
+                uid = values.get("Unique ID")
+                if uid is None or self.has_uid(str(uid)):
+                    continue
+                self._insert(values)
+                imported += 1
+            self._conn.execute("COMMIT")
+        except Exception:
+            if self._conn.in_transaction:
+                self._conn.execute("ROLLBACK")
+            raise
+        finally:
+            wb.close()
+        logger.info(
+            f"SQLite хранилище: импортировано {imported} строк из '{excel_filename}'."
+        )
+
+    def _build_select_sql(self, headers: List[str]) -> str:
+        """SELECT of the given headers over users LEFT JOIN every test table."""
+        aliases = {USERS_TABLE: "u"}
+        joins = []
+        for i, table in enumerate(self.test_header_groups):
+            alias = aliases[table] = f"t{i}"
+            joins.append(
+                f"LEFT JOIN {_q(table)} {alias} "
+                f"ON {alias}.{_q('Unique ID')} = u.{_q('Unique ID')}"
+            )
+        select_cols = [
+            f"{aliases[self._header_table[h]]}.{_q(h)}"
+            if h in self._header_table
+            else "NULL"  # Unknown header: empty column
+            for h in headers
+        ]
+        return (
+            f"SELECT {', '.join(select_cols)} FROM {USERS_TABLE} u "
+            + " ".join(joins)
+        )
+
+    # --- Reads ---
+    def has_header(self, header: str) -> bool:
+        return header in self._header_table
+
+    def has_uid(self, uid: str) -> bool:
+        with self._lock:
+            cur = self._conn.execute(
+                f"SELECT 1 FROM {USERS_TABLE} WHERE {_q('Unique ID')} = ?",
+                (str(uid),),
+            )
+            return cur.fetchone() is not None
+
+    def get_row(self, uid: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            cur = self._conn.execute(
+                f"{self._select_sql} WHERE u.{_q('Unique ID')} = ?",
+                (str(uid),),
+            )
+            row = cur.fetchone()
+        if row is None:
+            return None
+        return dict(zip(self.headers, row))
+
+    def existing_uids(self) -> Set[str]:
+        with self._lock:
+            cur = self._conn.execute(
+                f"SELECT {_q('Unique ID')} FROM {USERS_TABLE}"
+            )
+            return {r[0] for r in cur}
+
+    def uid_keys(self) -> _UidMembership:
+        return _UidMembership(self)
+
+    def find_uid_by_telegram_id(self, tgid: Union[str, int]) -> Optional[str]:
+        if "Telegram ID" not in self.base_headers:
+            return None
+        tgid_str = str(tgid)
+        # Telegram IDs are stored as int on registration, as text after re-login
+        tgid_int = int(tgid_str) if tgid_str.lstrip("-").isdigit() else tgid_str
+        with self._lock:
+            cur = self._conn.execute(
+                f"SELECT {_q('Unique ID')} FROM {USERS_TABLE} "
+                f"WHERE {_q('Telegram ID')} IN (?, ?) "
+                f"ORDER BY rowid DESC LIMIT 1",
+                (tgid_str, tgid_int),
+            )
+            row = cur.fetchone()
+        return row[0] if row else None
+
+    def row_count(self) -> int:
+        with self._lock:
+            return self._conn.execute(
+                f"SELECT COUNT(*) FROM {USERS_TABLE}"
+            ).fetchone()[0]
+
+    # --- Mutations ---
+    def _split_by_table(
+        self, values: Dict[str, Any]
+    ) -> Dict[str, Dict[str, Any]]:
+        by_table: Dict[str, Dict[str, Any]] = {}
+        for header, value in values.items():
+            table = self._header_table.get(header)
+            if table is None:
+                logger.warning(
+                    f"SQLite хранилище: заголовок '{header}' не найден. Пропуск."
+                )
+                continue
+            by_table.setdefault(table, {})[header] = (
+                None if value == "" else value
+            )
+        return by_table
+
+    def _upsert_test_values(self, uid: str, table: str, values: Dict[str, Any]):
+        cols = [_q("Unique ID")] + [_q(h) for h in values]
+        updates = ", ".join(f"{_q(h)} = excluded.{_q(h)}" for h in values)
+        self._conn.execute(
+            f"INSERT INTO {_q(table)} ({', '.join(cols)}) "
+            f"VALUES ({', '.join('?' * len(cols))}) "
+            f"ON CONFLICT({_q('Unique ID')}) DO UPDATE SET {updates}",
+            [uid, *values.values()],
+        )
+
+    def _insert(self, values: Dict[str, Any]):
+        by_table = self._split_by_table(values)
+        user_values = by_table.pop(USERS_TABLE, {})
+        uid = str(user_values["Unique ID"])
+        user_values["Unique ID"] = uid
+        cols = ", ".join(_q(h) for h in user_values)
+        self._conn.execute(
+            f"INSERT INTO {USERS_TABLE} ({cols}) "
+            f"VALUES ({', '.join('?' * len(user_values))})",
+            list(user_values.values()),
+        )
+        for table, table_values in by_table.items():
+            self._upsert_test_values(uid, table, table_values)
+
+    def append_row(self, values: Dict[str, Any]):
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._insert(values)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def update_row(self, uid: str, values: Dict[str, Any]) -> bool:
+        uid = str(uid)
+        by_table = self._split_by_table(values)
+        with self._lock:
+            if not self.has_uid(uid):
+                return False
+            self._conn.execute("BEGIN")
+            try:
+                user_values = by_table.pop(USERS_TABLE, {})
+                user_values.pop("Unique ID", None)
+                if user_values:
+                    sets = ", ".join(f"{_q(h)} = ?" for h in user_values)
+                    self._conn.execute(
+                        f"UPDATE {USERS_TABLE} SET {sets} "
+                        f"WHERE {_q('Unique ID')} = ?",
+                        [*user_values.values(), uid],
+                    )
+                for table, table_values in by_table.items():
+                    self._upsert_test_values(uid, table, table_values)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return True
+
+    # --- Flushing (no-op: every mutation is committed) ---
+    @property
+    def dirty_count(self) -> int:
+        return 0
+
+    def needs_flush(self) -> bool:
+        return False
+
+    def flush(self) -> bool:
+        return False
+
+    # --- Export ---
+    def iter_snapshot(self, headers: List[str]) -> Iterator[Tuple[Any, ...]]:
+        """
+        Yields every user row projected onto 'headers' (None for unknown ones).
+        Reads through its own connection inside one read transaction: WAL
+        gives it a consistent snapshot while the writer keeps committing.
+        """
+        sql = self._build_select_sql(headers)
+        conn = sqlite3.connect(
+            f"file:{self.db_filename}?mode=ro", uri=True, isolation_level=None
+        )
+        try:
+            conn.execute("BEGIN")
+            cur = conn.execute(f"{sql} ORDER BY u.rowid")
+            while True:
+                batch = cur.fetchmany(500)
+                if not batch:
+                    break
+                yield from batch
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
@@ -0,0 +1,261 @@
+# utils/stats_sketch.py
+import json
+import logging
+import math
+import os
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+SKETCH_QUANTILES = (0.5, 0.9, 0.99)
+
+
+class RunningStats:
+    """Welford's online count / mean / variance, plus min and max."""
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min: Optional[float] = None
+        self.max: Optional[float] = None
+
+    def add(self, x: float):
+        self.count += 1
+        delta = x - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (x - self.mean)
+        self.min = x if self.min is None else min(self.min, x)
+        self.max = x if self.max is None else max(self.max, x)
+
+    @property
+    def variance(self) -> float:
+        """Sample variance (0 for fewer than two values)."""
+        return self.m2 / (self.count - 1) if self.count > 1 else 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "count": self.count,
+            "mean": self.mean,
+            "m2": self.m2,
+            "min": self.min,
+            "max": self.max,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "RunningStats":
+        stats = cls()
+        stats.count = int(data["count"])
+        stats.mean = float(data["mean"])
+        stats.m2 = float(data["m2"])
+        stats.min = data.get("min")
+        stats.max = data.get("max")
+        return stats
+
+
+class P2Quantile:
+    """
+    P² streaming quantile estimate (Jain & Chlamtac, 1985): five markers,
+    O(1) time and memory per observation. Exact for the first five values.
+    """
+
+    def __init__(self, p: float):
+        self.p = p
+        self.heights: List[float] = []  # q[0..4] once initialised
+        self.positions = [1, 2, 3, 4, 5]
+        self.desired = [1, 1 + 2 * p, 1 + 4 * p, 3 + 2 * p, 5]
+        self.increments = [0, p / 2, p, (1 + p) / 2, 1]
+
+    def add(self, x: float):
+        q = self.heights
+        if len(q) < 5:
+            q.append(x)
+            q.sort()
+            return
+        if x < q[0]:
+            q[0] = x
+            k = 0
+        elif x >= q[4]:
+            q[4] = max(q[4], x)
+            k = 3
+        else:
+            k = next(i for i in range(4) if q[i] <= x < q[i + 1])
+        n = self.positions
+        for i in range(k + 1, 5):
+            n[i] += 1
+        for i in range(5):
+            self.desired[i] += self.increments[i]
+        for i in (1, 2, 3):
+            d = self.desired[i] - n[i]
+            if (d >= 1 and n[i + 1] - n[i] > 1) or (
+                d <= -1 and n[i - 1] - n[i] < -1
+            ):
+                step = 1 if d > 0 else -1
+                candidate = self._parabolic(i, step)
+                if not q[i - 1] < candidate < q[i + 1]:
+                    candidate = self._linear(i, step)
+                q[i] = candidate
+                n[i] += step
+
+    def _parabolic(self, i: int, d: int) -> float:
+        q, n = self.heights, self.positions
+        return q[i] + d / (n[i + 1] - n[i - 1]) * (
+            (n[i] - n[i - 1] + d) * (q[i + 1] - q[i]) / (n[i + 1] - n[i])
+            + (n[i + 1] - n[i] - d) * (q[i] - q[i - 1]) / (n[i] - n[i - 1])
+        )
+
+    def _linear(self, i: int, d: int) -> float:
+        q, n = self.heights, self.positions
+        return q[i] + d * (q[i + d] - q[i]) / (n[i + d] - n[i])
+
+    def value(self) -> Optional[float]:
+        q = self.heights
+        if not q:
+            return None
+        if len(q) < 5:  # Exact quantile of the few values seen so far
+            return q[min(len(q) - 1, max(0, math.ceil(self.p * len(q)) - 1))]
+        return q[2]
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "p": self.p,
+            "heights": self.heights,
+            "positions": self.positions,
+            "desired": self.desired,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "P2Quantile":
+        sketch = cls(float(data["p"]))
+        sketch.heights = [float(v) for v in data["heights"]]
+        sketch.positions = [int(v) for v in data["positions"]]
+        sketch.desired = [float(v) for v in data["desired"]]
+        return sketch
+
+
+class MetricSummary:
+    def __init__(self, quantiles: Iterable[float] = SKETCH_QUANTILES):
+        self.stats = RunningStats()
+        self.quantiles = {q: P2Quantile(q) for q in quantiles}
+
+    def add(self, x: float):
+        self.stats.add(x)
+        for sketch in self.quantiles.values():
+            sketch.add(x)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "stats": self.stats.to_dict(),
+            "quantiles": [s.to_dict() for s in self.quantiles.values()],
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "MetricSummary":
+        summary = cls(quantiles=())
+        summary.stats = RunningStats.from_dict(data["stats"])
+        for q_data in data["quantiles"]:
+            sketch = P2Quantile.from_dict(q_data)
+            summary.quantiles[sketch.p] = sketch
+        return summary
+
+
+class ResultStats:
+    """
+    Running aggregates per result header over every value ever saved
+    (retakes count as new observations). Updated in O(1) per value and
+    persisted to a small JSON sidecar; no workbook scan is ever needed.
+    The sidecar also stores journal_seq, the last results journal record
+    already folded in, so replaying a journal that outlived the save (crash
+    or failed compaction) does not count its records twice.
+    """
+
+    def __init__(self, filename: str, headers: Iterable[str]):
+        self.filename = filename
+        self.headers = list(headers)  # Tracked headers, in display order
+        self._tracked = set(self.headers)
+        self._metrics: Dict[str, MetricSummary] = {}
+        self.journal_seq = 0
+        self._dirty = False
+        self._last_save_ts = time.monotonic()
+        self._lock = threading.Lock()
+
+    @property
+    def dirty(self) -> bool:
+        return self._dirty
+
+    def needs_save(self, interval_s: float) -> bool:
+        return self._dirty and (
+            time.monotonic() - self._last_save_ts >= interval_s
+        )
+
+    def add_results(self, results: Dict[str, Any]):
+        with self._lock:
+            for header, value in results.items():
+                if header not in self._tracked or isinstance(value, bool):
+                    continue
+                if not isinstance(value, (int, float)) or math.isnan(value):
+                    continue  # "N/A", strings, lists...
+                self._metrics.setdefault(header, MetricSummary()).add(
+                    float(value)
+                )
+                self._dirty = True
+
+    def summaries(self) -> Dict[str, MetricSummary]:
+        with self._lock:
+            return {
+                h: self._metrics[h] for h in self.headers if h in self._metrics
+            }
+
+    def load(self):
+        if not os.path.exists(self.filename):
+            return
+        try:
+            with open(self.filename, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            metrics = {
+                header: MetricSummary.from_dict(summary)
+                for header, summary in data.get("metrics", {}).items()
+            }
+            journal_seq = int(data.get("journal_seq", 0))
+        except (ValueError, KeyError, TypeError) as e:
+            logger.error(
+                f"Файл статистики '{self.filename}' повреждён, статистика начнётся заново: {e}"
+            )
+            return
+        with self._lock:
+            self._metrics = metrics
+            self.journal_seq = journal_seq
+            self._dirty = False
+
+    def save(self, journal_seq: int = 0) -> bool:
+        """
+        Writes the sidecar if anything changed. journal_seq is the last
+        journal record folded in so far. Returns True if written.
+        """
+        with self._lock:
+            if not self._dirty:
+                return False
+            data = {
+                "metrics": {
+                    header: summary.to_dict()
+                    for header, summary in self._metrics.items()
+                },
+                "journal_seq": journal_seq,
+            }
+            self._dirty = False
+        tmp_filename = f"{self.filename}.tmp"
+        try:
+            with open(tmp_filename, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False)
+            os.replace(tmp_filename, self.filename)
+        except Exception:
+            with self._lock:
+                self._dirty = True
+            raise
+        # Only a snapshot on disk covers the journal up to journal_seq
+        with self._lock:
+            self.journal_seq = journal_seq
+            self._last_save_ts = time.monotonic()
+        return True
@@ -0,0 +1,275 @@
+# utils/test_sessions.py
+import json
+import marshal
+import time
+from dataclasses import dataclass, field, fields
+from typing import (
+    Any,
+    ClassVar,
+    Dict,
+    List,
+    Mapping,
+    Optional,
+    Set,
+    Type,
+    TypeVar,
+    get_origin,
+)
+
+TSession = TypeVar("TSession", bound="TestSession")
+
+# Bumped when stored sessions can no longer be read positionally
+SESSION_FORMAT_VERSION = 1
+
+
+def _restore_session(cls: Type[TSession], raw: bytes) -> TSession:
+    return cls.from_bytes(raw)
+
+
+class TestSession:
+    """
+    Base of the typed per-test sessions: slotted dataclasses kept under one
+    FSM key instead of dozens of prefixed string keys, so a mistyped field
+    raises AttributeError instead of silently reading a default.
+    Serialized as compact JSON [SESSION_FORMAT_VERSION, [field values]]
+    (no field names), which stays readable across Python versions; fields
+    are positional, so new ones go at the end and need a default. Set
+    fields are stored as sorted lists.
+    """
+
+    __slots__ = ()
+    FSM_KEY: ClassVar[str] = ""
+
+    def to_bytes(self) -> bytes:
+        # fields(), not __slots__: a subclass's __slots__ lists only its own
+        values = [
+            sorted(value) if isinstance(value, set) else value
+            for value in (getattr(self, f.name) for f in fields(self))
+        ]
+        return json.dumps(
+            [SESSION_FORMAT_VERSION, values],
+            ensure_ascii=False,
+            separators=(",", ":"),
+        ).encode("utf-8")
+
+    @classmethod
+    def from_bytes(cls: Type[TSession], raw: bytes) -> TSession:
+        if not raw.startswith(b"["):
+            # Written by an earlier release (marshal, same interpreter only)
+            return cls(*marshal.loads(raw))
+        version, values = json.loads(raw)
+        if version != SESSION_FORMAT_VERSION:
+            raise ValueError(f"Неизвестная версия формата сессии: {version}")
+        values = [
+            set(value) if get_origin(f.type) is set else value
+            for f, value in zip(fields(cls), values)
+        ]
+        return cls(*values)
+
+    def __reduce__(self):
+        # pickle (SQLiteStorage) stores the class reference plus the blob
+        return _restore_session, (type(self), self.to_bytes())
+
+    @classmethod
+    def from_fsm(cls: Type[TSession], data: Mapping[str, Any]) -> TSession:
+        """
+        Private copy of the session in FSM data (a fresh one if the test has
+        not started); changes are kept only once passed back via as_fsm_data().
+        """
+        stored = data.get(cls.FSM_KEY)
+        if isinstance(stored, cls):
+            return cls.from_bytes(stored.to_bytes())
+        return cls()
+
+    def as_fsm_data(self) -> Dict[str, Any]:
+        return {self.FSM_KEY: self}
+
+    @classmethod
+    async def update_fsm(cls: Type[TSession], state: Any, **changes: Any) -> TSession:
+        """
+        Session counterpart of state.update_data(**changes): re-reads the
+        session, sets the given fields (AttributeError on a typo) and
+        stores it. Returns the updated session.
+        """
+        session = cls.from_fsm(await state.get_data())
+        for name, value in changes.items():
+            setattr(session, name, value)
+        await state.update_data(session.as_fsm_data())
+        return session
+
+
+@dataclass(slots=True)
+class ProfiledTestSession(TestSession):
+    """Session that carries the participant's profile for the final save."""
+
+    unique_id: Optional[str] = None
+    profile_name: Optional[str] = None
+    profile_age: Optional[int] = None
+    profile_telegram_id: Optional[int] = None
+
+    def set_profile(self, profile: Mapping[str, Any]):
+        self.unique_id = profile.get("unique_id")
+        self.profile_name = profile.get("name")
+        self.profile_age = profile.get("age")
+        self.profile_telegram_id = profile.get("telegram_id")
+
+    def profile_for_save(self, data: Mapping[str, Any]) -> Dict[str, Any]:
+        """profile= for save_test_results; FSM active_* keys fill the gaps."""
+        return {
+            "telegram_id": self.profile_telegram_id
+            or data.get("active_telegram_id"),
+            "name": self.profile_name or data.get("active_name"),
+            "age": self.profile_age or data.get("active_age"),
+        }
+
+
+@dataclass(slots=True)
+class StroopSession(ProfiledTestSession):
+    FSM_KEY: ClassVar[str] = "stroop_session"
+
+    chat_id: Optional[int] = None
+    instruction_message_id: Optional[int] = None
+    stimulus_message_id: Optional[int] = None
+    stimulus_type: Optional[str] = None  # "text" | "photo"
+    current_part: int = 0  # 1..3 while running, 4 after the last part
+    current_iteration: int = 0
+    correct_answer: Optional[str] = None
+    # Per part, index = part - 1
+    part_errors: List[int] = field(default_factory=lambda: [0, 0, 0])
+    part_start_times: List[Optional[float]] = field(
+        default_factory=lambda: [None, None, None]
+    )
+    part_total_times: List[Optional[float]] = field(
+        default_factory=lambda: [None, None, None]
+    )
+
+    @property
+    def part_running(self) -> bool:
+        return 1 <= self.current_part <= 3
+
+    def start_part(self, part: int):
+        self.current_part = part
+        self.current_iteration = 1
+        self.part_start_times[part - 1] = time.time()
+
+    def finish_part_timer(self, keep_existing: bool = False):
+        """Stores the elapsed time of the current part, if it was started."""
+        idx = self.current_part - 1
+        start_t = self.part_start_times[idx]
+        if not start_t or (keep_existing and self.part_total_times[idx]):
+            return
+        self.part_total_times[idx] = round(time.time() - start_t, 2)
+
+
+@dataclass(slots=True)
+class CorsiSession(ProfiledTestSession):
+    FSM_KEY: ClassVar[str] = "corsi_session"
+
+    chat_id: Optional[int] = None
+    grid_message_id: Optional[int] = None
+    status_message_id: Optional[int] = None
+    feedback_message_id: Optional[int] = None
+    current_sequence_length: int = 2
+    error_count: int = 0
+    correct_sequence: List[int] = field(default_factory=list)
+    user_input_sequence: List[int] = field(default_factory=list)
+    sequence_start_time: float = 0.0
+    # Correctly repeated sequences: {"len", "time"}
+    sequence_times: List[Dict[str, Any]] = field(default_factory=list)
+    # Every evaluated attempt: {"len", "correct", "time"}
+    attempts: List[Dict[str, Any]] = field(default_factory=list)
+
+
+@dataclass(slots=True)
+class MentalRotationSession(ProfiledTestSession):
+    FSM_KEY: ClassVar[str] = "mr_session"
+
+    chat_id: Optional[int] = None
+    trigger_message: Optional[Dict[str, Optional[int]]] = None  # message_ref()
+    current_iteration: int = 0
+    used_references: List[str] = field(default_factory=list)
+    correct_option_index: Optional[int] = None  # Of the current iteration
+    iteration_results: List[Dict[str, Any]] = field(default_factory=list)
+    test_start_time: Optional[float] = None
+    iteration_start_time: Optional[float] = None
+    reference_message_id: Optional[int] = None
+    options_message_id: Optional[int] = None
+    countdown_message_id: Optional[int] = None
+    feedback_message_id: Optional[int] = None
+    # Summary computed by _finish_mental_rotation_test for the save
+    final_correct_answers: int = 0
+    final_avg_reaction_time_s: float = 0.0
+    final_total_test_time_s: float = 0.0
+    final_individual_responses: str = "N/A"
+    final_interrupted: Optional[bool] = None
+
+
+@dataclass(slots=True)
+class RavenSession(ProfiledTestSession):
+    FSM_KEY: ClassVar[str] = "raven_session"
+
+    chat_id: Optional[int] = None
+    trigger_message: Optional[Dict[str, Optional[int]]] = None  # message_ref()
+    task_filenames: List[str] = field(default_factory=list)
+    current_iteration: int = 0  # Index into task_filenames
+    current_task_filename: Optional[str] = None
+    correct_option: Optional[int] = None  # 1-based, of the current task
+    num_options: Optional[int] = None
+    iteration_results: List[Dict[str, Any]] = field(default_factory=list)
+    test_start_time: Optional[float] = None
+    test_end_time: Optional[float] = None  # Set when the last task is answered
+    task_start_time: Optional[float] = None
+    task_message_id: Optional[int] = None
+    feedback_message_id: Optional[int] = None
+    # Summary computed by _finish_raven_matrices_test for the save
+    final_correct_answers: int = 0
+    final_total_test_time_s: float = 0.0
+    final_avg_time_correct_s: float = 0.0
+    final_individual_times: str = "N/A"
+    final_interrupted: Optional[bool] = None
+
+
+@dataclass(slots=True)
+class ReactionTimeSession(ProfiledTestSession):
+    FSM_KEY: ClassVar[str] = "rt_session"
+
+    chat_id: Optional[int] = None
+    current_attempt: int = 1
+    reaction_time_ms: Optional[int] = None
+    status: str = "Pending"
+    instruction_message_id: Optional[int] = None
+    memorization_image_message_id: Optional[int] = None
+    stimulus_message_id: Optional[int] = None
+    retry_message_id: Optional[int] = None
+    target_missed_message_id: Optional[int] = None
+    # Per attempt
+    target_image_path: Optional[str] = None
+    stimuli_sequence: List[Dict[str, Any]] = field(default_factory=list)
+    current_stimulus_index: int = 0
+    current_is_target: bool = False
+    target_displayed_time: Optional[float] = None
+    reacted_correctly: bool = False
+
+    def reset_attempt(self):
+        """Clears the per-attempt fields before a retry."""
+        self.target_image_path = None
+        self.memorization_image_message_id = None
+        self.stimulus_message_id = None
+        self.target_missed_message_id = None
+        self.stimuli_sequence = []
+        self.current_stimulus_index = 0
+        self.current_is_target = False
+        self.target_displayed_time = None
+        self.reacted_correctly = False
+
+
+@dataclass(slots=True)
+class VerbalFluencySession(ProfiledTestSession):
+    FSM_KEY: ClassVar[str] = "vf_session"
+
+    chat_id: Optional[int] = None
+    task_base_category: Optional[str] = None
+    task_letter: Optional[str] = None
+    task_message_id: Optional[int] = None
+    trigger_message: Optional[Dict[str, Optional[int]]] = None  # message_ref()
+    collected_words: Set[str] = field(default_factory=set)
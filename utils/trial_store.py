@@ -0,0 +1,151 @@
+# utils/trial_store.py
+import json
+import logging
+import os
+import struct
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# Conditional import: only the loader needs NumPy
+try:
+    import numpy as np
+
+    NUMPY_AVAILABLE = True
+except ImportError:
+    np = None
+    NUMPY_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+# uid, unix time of the save, trial index, item id, correct (1/0/-1), RT (s)
+TRIAL_RECORD = struct.Struct("<IIHibf")
+TRIAL_FIELDS = [
+    ("uid", "<u4"),
+    ("ts", "<u4"),
+    ("trial", "<u2"),
+    ("item", "<i4"),
+    ("correct", "i1"),
+    ("rt", "<f4"),
+]
+
+# (item name, correct or None if not applicable, reaction time in seconds)
+Trial = Tuple[str, Optional[bool], float]
+
+
+class TrialStore:
+    """
+    Append-only per-test binary files of trial-level data.
+    <test>.trials.bin holds fixed-size little-endian records (TRIAL_RECORD);
+    <test>.items.json lists item names, a record's 'item' is an index into it.
+    Every save appends a new block, so retakes keep their history ('ts').
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._item_ids: Dict[str, Dict[str, int]] = {}
+        self._lock = threading.Lock()
+
+    def _path(self, test: str, suffix: str) -> str:
+        return os.path.join(self.directory, f"{test}.{suffix}")
+
+    def _load_item_ids(self, test: str) -> Dict[str, int]:
+        if test not in self._item_ids:
+            names = load_item_names(self.directory, test)
+            self._item_ids[test] = {name: i for i, name in enumerate(names)}
+        return self._item_ids[test]
+
+    def _write_item_names(self, test: str, item_ids: Dict[str, int]):
+        names = sorted(item_ids, key=item_ids.get)
+        path = self._path(test, "items.json")
+        with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+            json.dump(names, f, ensure_ascii=False)
+        os.replace(f"{path}.tmp", path)
+
+    def append(
+        self,
+        test: str,
+        uid: str,
+        trials: Iterable[Trial],
+        ts: Optional[float] = None,
+    ) -> int:
+        """Appends one save's trials; returns the number of records written."""
+        trials = list(trials)
+        if not trials:
+            return 0
+        if not str(uid).isdigit():
+            logger.warning(
+                f"Хранилище попыток: UID '{uid}' не числовой, попытки {test} не записаны."
+            )
+            return 0
+        ts_int = int(ts if ts is not None else time.time())
+        with self._lock:
+            os.makedirs(self.directory, exist_ok=True)
+            item_ids = self._load_item_ids(test)
+            new_items = False
+            for item, _, _ in trials:
+                if item not in item_ids:
+                    item_ids[item] = len(item_ids)
+                    new_items = True
+            if new_items:  # Names must be durable before records use them
+                self._write_item_names(test, item_ids)
+            payload = b"".join(
+                TRIAL_RECORD.pack(
+                    int(uid),
+                    ts_int,
+                    idx,
+                    item_ids[item],
+                    -1 if correct is None else int(bool(correct)),
+                    float(rt),
+                )
+                for idx, (item, correct, rt) in enumerate(trials)
+            )
+            path = self._path(test, "trials.bin")
+            size = os.path.getsize(path) if os.path.exists(path) else 0
+            if size % TRIAL_RECORD.size:
+                # Torn record from a crash mid-write: realign before appending
+                os.truncate(path, size - size % TRIAL_RECORD.size)
+            with open(path, "ab") as f:
+                f.write(payload)
+        return len(trials)
+
+
+def load_item_names(directory: str, test: str) -> List[str]:
+    path = os.path.join(directory, f"{test}.items.json")
+    if not os.path.exists(path):
+        return []
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def load_trials(directory: str, test: str):
+    """
+    Returns (records, item_names): a NumPy structured array with the
+    TRIAL_FIELDS columns (e.g. records["rt"] is float32) and the item names
+    indexed by records["item"]. A torn trailing record is ignored.
+    """
+    if not NUMPY_AVAILABLE:
+        raise RuntimeError("NumPy не установлен: загрузка попыток недоступна.")
+    dtype = np.dtype(TRIAL_FIELDS)
+    path = os.path.join(directory, f"{test}.trials.bin")
+    if not os.path.exists(path):
+        return np.empty(0, dtype=dtype), load_item_names(directory, test)
+    count = os.path.getsize(path) // dtype.itemsize
+    records = np.fromfile(path, dtype=dtype, count=count)
+    return records, load_item_names(directory, test)
+
+
+def latest_session_mask(records) -> "np.ndarray":
+    """Boolean mask keeping only each UID's most recent save (retakes)."""
+    if not NUMPY_AVAILABLE:
+        raise RuntimeError("NumPy не установлен: загрузка попыток недоступна.")
+    if records.size == 0:
+        return np.zeros(0, dtype=bool)
+    # Per-UID max ts: last entry of each uid group after sorting by (uid, ts)
+    order = np.lexsort((records["ts"], records["uid"]))
+    sorted_uid = records["uid"][order]
+    last_of_group = np.r_[sorted_uid[1:] != sorted_uid[:-1], True]
+    uids = sorted_uid[last_of_group]
+    ts = records["ts"][order][last_of_group]
+    idx = np.searchsorted(uids, records["uid"])
+    return records["ts"] == ts[idx]
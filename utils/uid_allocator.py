@@ -0,0 +1,143 @@
+# utils/uid_allocator.py
+import hashlib
+import hmac
+import json
+import logging
+import os
+import secrets
+import threading
+from contextlib import contextmanager
+from typing import Container, Iterator, Optional, Tuple
+
+# Conditional import: inter-process locking is POSIX-only
+try:
+    import fcntl
+
+    FCNTL_AVAILABLE = True
+except ImportError:
+    fcntl = None
+    FCNTL_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+_FEISTEL_ROUNDS = 8
+_KEY_BYTES = 32
+
+
+class UidPermutation:
+    """
+    Keyed bijection of [0, range_size): a balanced Feistel network over the
+    smallest even-bit domain covering the range, with HMAC-SHA256 as the
+    round function, and cycle-walking back into the range. Without the key
+    consecutive counters give unrelated-looking UIDs.
+    """
+
+    def __init__(self, key: bytes, range_size: int):
+        self.key = key
+        self.range_size = range_size
+        self.half_bits = max(1, ((range_size - 1).bit_length() + 1) // 2)
+        self._half_mask = (1 << self.half_bits) - 1
+
+    def _round(self, round_index: int, value: int) -> int:
+        digest = hmac.new(
+            self.key, f"{round_index}:{value}".encode(), hashlib.sha256
+        ).digest()
+        return int.from_bytes(digest[:8], "big") & self._half_mask
+
+    def _encrypt_once(self, value: int) -> int:
+        left, right = value >> self.half_bits, value & self._half_mask
+        for round_index in range(_FEISTEL_ROUNDS):
+            left, right = right, left ^ self._round(round_index, right)
+        return (left << self.half_bits) | right
+
+    def __call__(self, counter: int) -> int:
+        value = self._encrypt_once(counter)
+        while value >= self.range_size:  # Cycle-walking: stays a bijection
+            value = self._encrypt_once(value)
+        return value
+
+
+class UidAllocator:
+    """
+    Allocates UIDs from a persisted counter instead of random probing.
+    The counter's high-water mark and a secret permutation key live in a
+    small sidecar file. Each process reserves a block of counters under a
+    file lock and hands them out from memory, so several processes never
+    collide and registration is O(1). UIDs double as login codes, so
+    counter n maps to min_uid + UidPermutation(key)(n): the 7-digit format
+    is kept and a UID does not reveal any other UID.
+    """
+
+    def __init__(
+        self, filename: str, min_uid: int, max_uid: int, block_size: int
+    ):
+        self.filename = filename
+        self.min_uid = min_uid
+        self.range_size = max_uid - min_uid + 1
+        self.block_size = block_size
+        self._permutation: Optional[UidPermutation] = None
+        self._next = 0
+        self._block_end = 0  # Exclusive; empty until the first reservation
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def _file_lock(self) -> Iterator[None]:
+        if not FCNTL_AVAILABLE:
+            yield
+            return
+        with open(f"{self.filename}.lock", "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _read_state(self) -> Tuple[int, Optional[bytes]]:
+        try:
+            with open(self.filename, "r", encoding="utf-8") as f:
+                state = json.load(f)
+            key = bytes.fromhex(state["key"]) if state.get("key") else None
+            return int(state["high_water"]), key
+        except FileNotFoundError:
+            return 0, None
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            raise RuntimeError(
+                f"Файл счётчика UID '{self.filename}' повреждён: {e}"
+            ) from e
+
+    def _write_state(self, high_water: int, key: bytes):
+        tmp_filename = f"{self.filename}.tmp"
+        with open(tmp_filename, "w", encoding="utf-8") as f:
+            json.dump({"high_water": high_water, "key": key.hex()}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_filename, self.filename)
+
+    def _reserve_block(self) -> bool:
+        with self._file_lock():
+            start, key = self._read_state()
+            if start >= self.range_size:
+                return False
+            if key is None:
+                key = secrets.token_bytes(_KEY_BYTES)
+            end = min(start + self.block_size, self.range_size)
+            self._write_state(end, key)
+        if self._permutation is None or self._permutation.key != key:
+            self._permutation = UidPermutation(key, self.range_size)
+        self._next, self._block_end = start, end
+        return True
+
+    def allocate(self, existing_ids: Container[str]) -> Optional[int]:
+        """
+        Returns the next free UID, or None when the range is exhausted.
+        UIDs already in existing_ids (e.g. legacy random ones) are skipped.
+        """
+        with self._lock:
+            while True:
+                if self._next >= self._block_end and not self._reserve_block():
+                    logger.critical("Диапазон UID исчерпан.")
+                    return None
+                uid = self.min_uid + self._permutation(self._next)
+                self._next += 1
+                if str(uid) not in existing_ids:
+                    return uid